@@ -149,6 +149,20 @@ class ComputerSettings(wx.ScrolledWindow):
                               "cores per participant.",
                       values=1)
 
+        self.page.add(label="Share Cores and Memory Across Participants ",
+                      control=control.CHOICE_BOX,
+                      name='shareResourcesAcrossParticipants',
+                      type=dtype.BOOL,
+                      values=["False", "True"],
+                      comment="Run the processing steps of all the " \
+                              "participants running simultaneously within " \
+                              "the cores and memory of the machine, " \
+                              "instead of giving each participant a fixed " \
+                              "share. Each participant is still limited to " \
+                              "its own maximum cores and memory, and their " \
+                              "total can exceed the machine's. Only " \
+                              "applies when running on one machine.")
+
         self.page.set_sizer()
         parent.get_page_list().append(self)
 
@@ -252,6 +266,58 @@ class DirectorySettings(wx.ScrolledWindow):
                               "space, but any additional preprocessing or "
                               "analysis will have to be completely re-run.")
 
+        self.page.add(label="Intermediate NIfTI Format ",
+                      control=control.CHOICE_BOX,
+                      name='intermediateNiftiFormat',
+                      type=dtype.STR,
+                      values=["nii.gz", "nii", "pigz"],
+                      comment="Format of the NIfTI files written in the "
+                              "Working Directory by C-PAC's own processing "
+                              "steps.\n\nnii.gz: gzip compressed, nii: "
+                              "uncompressed, pigz: uncompressed then "
+                              "compressed with multi-threaded pigz.\n\nWith "
+                              "nii, the outputs are compressed when they are "
+                              "copied to the output directory.")
+
+        self.page.add(label="Generate Profiling Report ",
+                      control=control.CHOICE_BOX,
+                      name='generateProfilingReport',
+                      type=dtype.BOOL,
+                      values=["False", "True"],
+                      comment="Record the wall time, CPU time, peak "
+                              "memory and disk IO of each processing step, "
+                              "and write a report of the run (CSV, JSON "
+                              "and an HTML timeline) in the profiling "
+                              "folder of the Log Directory.\n\nThe report "
+                              "is only written at the end of runs on one "
+                              "machine. The steps then run in separate "
+                              "processes, even with one core.")
+
+        self.page.add(label="Result Cache Directory (optional) ",
+                      control=control.DIR_COMBO_BOX,
+                      name='resultCacheDirectory',
+                      type=dtype.STR,
+                      comment="Directory of the result cache, which keeps "
+                              "the outputs of C-PAC's own derivative steps "
+                              "(ReHo, network centrality, nuisance "
+                              "regression, frequency filtering, ROI time "
+                              "series) under the checksums of their inputs, "
+                              "their parameters and the C-PAC version.\n\n"
+                              "Later runs on the same inputs reuse them, "
+                              "even with a new Working Directory or "
+                              "pipeline name. Leave blank to disable the "
+                              "cache.",
+                      validation_req=False)
+
+        self.page.add(label="Result Cache Size (GB) ",
+                      control=control.INT_CTRL,
+                      name='resultCacheSizeGB',
+                      type=dtype.NUM,
+                      comment="Maximum size of the result cache, in GB. The "
+                              "least recently used outputs are deleted "
+                              "beyond it.",
+                      values=20)
+
         self.page.add(label="Run Logging ",
                       control=control.CHOICE_BOX,
                       name="run_logging",
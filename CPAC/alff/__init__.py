@@ -1,17 +1,21 @@
-from alff import create_alff
+from alff import create_alff, \
+                 calc_alff
 
 from utils import get_img_tr, \
                   get_N1, \
                   get_N2, \
                   set_op_str, \
                   set_op1_str, \
-                  takemod
+                  takemod, \
+                  calc_band_amplitudes
 
 
 __all__ = ['create_alff', \
+           'calc_alff', \
            'get_img_tr', \
            'get_N1', \
            'get_N2', \
            'set_op_str', \
            'set_op1_str', \
-           'takemod']
+           'takemod', \
+           'calc_band_amplitudes']
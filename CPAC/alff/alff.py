@@ -11,7 +11,81 @@ from CPAC.alff.utils import *
 from nipype.interfaces.afni import preprocess
 
 
-def create_alff(wf_name='alff_workflow'):
+def calc_alff(rest_res, rest_mask, hp, lp, save_bandpassed=False,
+              chunk_size=10000):
+    """
+    Calculate ALFF and fALFF maps in-process, from a single read of the
+    functional image
+
+    Parameters
+    ----------
+    rest_res : string (nifti file)
+        Nuisance signal regressed functional image
+    rest_mask : string (nifti file)
+        Mask volume in native space
+    hp : float
+        high pass frequency
+    lp : float
+        low pass frequency
+    save_bandpassed : boolean
+        also write the bandpassed functional image
+    chunk_size : integer
+        number of voxels transformed at a time
+
+    Returns
+    -------
+    alff_img : string (nifti file)
+        standard deviation of the signal in the low frequency band
+    falff_img : string (nifti file)
+        ALFF divided by the standard deviation of the unfiltered signal
+    bandpassed_img : string (nifti file)
+        bandpassed functional image, or None if not requested
+    """
+
+    import os
+    import numpy as np
+    import nibabel as nb
+    from CPAC.alff.utils import get_img_tr, calc_band_amplitudes
+    from CPAC.utils import load_masked, save_nifti
+
+    nii = nb.load(rest_res)
+    Y, mask = load_masked(rest_res, rest_mask)
+
+    TR = get_img_tr(rest_res, None)
+
+    nvox = Y.shape[1]
+    alff = np.zeros(nvox, dtype=np.float32)
+    falff = np.zeros(nvox, dtype=np.float32)
+    Y_bp = np.zeros(Y.shape, dtype=np.float32) if save_bandpassed else None
+
+    for start in range(0, nvox, chunk_size):
+        stop = start + chunk_size
+        chunk_alff, chunk_falff, chunk_bp = \
+            calc_band_amplitudes(Y[:, start:stop], TR, hp, lp,
+                                 return_bandpassed=save_bandpassed)
+        alff[start:stop] = chunk_alff
+        falff[start:stop] = chunk_falff
+        if save_bandpassed:
+            Y_bp[:, start:stop] = chunk_bp
+
+    def write_map(values, fname):
+        out = np.zeros(mask.shape + values.shape[:-1], dtype=np.float32)
+        out[mask] = values.T
+        img = nb.Nifti1Image(out, header=nii.get_header(),
+                             affine=nii.get_affine())
+        return save_nifti(img, fname)
+
+    alff_img = write_map(alff, 'alff')
+    falff_img = write_map(falff, 'falff')
+
+    bandpassed_img = None
+    if save_bandpassed:
+        bandpassed_img = write_map(Y_bp, 'residual_filtered')
+
+    return alff_img, falff_img, bandpassed_img
+
+
+def create_alff(wf_name='alff_workflow', use_afni=False):
     """
     Calculate Amplitude of low frequency oscillations(ALFF) and fractional ALFF maps
 
@@ -19,6 +93,9 @@ def create_alff(wf_name='alff_workflow'):
     ----------
     wf_name : string
         Workflow name
+    use_afni : boolean
+        Run the AFNI 3dBandpass, 3dTstat and 3dcalc chain instead of the
+        in-process `calc_alff` node
 
     Returns
     -------
@@ -59,6 +136,12 @@ def create_alff(wf_name='alff_workflow'):
             outputs image containing Normalized fALFF Z scores across full brain in native space
 
 
+    By default, ALFF and fALFF are computed in-process by `calc_alff`: the
+    in-mask time-series are read once, quadratically detrended, and the
+    power in the low frequency band is integrated from a single batched FFT,
+    which gives the standard deviation of the bandpassed signal without
+    writing it. With `use_afni`, the following commands are run instead.
+
     Order of Commands:
 
     - Filter the input file rest file( slice-time, motion corrected and nuisance regressed) ::
@@ -163,6 +246,27 @@ def create_alff(wf_name='alff_workflow'):
                                                         'falff_img']),
                          name='outputspec')
 
+    if not use_afni:
+        alff_falff = pe.Node(util.Function(input_names=['rest_res',
+                                                        'rest_mask',
+                                                        'hp',
+                                                        'lp'],
+                                           output_names=['alff_img',
+                                                         'falff_img',
+                                                         'bandpassed_img'],
+                                           function=calc_alff),
+                             name='alff_falff')
+
+        wf.connect(inputNode, 'rest_res', alff_falff, 'rest_res')
+        wf.connect(inputNode, 'rest_mask', alff_falff, 'rest_mask')
+        wf.connect(inputnode_hp, 'hp', alff_falff, 'hp')
+        wf.connect(inputnode_lp, 'lp', alff_falff, 'lp')
+
+        wf.connect(alff_falff, 'alff_img', outputNode, 'alff_img')
+        wf.connect(alff_falff, 'falff_img', outputNode, 'falff_img')
+
+        return wf
+
     # filtering
     bandpass = pe.Node(interface=preprocess.Bandpass(),
                        name='bandpass_filtering')
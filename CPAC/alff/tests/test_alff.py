@@ -0,0 +1,135 @@
+
+def make_sinusoids(nvols=200, TR=2.0, seed=0):
+    # one sinusoid inside the 0.01-0.1Hz band and one above it, on the
+    # frequency bins, per voxel, with different amplitudes
+    import numpy as np
+
+    np.random.seed(seed)
+
+    t = np.arange(nvols) * TR
+    freqs = np.fft.rfftfreq(nvols, d=TR)
+    f_in, f_out = freqs[20], freqs[60]
+    assert 0.01 < f_in < 0.1 < f_out
+
+    a_in = np.array([1.0, 2.0, 0.5, 3.0])
+    a_out = np.array([1.0, 0.5, 2.0, 0.0])
+
+    Y = 100 + a_in * np.sin(2 * np.pi * f_in * t)[:, np.newaxis] + \
+        a_out * np.cos(2 * np.pi * f_out * t)[:, np.newaxis]
+
+    return Y, a_in, a_out
+
+
+def test_calc_band_amplitudes():
+    from CPAC.alff import calc_band_amplitudes
+    import numpy as np
+
+    TR = 2.0
+    Y, a_in, a_out = make_sinusoids(TR=TR)
+
+    alff, falff, Y_bp = calc_band_amplitudes(Y, TR, 0.01, 0.1,
+                                             return_bandpassed=True)
+
+    assert alff.shape == falff.shape == (Y.shape[1],)
+    assert Y_bp.shape == Y.shape
+
+    # ALFF is the standard deviation of the bandpassed signal
+    np.testing.assert_allclose(alff, Y_bp.std(0, ddof=1), rtol=1e-10)
+
+    # fALFF is ALFF over the standard deviation of the whole signal
+    t = np.linspace(-1, 1, Y.shape[0])
+    linear = np.column_stack((np.ones(Y.shape[0]), t))
+    Y_lin = Y - linear.dot(np.linalg.pinv(linear).dot(Y))
+    np.testing.assert_allclose(falff, alff / Y_lin.std(0, ddof=1),
+                               rtol=1e-10)
+
+    # which for sinusoids is the band to total amplitude ratio
+    np.testing.assert_allclose(alff, a_in / np.sqrt(2), rtol=0.02)
+    np.testing.assert_allclose(falff, a_in / np.sqrt(a_in ** 2 + a_out ** 2),
+                               rtol=0.02)
+
+    alff_only, falff_only, Y_none = calc_band_amplitudes(Y, TR, 0.01, 0.1)
+    assert Y_none is None
+    np.testing.assert_allclose(alff_only, alff)
+    np.testing.assert_allclose(falff_only, falff)
+
+    # constant voxels have no amplitude
+    alff, falff, _ = calc_band_amplitudes(np.ones((50, 2)), TR, 0.01, 0.1)
+    np.testing.assert_allclose(alff, 0, atol=1e-12)
+    np.testing.assert_array_equal(falff, 0)
+
+
+def test_calc_alff():
+    from CPAC.alff import calc_alff, calc_band_amplitudes
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    TR = 2.0
+    Y, _, _ = make_sinusoids(TR=TR)
+
+    data = np.zeros((3, 2, 2, Y.shape[0]), dtype=np.float32)
+    mask_data = np.zeros((3, 2, 2), dtype=np.uint8)
+    coords = [(0, 0, 0), (1, 0, 1), (2, 1, 0), (2, 1, 1)]
+    for n, (x, y, z) in enumerate(coords):
+        data[x, y, z] = Y[:, n]
+        mask_data[x, y, z] = 1
+
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        rest_res = os.path.abspath('rest_res.nii.gz')
+        img = nb.Nifti1Image(data, np.eye(4))
+        img.get_header().set_zooms((3.0, 3.0, 3.0, TR))
+        img.to_filename(rest_res)
+
+        rest_mask = os.path.abspath('rest_mask.nii.gz')
+        nb.Nifti1Image(mask_data, np.eye(4)).to_filename(rest_mask)
+
+        expected_alff, expected_falff, expected_bp = \
+            calc_band_amplitudes(Y.astype(np.float32), TR, 0.01, 0.1,
+                                 return_bandpassed=True)
+
+        # chunks smaller than, not dividing, and larger than the mask
+        for chunk_size in [1, 3, 10000]:
+            alff_img, falff_img, bandpassed_img = \
+                calc_alff(rest_res, rest_mask, 0.01, 0.1,
+                          save_bandpassed=True, chunk_size=chunk_size)
+
+            alff = nb.load(alff_img).get_data()
+            falff = nb.load(falff_img).get_data()
+            bandpassed = nb.load(bandpassed_img).get_data()
+
+            assert alff.shape == falff.shape == mask_data.shape
+            assert bandpassed.shape == data.shape
+            assert not alff[mask_data == 0].any()
+            assert not falff[mask_data == 0].any()
+
+            for n, (x, y, z) in enumerate(coords):
+                np.testing.assert_allclose(alff[x, y, z],
+                                           expected_alff[n], rtol=1e-5)
+                np.testing.assert_allclose(falff[x, y, z],
+                                           expected_falff[n], rtol=1e-5)
+                np.testing.assert_allclose(bandpassed[x, y, z],
+                                           expected_bp[:, n], atol=1e-4)
+
+        alff_img, falff_img, bandpassed_img = \
+            calc_alff(rest_res, rest_mask, 0.01, 0.1)
+        assert bandpassed_img is None
+    finally:
+        os.chdir(cwd)
+
+
+def test_create_alff():
+    from CPAC.alff import create_alff
+
+    wf = create_alff('alff_workflow')
+    assert wf.get_node('alff_falff') is not None
+    assert wf.get_node('bandpass_filtering') is None
+
+    wf = create_alff('alff_workflow', use_afni=True)
+    for name in ['bandpass_filtering', 'stddev_fltrd', 'stddev_unfltrd',
+                 'falff', 'outputspec']:
+        assert wf.get_node(name) is not None
+    assert wf.get_node('alff_falff') is None
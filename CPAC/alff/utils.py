@@ -209,3 +209,100 @@ def takemod(nvols):
         return 0
     else:
         return 1
+
+
+def calc_band_amplitudes(Y, TR, hp, lp, return_bandpassed=False):
+    """
+    Computes ALFF and fALFF of voxel time-series from a single batched real
+    FFT, without writing the bandpassed time-series.
+
+    The time-series are quadratically detrended, as done by 3dBandpass, and
+    ALFF is the standard deviation of the signal in the [`hp`, `lp`] band,
+    integrated directly from the power spectrum (Parseval). fALFF is ALFF
+    divided by the standard deviation of the linearly detrended input
+    time-series, as done by 3dTstat -stdev.
+
+    Parameters
+    ----------
+
+    Y : numpy.ndarray
+        (`T`, `V`) matrix of `T` timepoints and `V` voxels
+
+    TR : float
+        Temporal Resolution, in seconds
+
+    hp : float
+        HighPass Low Cutoff Frequency
+
+    lp : float
+        LowPass High Cutoff Frequency
+
+    return_bandpassed : boolean
+
+        also return the bandpassed time-series
+
+    Returns
+    -------
+
+    alff : numpy.ndarray
+        (`V`,) array of ALFF values
+
+    falff : numpy.ndarray
+        (`V`,) array of fALFF values
+
+    Y_bp : numpy.ndarray or None
+        (`T`, `V`) bandpassed time-series, if requested
+
+    """
+
+    import numpy as np
+
+    Y = np.asarray(Y, dtype=np.float64)
+    nvols = Y.shape[0]
+
+    t = np.linspace(-1, 1, nvols)
+    trend = np.column_stack((np.ones(nvols), t, t ** 2))
+
+    # linear detrending for the standard deviation of the raw signal
+    linear = trend[:, :2]
+    Y_lin = Y - linear.dot(np.linalg.pinv(linear).dot(Y))
+    total_std = np.sqrt((Y_lin ** 2).sum(0) / (nvols - 1))
+    del Y_lin
+
+    # quadratic detrending before bandpassing
+    Y_det = Y - trend.dot(np.linalg.pinv(trend).dot(Y))
+
+    freqs = np.fft.rfftfreq(nvols, d=float(TR))
+    band = (freqs >= float(hp)) & (freqs <= float(lp))
+
+    # every frequency except DC and Nyquist appears twice in the full
+    # spectrum
+    weights = np.full(freqs.shape, 2.0)
+    weights[0] = 1.0
+    if nvols % 2 == 0:
+        weights[-1] = 1.0
+
+    F = np.fft.rfft(Y_det, axis=0)
+    del Y_det
+
+    power = F.real ** 2 + F.imag ** 2
+    band_ss = (weights[band, np.newaxis] * power[band]).sum(0) / nvols
+
+    # the bandpassed signal is zero mean, unless DC is within the band
+    if band[0]:
+        band_ss -= power[0] / nvols
+
+    alff = np.sqrt(np.maximum(band_ss, 0) / (nvols - 1))
+
+    # constant (or linear) voxels only keep rounding errors after the
+    # detrending, their fALFF is zero as with 3dcalc's division
+    falff = np.zeros_like(alff)
+    nonzero = total_std > 1e-10 * np.abs(Y).max(0)
+    falff[nonzero] = alff[nonzero] / total_std[nonzero]
+
+    Y_bp = None
+    if return_bandpassed:
+        F[~band] = 0
+        Y_bp = np.fft.irfft(F, n=nvols, axis=0)
+
+    return alff, falff, Y_bp
@@ -2,10 +2,16 @@ from easy_thresh import easy_thresh, \
                         copy_geom, \
                         get_standard_background_img, \
                         get_tuple, \
-                        call_cluster
+                        call_cluster, \
+                        estimate_smoothness, \
+                        cluster_logp, \
+                        cluster_threshold
 
 __all__ = ['easy_thresh', \
            'copy_geom', \
            'get_standard_background_img', \
            'get_tuple', \
-           'call_cluster']
+           'call_cluster', \
+           'estimate_smoothness', \
+           'cluster_logp', \
+           'cluster_threshold']
@@ -4,7 +4,7 @@ import nipype.interfaces.utility as util
 
 
 
-def easy_thresh(wf_name):
+def easy_thresh(wf_name, use_fsl=False, render=True):
     """
     Workflow for carrying out cluster-based thresholding 
     and colour activation overlaying
@@ -13,6 +13,14 @@ def easy_thresh(wf_name):
     ----------
     wf_name : string 
         Workflow name
+    use_fsl : boolean, optional
+        Estimate the smoothness and threshold the clusters with the FSL
+        smoothest and cluster commands, one set of nodes per z statistic
+        image, instead of in a single in-process node (cluster_threshold).
+    render : boolean, optional
+        Render the colour overlays of the thresholded images with FSL
+        overlay and slicer. If False, overlay_threshold and rendered_image
+        are not produced.
         
     Returns
     -------
@@ -66,6 +74,11 @@ def easy_thresh(wf_name):
             in the cluster
     
     
+    By default the smoothness estimation, masking and cluster thresholding
+    are done for all the z statistic images in one node (see
+    cluster_threshold). With use_fsl, they are done by the FSL commands
+    below, one set per image; the rendering commands are run in both cases.
+
     Order of commands:
     
     - Estimate smoothness of the image::
@@ -177,6 +190,110 @@ def easy_thresh(wf_name):
                                                         'rendered_image']),
                          name='outputspec')
 
+    if not use_fsl:
+        # smoothness estimation, GRF cluster inference and thresholding of
+        # all the z statistic images in one node
+        cluster = pe.Node(util.Function(input_names=['z_stats',
+                                                     'merge_mask',
+                                                     'z_threshold',
+                                                     'p_threshold'],
+                                        output_names=['index_files',
+                                                      'threshold_files',
+                                                      'localmax_txt_files',
+                                                      'stat_thresh'],
+                                        function=cluster_threshold),
+                          name='cluster_threshold')
+
+        easy_thresh.connect(inputnode, 'z_stats', cluster, 'z_stats')
+        easy_thresh.connect(inputnode, 'merge_mask', cluster, 'merge_mask')
+        easy_thresh.connect(inputnode, 'z_threshold', cluster, 'z_threshold')
+        easy_thresh.connect(inputnode, 'p_threshold', cluster, 'p_threshold')
+
+        cluster_index = (cluster, 'index_files')
+        cluster_thresh = (cluster, 'threshold_files')
+        cluster_localmax = (cluster, 'localmax_txt_files')
+        stat_thresh = (cluster, 'stat_thresh')
+
+    else:
+        cluster_index, cluster_thresh, cluster_localmax, stat_thresh = \
+            fsl_cluster_threshold(easy_thresh, inputnode)
+
+    easy_thresh.connect(cluster_thresh[0], cluster_thresh[1], outputnode,
+                        'cluster_threshold')
+    easy_thresh.connect(cluster_index[0], cluster_index[1], outputnode,
+                        'cluster_index')
+    easy_thresh.connect(cluster_localmax[0], cluster_localmax[1], outputnode,
+                        'cluster_localmax_txt')
+
+    if not render:
+        return easy_thresh
+
+    # colour activation overlaying
+    overlay = pe.MapNode(interface=fsl.Overlay(),
+                         name='overlay',
+                         iterfield=['stat_image', 'stat_thresh'])
+    overlay.inputs.transparency = True
+    overlay.inputs.auto_thresh_bg = True
+    overlay.inputs.out_type = 'float'
+
+    # colour rendering
+    slicer = pe.MapNode(interface=fsl.Slicer(), name='slicer',
+                        iterfield=['in_file'])
+    # set max picture width
+    slicer.inputs.image_width = 750
+    # set output all axial slices into one picture
+    slicer.inputs.all_axial = True
+
+    # function node to get the standard fsl brain image
+    # outputs single file
+    get_bg_imports = ['import os', 'from nibabel import load']
+    get_backgroundimage2 = pe.Node(util.Function(input_names=['in_file',
+                                                              'file_parameters'],
+                                                 output_names=['out_file'],
+                                                 function=get_standard_background_img,
+                                                 imports=get_bg_imports),
+                                   name='get_backgrndimg2')
+
+    easy_thresh.connect(cluster_thresh[0], cluster_thresh[1], overlay,
+                        'stat_image')
+    easy_thresh.connect(stat_thresh[0], stat_thresh[1], overlay,
+                        'stat_thresh')
+
+    easy_thresh.connect(inputnode, 'merge_mask', get_backgroundimage2,
+                        'in_file' )
+    easy_thresh.connect(inputnode, 'parameters', get_backgroundimage2,
+                        'file_parameters')
+
+    easy_thresh.connect(get_backgroundimage2, 'out_file', overlay,
+                        'background_image')
+
+    easy_thresh.connect(overlay, 'out_file', slicer, 'in_file')
+
+    easy_thresh.connect(overlay, 'out_file', outputnode, 'overlay_threshold')
+    easy_thresh.connect(slicer, 'out_file', outputnode, 'rendered_image')
+
+    return easy_thresh
+
+
+def fsl_cluster_threshold(easy_thresh, inputnode):
+    """
+    Adds the FSL smoothest/cluster chain of nodes to the easy thresh
+    workflow, one node per z statistic image.
+
+    Parameters
+    ----------
+    easy_thresh : nipype workflow
+        Easy thresh workflow
+    inputnode : nipype node
+        inputspec node of the workflow
+
+    Returns
+    -------
+    cluster_index, cluster_thresh, cluster_localmax, stat_thresh : tuples
+        (node, output) of the cluster index, thresholded images, cluster
+        tables and overlay thresholds
+    """
+
     # fsl easythresh
     # estimate image smoothness
     smooth_estimate = pe.MapNode(interface=fsl.SmoothEstimate(),
@@ -253,22 +370,6 @@ def easy_thresh(wf_name):
                               name='create_tuple',
                               iterfield=['infile_b'])
 
-    # colour activation overlaying
-    overlay = pe.MapNode(interface=fsl.Overlay(),
-                         name='overlay',
-                         iterfield=['stat_image', 'stat_thresh'])
-    overlay.inputs.transparency = True
-    overlay.inputs.auto_thresh_bg = True
-    overlay.inputs.out_type = 'float'
-
-    # colour rendering
-    slicer = pe.MapNode(interface=fsl.Slicer(), name='slicer',
-                        iterfield=['in_file'])
-    # set max picture width
-    slicer.inputs.image_width = 750
-    # set output all axial slices into one picture
-    slicer.inputs.all_axial = True
-
     # function mapnode to get the standard fsl brain image based on parameters
     # as FSLDIR,MNI and voxel size
     get_bg_imports = ['import os', 'from nibabel import load']
@@ -280,15 +381,6 @@ def easy_thresh(wf_name):
                                      name='get_bckgrndimg1',
                                      iterfield=['in_file'])
 
-    # function node to get the standard fsl brain image
-    # outputs single file
-    get_backgroundimage2 = pe.Node(util.Function(input_names=['in_file',
-                                                              'file_parameters'],
-                                                 output_names=['out_file'],
-                                                 function=get_standard_background_img,
-                                                 imports=get_bg_imports),
-                                   name='get_backgrndimg2')
-
     # connections
     easy_thresh.connect(inputnode, 'z_stats', smooth_estimate, 'zstat_file')
     easy_thresh.connect(inputnode, 'merge_mask', smooth_estimate, 'mask_file')
@@ -317,28 +409,246 @@ def easy_thresh(wf_name):
     easy_thresh.connect(image_stats, 'out_stat', create_tuple, 'infile_b')
     easy_thresh.connect(inputnode, 'z_threshold', create_tuple, 'infile_a')
 
-    easy_thresh.connect(cluster, 'threshold_file', overlay, 'stat_image')
-    easy_thresh.connect(create_tuple, 'out_file', overlay, 'stat_thresh')
+    return (cluster, 'index_file'), (cluster, 'threshold_file'), \
+           (cluster, 'localmax_txt_file'), (create_tuple, 'out_file')
 
-    easy_thresh.connect(inputnode, 'merge_mask', get_backgroundimage2,
-                        'in_file' )
-    easy_thresh.connect(inputnode, 'parameters', get_backgroundimage2,
-                        'file_parameters')
 
-    easy_thresh.connect(get_backgroundimage2, 'out_file', overlay,
-                        'background_image')
+def estimate_smoothness(zstat, mask):
+    """
+    Estimates the smoothness of a z statistic image, from the lag-1
+    spatial autocorrelation of the image in each direction, as FSL
+    smoothest --zstat does.
 
-    easy_thresh.connect(overlay, 'out_file', slicer, 'in_file')
+    Parameters
+    ----------
+    zstat : numpy array
+        3D z statistic image
+    mask : numpy array (boolean)
+        3D brain mask
 
-    easy_thresh.connect(cluster, 'threshold_file', outputnode,
-                        'cluster_threshold')
-    easy_thresh.connect(cluster, 'index_file', outputnode, 'cluster_index')
-    easy_thresh.connect(cluster, 'localmax_txt_file', outputnode,
-                        'cluster_localmax_txt')
-    easy_thresh.connect(overlay, 'out_file', outputnode, 'overlay_threshold')
-    easy_thresh.connect(slicer, 'out_file', outputnode, 'rendered_image')
+    Returns
+    -------
+    dlh : float
+        sqrt(det(Lambda)), Lambda being the variance-covariance matrix of
+        the partial derivatives of the image
+    volume : integer
+        number of voxels in the mask
+    resels : float
+        size of a resolution element, in voxels
+    """
 
-    return easy_thresh
+    import numpy as np
+
+    zstat = np.where(mask, zstat, 0).astype(np.float64)
+
+    sigmasq = []
+    for axis in range(3):
+        lead = [slice(None)] * 3
+        lag = [slice(None)] * 3
+        lead[axis] = slice(1, None)
+        lag[axis] = slice(None, -1)
+        lead, lag = tuple(lead), tuple(lag)
+
+        # only pairs of neighbours which are both in the mask
+        pairs = mask[lead] & mask[lag]
+        a = zstat[lead][pairs]
+        b = zstat[lag][pairs]
+
+        ss_minus = np.dot(a, b)
+        s2 = 0.5 * (np.dot(a, a) + np.dot(b, b))
+
+        if s2 == 0 or ss_minus == 0:
+            raise Exception('\n\n[!] CPAC says: The smoothness of the z '
+                            'statistic image cannot be estimated.\n\n')
+
+        sigmasq.append(-1.0 / (4.0 * np.log(abs(ss_minus / s2))))
+
+    sigmasq = np.array(sigmasq)
+
+    dlh = np.prod(sigmasq) ** -0.5 * 8 ** -0.5
+    resels = np.prod(np.sqrt(8 * np.log(2) * sigmasq))
+
+    return dlh, int(mask.sum()), resels
+
+
+def cluster_logp(sizes, z_threshold, dlh, volume):
+    """
+    Log probabilities of 3D clusters of the given sizes from Gaussian
+    random field theory, as in FSL cluster.
+
+    Parameters
+    ----------
+    sizes : numpy array
+        cluster sizes, in voxels
+    z_threshold : float
+        cluster forming threshold
+    dlh : float
+        smoothness estimate, sqrt(det(Lambda))
+    volume : integer
+        number of voxels in the mask
+
+    Returns
+    -------
+    logp : numpy array
+        natural log of the probability of each cluster
+    """
+
+    import numpy as np
+    from scipy.special import gamma
+    from scipy.stats import norm
+
+    D = 3.0
+    t = float(z_threshold)
+    sizes = np.asarray(sizes, dtype=np.float64)
+
+    # expected number of clusters (Euler characteristic) and of
+    # suprathreshold voxels per cluster
+    em = volume * (2 * np.pi) ** (-(D + 1) / 2) * dlh * \
+        (t * t - 1) ** ((D - 1) / 2) * np.exp(-t * t / 2)
+    en = volume * norm.sf(t) / em
+    b = (gamma(D / 2 + 1) / en) ** (2 / D)
+
+    arg1 = -b * sizes ** (2 / D)
+    arg2 = -em * np.exp(arg1)
+
+    # log(1 - exp(arg2)), approximated for small probabilities
+    small = np.abs(arg2) < 1e-6
+    logp = np.empty_like(sizes)
+    logp[small] = np.log(em) + arg1[small]
+    logp[~small] = np.log(1 - np.exp(arg2[~small]))
+
+    return logp
+
+
+def cluster_threshold(z_stats, merge_mask, z_threshold, p_threshold):
+    """
+    Cluster-based thresholding of z statistic images: estimates the
+    smoothness of each image within the mask, labels the clusters of
+    voxels above z_threshold (26-connectivity), and keeps the clusters
+    whose GRF probability is below p_threshold. Replaces the FSL
+    smoothest, fslmaths, fslcpgeom, cluster and fslstats calls.
+
+    Parameters
+    ----------
+    z_stats : string or list of strings (nifti files)
+        z statistic images
+    merge_mask : string (nifti file)
+        group mask
+    z_threshold : float
+        cluster forming threshold
+    p_threshold : float
+        cluster probability threshold
+
+    Returns
+    -------
+    index_files : list of strings (nifti files)
+        images of the significant clusters, numbered in increasing size
+        order
+    threshold_files : list of strings (nifti files)
+        z statistic images masked by the significant clusters
+    localmax_txt_files : list of strings (text files)
+        cluster tables, in the format of FSL cluster
+    stat_thresh : list of tuples
+        z threshold and maximum of each thresholded image, for the
+        overlays
+    """
+
+    import os
+    import re
+    import numpy as np
+    import nibabel as nb
+    from scipy import ndimage
+    from CPAC.easy_thresh.easy_thresh import estimate_smoothness, \
+        cluster_logp
+    from CPAC.utils import save_nifti
+
+    if isinstance(z_stats, basestring):
+        z_stats = [z_stats]
+
+    mask = nb.load(merge_mask).get_data() > 0
+    structure = ndimage.generate_binary_structure(3, 3)
+
+    header = 'Cluster Index\tVoxels\tP\t-log10(P)\tMAX\tMAX X (vox)\t' \
+             'MAX Y (vox)\tMAX Z (vox)\tCOG X (vox)\tCOG Y (vox)\t' \
+             'COG Z (vox)'
+
+    index_files = []
+    threshold_files = []
+    localmax_txt_files = []
+    stat_thresh = []
+
+    for z_stat in z_stats:
+
+        out_name = re.match('z(\w)*stat(\d)+', os.path.basename(z_stat))
+        if out_name:
+            out_name = out_name.group(0)
+        else:
+            out_name = os.path.basename(z_stat).split('.')[0]
+
+        img = nb.load(z_stat)
+        zstat = np.squeeze(img.get_data()).astype(np.float32)
+        zstat[~mask] = 0
+
+        dlh, volume, resels = estimate_smoothness(zstat, mask)
+
+        labels, n_clusters = ndimage.label(zstat > z_threshold, structure)
+        sizes = np.bincount(labels.ravel())[1:]
+
+        rows = []
+        cluster_index = np.zeros(labels.shape, dtype=np.int16)
+        if n_clusters:
+            logp = cluster_logp(sizes, z_threshold, dlh, volume)
+            keep = np.flatnonzero(logp < np.log(p_threshold)) + 1
+
+            # clusters are numbered in increasing size order, so that the
+            # largest one has the highest index
+            keep = keep[np.argsort(sizes[keep - 1], kind='mergesort')]
+            new_index = np.zeros(n_clusters + 1, dtype=np.int16)
+            new_index[keep] = np.arange(1, keep.size + 1)
+            cluster_index = new_index[labels]
+
+            if keep.size:
+                values = np.where(cluster_index > 0, zstat, 0)
+                maxima = ndimage.maximum(zstat, cluster_index,
+                                         range(1, keep.size + 1))
+                max_pos = ndimage.maximum_position(zstat, cluster_index,
+                                                   range(1, keep.size + 1))
+                cogs = ndimage.center_of_mass(values, cluster_index,
+                                              range(1, keep.size + 1))
+
+                for i in range(keep.size, 0, -1):
+                    label = keep[i - 1]
+                    p = np.exp(logp[label - 1])
+                    rows.append([i, sizes[label - 1], '{0:.3g}'.format(p),
+                                 '{0:.2f}'.format(-np.log10(p)),
+                                 '{0:.3g}'.format(maxima[i - 1])] +
+                                list(max_pos[i - 1]) +
+                                ['{0:.3g}'.format(c) for c in cogs[i - 1]])
+
+        thresh = np.where(cluster_index > 0, zstat, 0).astype(np.float32)
+
+        hdr = img.get_header().copy()
+        hdr.set_data_dtype(np.float32)
+        threshold_files.append(
+            save_nifti(nb.Nifti1Image(thresh, img.get_affine(), hdr),
+                       'thresh_' + out_name))
+
+        hdr.set_data_dtype(np.int16)
+        index_files.append(
+            save_nifti(nb.Nifti1Image(cluster_index, img.get_affine(), hdr),
+                       'cluster_mask_' + out_name))
+
+        localmax_txt_file = os.path.join(os.getcwd(),
+                                         'cluster_' + out_name + '.txt')
+        with open(localmax_txt_file, 'w') as f:
+            f.write(header + '\n')
+            for row in rows:
+                f.write('\t'.join(str(v) for v in row) + '\n')
+        localmax_txt_files.append(localmax_txt_file)
+
+        stat_thresh.append((z_threshold, float(thresh.max())))
+
+    return index_files, threshold_files, localmax_txt_files, stat_thresh
 
 
 def call_cluster(in_file, volume, dlh, threshold, pthreshold, parameters):
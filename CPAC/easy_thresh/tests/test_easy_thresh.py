@@ -0,0 +1,105 @@
+
+
+def test_estimate_smoothness():
+    from CPAC.easy_thresh import estimate_smoothness
+    import numpy as np
+    from scipy import ndimage
+
+    np.random.seed(0)
+    sigma = 2.0
+    mask = np.zeros((60, 60, 60), dtype=bool)
+    mask[5:-5, 5:-5, 5:-5] = True
+
+    zstat = ndimage.gaussian_filter(np.random.randn(*mask.shape), sigma)
+    zstat /= zstat[mask].std()
+
+    dlh, volume, resels = estimate_smoothness(zstat, mask)
+
+    # white noise smoothed by a gaussian kernel of standard deviation
+    # sigma has Lambda = I / (4 sigma^2), and a resel of the size of the
+    # FWHM of the kernel in each direction
+    assert volume == mask.sum()
+    np.testing.assert_allclose(dlh, (2 * sigma ** 2) ** -1.5, rtol=0.2)
+    np.testing.assert_allclose(resels,
+                               (sigma * np.sqrt(8 * np.log(2))) ** 3,
+                               rtol=0.2)
+
+
+def test_cluster_logp():
+    from CPAC.easy_thresh import cluster_logp
+    import numpy as np
+
+    # log probabilities of FSL cluster (Infer in infer.cc) for
+    # DLH 0.0345, VOLUME 200000 and a z threshold of 2.3, covering both
+    # the exact and the small probability branches
+    sizes = [1, 10, 100, 500, 2000]
+    fsl_logp = [0.0, -4.551914400963152e-15, -0.003023074498239143,
+                -2.5466038744040187, -12.35603021961311]
+
+    logp = cluster_logp(sizes, 2.3, 0.0345, 200000)
+
+    np.testing.assert_allclose(logp, fsl_logp, rtol=1e-6, atol=1e-12)
+
+
+def test_cluster_threshold():
+    from CPAC.easy_thresh import cluster_threshold
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+    from scipy import ndimage
+
+    np.random.seed(0)
+    mask = np.zeros((30, 30, 30), dtype=bool)
+    mask[2:-2, 2:-2, 2:-2] = True
+
+    # weak smooth noise, and three clusters of 512, 27 and 1 voxels
+    zstat = ndimage.gaussian_filter(np.random.randn(*mask.shape), 1.5)
+    zstat /= 2 * zstat[mask].std()
+    zstat[5:13, 5:13, 5:13] = 4.0
+    zstat[20:23, 20:23, 20:23] = 3.0
+    zstat[20, 5, 20] = 3.0
+    # outside of the mask
+    zstat[0, 0, 0] = 5.0
+
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        nb.Nifti1Image(zstat.astype(np.float32),
+                       np.eye(4)).to_filename('zstat1.nii.gz')
+        nb.Nifti1Image(mask.astype(np.int16),
+                       np.eye(4)).to_filename('mask.nii.gz')
+
+        # p of 5.6e-7, 0.82 and 1.0
+        index_files, threshold_files, localmax_txt_files, stat_thresh = \
+            cluster_threshold('zstat1.nii.gz', 'mask.nii.gz', 2.3, 0.9)
+
+        index = nb.load(index_files[0]).get_data()
+        thresh = nb.load(threshold_files[0]).get_data()
+        with open(localmax_txt_files[0], 'r') as f:
+            rows = [line.split('\t') for line in f.read().splitlines()]
+
+        strict_index = nb.load(cluster_threshold(
+            ['zstat1.nii.gz'], 'mask.nii.gz', 2.3, 0.05)[0][0]).get_data()
+    finally:
+        os.chdir(cwd)
+
+    # clusters numbered in increasing size order
+    assert sorted(np.unique(index)) == [0, 1, 2]
+    assert (index == 1).sum() == 27
+    assert (index == 2).sum() == 512
+    assert (index[5:13, 5:13, 5:13] == 2).all()
+    assert (index[20:23, 20:23, 20:23] == 1).all()
+    assert index[20, 5, 20] == 0
+    assert index[0, 0, 0] == 0
+
+    np.testing.assert_array_equal(thresh, np.where(index > 0, zstat, 0))
+    assert stat_thresh == [(2.3, 4.0)]
+
+    # table in the FSL cluster format, largest cluster first
+    assert rows[0][:2] == ['Cluster Index', 'Voxels']
+    assert [row[:2] for row in rows[1:]] == [['2', '512'], ['1', '27']]
+    assert float(rows[1][2]) < 1e-6
+
+    assert sorted(np.unique(strict_index)) == [0, 1]
+    assert (strict_index == 1).sum() == 512
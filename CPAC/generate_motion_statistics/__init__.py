@@ -6,6 +6,8 @@ from generate_motion_statistics import  motion_power_statistics,\
                                  gen_motion_parameters,\
                                  gen_power_parameters,\
                                  calculate_DVARS, \
+                                 calc_motion_stats, \
+                                 calc_power_stats, \
                                  fristons_twenty_four, \
                                  calc_friston_twenty_four
 
@@ -17,5 +19,7 @@ __all__ = ['motion_power_statistics', \
            'gen_motion_parameters', \
            'gen_power_parameters', \
            'calculate_DVARS', \
+           'calc_motion_stats', \
+           'calc_power_stats', \
            'fristons_twenty_four', \
            'calc_friston_twenty_four' ]
@@ -193,6 +193,10 @@ def motion_power_statistics(calculation='Jenkinson',
         
         outputspec.motion_params : txt file
             Text file containing various movement parameters
+
+        outputspec.motion_stats : json file
+            One record per scan with all of the movement and power
+            parameters
         
     
     Order of commands:
@@ -332,42 +336,65 @@ def motion_power_statistics(calculation='Jenkinson',
                                                         'frames_ex_1D',
                                                         'frames_in_1D',
                                                         'power_params',
-                                                        'motion_params']),
+                                                        'motion_params',
+                                                        'motion_stats']),
                          name='outputspec')
 
-    cal_DVARS = pe.Node(util.Function(input_names=['rest', 
-                                                   'mask'],
-                                      output_names=['out_file'],
-                                      function=calculate_DVARS),
-                        name='cal_DVARS')
-
-    # calculate mean DVARS
-    pm.connect(inputNode, 'motion_correct', cal_DVARS, 'rest')
-    pm.connect(inputNode, 'mask', cal_DVARS, 'mask')
-    
-    # Calculating mean Framewise Displacement as per power et al., 2012
-    calculate_FDP = pe.Node(util.Function(input_names=['in_file'],
-                                          output_names=['out_file'],
-                                          function=calculate_FD_P),
-                            name='calculate_FD')
-    
-    pm.connect(inputNode, 'movement_parameters', 
-               calculate_FDP, 'in_file' )
-    pm.connect(calculate_FDP, 'out_file', 
-               outputNode, 'FDP_1D')
-    
-    # Calculating mean Framewise Displacement as per jenkinson et al., 2002
-    fdj_imports = ['import os', 'import math', 'import numpy as np']
-    calculate_FDJ = pe.Node(util.Function(input_names=['in_file'],
-                                          output_names=['out_file'],
-                                          function=calculate_FD_J,
-                                          imports=fdj_imports),
-                            name='calculate_FDJ')
-    
-    pm.connect(inputNode, 'oned_matrix_save', 
-               calculate_FDJ, 'in_file')
-    pm.connect(calculate_FDJ, 'out_file', 
-               outputNode, 'FDJ_1D')
+    # calculating the framewise displacements, DVARS, and the motion
+    # parameters in one pass, once for all the scrubbing thresholds
+    calc_stats = pe.Node(util.Function(input_names=['subject_id',
+                                                    'scan_id',
+                                                    'movement_parameters',
+                                                    'max_displacement',
+                                                    'oned_matrix_save',
+                                                    'rest',
+                                                    'mask'],
+                                       output_names=['FDP_1D',
+                                                     'FDJ_1D',
+                                                     'DVARS',
+                                                     'motion_params',
+                                                     'motion_summary'],
+                                       function=calc_motion_stats),
+                         name='calc_motion_stats')
+
+    pm.connect(inputNode, 'subject_id', calc_stats, 'subject_id')
+    pm.connect(inputNode, 'scan_id', calc_stats, 'scan_id')
+    pm.connect(inputNode, 'movement_parameters',
+               calc_stats, 'movement_parameters')
+    pm.connect(inputNode, 'max_displacement',
+               calc_stats, 'max_displacement')
+    pm.connect(inputNode, 'oned_matrix_save',
+               calc_stats, 'oned_matrix_save')
+    pm.connect(inputNode, 'motion_correct', calc_stats, 'rest')
+    pm.connect(inputNode, 'mask', calc_stats, 'mask')
+
+    pm.connect(calc_stats, 'FDP_1D', outputNode, 'FDP_1D')
+    pm.connect(calc_stats, 'FDJ_1D', outputNode, 'FDJ_1D')
+    pm.connect(calc_stats, 'motion_params', outputNode, 'motion_params')
+
+    # calculating the power parameters of each scrubbing threshold
+    calc_power = pe.Node(util.Function(input_names=['subject_id',
+                                                    'scan_id',
+                                                    'FDP_1D',
+                                                    'FDJ_1D',
+                                                    'DVARS',
+                                                    'motion_summary',
+                                                    'threshold'],
+                                       output_names=['power_params',
+                                                     'motion_stats'],
+                                       function=calc_power_stats),
+                         name='calc_power_stats')
+
+    pm.connect(inputNode, 'subject_id', calc_power, 'subject_id')
+    pm.connect(inputNode, 'scan_id', calc_power, 'scan_id')
+    pm.connect(calc_stats, 'FDP_1D', calc_power, 'FDP_1D')
+    pm.connect(calc_stats, 'FDJ_1D', calc_power, 'FDJ_1D')
+    pm.connect(calc_stats, 'DVARS', calc_power, 'DVARS')
+    pm.connect(calc_stats, 'motion_summary', calc_power, 'motion_summary')
+    pm.connect(scrubbing_input, 'threshold', calc_power, 'threshold')
+
+    pm.connect(calc_power, 'power_params', outputNode, 'power_params')
+    pm.connect(calc_power, 'motion_stats', outputNode, 'motion_stats')
 
     # calculating frames to exclude and include after scrubbing
     exc_frames_imports = ['import os', 'import numpy as np',
@@ -382,9 +409,9 @@ def motion_power_statistics(calculation='Jenkinson',
                              name='exclude_frames')
 
     if calculation == 'Jenkinson':
-        pm.connect(calculate_FDJ, 'out_file', exclude_frames, 'in_file')
+        pm.connect(calc_stats, 'FDJ_1D', exclude_frames, 'in_file')
     elif calculation == 'Power':
-        pm.connect(calculate_FDP, 'out_file', exclude_frames, 'in_file')
+        pm.connect(calc_stats, 'FDP_1D', exclude_frames, 'in_file')
 
     pm.connect(scrubbing_input, 'threshold', exclude_frames, 'threshold')
     pm.connect(scrubbing_input, 'remove_frames_before',
@@ -405,9 +432,9 @@ def motion_power_statistics(calculation='Jenkinson',
                              name='include_frames')
 
     if calculation == 'Jenkinson':
-        pm.connect(calculate_FDJ, 'out_file', include_frames, 'in_file')
+        pm.connect(calc_stats, 'FDJ_1D', include_frames, 'in_file')
     elif calculation == 'Power':
-        pm.connect(calculate_FDP, 'out_file', include_frames, 'in_file')
+        pm.connect(calc_stats, 'FDP_1D', include_frames, 'in_file')
 
     pm.connect(scrubbing_input, 'threshold', include_frames, 'threshold')
     pm.connect(exclude_frames, 'out_file', 
@@ -415,55 +442,6 @@ def motion_power_statistics(calculation='Jenkinson',
     pm.connect(include_frames, 'out_file', 
                outputNode, 'frames_in_1D')
 
-    motion_imports = ['import os', 'import numpy as np', 'import re']
-    calc_motion_parameters = pe.Node(util.Function(input_names=["subject_id", 
-                                                                "scan_id", 
-                                                                "movement_parameters",
-                                                                "max_displacement"],
-                                                   output_names=['out_file'],
-                                                   function=gen_motion_parameters,
-                                                   imports=motion_imports),
-                                     name='calc_motion_parameters')
-    pm.connect(inputNode, 'subject_id',
-               calc_motion_parameters, 'subject_id')
-    pm.connect(inputNode, 'scan_id',
-               calc_motion_parameters, 'scan_id')
-    pm.connect(inputNode, 'movement_parameters',
-               calc_motion_parameters, 'movement_parameters')
-    pm.connect(inputNode, 'max_displacement',
-               calc_motion_parameters, 'max_displacement')
-    
-    pm.connect(calc_motion_parameters, 'out_file', 
-               outputNode, 'motion_params')
-
-    power_imports = ['import os', 'import numpy as np',
-                     'from numpy import loadtxt']
-    calc_power_parameters = pe.Node(util.Function(input_names=["subject_id", 
-                                                                "scan_id", 
-                                                                "FDP_1D",
-                                                                "FDJ_1D", 
-                                                                "threshold",
-                                                                "DVARS"],
-                                                  output_names=['out_file'],
-                                                  function=gen_power_parameters,
-                                                  imports=power_imports),
-                                     name='calc_power_parameters')
-    pm.connect(inputNode, 'subject_id',
-               calc_power_parameters, 'subject_id')
-    pm.connect(inputNode, 'scan_id',
-               calc_power_parameters, 'scan_id')
-    pm.connect(cal_DVARS, 'out_file',
-               calc_power_parameters, 'DVARS')
-    pm.connect(calculate_FDP, 'out_file',
-               calc_power_parameters, 'FDP_1D')
-    pm.connect(calculate_FDJ, 'out_file',
-               calc_power_parameters, 'FDJ_1D')
-    pm.connect(scrubbing_input, 'threshold',
-               calc_power_parameters, 'threshold')
-
-    pm.connect(calc_power_parameters, 'out_file', 
-               outputNode, 'power_params')
-
     return pm
 
 
@@ -487,80 +465,47 @@ def calculate_FD_P(in_file):
     
     import os
     import numpy as np
+    from CPAC.generate_motion_statistics.utils import calc_fd_power
 
     out_file = os.path.join(os.getcwd(), 'FD.1D') 
 
-    lines = open(in_file, 'r').readlines()
-    rows = [[float(x) for x in line.split()] for line in lines]
-    cols = np.array([list(col) for col in zip(*rows)])
-    
-    translations = np.transpose(np.abs(np.diff(cols[3:6, :])))
-    rotations = np.transpose(np.abs(np.diff(cols[0:3, :])))
+    movement = np.atleast_2d(np.genfromtxt(in_file))
+    FD_power = calc_fd_power(movement)
 
-    FD_power = np.sum(translations, axis = 1) + (50*3.141/180)*np.sum(rotations, axis =1)
-    
-    #FD is zero for the first time point
-    FD_power = np.insert(FD_power, 0, 0)
-    
     np.savetxt(out_file, FD_power)
     
     return out_file
-    
+
 
 def calculate_FD_J(in_file):
     
     """
-    @ Krsna
-    May 2013
-    compute 
-    1) Jenkinson FD from 3dvolreg's *.affmat12.1D file from -1Dmatrix_save option
-    input: subject ID, rest_number, name of 6 parameter motion correction file (an output of 3dvolreg)
-    output: FD_J.1D file
-    Assumptions:    1) subject is available in BASE_DIR
-    2) 3dvolreg is already performed and the 1D motion parameter and 1D_matrix file file is present in sub?/rest_? called as --->'lfo_mc_affmat.1D'
-
-    """
-
-    # TODO: update docstrings
-    # in_file = CPAC's "coordinate transformation" resource
-
-    out_file = os.path.join(os.getcwd(), 'FD_J.1D')
-    pm_ = np.genfromtxt(in_file)
-        
-    pm = np.zeros((pm_.shape[0],pm_.shape[1]+4))
-    pm[:, :12] = pm_
-    pm[:, 12:] = [0.0, 0.0, 0.0, 1.0]
-
-    # The default radius (as in FSL) of a sphere represents the brain
-    rmax = 80.0
+    Method to calculate Framewise Displacement (FD) calculations
+    (Jenkinson et al., 2002)
 
-    # rigid body transformation matrix
-    T_rb_prev = np.matrix(np.eye(4))
+    Parameters
+    ----------
+    in_file : string
+        path to the aff12 1D file from 3dvolreg's -1Dmatrix_save option
+        (CPAC's "coordinate transformation" resource)
 
-    out_lines = []
+    Returns
+    -------
+    out_file : string
+        Frame-wise displacement 1D file path
 
-    for i in range(0, pm.shape[0]):
-        # making use of the fact that the order of aff12 matrix is
-        # "row-by-row"
-        T_rb = np.matrix(pm[i].reshape(4,4))
+    """
 
-        if not out_lines:
-            out_lines.append('0')
-        else:
-            M = np.dot(T_rb, T_rb_prev.I) - np.eye(4)
-            A = M[0:3, 0:3]
-            b = M[0:3, 3]
+    import os
+    from CPAC.generate_motion_statistics.utils import load_affine_matrices, \
+                                                     calc_fd_jenkinson, \
+                                                     write_fd_jenkinson
 
-            FD_J = math.sqrt((rmax*rmax/5)*np.trace(np.dot(A.T, A)) + np.dot(b.T, b))
-            out_lines.append('\n{0:.8f}'.format(FD_J))
+    out_file = os.path.join(os.getcwd(), 'FD_J.1D')
 
-        T_rb_prev = T_rb
+    FD_J = calc_fd_jenkinson(load_affine_matrices(in_file))
 
-    with open(out_file, "w") as f:
-        for line in out_lines:
-            f.write(line)
-    
-    return out_file
+    return write_fd_jenkinson(out_file, FD_J)
 
 
 def set_frames_in(in_file, threshold, exclude_list):
@@ -695,99 +640,20 @@ def gen_motion_parameters(subject_id, scan_id, movement_parameters,
 
     """
 
+    import os
+    import numpy as np
+    from CPAC.generate_motion_statistics.utils import load_max_displacement, \
+                                                     calc_motion_summary, \
+                                                     write_motion_params
+
     out_file = os.path.join(os.getcwd(), 'motion_parameters.txt')
 
-    arr = np.genfromtxt(movement_parameters)
-    arr = arr.T
-
-    # Relative RMS of translation
-    rms = np.sqrt(arr[3]*arr[3] + arr[4]*arr[4] + arr[5]*arr[5])
-    diff = np.diff(rms)
-    MEANrms = np.mean(abs(diff))
-
-    # Max Relative RMS Displacement
-    MAXrms = np.max(abs(diff))
-
-    # NUMBER OF relative RMS movements >0.1mm
-    NUMmove = np.sum(abs(diff) > 0.1)
-
-    # Mean of mean relative rotation (params 1-3)
-    MEANrot = np.mean(np.abs(np.diff((abs(arr[0])+ abs(arr[1])+ abs(arr[2]))/3)))
-
-    with open(max_displacement, 'r') as f:
-        lines = f.readlines()
-    list1 = []
-
-    # remove any other information aother than matrix from
-    # max displacement file. afni adds infomration to the file
-    for l in lines:
-        if re.match("^\d+?\.\d+?$", l.strip()):
-            list1.append(float(l.strip()))
-
-    arr2 = np.array(list1, dtype='float')
-
-    # Mean Relative Maxdisp
-    mean = np.mean(np.diff(arr2))
-
-    # Max Relative Maxdisp
-    relMAX = np.max(abs(np.diff(arr2)))
-
-    # Max Abs Maxdisp
-    MAX= np.max(arr2)
-
-    with open(out_file, 'w') as f:
-        f.write("Subject,Scan,Mean_Relative_RMS_Displacement,"
-                "Max_Relative_RMS_Displacement,Movements_gt_threshold,"
-                "Mean_Relative_Mean_Rotation,Mean_Relative_Maxdisp,Max_Relative_Maxdisp,"
-                "Max_Abs_Maxdisp,Max Relative_Roll,Max_Relative_Pitch,"
-                "Max_Relative_Yaw,Max_Relative_dS-I,Max_Relative_dL-R,"
-                "Max_Relative_dP-A,Mean_Relative_Roll,Mean_Relative_Pitch,Mean_Relative_Yaw,"
-                "Mean_Relative_dS-I,Mean_Relative_dL-R,Mean_Relative_dP-A,Max_Abs_Roll,"
-                "Max_Abs_Pitch,Max_Abs_Yaw,Max_Abs_dS-I,Max_Abs_dL-R,Max_Abs_dP-A,"
-                "Mean_Abs_Roll,Mean_Abs_Pitch,Mean_Abs_Yaw,Mean_Abs_dS-I,Mean_Abs_dL-R,Mean_Abs_dP-A\n")
-
-        f.write("{0},{1},{2}".format(subject_id, scan_id, ",".join(
-            ["{0:.3f}".format(val) for val in [MEANrms, MAXrms, NUMmove, MEANrot, mean, relMAX, MAX]])))
-
-        # f.write("%.3f," % (MEANrms))
-        # f.write("%.3f," % (MAXrms))
-        # f.write("%.3f," % (NUMmove))
-        # f.write("%.3f," % (MEANrot))
-        # f.write("%.3f," % (mean))
-        # f.write("%.3f," % (relMAX))
-        # f.write("%.3f," % (MAX))
-
-        # Max Relative Roll,Max Relative Pitch,
-        # Max Relative Yaw,Max Relative dS-I,
-        # Max Relative dL-R,Max Relative dP-A
-        f.write(",{0}".format(",".join(["{0:.6f}".format(np.max(abs(np.diff(arr[i])))) for i in range(6)])))
-        # for i in range(6):
-        #     f.write("%.6f," %(np.max(abs(np.diff(arr[i])))))
-
-        # Mean Relative Roll,Mean Relative Pitch,
-        # Mean Relative Yaw,Mean Relative dS-I,
-        # Mean Relative dL-R,Mean Relative dP-A
-        f.write(",{0}".format(",".join(["{0:.6f}".format(np.mean(np.diff(arr[i]))) for i in range(6)])))
-        #
-        # for i in range(6):
-        #     f.write("%.6f," %(np.mean(np.diff(arr[i]))))
-
-        # Max Abs Roll,Max Abs Pitch,Max Abs Yaw,
-        # Max Abs dS-I,Max Abs dL-R,Max Abs dP-A
-        # for i in range(6):
-        #     f.write("%.6f," %(np.max(abs(arr[i]))))
-        f.write(",{0}".format(",".join(["{0:.6f}".format(np.max(abs(arr[i]))) for i in range(6)])))
-
-
-        # Mean Abs Roll,Mean Abs Pitch,Mean Abs Yaw,
-        # Mean Abs dS-I,Mean Abs dL-R,Mean Abs dP-A
-        # for i in range(6):
-        #     f.write("%.6f," %(np.mean(abs(arr[i]))))
-        f.write(",{0}".format(",".join(["{0:.6f}".format(np.mean(abs(arr[i]))) for i in range(6)])))
-
-        f.write("\n")
+    movement = np.atleast_2d(np.genfromtxt(movement_parameters))
+    maxdisp = load_max_displacement(max_displacement)
 
-    return out_file
+    summary = calc_motion_summary(movement, maxdisp)
+
+    return write_motion_params(out_file, subject_id, scan_id, summary)
 
 
 def gen_power_parameters(subject_id, scan_id, FDP_1D, FDJ_1D, DVARS,
@@ -818,52 +684,20 @@ def gen_power_parameters(subject_id, scan_id, FDP_1D, FDJ_1D, DVARS,
         path to csv file containing all the pow parameters 
     """
 
-    threshold = float(threshold)
-
-    powersFD_data = loadtxt(FDP_1D)
-    jenkFD_data = loadtxt(FDJ_1D)
-    
-    # Mean (across time/frames) of the absolute values
-    # for Framewise Displacement (FD)
-    meanFD_Power  = np.mean(powersFD_data)
-    
-    # Mean FD Jenkinson
-    meanFD_Jenkinson = np.mean(jenkFD_data)
-    
-    # Number of frames (time points) where movement
-    # (FD) exceeded threshold
-    numFD = float(jenkFD_data[jenkFD_data > threshold].size)
-    
-    # Root mean square (RMS; across time/frames)
-    # of the absolute values for FD
-    rmsFD = np.sqrt(np.mean(jenkFD_data))
-
-    # Mean of the top quartile of FD is $FDquartile
-    quat=int(len(jenkFD_data)/4)
-    FDquartile=np.mean(np.sort(jenkFD_data)[::-1][:quat])
+    import os
+    import numpy as np
+    from CPAC.generate_motion_statistics.utils import calc_power_summary, \
+                                                     write_power_params
 
-    # NUMBER OF FRAMES >threshold FD as percentage of total num frames
-    count = np.float(jenkFD_data[jenkFD_data>threshold].size)
-    percentFD = (count*100/(len(jenkFD_data)+1))
+    threshold = float(threshold)
 
-    # Mean DVARS
-    meanDVARS = np.mean(np.load(DVARS))
+    summary = calc_power_summary(np.loadtxt(FDP_1D), np.loadtxt(FDJ_1D),
+                                 np.load(DVARS), threshold)
 
     out_file = os.path.join(os.getcwd(), 'pow_params.txt')
 
-    with open(out_file, 'w') as f:
-        f.write("Subject, Scan, MeanFD_Power, MeanFD_Jenkinson, "
-                "NumFD_greater_than_{0:.2f}, rootMeanSquareFD, "
-                "FDquartile(top1/4thFD), PercentFD_greater_than_{1:.2f}, "
-                "MeanDVARS\n".format(threshold, threshold))
-
-        f.write("{0}, {1}, ".format(subject_id, scan_id))
-        f.write('{0:.4f}, {1:.4f}, '.format(meanFD_Power, meanFD_Jenkinson))
-        f.write('{0:.4f}, {1:.4f}, '.format(numFD, rmsFD))
-        f.write('{0:.4f}, {1:.4f}, '.format(FDquartile, percentFD))
-        f.write('{0:.4f}'.format(meanDVARS))
-    
-    return out_file
+    return write_power_params(out_file, subject_id, scan_id, threshold,
+                              summary)
 
 
 def calculate_DVARS(rest, mask):
@@ -886,25 +720,153 @@ def calculate_DVARS(rest, mask):
     """
     
     import numpy as np
-    import nibabel as nib
     import os
+    from CPAC.generate_motion_statistics.utils import calc_dvars
     
     out_file = os.path.join(os.getcwd(), 'DVARS.npy')
+
+    np.save(out_file, calc_dvars(rest, mask))
     
-    rest_data = nib.load(rest).get_data().astype(np.float32)
-    mask_data = nib.load(mask).get_data().astype('bool')
-    
-    # square of relative intensity value for each voxel across every timepoint
-    data = np.square(np.diff(rest_data, axis=3))
+    return out_file
 
-    # applying mask, getting the data in the brain only
-    data = data[mask_data]
 
-    # square root and mean across all timepoints inside mask
-    DVARS = np.sqrt(np.mean(data, axis=0))
+def calc_motion_stats(subject_id, scan_id, movement_parameters,
+                      max_displacement, oned_matrix_save, rest, mask):
+    """
+    Method to calculate the framewise displacements, DVARS, and the motion
+    parameters of a scan at once. Nothing here depends on the scrubbing
+    threshold, see `calc_power_stats` for the parameters which do.
 
-    np.save(out_file, DVARS)
-    
-    return out_file
+    Parameters
+    ----------
+    subject_id : string
+        subject name or id
+    scan_id : string
+        scan name or id
+    movement_parameters : string
+        path of 1D file containing six movement/motion parameters(3 Translation,
+        3 Rotations) in different columns (roll pitch yaw dS  dL  dP)
+    max_displacement : string
+        path of file with maximum displacement (in mm) for brain voxels in each volume
+    oned_matrix_save : string
+        path to the aff12 1D file from 3dvolreg's -1Dmatrix_save option
+    rest : string (nifti file)
+        path to motion correct functional data
+    mask : string (nifti file)
+        path to brain only mask for functional data
 
-    
+    Returns
+    -------
+    FDP_1D : string
+        framewise displacement(FD as per power et al., 2012) file path
+    FDJ_1D : string
+        framewise displacement(FD as per jenkinson et al., 2002) file path
+    DVARS : string
+        path to numpy file containing DVARS
+    motion_params : string
+        path to csv file containing various motion parameters
+    motion_summary : string
+        path to json file with the motion parameters of the scan, at full
+        precision
+    """
+
+    import os
+    import json
+    import numpy as np
+    from CPAC.generate_motion_statistics import utils
+
+    movement = np.atleast_2d(np.genfromtxt(movement_parameters))
+    affines = utils.load_affine_matrices(oned_matrix_save)
+    maxdisp = utils.load_max_displacement(max_displacement)
+
+    fd_power = utils.calc_fd_power(movement)
+    fd_jenkinson = utils.calc_fd_jenkinson(affines)
+    dvars = utils.calc_dvars(rest, mask)
+
+    motion_summary = utils.calc_motion_summary(movement, maxdisp)
+
+    FDP_1D = os.path.join(os.getcwd(), 'FD.1D')
+    np.savetxt(FDP_1D, fd_power)
+
+    FDJ_1D = utils.write_fd_jenkinson(os.path.join(os.getcwd(), 'FD_J.1D'),
+                                      fd_jenkinson)
+
+    DVARS = os.path.join(os.getcwd(), 'DVARS.npy')
+    np.save(DVARS, dvars)
+
+    motion_params = utils.write_motion_params(
+        os.path.join(os.getcwd(), 'motion_parameters.txt'),
+        subject_id, scan_id, motion_summary)
+
+    record = {'Subject': subject_id, 'Scan': scan_id}
+    record.update(zip(utils.MOTION_PARAMS_FIELDS,
+                      [float(val) for val in motion_summary]))
+
+    motion_summary = os.path.join(os.getcwd(), 'motion_summary.json')
+    with open(motion_summary, 'w') as f:
+        json.dump(record, f, indent=4, sort_keys=True)
+
+    return FDP_1D, FDJ_1D, DVARS, motion_params, motion_summary
+
+
+def calc_power_stats(subject_id, scan_id, FDP_1D, FDJ_1D, DVARS,
+                     motion_summary, threshold=1.0):
+    """
+    Method to calculate the power parameters of a scan for a scrubbing
+    threshold, from the framewise displacements and DVARS written by
+    `calc_motion_stats`, and to write the record of all of the motion and
+    power parameters of the scan
+
+    Parameters
+    ----------
+    subject_id : string
+        subject name or id
+    scan_id : string
+        scan name or id
+    FDP_1D : string
+        framewise displacement(FD as per power et al., 2012) file path
+    FDJ_1D : string
+        framewise displacement(FD as per jenkinson et al., 2002) file path
+    DVARS : string
+        path to numpy file containing DVARS
+    motion_summary : string
+        path to json file with the motion parameters of the scan
+    threshold : float
+        scrubbing threshold set in the configuration
+        by default the value is set to 1.0
+
+    Returns
+    -------
+    power_params : string
+        path to csv file containing all the pow parameters
+    motion_stats : string
+        path to json file with one record holding the motion and power
+        parameters of the scan
+    """
+
+    import os
+    import json
+    import numpy as np
+    from CPAC.generate_motion_statistics import utils
+
+    threshold = float(threshold)
+
+    power_summary = utils.calc_power_summary(np.loadtxt(FDP_1D),
+                                             np.loadtxt(FDJ_1D),
+                                             np.load(DVARS), threshold)
+
+    power_params = utils.write_power_params(
+        os.path.join(os.getcwd(), 'pow_params.txt'),
+        subject_id, scan_id, threshold, power_summary)
+
+    with open(motion_summary, 'r') as f:
+        record = json.load(f)
+    record['threshold'] = threshold
+    record.update(zip(utils.POWER_PARAMS_FIELDS,
+                      [float(val) for val in power_summary]))
+
+    motion_stats = os.path.join(os.getcwd(), 'motion_statistics.json')
+    with open(motion_stats, 'w') as f:
+        json.dump(record, f, indent=4, sort_keys=True)
+
+    return power_params, motion_stats
@@ -0,0 +1,330 @@
+
+def make_motion(n_vols=20, seed=0):
+    import numpy as np
+
+    np.random.seed(seed)
+
+    # slow drift plus jitter, rotations in degrees
+    movement = np.cumsum(np.random.randn(n_vols, 6) * 0.05, axis=0)
+    maxdisp = np.abs(np.cumsum(np.random.randn(n_vols) * 0.1)) + 0.001
+
+    return movement, maxdisp
+
+
+def make_affines(movement):
+    import numpy as np
+
+    affines = np.zeros((movement.shape[0], 4, 4))
+    params = np.hstack((np.radians(movement[:, :3]), movement[:, 3:]))
+    for i, (roll, pitch, yaw, dS, dL, dP) in enumerate(params):
+        cx, sx = np.cos(roll), np.sin(roll)
+        cy, sy = np.cos(pitch), np.sin(pitch)
+        cz, sz = np.cos(yaw), np.sin(yaw)
+        rx = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+        ry = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+        rz = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+        affines[i, :3, :3] = np.dot(rz, np.dot(ry, rx))
+        affines[i, :3, 3] = [dL, dP, dS]
+        affines[i, 3, 3] = 1.0
+
+    return affines
+
+
+def old_fd_power(movement):
+    # the per-column implementation of calculate_FD_P
+    import numpy as np
+
+    cols = movement.T
+    translations = np.transpose(np.abs(np.diff(cols[3:6])))
+    rotations = np.transpose(np.abs(np.diff(cols[0:3])))
+
+    FD_power = np.sum(translations, axis=1) + \
+        (50 * 3.141 / 180) * np.sum(rotations, axis=1)
+
+    return np.insert(FD_power, 0, 0)
+
+
+def old_fd_jenkinson(affines, rmax=80.0):
+    # the per-frame np.matrix loop of calculate_FD_J
+    import math
+    import numpy as np
+
+    fd = [0.0]
+    T_rb_prev = np.matrix(affines[0])
+    for i in range(1, affines.shape[0]):
+        T_rb = np.matrix(affines[i])
+        M = np.dot(T_rb, T_rb_prev.I) - np.eye(4)
+        A = M[0:3, 0:3]
+        b = M[0:3, 3]
+        fd.append(math.sqrt((rmax * rmax / 5) * np.trace(np.dot(A.T, A)) +
+                            np.dot(b.T, b)))
+        T_rb_prev = T_rb
+
+    return np.array(fd)
+
+
+def old_motion_summary(movement, maxdisp):
+    # the column by column implementation of gen_motion_parameters
+    import numpy as np
+
+    arr = movement.T
+    rms = np.sqrt(arr[3] * arr[3] + arr[4] * arr[4] + arr[5] * arr[5])
+    diff = np.diff(rms)
+    summary = [np.mean(abs(diff)),
+               np.max(abs(diff)),
+               np.sum(abs(diff) > 0.1),
+               np.mean(abs(np.diff((abs(arr[0]) + abs(arr[1]) +
+                                    abs(arr[2])) / 3))),
+               np.mean(np.diff(maxdisp)),
+               np.max(abs(np.diff(maxdisp))),
+               np.max(maxdisp)]
+
+    summary += [np.max(abs(np.diff(arr[i]))) for i in range(6)]
+    summary += [np.mean(np.diff(arr[i])) for i in range(6)]
+    summary += [np.max(abs(arr[i])) for i in range(6)]
+    summary += [np.mean(abs(arr[i])) for i in range(6)]
+
+    return summary
+
+
+def test_calc_fd_power():
+    from CPAC.generate_motion_statistics.utils import calc_fd_power
+    import numpy as np
+
+    movement, _ = make_motion()
+
+    fd = calc_fd_power(movement)
+
+    assert fd.shape == (movement.shape[0],)
+    assert fd[0] == 0
+    np.testing.assert_allclose(fd, old_fd_power(movement), rtol=1e-12)
+
+
+def test_calc_fd_jenkinson():
+    from CPAC.generate_motion_statistics.utils import calc_fd_jenkinson, \
+        load_affine_matrices
+    import os
+    import tempfile
+    import numpy as np
+
+    movement, _ = make_motion()
+    affines = make_affines(movement)
+
+    fd = calc_fd_jenkinson(affines)
+
+    assert fd.shape == (movement.shape[0],)
+    assert fd[0] == 0
+    np.testing.assert_allclose(fd, old_fd_jenkinson(affines), rtol=1e-10,
+                               atol=1e-12)
+    np.testing.assert_allclose(calc_fd_jenkinson(affines, rmax=50.0),
+                               old_fd_jenkinson(affines, rmax=50.0),
+                               rtol=1e-10, atol=1e-12)
+
+    # a scan without motion has no displacement
+    still = np.tile(np.eye(4), (5, 1, 1))
+    np.testing.assert_allclose(calc_fd_jenkinson(still), 0, atol=1e-12)
+
+    # from the aff12 rows of 3dvolreg's -1Dmatrix_save
+    oned_matrix_save = os.path.join(tempfile.mkdtemp(), 'rest.aff12.1D')
+    np.savetxt(oned_matrix_save, affines[:, :3, :].reshape(-1, 12),
+               fmt='%.10f', header='3dvolreg matrices')
+    np.testing.assert_allclose(load_affine_matrices(oned_matrix_save),
+                               affines, atol=1e-9)
+
+
+def test_calc_motion_summary():
+    from CPAC.generate_motion_statistics.utils import calc_motion_summary, \
+        MOTION_PARAMS_FIELDS
+    import numpy as np
+
+    movement, maxdisp = make_motion()
+
+    # large enough steps for some movements over 0.1mm
+    movement[5, 3:6] += 0.5
+
+    summary = calc_motion_summary(movement, maxdisp)
+    expected = old_motion_summary(movement, maxdisp)
+
+    assert len(summary) == len(MOTION_PARAMS_FIELDS)
+    assert summary[2] == expected[2] > 0
+    np.testing.assert_allclose(summary, expected, rtol=1e-12, atol=1e-15)
+
+
+def test_calc_power_summary():
+    from CPAC.generate_motion_statistics.utils import calc_power_summary, \
+        POWER_PARAMS_FIELDS
+    import numpy as np
+
+    fd_power = np.array([0.0, 0.2, 0.5, 1.2, 0.1, 0.3, 0.9, 0.4])
+    fd_jenkinson = np.array([0.0, 0.1, 0.3, 0.8, 0.05, 0.25, 0.6, 0.2])
+    dvars = np.array([10.0, 12.0, 30.0, 11.0, 9.0, 14.0, 13.0])
+
+    summary = calc_power_summary(fd_power, fd_jenkinson, dvars, 0.2)
+
+    assert len(summary) == len(POWER_PARAMS_FIELDS)
+    np.testing.assert_allclose(summary,
+                               [np.mean(fd_power),
+                                np.mean(fd_jenkinson),
+                                4.0,
+                                np.sqrt(np.mean(fd_jenkinson)),
+                                (0.8 + 0.6) / 2,
+                                4.0 * 100 / 9,
+                                np.mean(dvars)])
+
+
+def test_calc_motion_and_power_stats():
+    from CPAC.generate_motion_statistics import calc_motion_stats, \
+        calc_power_stats
+    from CPAC.generate_motion_statistics import utils
+    import os
+    import json
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    movement, maxdisp = make_motion()
+    affines = make_affines(movement)
+    n_vols = movement.shape[0]
+
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        movement_parameters = os.path.abspath('rest.1D')
+        np.savetxt(movement_parameters, movement)
+
+        oned_matrix_save = os.path.abspath('rest.aff12.1D')
+        np.savetxt(oned_matrix_save, affines[:, :3, :].reshape(-1, 12))
+
+        max_displacement = os.path.abspath('max_disp.1D')
+        with open(max_displacement, 'w') as f:
+            f.write('# 3dvolreg maxdisp1D\n')
+            f.write('\n'.join('{0:.6f}'.format(val) for val in maxdisp))
+
+        np.random.seed(1)
+        rest = os.path.abspath('rest.nii.gz')
+        data = np.random.randn(4, 4, 4, n_vols).astype(np.float32) + 100
+        nb.Nifti1Image(data, np.eye(4)).to_filename(rest)
+
+        mask = os.path.abspath('mask.nii.gz')
+        mask_data = np.zeros((4, 4, 4), dtype=np.uint8)
+        mask_data[1:3, 1:3, :] = 1
+        nb.Nifti1Image(mask_data, np.eye(4)).to_filename(mask)
+
+        FDP_1D, FDJ_1D, DVARS, motion_params, motion_summary = \
+            calc_motion_stats('sub-1', 'rest_1', movement_parameters,
+                              max_displacement, oned_matrix_save, rest, mask)
+
+        np.testing.assert_allclose(np.loadtxt(FDP_1D), old_fd_power(movement))
+        np.testing.assert_allclose(np.loadtxt(FDJ_1D),
+                                   old_fd_jenkinson(affines), atol=1e-8)
+
+        dvars = np.load(DVARS)
+        masked = data[mask_data.astype(bool)]
+        np.testing.assert_allclose(
+            dvars, np.sqrt(np.mean(np.square(np.diff(masked, axis=1)),
+                                   axis=0)), rtol=1e-6)
+
+        # the same motion record, once per scrubbing threshold
+        for threshold in [0.2, 0.5]:
+            os.chdir(tempfile.mkdtemp())
+            power_params, motion_stats = \
+                calc_power_stats('sub-1', 'rest_1', FDP_1D, FDJ_1D, DVARS,
+                                 motion_summary, threshold)
+
+            with open(power_params, 'r') as f:
+                lines = f.read().splitlines()
+            assert 'NumFD_greater_than_{0:.2f}'.format(threshold) in lines[0]
+
+            expected = utils.calc_power_summary(np.loadtxt(FDP_1D),
+                                                np.loadtxt(FDJ_1D), dvars,
+                                                threshold)
+
+            with open(motion_stats, 'r') as f:
+                record = json.load(f)
+
+            assert record['Subject'] == 'sub-1'
+            assert record['Scan'] == 'rest_1'
+            assert record['threshold'] == threshold
+            for field, val in zip(utils.MOTION_PARAMS_FIELDS,
+                                  old_motion_summary(movement, maxdisp)):
+                np.testing.assert_allclose(record[field], val, atol=1e-6)
+            for field, val in zip(utils.POWER_PARAMS_FIELDS, expected):
+                np.testing.assert_allclose(record[field], val)
+    finally:
+        os.chdir(cwd)
+
+
+def old_dvars(rest, mask):
+    # the full 4D np.diff implementation of calculate_DVARS
+    import numpy as np
+    import nibabel as nib
+
+    rest_data = nib.load(rest).get_data().astype(np.float32)
+    mask_data = nib.load(mask).get_data().astype('bool')
+
+    data = np.square(np.diff(rest_data, axis=3))
+    data = data[mask_data]
+
+    return np.sqrt(np.mean(data, axis=0))
+
+
+def test_calc_dvars():
+    from CPAC.generate_motion_statistics.utils import calc_dvars
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(2)
+    n_vols = 11
+    data = np.random.randn(5, 4, 3, n_vols) * 10 + 500
+    mask_data = np.zeros((5, 4, 3), dtype=np.uint8)
+    mask_data[1:4, 1:3, :] = 1
+
+    out_dir = tempfile.mkdtemp()
+    mask = os.path.join(out_dir, 'mask.nii.gz')
+    nb.Nifti1Image(mask_data, np.eye(4)).to_filename(mask)
+
+    rest_files = []
+    for ext in ['nii', 'nii.gz']:
+        rest = os.path.join(out_dir, 'rest.' + ext)
+        nb.Nifti1Image(data.astype(np.float32), np.eye(4)).to_filename(rest)
+        rest_files.append(rest)
+
+    # scaled integers, read back with the slope and intercept applied
+    rest = os.path.join(out_dir, 'rest_int16.nii.gz')
+    img = nb.Nifti1Image(np.round(data).astype(np.int16), np.eye(4))
+    img.get_header().set_slope_inter(0.5, 10.0)
+    img.to_filename(rest)
+    rest_files.append(rest)
+
+    for rest in rest_files:
+        expected = old_dvars(rest, mask)
+        assert expected.shape == (n_vols - 1,)
+
+        # chunks smaller than, not dividing, and larger than the scan
+        for chunk_size in [1, 3, 32]:
+            np.testing.assert_allclose(calc_dvars(rest, mask, chunk_size),
+                                       expected, rtol=1e-5)
+
+        dvars, stats = calc_dvars(rest, mask, chunk_size=4,
+                                  return_stats=True)
+        np.testing.assert_allclose(dvars, expected, rtol=1e-5)
+
+        masked = nb.load(rest).get_data().astype(np.float64)[
+            mask_data.astype(bool)]
+        mean = masked.mean(1)
+        std = masked.std(1)
+        np.testing.assert_allclose(stats['mean'][mask_data.astype(bool)],
+                                   mean, rtol=1e-6)
+        np.testing.assert_allclose(stats['std'][mask_data.astype(bool)],
+                                   std, rtol=1e-5)
+        assert not stats['mean'][~mask_data.astype(bool)].any()
+        assert not stats['std'][~mask_data.astype(bool)].any()
+
+        centered = masked - mean[:, np.newaxis]
+        ar1 = (centered[:, 1:] * centered[:, :-1]).sum(1) / \
+            (n_vols - 1) / std ** 2
+        diff_sd = np.sqrt(2 * (1 - ar1)) * std
+        np.testing.assert_allclose(stats['dvars_std'],
+                                   expected / diff_sd.mean(), rtol=1e-4)
@@ -0,0 +1,359 @@
+import re
+import numpy as np
+
+
+# header names of the motion parameters text file, in order
+MOTION_PARAMS_FIELDS = ['Mean_Relative_RMS_Displacement',
+                        'Max_Relative_RMS_Displacement',
+                        'Movements_gt_threshold',
+                        'Mean_Relative_Mean_Rotation',
+                        'Mean_Relative_Maxdisp',
+                        'Max_Relative_Maxdisp',
+                        'Max_Abs_Maxdisp'] + \
+                       ['{0}_{1}'.format(stat, param)
+                        for stat in ['Max_Relative', 'Mean_Relative',
+                                     'Max_Abs', 'Mean_Abs']
+                        for param in ['Roll', 'Pitch', 'Yaw',
+                                      'dS-I', 'dL-R', 'dP-A']]
+
+# header names of the power parameters text file, in order
+POWER_PARAMS_FIELDS = ['MeanFD_Power',
+                       'MeanFD_Jenkinson',
+                       'NumFD_greater_than_threshold',
+                       'rootMeanSquareFD',
+                       'FDquartile(top1/4thFD)',
+                       'PercentFD_greater_than_threshold',
+                       'MeanDVARS']
+
+
+def load_affine_matrices(oned_matrix_save):
+    """
+    Load the 3dvolreg -1Dmatrix_save file into a stack of rigid body
+    transformation matrices.
+
+    Parameters
+    ----------
+    oned_matrix_save : string
+        path to the aff12 1D file, one row-by-row 3x4 matrix per volume
+
+    Returns
+    -------
+    affines : numpy.ndarray
+        array of shape (T, 4, 4)
+    """
+
+    aff12 = np.atleast_2d(np.genfromtxt(oned_matrix_save))
+
+    affines = np.zeros((aff12.shape[0], 4, 4))
+    affines[:, :3, :] = aff12[:, :12].reshape(-1, 3, 4)
+    affines[:, 3, 3] = 1.0
+
+    return affines
+
+
+def load_max_displacement(max_displacement):
+    """
+    Load the maximum displacement values from the 3dvolreg -maxdisp1D file,
+    skipping any other information AFNI adds to the file.
+
+    Parameters
+    ----------
+    max_displacement : string
+        path to the max displacement 1D file
+
+    Returns
+    -------
+    maxdisp : numpy.ndarray
+        array of shape (T,)
+    """
+
+    with open(max_displacement, 'r') as f:
+        text = f.read()
+
+    values = re.findall(r"^\s*(\d+?\.\d+?)\s*$", text, re.MULTILINE)
+
+    return np.array(values, dtype='float')
+
+
+def calc_fd_power(movement):
+    """
+    Calculate the Framewise Displacement (FD) as per Power et al., 2012.
+
+    Parameters
+    ----------
+    movement : numpy.ndarray
+        array of shape (T, 6) of the motion parameters (roll pitch yaw dS dL
+        dP), rotations in degrees
+
+    Returns
+    -------
+    fd : numpy.ndarray
+        array of shape (T,), zero for the first time point
+    """
+
+    deltas = np.abs(np.diff(movement, axis=0))
+
+    fd = np.zeros(movement.shape[0])
+    fd[1:] = deltas[:, 3:6].sum(1) + (50*3.141/180) * deltas[:, 0:3].sum(1)
+
+    return fd
+
+
+def calc_fd_jenkinson(affines, rmax=80.0):
+    """
+    Calculate the Framewise Displacement (FD) as per Jenkinson et al., 2002.
+
+    Parameters
+    ----------
+    affines : numpy.ndarray
+        array of shape (T, 4, 4) of the rigid body transformation of each
+        volume
+    rmax : float
+        radius of the sphere representing the brain, the default is FSL's
+
+    Returns
+    -------
+    fd : numpy.ndarray
+        array of shape (T,), zero for the first time point
+    """
+
+    M = np.einsum('tij,tjk->tik', affines[1:],
+                  np.linalg.inv(affines[:-1])) - np.eye(4)
+    A = M[:, 0:3, 0:3]
+    b = M[:, 0:3, 3]
+
+    fd = np.zeros(affines.shape[0])
+    fd[1:] = np.sqrt((rmax * rmax / 5) * np.einsum('tij,tij->t', A, A) +
+                     np.einsum('ti,ti->t', b, b))
+
+    return fd
+
+
+def calc_motion_summary(movement, maxdisp):
+    """
+    Calculate the motion parameters summary of a scan.
+
+    Parameters
+    ----------
+    movement : numpy.ndarray
+        array of shape (T, 6) of the motion parameters (roll pitch yaw dS dL
+        dP)
+    maxdisp : numpy.ndarray
+        array of shape (T,) of the maximum displacement (in mm) for brain
+        voxels in each volume
+
+    Returns
+    -------
+    summary : list
+        values in the order of `MOTION_PARAMS_FIELDS`
+    """
+
+    # Relative RMS of translation
+    rms = np.sqrt((movement[:, 3:6] ** 2).sum(1))
+    rel_rms = np.abs(np.diff(rms))
+
+    rel_rot = np.diff(np.abs(movement[:, 0:3]).sum(1) / 3)
+
+    rel_movement = np.diff(movement, axis=0)
+    rel_maxdisp = np.diff(maxdisp)
+
+    summary = [rel_rms.mean(),
+               rel_rms.max(),
+               np.sum(rel_rms > 0.1),
+               np.abs(rel_rot).mean(),
+               rel_maxdisp.mean(),
+               np.abs(rel_maxdisp).max(),
+               maxdisp.max()]
+
+    summary += list(np.abs(rel_movement).max(0))
+    summary += list(rel_movement.mean(0))
+    summary += list(np.abs(movement).max(0))
+    summary += list(np.abs(movement).mean(0))
+
+    return summary
+
+
+def calc_power_summary(fd_power, fd_jenkinson, dvars, threshold):
+    """
+    Calculate the power parameters summary of a scan.
+
+    Parameters
+    ----------
+    fd_power : numpy.ndarray
+        FD as per Power et al., 2012
+    fd_jenkinson : numpy.ndarray
+        FD as per Jenkinson et al., 2002
+    dvars : numpy.ndarray
+        DVARS of each volume
+    threshold : float
+        scrubbing threshold
+
+    Returns
+    -------
+    summary : list
+        values in the order of `POWER_PARAMS_FIELDS`
+    """
+
+    num_fd = float(np.sum(fd_jenkinson > threshold))
+
+    # Mean of the top quartile of FD
+    quat = int(len(fd_jenkinson) / 4)
+    fd_quartile = np.mean(np.sort(fd_jenkinson)[::-1][:quat])
+
+    return [np.mean(fd_power),
+            np.mean(fd_jenkinson),
+            num_fd,
+            np.sqrt(np.mean(fd_jenkinson)),
+            fd_quartile,
+            num_fd * 100 / (len(fd_jenkinson) + 1),
+            np.mean(dvars)]
+
+
+def write_motion_params(out_file, subject_id, scan_id, summary):
+    """
+    Write the motion parameters summary to a csv file.
+    """
+
+    header = ['Subject', 'Scan'] + list(MOTION_PARAMS_FIELDS)
+    header[header.index('Max_Relative_Roll')] = 'Max Relative_Roll'
+
+    with open(out_file, 'w') as f:
+        f.write(','.join(header) + '\n')
+        f.write("{0},{1},{2}".format(subject_id, scan_id, ",".join(
+            ["{0:.3f}".format(val) for val in summary[:7]])))
+        f.write(",{0}".format(",".join(
+            ["{0:.6f}".format(val) for val in summary[7:]])))
+        f.write("\n")
+
+    return out_file
+
+
+def write_power_params(out_file, subject_id, scan_id, threshold, summary):
+    """
+    Write the power parameters summary to a csv file.
+    """
+
+    with open(out_file, 'w') as f:
+        f.write("Subject, Scan, MeanFD_Power, MeanFD_Jenkinson, "
+                "NumFD_greater_than_{0:.2f}, rootMeanSquareFD, "
+                "FDquartile(top1/4thFD), PercentFD_greater_than_{1:.2f}, "
+                "MeanDVARS\n".format(threshold, threshold))
+
+        f.write("{0}, {1}, ".format(subject_id, scan_id))
+        f.write(", ".join(["{0:.4f}".format(val) for val in summary]))
+
+    return out_file
+
+
+def calc_dvars(rest, mask, chunk_size=32, return_stats=False):
+    """
+    Calculate DVARS as per Power's method.
+
+    The functional data is read lazily, `chunk_size` volumes at a time, and
+    only the voxels inside the mask are kept, so the 4D array and its
+    temporal derivative are never held in memory.
+
+    Parameters
+    ----------
+    rest : string (nifti file)
+        path to motion correct functional data
+    mask : string (nifti file)
+        path to brain only mask for functional data
+    chunk_size : integer
+        number of volumes read at a time
+    return_stats : boolean
+        also return the standardized DVARS and the voxelwise mean and
+        temporal standard deviation, computed in the same pass
+
+    Returns
+    -------
+    dvars : numpy.ndarray
+        array of shape (T - 1,)
+    stats : dictionary
+        only if `return_stats` is set. 'dvars_std' is DVARS divided by its
+        expected value under temporal-SD and lag-1 autocorrelation of each
+        voxel (Nichols, 2013); 'mean' and 'std' are 3D arrays, zero outside
+        the mask.
+    """
+
+    import nibabel as nib
+    from CPAC.utils import iter_volume_chunks
+
+    mask_data = nib.load(mask).get_data().astype('bool')
+    n_voxels = mask_data.sum()
+
+    dvars = []
+    prev = None
+
+    sum_x = np.zeros(n_voxels)
+    sum_xx = np.zeros(n_voxels)
+    sum_lag = np.zeros(n_voxels)
+    first = None
+
+    for start, chunk in iter_volume_chunks(rest, chunk_size):
+        # applying mask, getting the data in the brain only
+        data = chunk[mask_data]
+        del chunk
+
+        if prev is not None:
+            data = np.hstack((prev[:, np.newaxis], data))
+
+        # square of relative intensity value for each voxel across every
+        # timepoint, square root and mean across all timepoints inside mask
+        dvars.append(np.sqrt(np.mean(np.square(np.diff(data, axis=1)),
+                                     axis=0)))
+
+        if return_stats:
+            data64 = data.astype(np.float64)
+            new = data64 if prev is None else data64[:, 1:]
+            if first is None:
+                first = data64[:, 0]
+            sum_x += new.sum(1)
+            sum_xx += np.square(new).sum(1)
+            sum_lag += (data64[:, 1:] * data64[:, :-1]).sum(1)
+            del data64
+
+        prev = data[:, -1]
+
+    dvars = np.concatenate(dvars)
+
+    if not return_stats:
+        return dvars
+
+    n_vols = dvars.shape[0] + 1
+    mean = sum_x / n_vols
+    var = np.maximum(sum_xx / n_vols - mean ** 2, 0)
+    std = np.sqrt(var)
+
+    # lag-1 autocovariance, from the sum of the lagged products
+    last = prev.astype(np.float64)
+    autocov = (sum_lag - mean * (2 * sum_x - first - last)) / (n_vols - 1) + \
+        mean ** 2
+    ar1 = np.zeros(n_voxels)
+    ar1[var > 0] = autocov[var > 0] / var[var > 0]
+
+    diff_sd = np.sqrt(np.maximum(2 * (1 - ar1), 0)) * std
+
+    mean_img = np.zeros(mask_data.shape)
+    std_img = np.zeros(mask_data.shape)
+    mean_img[mask_data] = mean
+    std_img[mask_data] = std
+
+    stats = {'dvars_std': dvars / diff_sd.mean(),
+             'mean': mean_img,
+             'std': std_img}
+
+    return dvars, stats
+
+
+def write_fd_jenkinson(out_file, fd):
+    """
+    Write the Jenkinson FD to a 1D file.
+    """
+
+    with open(out_file, 'w') as f:
+        f.write('0')
+        for val in fd[1:]:
+            f.write('\n{0:.8f}'.format(val))
+
+    return out_file
@@ -3,7 +3,92 @@ import nipype.interfaces.utility as util
 
 
 
-def median_angle_correct(target_angle_deg, realigned_file):
+def load_normalized_timeseries(realigned_file):
+    """
+    Loads the in-brain voxel time-series of a subject as a single precision,
+    demeaned and unit norm (`T`, `V`) matrix.
+
+    The normalization is done in place on one copy of the data.
+
+    Parameters
+    ----------
+    realigned_file : string
+        Path of a realigned nifti file.
+
+    Returns
+    -------
+    nii : nibabel.Nifti1Image
+        Loaded nifti image.
+    mask : numpy.ndarray
+        Boolean 3D mask of the voxels with nonzero time-series.
+    Yn : numpy.ndarray
+        Normalized (`T`, `V`) matrix, stored column-major.
+    global_signal : numpy.ndarray
+        Mean of the demeaned time-series across voxels.
+    norms : numpy.ndarray
+        Norm of each demeaned voxel time-series.
+    """
+    import numpy as np
+    import nibabel as nb
+    from CPAC.utils import load_masked
+
+    nii = nb.load(realigned_file)
+    data, mask = load_masked(realigned_file)
+
+    Yn = np.array(data, dtype=np.float32)
+    del data
+
+    Yn -= Yn.mean(0)
+    global_signal = Yn.mean(1)
+
+    norms = np.sqrt((Yn * Yn).sum(0))
+    Yn /= norms
+
+    return nii, mask, Yn, global_signal, norms
+
+
+def shift_columns(pc, A, dtheta, chunk_size=10000):
+    """
+    Rotates every column of `A` away from `pc` by `dtheta` radians, in place.
+
+    Columns are processed in chunks of `chunk_size` voxels so that only a
+    chunk-sized temporary is allocated.
+
+    Parameters
+    ----------
+    pc : numpy.ndarray
+        Unit norm principal component of shape (`T`,).
+    A : numpy.ndarray
+        Unit norm column vectors of shape (`T`, `V`).
+    dtheta : float
+        Angle, in radians, to add to the angle of each column with `pc`.
+    chunk_size : integer, optional
+        Number of columns to rotate at a time.
+
+    Returns
+    -------
+    A : numpy.ndarray
+        The rotated input matrix.
+    """
+    import numpy as np
+
+    pc = pc.astype(A.dtype)
+
+    for start in range(0, A.shape[1], chunk_size):
+        chunk = A[:, start:start + chunk_size]
+
+        pcxA = np.dot(pc, chunk)
+        x = chunk - np.outer(pc, pcxA)
+        x /= np.sqrt((x * x).sum(0))
+
+        theta_new = np.arccos(np.clip(pcxA, -1, 1)) + dtheta
+
+        chunk[:] = np.outer(pc, np.cos(theta_new)) + np.sin(theta_new) * x
+
+    return A
+
+
+def median_angle_correct(target_angle_deg, realigned_file, pc_file=None):
     """
     Performs median angle correction on fMRI data.  Median angle correction algorithm
     based on [1]_.
@@ -14,6 +99,10 @@ def median_angle_correct(target_angle_deg, realigned_file):
         Target median angle to adjust the time-series data.
     realigned_file : string
         Path of a realigned nifti file.
+    pc_file : string, optional
+        Path of the numpy file (.npy file) of principal components written by
+        `calc_median_angle_params` for the same realigned file.  If not
+        provided, the principal components are recomputed.
     
     Returns
     -------
@@ -32,59 +121,48 @@ def median_angle_correct(target_angle_deg, realigned_file):
     import nibabel as nb
     import os
     from scipy.stats.stats import pearsonr
-
-    def shiftCols(pc, A, dtheta):
-        pcxA = np.dot(pc, A)
-        x = A - np.dot(pc[:, np.newaxis], pcxA[np.newaxis, :])
-
-        theta = np.arccos(np.dot(pc.T, A))
-        theta_new = theta + dtheta
-
-        x /= np.tile(np.sqrt((x * x).sum(0)), (x.shape[0], 1))
-        v_new = np.dot(pc[:, np.newaxis],\
-             np.cos(theta_new)[np.newaxis, :]) + (np.sin(theta_new) * x)
-
-        return v_new
+    from CPAC.nuisance import calc_truncated_svd
+    from CPAC.median_angle.median_angle import load_normalized_timeseries, \
+                                              shift_columns
+    from CPAC.utils import save_nifti
 
     def writeToFile(data, nii, fname):
         img_whole_y = nb.Nifti1Image(data,\
             header=nii.get_header(), affine=nii.get_affine())
-        img_whole_y.to_filename(fname)
+        return save_nifti(img_whole_y, fname)
 
-    nii = nb.load(realigned_file)
-    data = nii.get_data().astype(np.float64)
-
-    mask = (data != 0).sum(-1) != 0
+    nii, mask, Yn, G, norms = load_normalized_timeseries(realigned_file)
 
-    Y = data[mask].T
-
-    Yc = Y - np.tile(Y.mean(0), (Y.shape[0], 1))
-    Yn = Yc / np.tile(np.sqrt((Yc * Yc).sum(0)), (Yc.shape[0], 1))
-    U, S, Vh = np.linalg.svd(Yn, full_matrices=False)
+    if pc_file:
+        U = np.load(pc_file)
+    else:
+        U = calc_truncated_svd(Yn, 5)
 
-    G = Yc.mean(1)
     #Correlation of Global and U
     corr_gu = pearsonr(G, U[:, 0])
     PC1 = U[:, 0] if corr_gu[0] >= 0 else -U[:, 0]
 
-    median_angle = np.median(np.arccos(np.dot(PC1.T, Yn)))
-    angle_shift = (np.pi / 180) * target_angle_deg - median_angle
-    if(angle_shift > 0):
-        #Shifting all vectors
-        Ynf = shiftCols(PC1, Yn, angle_shift)
-    else:
-        #'Median Angle >= Target Angle, skipping correction'
-        Ynf = Yn
+    median_angle = np.median(np.arccos(np.clip(
+        np.dot(PC1.T.astype(Yn.dtype), Yn), -1, 1)))
 
-    corrected_file = os.path.join(os.getcwd(), 'median_angle_corrected.nii.gz')
     angles_file = os.path.join(os.getcwd(), 'angles_U5_Yn.npy')
 
-    angles_U5_Yn = np.arccos(np.dot(U[:, 0:5].T, Yn))
+    # the angles are computed before Yn is shifted in place
+    angles_U5_Yn = np.arccos(np.clip(np.dot(U[:, 0:5].T.astype(Yn.dtype), Yn),
+                                     -1, 1))
     np.save(angles_file, angles_U5_Yn)
+    del angles_U5_Yn
 
-    data = np.zeros_like(data)
-    data[mask] = Ynf.T
-    writeToFile(data, nii, corrected_file)
+    angle_shift = (np.pi / 180) * target_angle_deg - median_angle
+    if(angle_shift > 0):
+        #Shifting all vectors
+        shift_columns(PC1, Yn, angle_shift)
+    #else:
+        #'Median Angle >= Target Angle, skipping correction'
+
+    data = np.zeros(nii.shape, dtype=Yn.dtype)
+    data[mask] = Yn.T
+    corrected_file = writeToFile(data, nii, 'median_angle_corrected')
 
     return corrected_file, angles_file
 
@@ -103,32 +181,36 @@ def calc_median_angle_params(subject):
         Mean bold amplitude of a subject. 
     median_angle : float
         Median angle of a subject.
+    pc_file : string
+        Path of numpy file (.npy file) containing the 5 largest principal
+        components, to be reused by `median_angle_correct`.
     """
+    import os
     import numpy as np
-    import nibabel as nb
-    
-    data = nb.load(subject).get_data().astype('float64')
-    mask = (data != 0).sum(-1) != 0
-    
-    Y = data[mask].T
-    
-    Yc = Y - np.tile(Y.mean(0), (Y.shape[0], 1))
-    Yn = Yc/np.tile(np.sqrt((Yc*Yc).sum(0)), (Yc.shape[0], 1))
-    U,S,Vh = np.linalg.svd(Yn, full_matrices=False)
-    
-    glb = (Yn/np.tile(Yn.std(0), (Y.shape[0], 1))).mean(1)
+    from CPAC.nuisance import calc_truncated_svd
+    from CPAC.median_angle.median_angle import load_normalized_timeseries
+
+    nii, mask, Yn, G, norms = load_normalized_timeseries(subject)
+
+    U = calc_truncated_svd(Yn, 5)
+
+    pc_file = os.path.join(os.getcwd(), 'pc_U5.npy')
+    np.save(pc_file, U)
+
+    # every column of Yn has the same standard deviation, so the global
+    # signal of the standardized data is proportional to the mean of Yn
+    glb = Yn.mean(1)
 
     from scipy.stats.stats import pearsonr
     corr = pearsonr(U[:,0],glb) 
 
     PC1 = U[:,0] if corr[0] >= 0 else -U[:,0]
-    median_angle = np.median(np.arccos(np.dot(PC1.T, Yn)))
+    median_angle = np.median(np.arccos(np.clip(
+        np.dot(PC1.T.astype(Yn.dtype), Yn), -1, 1)))
     median_angle *= 180.0/np.pi
-    Yp = Yc
-    mean_bold = Yp.std(0).mean()
+    mean_bold = (norms / np.sqrt(Yn.shape[0])).mean()
 
-    
-    return mean_bold, median_angle
+    return mean_bold, median_angle, pc_file
 
 def calc_target_angle(mean_bolds, median_angles):
     """
@@ -186,6 +268,10 @@ def create_median_angle_correction(name='median_angle_correction'):
             Realigned nifti file of a subject
         inputspec.target_angle : integer
             Target angle in degrees to correct the median angle to
+        inputspec.pc_file : string (.npy file), optional
+            Principal components of the subject, as saved in
+            `outputspec.pc_files` of the target angle workflow, to skip
+            recomputing them
             
     Workflow Outputs::
     
@@ -214,14 +300,16 @@ def create_median_angle_correction(name='median_angle_correction'):
     median_angle_correction = pe.Workflow(name=name)
     
     inputspec = pe.Node(util.IdentityInterface(fields=['subject',
-                                                       'target_angle']),
+                                                       'target_angle',
+                                                       'pc_file']),
                         name='inputspec')
     outputspec = pe.Node(util.IdentityInterface(fields=['subject',
                                                         'pc_angles']),
                          name='outputspec')
     
     mac = pe.Node(util.Function(input_names=['target_angle_deg',
-                                             'realigned_file'],
+                                             'realigned_file',
+                                             'pc_file'],
                                 output_names=['corrected_file',
                                               'angles_file'],
                                 function=median_angle_correct),
@@ -231,6 +319,8 @@ def create_median_angle_correction(name='median_angle_correction'):
                                     mac, 'realigned_file')
     median_angle_correction.connect(inputspec, 'target_angle',
                                     mac, 'target_angle_deg')
+    median_angle_correction.connect(inputspec, 'pc_file',
+                                    mac, 'pc_file')
     median_angle_correction.connect(mac, 'corrected_file',
                                     outputspec, 'subject')
     median_angle_correction.connect(mac, 'angles_file',
@@ -264,6 +354,9 @@ def create_target_angle(name='target_angle'):
     
         outputspec.target_angle : float
             Target angle over the provided group of subjects.
+        outputspec.pc_files : list (.npy files)
+            Principal components of each subject, which can be passed to
+            `median_angle_correct` to skip recomputing them.
             
     Target Angle procedure:
     
@@ -287,12 +380,14 @@ def create_target_angle(name='target_angle'):
     
     inputspec = pe.Node(util.IdentityInterface(fields=['subjects']),
                         name='inputspec')
-    outputspec = pe.Node(util.IdentityInterface(fields=['target_angle']),
+    outputspec = pe.Node(util.IdentityInterface(fields=['target_angle',
+                                                        'pc_files']),
                          name='outputspec')
     
     cmap = pe.MapNode(util.Function(input_names=['subject'],
                                     output_names=['mean_bold',
-                                                  'median_angle'],
+                                                  'median_angle',
+                                                  'pc_file'],
                                     function=calc_median_angle_params),
                       name='median_angle_params',
                       iterfield=['subject'])
@@ -311,6 +406,8 @@ def create_target_angle(name='target_angle'):
                          cta, 'median_angles')
     target_angle.connect(cta, 'target_angle',
                          outputspec, 'target_angle')
+    target_angle.connect(cmap, 'pc_file',
+                         outputspec, 'pc_files')
     
     return target_angle
     
\ No newline at end of file
@@ -29,4 +29,53 @@ def test_median_angle_correct():
     
     print median_angle_orig*180.0/np.pi, median_angle_corr*180.0/np.pi
     
-    
\ No newline at end of file
+    
+def test_shift_columns():
+    from CPAC.median_angle.median_angle import shift_columns
+    import numpy as np
+
+    np.random.seed(0)
+    A = np.random.randn(50, 300)
+    A -= A.mean(0)
+    A /= np.sqrt((A * A).sum(0))
+
+    pc = np.random.randn(50)
+    pc /= np.sqrt((pc * pc).sum())
+
+    theta = np.arccos(np.dot(pc, A))
+    shifted = shift_columns(pc, A.copy(), 0.1, chunk_size=64)
+
+    np.testing.assert_allclose(np.sqrt((shifted * shifted).sum(0)), 1.0)
+    np.testing.assert_allclose(np.arccos(np.dot(pc, shifted)), theta + 0.1)
+
+
+def test_median_angle_correct_pc_file():
+    from CPAC.median_angle import median_angle_correct, \
+                                  calc_median_angle_params
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(0)
+    data = np.zeros((6, 6, 6, 40), dtype=np.float32)
+    data[1:5, 1:5, 1:5] = np.random.randn(4, 4, 4, 40) + 100
+    data[1:5, 1:5, 1:5] += 5 * np.sin(np.linspace(0, 8, 40))
+
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        subject = os.path.abspath('subject.nii.gz')
+        nb.Nifti1Image(data, np.eye(4)).to_filename(subject)
+
+        mean_bold, median_angle, pc_file = calc_median_angle_params(subject)
+        with_pcs = nb.load(median_angle_correct(90.0, subject,
+                                                pc_file)[0]).get_data()
+        with_pcs = np.array(with_pcs)
+
+        without_pcs = nb.load(median_angle_correct(90.0,
+                                                   subject)[0]).get_data()
+    finally:
+        os.chdir(cwd)
+
+    np.testing.assert_allclose(with_pcs, without_pcs, atol=1e-5)
@@ -10,6 +10,7 @@ from z_score import get_cent_zscore
 from utils import convert_pvalue_to_r,\
                   map_centrality_matrix,\
                   calc_blocksize,\
+                  estimate_centrality_memory,\
                   calc_corrcoef,\
                   cluster_data,\
                   merge_lists
@@ -30,6 +31,7 @@ __all__ = ['create_resting_state_graphs',\
            'calc_centrality', \
            'convert_pvalue_to_r',\
            'calc_blocksize',\
+           'estimate_centrality_memory',\
            'degree_centrality',\
            'fast_degree_centrality',\
            'eigenvector_centrality',\
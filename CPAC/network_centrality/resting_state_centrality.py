@@ -212,20 +212,21 @@ def load(datafile, template=None):
     import os
     import nibabel as nib
     import numpy as np
+    from CPAC.utils import load_masked, masked_voxels
 
     try:
         if isinstance(datafile, list):
-            img = nib.load(datafile[0])
-        else:
-            img = nib.load(datafile) 
-        
-        data = img.get_data().astype(np.float32)
+            datafile = datafile[0]
+
+        img = nib.load(datafile)
+        data, data_mask = load_masked(datafile)
         aff = img.get_affine()    
-        scans = data.shape[3]
+        scans = data.shape[0]
         
-        datmask = data.var(axis=3).astype('bool')
+        datmask = np.zeros(data_mask.shape, dtype=bool)
+        datmask[data_mask] = data.var(axis=0).astype('bool')
         if template is None:
-            mask = np.ones((data.shape[:3]))
+            mask = np.ones((data_mask.shape))
         else:
             mask = nib.load(template).get_data().astype(np.float32)
         
@@ -234,7 +235,7 @@ def load(datafile, template=None):
         raise Exception(err_msg)
     
     
-    if mask.shape != data.shape[:3]:
+    if mask.shape != data_mask.shape:
         raise Exception('Invalid Shape Error. mask and data file have'\
                         'different shape please check the voxel size of the two files')
 
@@ -249,8 +250,9 @@ def load(datafile, template=None):
         flag=1
         for n in nodes:
             if n > 0:
-                node_array = data[(mask == n) & datmask]
-                avg = np.mean(node_array, axis =0)
+                node_array = masked_voxels(data, data_mask,
+                                           (mask == n) & datmask)
+                avg = np.mean(node_array, axis=1)
                 if flag:
                     timeseries = avg
                     flag=0
@@ -264,7 +266,7 @@ def load(datafile, template=None):
         template_type = 0
         mask = mask.astype('bool')
         final_mask = mask & datmask
-        timeseries = data[final_mask]
+        timeseries = masked_voxels(data, data_mask, final_mask).T
 
     return timeseries, aff, final_mask, template_type, scans
 
@@ -711,6 +713,18 @@ def calc_centrality(in_file, template, method_option, threshold_option,
                                         convert_pvalue_to_r
     from CPAC.network_centrality.utils import check_centrality_params
     from CPAC.cwas.subdist import norm_cols
+    from CPAC.utils.instrumentation import StageTimer
+    from CPAC.utils.result_cache import ResultCache
+
+    # Reuse the maps of identical inputs, if the result cache is enabled
+    cache = ResultCache(
+        'CPAC.network_centrality.resting_state_centrality.calc_centrality',
+        in_file=in_file, template=template, method_option=method_option,
+        threshold_option=threshold_option, threshold=threshold,
+        allocated_memory=allocated_memory)
+    out_list = cache.fetch()
+    if out_list is not None:
+        return out_list
 
     # First check input parameters and get proper formatted method/thr options
     method_option, threshold_option = \
@@ -718,8 +732,12 @@ def calc_centrality(in_file, template, method_option, threshold_option,
 
     # Init variables
     out_list = []
+    stages = StageTimer()
+    stages.start('load')
     ts, aff, mask, t_type, scans = load(in_file, template)
 
+    stages.start('centrality')
+
     # If we're doing degree sparsity
     if method_option == 'degree' and threshold_option == 'sparsity':
         block_size = calc_blocksize(ts, memory_allocated=allocated_memory,
@@ -767,9 +785,11 @@ def calc_centrality(in_file, template, method_option, threshold_option,
         raise Exception(err_msg)
  
     # Map the arrays back to images
+    stages.start('write')
     for mat in centrality_matrix:
         centrality_image = map_centrality_matrix(mat, aff, mask, t_type)
         out_list.append(centrality_image)
+    stages.stop()
 
     # Finally return
-    return out_list
+    return cache.store(out_list)
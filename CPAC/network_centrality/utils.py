@@ -47,12 +47,64 @@ def calc_blocksize(timeseries, memory_allocated=None,
 
     # Init variables
     logger = logging.getLogger('workflow')
-    block_size = 1000   # default
 
     nvoxs   = timeseries.shape[0]
     ntpts   = timeseries.shape[1]
     nbytes  = timeseries.dtype.itemsize
 
+    block_size, memory_usage = \
+        calc_blocksize_from_shape(nvoxs, ntpts, nbytes, memory_allocated,
+                                  include_full_matrix, sparsity_thresh)
+
+    # Log information
+    logger.info('block_size -> %i voxels' % block_size)
+    logger.info('# of blocks -> %i' % np.ceil(float(nvoxs)/block_size))
+    logger.info('expected usage -> %.2fGB' % memory_usage)
+
+    return block_size
+
+
+# Method to return the block size and memory usage for a timeseries shape
+def calc_blocksize_from_shape(nvoxs, ntpts, nbytes, memory_allocated=None,
+                              include_full_matrix=False, sparsity_thresh=0.0):
+    '''
+    Method to calculate the block size and the expected memory usage of
+    the centrality calculation, from the shape of the timeseries only.
+    See calc_blocksize.
+
+    Parameters
+    ----------
+    nvoxs : integer
+       number of voxels (or nodes) of the timeseries
+    ntpts : integer
+       number of timepoints of the timeseries
+    nbytes : integer
+       number of bytes of one timeseries value
+    memory_allocated : float
+       memory allocated in GB for degree centrality
+    include_full_matrix : boolean
+        Boolean indicating if we're using the entire correlation matrix
+        in RAM (needed during eigenvector centrality).
+        Default is False
+    sparsity_thresh : float
+        a number between 0 and 1 that represents the number of
+        connections to keep during sparsity thresholding.
+        Default is 0.0.
+
+    Returns
+    -------
+    block_size : an integer
+      size of block for matrix calculation
+    memory_usage : float
+      expected memory usage in GB
+    '''
+
+    # Import packages
+    import numpy as np
+
+    # Init variables
+    block_size = 1000   # default
+
     # If we need the full matrix for centrality calculation
     if include_full_matrix:
         memory_for_full_matrix = nvoxs * nvoxs * nbytes
@@ -121,12 +173,79 @@ def calc_blocksize(timeseries, memory_allocated=None,
     else:
         memory_usage = (needed_memory + block_size*nvoxs*nbytes)/1024.0**3
 
-    # Log information
-    logger.info('block_size -> %i voxels' % block_size)
-    logger.info('# of blocks -> %i' % np.ceil(float(nvoxs)/block_size))
-    logger.info('expected usage -> %.2fGB' % memory_usage)
+    return block_size, memory_usage
 
-    return block_size
+
+# Method to estimate the memory needed by calc_centrality
+def estimate_centrality_memory(template, ntpts, method_option,
+                               threshold_option, threshold,
+                               allocated_memory=None, nbytes=4):
+    '''
+    Method to estimate the memory used by calc_centrality for a template
+    and a number of timepoints, before the data is available. It follows
+    the block size choices of calc_centrality, and adds the copies of the
+    timeseries made while loading and normalizing it.
+
+    Parameters
+    ----------
+    template : string (nifti file)
+       path to mask/parcellation unit
+    ntpts : integer
+       number of timepoints of the functional data
+    method_option : string
+        accepted values are 'degree centrality', 'eigenvector centrality', and
+        'lfcd'
+    threshold_option : string
+        accepted values are: 'significance', 'sparsity', and 'correlation'
+    threshold : float
+        pvalue/sparsity_threshold/threshold value
+    allocated_memory : float
+       memory allocated in GB for degree centrality
+    nbytes : integer
+       number of bytes of one timeseries value
+
+    Returns
+    -------
+    memory_gb : float
+      estimated memory usage in GB
+    '''
+
+    # Import packages
+    import numpy as np
+    import nibabel as nib
+
+    # First check input parameters and get proper formatted method/thr options
+    method_option, threshold_option = \
+        check_centrality_params(method_option, threshold_option, threshold)
+
+    # Number of voxels in a mask, or of nodes in a parcellation, as in load
+    mask = nib.load(template).get_data()
+    nodes = np.unique(mask)
+    if len(nodes) > 2:
+        nvoxs = int(np.count_nonzero(nodes > 0))
+    else:
+        nvoxs = int(np.count_nonzero(mask))
+
+    sparsity_thresh = 0.0
+    include_full_matrix = False
+    if method_option == 'degree' and threshold_option == 'sparsity':
+        sparsity_thresh = threshold
+    elif method_option == 'eigenvector':
+        include_full_matrix = True
+
+    try:
+        block_size, memory_usage = \
+            calc_blocksize_from_shape(nvoxs, ntpts, nbytes, allocated_memory,
+                                      include_full_matrix, sparsity_thresh)
+    except MemoryError:
+        # calc_centrality will fail anyway, use what was allocated
+        memory_usage = allocated_memory or 0.0
+
+    # The loaded data, and the centered and normalized copies of the
+    # timeseries
+    memory_for_copies = 3 * nvoxs * ntpts * nbytes / 1024.0**3
+
+    return memory_usage + memory_for_copies
 
 
 # Method to calculate correlation coefficient from (one or two) datasets
@@ -355,6 +474,7 @@ def map_centrality_matrix(centrality_matrix, aff, mask, template_type):
     import nibabel as nib
     import numpy as np
     from nipype import logging
+    from CPAC.utils import nifti_output_path, save_nifti
 
     # Init logger
     logger = logging.getLogger('workflow')
@@ -362,7 +482,7 @@ def map_centrality_matrix(centrality_matrix, aff, mask, template_type):
     try:
         out_file, matrix = centrality_matrix
 
-        out_file = os.path.join(os.getcwd(), out_file + '.nii.gz')
+        out_file = nifti_output_path(out_file)
         sparse_m = np.zeros((mask.shape), dtype=float)
 
         logger.info('mapping centrality matrix to nifti image: %s' % out_file)
@@ -391,7 +511,7 @@ def map_centrality_matrix(centrality_matrix, aff, mask, template_type):
                     index+=1
 
         nifti_img = nib.Nifti1Image(sparse_m, aff)
-        nifti_img.to_filename(out_file)
+        out_file = save_nifti(nifti_img, out_file)
 
         return out_file
     except Exception as exc:
@@ -418,6 +538,7 @@ def sep_nifti_subbriks(nifti_file, out_names):
     # Import packages
     import os
     import nibabel as nib
+    from CPAC.utils import save_nifti
 
     # Init variables
     output_niftis = []
@@ -437,9 +558,8 @@ def sep_nifti_subbriks(nifti_file, out_names):
     # Iterate through last dimension
     for brik, out_name in enumerate(out_names):
         brik_arr = nii_arr[:, :, :, 0, brik]
-        out_file = os.path.join(os.getcwd(), out_name+'.nii.gz')
         out_img = nib.Nifti1Image(brik_arr, nii_affine)
-        out_img.to_filename(out_file)
+        out_file = save_nifti(out_img, out_name)
         output_niftis.append(out_file)
 
     # Return separated nifti filepaths
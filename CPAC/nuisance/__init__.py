@@ -1,5 +1,7 @@
 from utils import calc_compcor_components, \
-                  erode_mask
+                  calc_truncated_svd, \
+                  erode_mask, \
+                  estimate_residuals_memory
 
 from nuisance import create_nuisance, \
                      calc_residuals, \
@@ -10,5 +12,7 @@ __all__ = ['create_nuisance', \
            'calc_residuals', \
            'bandpass_voxels', \
            'calc_compcor_components', \
+           'calc_truncated_svd', \
            'erode_mask', \
+           'estimate_residuals_memory', \
            'extract_tissue_data']
\ No newline at end of file
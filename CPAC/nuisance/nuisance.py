@@ -28,6 +28,16 @@ def bandpass_voxels(realigned_file, bandpass_freqs, sample_period=None):
     
     """
 
+    # reuse the filtered file of identical inputs, if the result cache is
+    # enabled
+    cache = ResultCache('CPAC.nuisance.nuisance.bandpass_voxels',
+                        realigned_file=realigned_file,
+                        bandpass_freqs=bandpass_freqs,
+                        sample_period=sample_period)
+    bandpassed_file = cache.fetch()
+    if bandpassed_file is not None:
+        return bandpassed_file
+
     def ideal_bandpass(data, sample_period, bandpass_freqs):
         # Derived from YAN Chao-Gan 120504 based on REST.
         sample_freq = 1. / sample_period
@@ -86,11 +96,9 @@ def bandpass_voxels(realigned_file, bandpass_freqs, sample_period=None):
     data[mask] = Y_bp.T
     img = nb.Nifti1Image(data, header=nii.get_header(),
                          affine=nii.get_affine())
-    bandpassed_file = os.path.join(os.getcwd(),
-                                   'bandpassed_demeaned_filtered.nii.gz')
-    img.to_filename(bandpassed_file)
+    bandpassed_file = save_nifti(img, 'bandpassed_demeaned_filtered')
     
-    return bandpassed_file
+    return cache.store(bandpassed_file)
 
 
 def calc_residuals(subject,
@@ -147,54 +155,71 @@ def calc_residuals(subject,
     >>> 'linear' : True,
     >>> 'quadratic' : True}
     """
-    
+
+    # reuse the residuals of identical inputs, if the result cache is enabled
+    cache = ResultCache('CPAC.nuisance.nuisance.calc_residuals',
+                        subject=subject, selector=selector,
+                        despiking=despiking, wm_sig_file=wm_sig_file,
+                        csf_sig_file=csf_sig_file, gm_sig_file=gm_sig_file,
+                        motion_file=motion_file,
+                        compcor_ncomponents=compcor_ncomponents,
+                        frames_ex=frames_ex)
+    outputs = cache.fetch()
+    if outputs is not None:
+        return outputs
+
+    stages = StageTimer()
+    stages.start('load')
+
     nii = nb.load(subject)
-    data = nii.get_data().astype(np.float64)
-    global_mask = (data != 0).sum(-1) != 0
+    data, global_mask = load_masked(subject)
+    nvols = data.shape[0]
+
+    stages.start('regressors')
     
     # Check and define regressors which are provided from files
     if wm_sig_file is not None:
         wm_sigs = np.load(wm_sig_file)
-        if wm_sigs.shape[1] != data.shape[3]:
+        if wm_sigs.shape[1] != nvols:
             raise ValueError('White matter signals length {0} do not match '
                              'data timepoints {1}'.format(wm_sigs.shape[1], 
-                                                          data.shape[3]))
+                                                          nvols))
         if wm_sigs.size == 0:
             raise ValueError('White matter signal file {0} is '
                              'empty'.format(wm_sig_file))
         
     if csf_sig_file is not None:
         csf_sigs = np.load(csf_sig_file)
-        if csf_sigs.shape[1] != data.shape[3]:
+        if csf_sigs.shape[1] != nvols:
             raise ValueError('CSF signals length {0} do not match data '
                              'timepoints {1}'.format(csf_sigs.shape[1], 
-                                                     data.shape[3]))
+                                                     nvols))
         if csf_sigs.size == 0:
             raise ValueError('CSF signal file {0} is '
                              'empty'.format(csf_sig_file))
         
     if gm_sig_file is not None:
         gm_sigs = np.load(gm_sig_file)
-        if gm_sigs.shape[1] != data.shape[3]:
+        if gm_sigs.shape[1] != nvols:
             raise ValueError('Grey matter signals length {0} do not match '
                              'data timepoints {1}'.format(gm_sigs.shape[1], 
-                                                          data.shape[3]))
+                                                          nvols))
         if gm_sigs.size == 0:
             raise ValueError('Grey matter signal file {0} is '
                              'empty'.format(gm_sig_file))
         
     if motion_file is not None:
         motion = np.genfromtxt(motion_file)
-        if motion.shape[0] != data.shape[3]:
+        if motion.shape[0] != nvols:
             raise ValueError('Motion parameters {0} do not match data '
                              'timepoints {1}'.format(motion.shape[0], 
-                                                     data.shape[3]))
+                                                     nvols))
         if motion.size == 0:
             raise ValueError('Motion signal file {0} is '
                              'empty'.format(motion_file))
 
     # Calculate regressors
-    regressor_map = {'constant': np.ones((data.shape[3], 1))}
+    regressor_map = {'constant': np.ones((nvols, 1))}
 
     if selector['compcor']:
         if not wm_sig_file:
@@ -220,22 +245,22 @@ def calc_residuals(subject,
         regressor_map['gm'] = gm_sigs.mean(0)
         
     if selector['global']:
-        regressor_map['global'] = data[global_mask].mean(0)
+        regressor_map['global'] = data.mean(1, dtype=np.float64)
         
     if selector['pc1']:
-        bdata = data[global_mask].T
+        bdata = data.astype(np.float64)
         bdatac = bdata - np.tile(bdata.mean(0), (bdata.shape[0], 1))
-        U, S, Vh = np.linalg.svd(bdatac, full_matrices=False)
+        U = calc_truncated_svd(bdatac, 1)
         regressor_map['pc1'] = U[:, 0]
         
     if selector['motion']:
         regressor_map['motion'] = motion
         
     if selector['linear']:
-        regressor_map['linear'] = np.arange(0, data.shape[3])
+        regressor_map['linear'] = np.arange(0, nvols)
     
     if selector['quadratic']:
-        regressor_map['quadratic'] = np.arange(0, data.shape[3])**2
+        regressor_map['quadratic'] = np.arange(0, nvols)**2
 
     # insert the de-spiking regressor matrix here, if running de-spiking
     if frames_ex:
@@ -245,7 +270,7 @@ def calc_residuals(subject,
         if despike_mat is not None:
             regressor_map['despike'] = despike_mat
 
-    X = np.zeros((data.shape[3], 1))
+    X = np.zeros((nvols, 1))
     csv_filename = ''
     for rname, rval in regressor_map.items():
         X = np.hstack((X, rval.reshape(rval.shape[0],-1)))
@@ -260,7 +285,10 @@ def calc_residuals(subject,
     if np.isnan(X).any() or np.isnan(X).any():
         raise ValueError('Regressor file contains NaN')
 
-    Y = data[global_mask].T
+    stages.start('regression')
+
+    Y = data.astype(np.float64)
+    del data
 
     try:
         B = np.linalg.inv(X.T.dot(X)).dot(X.T).dot(Y)
@@ -278,13 +306,15 @@ def calc_residuals(subject,
                             "nuisance regression.\n\n".format(e))
 
     Y_res = Y - X.dot(B)
-    
+
+    stages.start('write')
+
+    data = np.zeros(global_mask.shape + (nvols,))
     data[global_mask] = Y_res.T
     
     img = nb.Nifti1Image(data, header=nii.get_header(),
                          affine=nii.get_affine())
-    residual_file = os.path.join(os.getcwd(), 'residual.nii.gz')
-    img.to_filename(residual_file)
+    residual_file = save_nifti(img, 'residual')
     
     # Easier to read for debugging purposes
     regressors_file = os.path.join(os.getcwd(), 'nuisance_regressors.mat')
@@ -295,8 +325,10 @@ def calc_residuals(subject,
     else:
         # for scipy v0.12: OK
         scipy.io.savemat(regressors_file, regressor_map, oned_as='column')
-    
-    return residual_file, regressors_file
+
+    stages.stop()
+
+    return cache.store((residual_file, regressors_file))
 
 
 def extract_tissue_data(data_file,
@@ -306,77 +338,76 @@ def extract_tissue_data(data_file,
     import nibabel as nb
     import os    
     from CPAC.nuisance import erode_mask
-    from CPAC.utils import safe_shape
+    from CPAC.utils import safe_shape, load_masked, masked_voxels, save_nifti
 
+    # load the functional data once, in single precision, and reuse it for
+    # every tissue class
     try:
-        data = nb.load(data_file).get_data().astype('float64')
+        data, data_mask = load_masked(data_file)
     except:
         raise MemoryError('Unable to load %s' % data_file)
 
 
     try:
-        lat_ventricles_mask = nb.load(ventricles_mask_file).get_data().astype('float64')
+        lat_ventricles_mask = nb.load(ventricles_mask_file).get_data()
     except:
         raise MemoryError('Unable to load %s' % lat_ventricles_mask)
 
-    if not safe_shape(data, lat_ventricles_mask):
+    if not safe_shape(data_mask, lat_ventricles_mask):
         raise ValueError('Spatial dimensions for data and the lateral '
                          'ventricles mask do not match')
 
     try:
-        wm_seg = nb.load(wm_seg_file).get_data().astype('float64')
+        wm_seg = nb.load(wm_seg_file).get_data()
     except:
         raise MemoryError('Unable to load %s' % wm_seg)
 
-    if not safe_shape(data, wm_seg):
+    if not safe_shape(data_mask, wm_seg):
         raise ValueError('Spatial dimensions for data, white matter segment '
                          'do not match')
 
     wm_mask = erode_mask(wm_seg > 0)
-    wm_sigs = data[wm_mask]
+    wm_sigs = np.ascontiguousarray(masked_voxels(data, data_mask, wm_mask).T)
     file_wm = os.path.join(os.getcwd(), 'wm_signals.npy')
     np.save(file_wm, wm_sigs)
     del wm_sigs
 
     try:
-        csf_seg = nb.load(csf_seg_file).get_data().astype('float64')
+        csf_seg = nb.load(csf_seg_file).get_data()
     except:
         raise MemoryError('Unable to load %s' % csf_seg)
 
-    if not safe_shape(data, csf_seg):
+    if not safe_shape(data_mask, csf_seg):
         raise ValueError('Spatial dimensions for data, cerebral spinal '
                          'fluid segment do not match')
 
     # Only take the CSF at the lateral ventricles as labeled in the Harvard
     # Oxford parcellation regions 4 and 43
     csf_mask = (csf_seg > 0)*(lat_ventricles_mask==1)
-    csf_sigs = data[csf_mask]
+    csf_sigs = np.ascontiguousarray(masked_voxels(data, data_mask, csf_mask).T)
     file_csf = os.path.join(os.getcwd(), 'csf_signals.npy')
     np.save(file_csf, csf_sigs)
     del csf_sigs
 
     try:
-        gm_seg = nb.load(gm_seg_file).get_data().astype('float64')
+        gm_seg = nb.load(gm_seg_file).get_data()
     except:
         raise MemoryError('Unable to load %s' % gm_seg)
 
-    if not safe_shape(data, gm_seg):
+    if not safe_shape(data_mask, gm_seg):
         raise ValueError('Spatial dimensions for data, gray matter '
                          'segment do not match')
 
     gm_mask = erode_mask(gm_seg > 0)
-    gm_sigs = data[gm_mask]
+    gm_sigs = np.ascontiguousarray(masked_voxels(data, data_mask, gm_mask).T)
     file_gm = os.path.join(os.getcwd(), 'gm_signals.npy')
     np.save(file_gm, gm_sigs)
     del gm_sigs
 
     nii = nb.load(wm_seg_file)
-    wm_mask_file = os.path.join(os.getcwd(), 'wm_mask.nii.gz')
-    csf_mask_file = os.path.join(os.getcwd(), 'csf_mask.nii.gz')
-    gm_mask_file = os.path.join(os.getcwd(), 'gm_mask.nii.gz')
-    nb.Nifti1Image(wm_mask, header=nii.get_header(), affine=nii.get_affine()).to_filename(wm_mask_file)
-    nb.Nifti1Image(csf_mask, header=nii.get_header(), affine=nii.get_affine()).to_filename(csf_mask_file)
-    nb.Nifti1Image(gm_mask, header=nii.get_header(), affine=nii.get_affine()).to_filename(gm_mask_file)
+    save_nifti(nb.Nifti1Image(wm_mask, header=nii.get_header(), affine=nii.get_affine()), 'wm_mask')
+    save_nifti(nb.Nifti1Image(csf_mask, header=nii.get_header(), affine=nii.get_affine()), 'csf_mask')
+    save_nifti(nb.Nifti1Image(gm_mask, header=nii.get_header(), affine=nii.get_affine()), 'gm_mask')
 
     return file_wm, file_csf, file_gm
 
@@ -551,6 +582,10 @@ def create_nuisance(use_ants, name='nuisance'):
     calc_imports = ['import os', 'import scipy', 'import numpy as np',
                     'import nibabel as nb', 
                     'from CPAC.nuisance import calc_compcor_components',
+                    'from CPAC.nuisance import calc_truncated_svd',
+                    'from CPAC.utils import load_masked, save_nifti',
+                    'from CPAC.utils.instrumentation import StageTimer',
+                    'from CPAC.utils.result_cache import ResultCache',
                     'from CPAC.nuisance.utils import create_despike_regressor_matrix']
     calc_r = pe.Node(util.Function(input_names=['subject',
                                                 'selector',
@@ -131,3 +131,37 @@ def test_nuisance():
     cn.inputs.inputspec.harvard_oxford_mask = '/usr/share/fsl/4.1/data/atlases/HarvardOxford/HarvardOxford-sub-maxprob-thr25-2mm.nii.gz'
     cn.inputs.inputspec.subject = '/home/data/PreProc/ABIDE_CPAC_test_1/pipeline_0/0050102_session_1/preprocessed/_scan_rest_1_rest/rest_3dc_RPI_3dv_3dc_maths.nii.gz'
     cn.base_dir = '/home/bcheung/cn_run'
+
+
+def test_calc_truncated_svd():
+    import numpy as np
+    from CPAC.nuisance import calc_truncated_svd
+
+    np.random.seed(0)
+    Y = np.random.randn(120, 2000)
+    Y = Y - Y.mean(0)
+
+    U_full, S, Vh = np.linalg.svd(Y, full_matrices=False)
+    U = calc_truncated_svd(Y, 5)
+
+    assert U.shape == (120, 5)
+
+    # singular vectors are only defined up to sign
+    np.testing.assert_allclose(np.abs((U * U_full[:, :5]).sum(0)),
+                               np.ones(5), rtol=1e-6)
+
+
+def test_erode_mask():
+    import numpy as np
+    from CPAC.nuisance import erode_mask
+
+    data = np.zeros((7, 7, 7))
+    data[:, 1:6, 1:6] = 1.0
+
+    eroded = erode_mask(data)
+
+    expected = np.zeros_like(data)
+    expected[1:6, 2:5, 2:5] = 1.0
+
+    # voxels on the edge of the volume never survive erosion
+    np.testing.assert_array_equal(eroded, expected)
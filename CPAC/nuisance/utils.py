@@ -22,36 +22,73 @@ def calc_compcor_components(data, nComponents, wm_sigs, csf_sigs):
     Yc = Yc / np.tile(np.array(Y.std(0)).reshape(1,Y.shape[1]), (Y.shape[0],1))
     
     print 'Calculating SVD decomposition of Y*Y\''
-    U, S, Vh = np.linalg.svd(Yc)
-    
-    return U[:, :nComponents]
+    U = calc_truncated_svd(Yc, nComponents)
+
+    return U
+
+
+def calc_truncated_svd(Y, n_components):
+    """Compute the leading left singular vectors of a (T x V) matrix.
+
+    Rather than running a full SVD on the (T x V) matrix, which builds
+    factors over every voxel only to keep a handful of timepoint-space
+    components, this eigen-decomposes the (T x T) Gram matrix Y*Y' and keeps
+    the `n_components` eigenvectors with the largest eigenvalues. These are
+    the left singular vectors of `Y`, up to sign.
+
+    Parameters
+    ----------
+    Y : numpy.ndarray
+        Matrix of shape (`T`, `V`), `T` timepoints and `V` voxels.
+    n_components : integer
+        Number of components to keep.
+
+    Returns
+    -------
+    U : numpy.ndarray
+        Matrix of shape (`T`, `n_components`), ordered by decreasing singular
+        value.
+    """
+
+    n_components = min(int(n_components), Y.shape[0])
+
+    # accumulate the Gram matrix in double precision regardless of the
+    # input type, the (T x T) result is small
+    Y = np.asarray(Y, dtype=np.float64)
+    gram = np.dot(Y, Y.T)
+    eigvals, eigvecs = np.linalg.eigh(gram)
+
+    # eigh returns the eigenvalues in ascending order
+    return eigvecs[:, ::-1][:, :n_components]
 
 
 def erode_mask(data):
+    """Erode the nonzero region of a 3D volume by one voxel.
+
+    A voxel is kept if it and its six face-connected neighbors are all
+    nonzero. Voxels on the edge of the volume are always removed.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        3D volume.
+
+    Returns
+    -------
+    eroded_data : numpy.ndarray
+        Copy of `data` with the eroded voxels set to zero.
+    """
+
+    from scipy import ndimage
+
     mask = data != 0
-    eroded_mask = np.zeros_like(data, dtype='bool')
-    max_x, max_y, max_z = data.shape
-    x,y,z = np.where(data != 0)
-    for i in range(x.shape[0]):
-        if (max_x-1) == x[i] or \
-           (max_y-1) == y[i] or \
-           (max_z-1) == z[i] or \
-           x[i] == 0 or \
-           y[i] == 0 or \
-           z[i] == 0:
-            eroded_mask[x[i],y[i],z[i]] = False
-        else:
-            eroded_mask[x[i],y[i],z[i]] = mask[x[i], y[i], z[i]] * \
-                                          mask[x[i] + 1, y[i], z[i]] * \
-                                          mask[x[i], y[i] + 1, z[i]] * \
-                                          mask[x[i], y[i], z[i] + 1] * \
-                                          mask[x[i] - 1, y[i], z[i]] * \
-                                          mask[x[i], y[i] - 1, z[i]] * \
-                                          mask[x[i], y[i], z[i] - 1]
+    structure = ndimage.generate_binary_structure(3, 1)
+    eroded_mask = ndimage.binary_erosion(mask, structure=structure,
+                                         border_value=0)
 
     eroded_data = np.zeros_like(data)
     eroded_data[eroded_mask] = data[eroded_mask]
-    
+
     return eroded_data
 
 
@@ -83,3 +120,35 @@ def create_despike_regressor_matrix(frames_excluded, total_vols):
         i += 1
 
     return reg_matrix
+
+
+def estimate_residuals_memory(nvoxs, ntpts, regressors=None):
+    """Estimate the memory used by `calc_residuals`, in GB.
+
+    The regression works on a double precision copy of the in-mask data,
+    and holds the fitted values, the residuals and the full-volume output
+    image at its peak. The PC1 regressor adds two more copies.
+
+    Parameters
+    ----------
+    nvoxs : integer
+        Number of voxels of one functional volume.
+    ntpts : integer
+        Number of timepoints.
+    regressors : list of dictionaries, optional
+        Regressor selectors the node iterates over.
+
+    Returns
+    -------
+    memory_gb : float
+        Estimated peak memory usage.
+    """
+
+    copies = 4
+    if any(selector.get('pc1') for selector in regressors or []):
+        copies += 2
+
+    # the loaded single precision data, and room for the regressors and
+    # the interpreter
+    data_gb = nvoxs * ntpts * 8 / 1024.0 ** 3
+    return copies * data_gb + data_gb / 2 + 0.25
@@ -41,19 +41,18 @@ def create_dir(dir_path, description):
             raise Exception(err)
 
 
-def create_merged_copefile(list_of_output_files, merged_outfile):
+def create_merged_copefile(list_of_output_files, merged_outfile,
+                           mask_outfile=None):
 
-    import subprocess
-
-    merge_string = ["fslmerge", "-t", merged_outfile]
-
-    merge_string = merge_string + list_of_output_files
+    from CPAC.utils import merge_nifti_files
 
+    # the volumes are written in the order of the list, so the merged file
+    # matches the design matrix by construction
     try:
-        retcode = subprocess.check_output(merge_string)
+        merge_nifti_files(list_of_output_files, merged_outfile, mask_outfile)
     except Exception as e:
-        err = "\n\n[!] Something went wrong with FSL's fslmerge during the " \
-              "creation of the 4D merged file for group analysis.\n\n" \
+        err = "\n\n[!] Something went wrong during the creation of the 4D " \
+              "merged file for group analysis.\n\n" \
               "Attempted to create file: %s\n\nLength of list of files to " \
               "merge: %d\n\nError details: %s\n\n" \
               % (merged_outfile, len(list_of_output_files), e)
@@ -64,16 +63,14 @@ def create_merged_copefile(list_of_output_files, merged_outfile):
 
 def create_merge_mask(merged_file, mask_outfile):
 
-    import subprocess
-
-    mask_string = ["fslmaths", merged_file, "-abs", "-Tmin", "-bin", \
-                   mask_outfile]
+    from CPAC.utils import merge_nifti_files
 
+    # voxels which are non-zero in every volume (fslmaths -abs -Tmin -bin)
     try:
-        retcode = subprocess.check_output(mask_string)
+        merge_nifti_files([merged_file], mask_file=mask_outfile)
     except Exception as e:
-        err = "\n\n[!] Something went wrong with FSL's fslmaths during the " \
-              "creation of the merged copefile group mask.\n\nAttempted to " \
+        err = "\n\n[!] Something went wrong during the creation of the " \
+              "merged copefile group mask.\n\nAttempted to " \
               "create file: %s\n\nMerged file: %s\n\nError details: %s\n\n" \
               % (mask_outfile, merged_file, e)
         raise Exception(err)
@@ -81,89 +78,128 @@ def create_merge_mask(merged_file, mask_outfile):
     return mask_outfile
 
 
-def check_merged_file(list_of_output_files, merged_outfile):
-
-    import subprocess
 
-    # make sure the order is correct
-    #   we are ensuring each volume of the merge file correlates perfectly
-    #   with the output file it should correspond to
-    i = 0
-    for output_file in list_of_output_files:
-        test_string = ["3ddot", "-demean",
-                       "{0}[{1}]".format(merged_outfile, str(i)), output_file]
+def calculate_mask_means(raw_files, mask=None, roi_mask=None,
+                         num_threads=1):
+    """
+    Computes the mean of each raw output file within a mask (as 3dmaskave)
+    and within each label of an ROI image (as 3dROIstats), loading the
+    masks once and reading the raw files with a pool of threads.
+
+    Parameters
+    ----------
+    raw_files : list of strings
+        Paths of the raw output files.
+    mask : string, optional
+        Path of the mask for the Measure_Mean column.
+    roi_mask : string, optional
+        Path of the ROI label image for the Custom_ROI_Mean_<n> columns,
+        numbered in increasing label order.
+    num_threads : integer, optional
+        Number of files read at the same time.
+
+    Returns
+    -------
+    means_df : pandas DataFrame
+        Raw_Filepath, Measure_Mean and Custom_ROI_Mean_<n> columns, with one
+        row per raw file, in the order of raw_files.
+    """
 
-        try:
-            retcode = subprocess.check_output(test_string)
-        except Exception as e:
-            err = "\n\n[!] Something went wrong while trying to run AFNI's " \
-                  "3ddot for the purpose of testing the merge file output." \
-                  "\n\nError details: %s\n\n" % e
+    import numpy as np
+    import pandas as pd
+    import nibabel as nb
+    from multiprocessing.pool import ThreadPool
+
+    shape = None
+    mask_voxels = None
+    roi_voxels = None
+
+    if mask:
+        mask_data = nb.load(mask).get_data()
+        shape = mask_data.shape[:3]
+        mask_voxels = np.flatnonzero(mask_data.reshape(shape, order='F'))
+
+    if roi_mask:
+        roi_data = nb.load(roi_mask).get_data()
+        if shape is not None and roi_data.shape[:3] != shape:
+            err = "\n\n[!] The custom ROI mask file and the mask file do " \
+                  "not have the same dimensions.\n\nCustom ROI mask file: " \
+                  "%s\n\nMask file: %s\n\n" % (roi_mask, mask)
             raise Exception(err)
-
-        retcode = retcode.rstrip("\n").rstrip("\t")
-
-        if retcode != "1":
-            err = "\n\n[!] The volumes of the merged file do not correspond "\
-                  "to the correct order of output files as described in the "\
-                  "phenotype matrix. If you are seeing this error, " \
-                  "something possibly went wrong with FSL's fslmerge.\n\n" \
-                  "Merged file: %s\n\nMismatch between merged file volume " \
-                  "%d and derivative file %s\n\nEach volume should " \
-                  "correspond to the derivative output file for each " \
-                  "participant in the model.\n\n" \
-                  % (merged_outfile, i, output_file)
+        shape = roi_data.shape[:3]
+        roi_data = np.round(roi_data.reshape(shape, order='F')).astype(int)
+        roi_voxels = np.flatnonzero(roi_data)
+        roi_labels, roi_index = np.unique(roi_data.ravel()[roi_voxels],
+                                          return_inverse=True)
+        roi_sizes = np.bincount(roi_index).astype(np.float64)
+
+    def file_means(raw_file):
+        data = nb.load(raw_file).get_data()
+        if data.shape[:3] != shape:
+            err = "\n\n[!] The raw output file %s has dimensions %s, but " \
+                  "the mask has dimensions %s.\n\n" \
+                  % (raw_file, str(data.shape[:3]), str(shape))
             raise Exception(err)
+        data = np.asarray(data, dtype=np.float64).reshape(shape, order='F')
+        data = data.ravel()
+
+        means = {"Raw_Filepath": raw_file}
+        if mask_voxels is not None:
+            means["Measure_Mean"] = data[mask_voxels].mean()
+        if roi_voxels is not None:
+            roi_means = np.bincount(roi_index, weights=data[roi_voxels]) / \
+                roi_sizes
+            for i, roi_mean in enumerate(roi_means):
+                means["Custom_ROI_Mean_%d" % (i + 1)] = roi_mean
+        return means
+
+    pool = ThreadPool(max(1, int(num_threads)))
+    try:
+        means_list = pool.map(file_means, list(raw_files))
+    finally:
+        pool.close()
+        pool.join()
 
-        i += 1
+    columns = ["Raw_Filepath"]
+    if mask_voxels is not None:
+        columns.append("Measure_Mean")
+    if roi_voxels is not None:
+        columns += ["Custom_ROI_Mean_%d" % (i + 1)
+                    for i in range(len(roi_labels))]
 
+    return pd.DataFrame(means_list, columns=columns)
 
-def calculate_measure_mean_in_df(model_df, merge_mask):
 
-    import subprocess
+def calculate_mask_means_in_df(model_df, mask=None, roi_mask=None,
+                               num_threads=1):
+
     import pandas as pd
+    from CPAC.pipeline.cpac_ga_model_generator import calculate_mask_means
+
+    means_df = calculate_mask_means(list(model_df["Raw_Filepath"]), mask,
+                                    roi_mask, num_threads)
 
-    mm_dict_list = []
-    
-    for raw_file in list(model_df["Raw_Filepath"]):
-    
-        mask_string = ["3dmaskave", "-mask", merge_mask, raw_file]
-        
-        # calculate
-        try:
-            retcode = subprocess.check_output(mask_string)
-        except Exception as e:
-            err = "\n\n[!] AFNI's 3dMaskAve failed for raw output: %s\n" \
-                  "Error details: %s\n\n" % (raw_file, e)
-            raise Exception(err)
-        
-        # if this breaks, 3dmaskave output to STDOUT has changed
-        try:
-            mean = retcode.split(" ")[0]
-        except Exception as e:
-            err = "\n\n[!] Something went wrong with parsing the output of " \
-                  "AFNI's 3dMaskAve - this is used in calculating the " \
-                  "Measure Mean in group analysis.\n\nError details: %s\n\n" \
-                  % e
-            raise Exception(err)
-        
-        mm_dict = {}
-        mm_dict["Raw_Filepath"] = raw_file
-        mm_dict["Measure_Mean"] = mean
-        mm_dict_list.append(mm_dict)
-        
-    mm_df = pd.DataFrame(mm_dict_list)
-    
     # demean!
-    mm_df["Measure_Mean"] = mm_df["Measure_Mean"].astype(float)
-    mm_df["Measure_Mean"] = \
-        mm_df["Measure_Mean"].sub(mm_df["Measure_Mean"].mean())
-    
-    model_df = pd.merge(model_df, mm_df, how="inner", on=["Raw_Filepath"])
-    
+    for col in means_df.columns:
+        if col == "Raw_Filepath":
+            continue
+        means_df[col] = means_df[col].astype(float)
+        means_df[col] = means_df[col].sub(means_df[col].mean())
+
+    model_df = pd.merge(model_df, means_df, how="inner", on=["Raw_Filepath"])
+
     return model_df
 
 
+def calculate_measure_mean_in_df(model_df, merge_mask, num_threads=1):
+
+    from CPAC.pipeline.cpac_ga_model_generator import \
+        calculate_mask_means_in_df
+
+    return calculate_mask_means_in_df(model_df, mask=merge_mask,
+                                      num_threads=num_threads)
+
+
 def check_mask_file_resolution(data_file, roi_mask, group_mask, out_dir, \
     output_id=None):
 
@@ -229,77 +265,13 @@ def trim_mask(input_mask, ref_mask, output_mask_path):
     return output_mask_path
 
 
-def calculate_custom_roi_mean_in_df(model_df, roi_mask):   
-
-    import os
-    import subprocess
-    import pandas as pd
-
-    # calculate the ROI means
-    roi_dict_list = []
-    
-    for raw_file in list(model_df["Raw_Filepath"]):
-        
-        roi_string = ["3dROIstats", "-mask", roi_mask, raw_file]
-
-        try:
-            retcode = subprocess.check_output(roi_string)
-        except Exception as e:
-            err = "\n\n[!] Something went wrong with running AFNI's " \
-                  "3dROIstats while calculating the custom ROI means.\n\n" \
-                  "Custom ROI mask file: %s\n\nRaw output filepath: %s\n\n" \
-                  "Error details: %s\n\n" % (roi_mask, raw_file, e)
-            raise Exception(err)
-
-        # process the output string
-        roi_means_string = str(retcode.split(raw_file)[1].rstrip("\n"))
-
-        roi_means_string_list = roi_means_string.split("\t")
-
-        # check
-        roi_means_list = []
-        for roi_mean in roi_means_string_list:
-            try:
-                roi_mean = float(roi_mean)
-            except:
-                continue
-
-            roi_means_list.append(roi_mean)
-
-        if len(roi_means_list) != retcode.count("Mean_"):
-            err = "\n\n[!] Something went wrong with parsing the output "\
-                  "of AFNI's 3dROIstats during the calculation of the " \
-                  "custom ROI means.\n\nOutput file: %s\n\nCustom ROI " \
-                  "mask file: %s\n\n3dROIstats output: %s\n\n" \
-                  % (raw_file, roi_mask, retcode)
-            raise Exception(err)
-
-        # add in the custom ROI means!
-        roi_dict = {}
-        roi_dict["Raw_Filepath"] = raw_file
-
-        i = 1
-        for roi_mean in roi_means_list:
-            roi_label = "Custom_ROI_Mean_%d" % i
-            roi_dict[roi_label] = roi_mean
-            i += 1
-
-        roi_dict_list.append(roi_dict)
+def calculate_custom_roi_mean_in_df(model_df, roi_mask, num_threads=1):
 
+    from CPAC.pipeline.cpac_ga_model_generator import \
+        calculate_mask_means_in_df
 
-    roi_df = pd.DataFrame(roi_dict_list)
-    
-    # demean!
-    i = 1
-    for roi_mean in roi_means_list:
-        roi_label = "Custom_ROI_Mean_%d" % i
-        i += 1  
-        roi_df[roi_label] = roi_df[roi_label].astype(float)
-        roi_df[roi_label] = roi_df[roi_label].sub(roi_df[roi_label].mean())
-    
-    model_df = pd.merge(model_df, roi_df, how="inner", on=["Raw_Filepath"])
-    
-    return model_df
+    return calculate_mask_means_in_df(model_df, roi_mask=roi_mask,
+                                      num_threads=num_threads)
 
 
 def parse_out_covariates(design_formula):
@@ -651,13 +623,13 @@ def prep_group_analysis_workflow(model_df, pipeline_config_path, model_name,
     merge_outfile = model_name + "_" + resource_id + "_merged.nii.gz"
     merge_outfile = os.path.join(model_path, merge_outfile)
 
-    merge_file = create_merged_copefile(list(model_df["Filepath"]),
-                                        merge_outfile)
-
-    # create merged group mask
+    # the merged group mask is created in the same pass
     merge_mask_outfile = model_name + "_" + resource_id + "_merged_mask.nii.gz"
     merge_mask_outfile = os.path.join(model_path, merge_mask_outfile)
-    merge_mask = create_merge_mask(merge_file, merge_mask_outfile)
+
+    merge_file = create_merged_copefile(list(model_df["Filepath"]),
+                                        merge_outfile, merge_mask_outfile)
+    merge_mask = merge_mask_outfile
 
     if "Group Mask" in group_config_obj.mean_mask:
         mask_for_means = merge_mask
@@ -672,11 +644,14 @@ def prep_group_analysis_workflow(model_df, pipeline_config_path, model_name,
                                                mask_for_means_path)
         readme_flags.append("individual_masks")
 
-    # calculate measure means, and demean
+    # the measure means and the custom ROI means are computed in one pass
+    # over the raw output files
+    means_mask = None
+    roi_mask = None
+
     if "Measure_Mean" in design_formula:
-        model_df = calculate_measure_mean_in_df(model_df, mask_for_means)
+        means_mask = mask_for_means
 
-    # calculate custom ROIs, and demean (in workflow?)
     if "Custom_ROI_Mean" in design_formula:
 
         custom_roi_mask = group_config_obj.custom_roi_mask
@@ -700,8 +675,14 @@ def prep_group_analysis_workflow(model_df, pipeline_config_path, model_name,
         roi_mask = trim_mask(roi_mask, mask_for_means, output_mask)
         readme_flags.append("custom_roi_mask_trimmed")
 
-        # calculate
-        model_df = calculate_custom_roi_mean_in_df(model_df, roi_mask)
+    # calculate, and demean
+    if means_mask or roi_mask:
+        num_threads = getattr(pipeline_config_obj, "maxCoresPerParticipant",
+                              1)
+        model_df = calculate_mask_means_in_df(model_df, means_mask, roi_mask,
+                                              num_threads)
+
+    if "Custom_ROI_Mean" in design_formula:
 
         # update the design formula
         new_design_substring = ""
@@ -910,9 +891,6 @@ def prep_group_analysis_workflow(model_df, pipeline_config_path, model_name,
         contrasts_vectors = create_contrasts_dict(dmatrix, contrasts_list,
                                                   resource_id)
 
-    # check the merged file's order
-    check_merged_file(model_df["Filepath"], merge_file)
-
     # we must demean the categorical regressors if the Intercept/Grand Mean
     # is included in the model, otherwise FLAME produces blank outputs
     if "Intercept" in column_names:
@@ -83,62 +83,169 @@ def load_pheno_csv_into_df(pheno_file):
     return pheno_dataframe
 
 
-def gather_nifti_globs(pipeline_output_folder, resource_list):
+def list_output_dir(dir_path):
 
-    # the number of directory levels under each participant's output folder
-    # can vary depending on what preprocessing strategies were chosen, and
-    # there may be several output filepaths with varying numbers of directory
-    # levels
-
-    # this parses them quickly while also catching each preprocessing strategy
+    # lists the subdirectories and the files of interest (NIFTI files and
+    # power parameters files) of a directory of the output folder
+    #
+    # input
+    #   dir_path: full path to the directory
+    #
+    # output
+    #   subdirs: list of subdirectory names
+    #   files: list of NIFTI and power parameters file names
 
     import os
-    import glob
-    from __builtin__ import any as b_any
 
-    ext = ".nii"
-    nifti_globs = []
+    try:
+        from os import scandir
+    except ImportError:
+        try:
+            from scandir import scandir
+        except ImportError:
+            scandir = None
+
+    subdirs = []
+    files = []
+
+    if scandir:
+        for entry in scandir(dir_path):
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif (".nii" in entry.name) or ("pow_params.txt" in entry.name):
+                files.append(entry.name)
+    else:
+        for name in os.listdir(dir_path):
+            if os.path.isdir(os.path.join(dir_path, name)):
+                subdirs.append(name)
+            elif (".nii" in name) or ("pow_params.txt" in name):
+                files.append(name)
 
-    if len(resource_list) == 0:
-        err = "\n\n[!] No derivatives selected!\n\n"
-        raise Exception(err)
+    return sorted(subdirs), sorted(files)
 
-    # remove any extra /'s
-    pipeline_output_folder = pipeline_output_folder.rstrip("/")
 
-    # grab MeanFD_Jenkinson just in case
-    resource_list.append("power_params")
+def build_output_catalog(pipeline_output_folder, catalog_file=None):
 
-    print "\n\nGathering the output file paths from %s..." \
-          % pipeline_output_folder
+    # walks the pipeline output folder once and builds a table of all the
+    # output files, laid out as:
+    #   {participant}/{resource}/{_scan_series}/{strategy dirs}/{file}
+    #
+    # the directory listings are kept in a sidecar file, and only the
+    # directories whose modification time changed since the last run are
+    # listed again
+    #
+    # input
+    #   pipeline_output_folder: the individual-level pipeline output folder
+    #   catalog_file: the sidecar file (default: .cpac_output_catalog.json
+    #                 in the pipeline output folder)
+    #
+    # output
+    #   catalog: DataFrame with one row per NIFTI output file, with the
+    #            participant_id, Series, series_dir, resource_id,
+    #            strat_info, Filepath and power_params_file columns
 
-    for resource_name in resource_list:
+    import os
+    import json
+    import pandas as pd
+    from CPAC.pipeline.cpac_group_runner import list_output_dir
+    from CPAC.utils.utils import atomic_write
 
-        glob_string = os.path.join(pipeline_output_folder, "*", \
-                                       resource_name, "*", "*")
+    pipeline_output_folder = os.path.abspath(pipeline_output_folder)
 
-        # get all glob strings that result in a list of paths where every path
-        # ends with a NIFTI file
-        
-        prog_string = ".."
+    if not catalog_file:
+        catalog_file = os.path.join(pipeline_output_folder,
+                                    ".cpac_output_catalog.json")
 
-        while len(glob.glob(glob_string)) != 0:
+    cached_dirs = {}
+    try:
+        with open(catalog_file, "r") as f:
+            catalog_dict = json.load(f)
+        if catalog_dict.get("pipeline_output_folder") == \
+                pipeline_output_folder:
+            cached_dirs = catalog_dict["dirs"]
+    except (IOError, OSError, ValueError, KeyError):
+        pass
 
-            if b_any(ext in x for x in glob.glob(glob_string)) == True:
-                nifti_globs.append(glob_string)
-        
-            glob_string = os.path.join(glob_string, "*")
-            prog_string = prog_string + "."
-            print prog_string
+    print "\n\nGathering the output file paths from %s..." \
+          % pipeline_output_folder
 
-    if len(nifti_globs) == 0:
-        err = "\n\n[!] No output filepaths found in the pipeline output " \
-              "directory provided for the derivatives selected!\n\nPipeline "\
-              "output directory provided: %s\nDerivatives selected:%s\n\n" \
-              % (pipeline_output_folder, resource_list)
-        raise Exception(err)
+    dirs = {}
+    changed = set(cached_dirs.keys())
+    to_visit = [""]
+    while to_visit:
+        rel_dir = to_visit.pop()
+        dir_path = os.path.join(pipeline_output_folder, rel_dir)
+
+        try:
+            mtime = os.stat(dir_path).st_mtime
+        except OSError:
+            continue
+
+        cached = cached_dirs.get(rel_dir)
+        if cached and cached[0] == mtime:
+            subdirs, files = cached[1], cached[2]
+        else:
+            subdirs, files = list_output_dir(dir_path)
+
+        if cached and cached[1:] == [subdirs, files]:
+            changed.discard(rel_dir)
+        else:
+            changed.add(rel_dir)
+
+        dirs[rel_dir] = [mtime, subdirs, files]
+        to_visit += [os.path.join(rel_dir, subdir) for subdir in subdirs]
+
+    if changed:
+        # write to a temporary file first, so that a concurrent run never
+        # reads a partial catalog
+        catalog = {"pipeline_output_folder": pipeline_output_folder,
+                   "dirs": dirs}
+        try:
+            with atomic_write(catalog_file) as tmp_file:
+                with open(tmp_file, "w") as f:
+                    json.dump(catalog, f)
+        except (IOError, OSError):
+            pass
+
+    # power parameters files, per participant and series
+    power_params = {}
+    for rel_dir in sorted(dirs.keys()):
+        levels = rel_dir.split(os.sep)
+        if len(levels) < 3 or levels[1] != "power_params":
+            continue
+        for filename in dirs[rel_dir][2]:
+            if "pow_params.txt" in filename:
+                power_params[(levels[0], levels[2])] = \
+                    os.path.join(pipeline_output_folder, rel_dir, filename)
+
+    rows = []
+    for rel_dir in sorted(dirs.keys()):
+        levels = rel_dir.split(os.sep)
+        if len(levels) < 3:
+            continue
+        participant_id, resource_id, series_dir = levels[:3]
+
+        series_id = series_dir.replace("_scan_", "")
+        series_id = series_id.replace("_rest", "")
+
+        for filename in dirs[rel_dir][2]:
+            if ".nii" not in filename:
+                continue
+            rows.append({
+                "participant_id": participant_id,
+                "Series": series_id,
+                "series_dir": series_dir,
+                "resource_id": resource_id,
+                "strat_info": "/" + "/".join(levels[3:] + [filename]),
+                "Filepath": os.path.join(pipeline_output_folder, rel_dir,
+                                         filename),
+                "power_params_file": power_params.get((participant_id,
+                                                        series_dir))})
+
+    columns = ["participant_id", "Series", "series_dir", "resource_id",
+               "strat_info", "Filepath", "power_params_file"]
 
-    return nifti_globs
+    return pd.DataFrame(rows, columns=columns)
 
 
 def grab_raw_score_filepath(filepath, resource_id):
@@ -189,39 +296,6 @@ def grab_raw_score_filepath(filepath, resource_id):
     return raw_score_path
 
 
-def find_power_params_file(filepath, resource_id, series_id):
-
-    import os
-
-    try:
-        power_path = filepath.replace(resource_id, "power_params", 1)
-        series_id_string = "_scan_%s" % series_id
-        power_first_half = power_path.split(series_id_string)[0]
-        power_first_half = os.path.join(power_first_half, series_id_string)
-        participant_id = power_first_half.split("/")[-3]
-    except Exception as e:
-        err = "\n\n[!] Something went wrong with finding the power " \
-              "parameters file for at least one of the participants.\n\n" \
-              "Error details: %s\n\n" % e
-        raise Exception(err)
-    
-    power_params_file = None
-    for root, dirs, files in os.walk(power_first_half):
-        for filename in files:
-            filepath = os.path.join(root, filename)
-            if "pow_params.txt" in filepath:
-                power_params_file = filepath
-
-    if not power_params_file:
-        err = "\n\n[!] Could not find the power parameters file for the " \
-              "following participant and series..\nParticipant: %s\n" \
-              "Series: %s\n\nIt should be available here: %s\n\n" \
-              % (participant_id, series_id, power_first_half)
-        raise Exception(err)
-
-    return power_params_file
-
-
 def extract_power_params(power_params_lines, power_params_filepath):
 
     # check formatting
@@ -257,69 +331,100 @@ def extract_power_params(power_params_lines, power_params_filepath):
     return meanfd_power, meanfd_jenk, meandvars
  
 
-def create_output_dict_list(nifti_globs, pipeline_output_folder,
+def load_power_params(output_catalog):
+
+    # parses the power parameters file of each participant and series once
+    #
+    # input
+    #   output_catalog: DataFrame from build_output_catalog
+    #
+    # output
+    #   power_params_df: DataFrame with the participant_id, series_dir,
+    #                    MeanFD_Power, MeanFD_Jenkinson and MeanDVARS
+    #                    columns, one row per participant and series
+
+    import pandas as pd
+
+    power_files = output_catalog[["participant_id", "series_dir",
+                                  "power_params_file"]]
+    power_files = power_files.drop_duplicates(["participant_id",
+                                               "series_dir"])
+
+    rows = []
+    for participant_id, series_dir, power_params_file in \
+            power_files.itertuples(index=False):
+
+        if pd.isnull(power_params_file):
+            continue
+
+        power_params_lines = load_text_file(power_params_file, \
+            "power parameters file")
+        meanfd_p, meanfd_j, meandvars = \
+            extract_power_params(power_params_lines, power_params_file)
+
+        rows.append({"participant_id": participant_id,
+                     "series_dir": series_dir,
+                     "MeanFD_Power": meanfd_p,
+                     "MeanFD_Jenkinson": meanfd_j,
+                     "MeanDVARS": meandvars})
+
+    columns = ["participant_id", "series_dir", "MeanFD_Power",
+               "MeanFD_Jenkinson", "MeanDVARS"]
+
+    return pd.DataFrame(rows, columns=columns)
+
+
+def create_output_dict_list(output_catalog, resource_list,
                             get_motion=False, get_raw_score=False):
 
-    import os
-    import glob
+    # output_catalog: DataFrame from build_output_catalog
 
-    ext = ".nii"
+    import pandas as pd
 
-    # parse each result of each "valid" glob string
-    output_dict_list = {}
-    output_df_dict = {}
+    if len(resource_list) == 0:
+        err = "\n\n[!] No derivatives selected!\n\n"
+        raise Exception(err)
 
-    for nifti_glob_string in nifti_globs:
+    outputs = output_catalog[output_catalog["resource_id"].isin(resource_list)]
 
-        nifti_paths = glob.glob(nifti_glob_string + ext + "*")   
+    if len(outputs) == 0:
+        err = "\n\n[!] No output filepaths found in the pipeline output " \
+              "directory provided for the derivatives selected!\n\n" \
+              "Derivatives selected:%s\n\n" % resource_list
+        raise Exception(err)
 
-        for filepath in nifti_paths:
-        
-            second_half_filepath = filepath.split(pipeline_output_folder)[1]
-            filename = filepath.split("/")[-1]
-            
-            resource_id = second_half_filepath.split("/")[2]
-            series_id_string = second_half_filepath.split("/")[3]
-            strat_info = second_half_filepath.split(series_id_string)[1]
-            
-            unique_resource_id = (resource_id,strat_info)
-                        
-            if unique_resource_id not in output_dict_list.keys():
-                output_dict_list[unique_resource_id] = []
-            
-            unique_id = second_half_filepath.split("/")[1]
+    if get_motion:
+        # if we're including motion measures, join them on the participant
+        # and series of each output file
+        missing = outputs[pd.isnull(outputs["power_params_file"])]
+        if len(missing) > 0:
+            err = "\n\n[!] Could not find the power parameters file for " \
+                  "the following participant and series..\nParticipant: " \
+                  "%s\nSeries: %s\n\n" % (missing["participant_id"].iloc[0],
+                                            missing["Series"].iloc[0])
+            raise Exception(err)
 
-            series_id = series_id_string.replace("_scan_","")
-            series_id = series_id.replace("_rest","")
-            
-            new_row_dict = {}
-            
-            new_row_dict["participant_id"] = unique_id
-            new_row_dict["Series"] = series_id
-                                   
-            new_row_dict["Filepath"] = filepath
-                        
-            if get_motion:
-                # if we're including motion measures
-                power_params_file = find_power_params_file(filepath, \
-                    resource_id, series_id)
-                power_params_lines = load_text_file(power_params_file, \
-                    "power parameters file")
-                meanfd_p, meanfd_j, meandvars = \
-                    extract_power_params(power_params_lines, \
-                                         power_params_file)
-                new_row_dict["MeanFD_Power"] = meanfd_p
-                new_row_dict["MeanFD_Jenkinson"] = meanfd_j
-                new_row_dict["MeanDVARS"] = meandvars
-
-            if get_raw_score:
-                # grab raw score for measure mean just in case
-                raw_score_path = grab_raw_score_filepath(filepath, \
-                                                         resource_id)                    
-                new_row_dict["Raw_Filepath"] = raw_score_path
-                       
-            # unique_resource_id is tuple (resource_id,strat_info)
-            output_dict_list[unique_resource_id].append(new_row_dict)
+        outputs = pd.merge(outputs, load_power_params(outputs), how="left",
+                           on=["participant_id", "series_dir"])
+
+    if get_raw_score:
+        # grab raw score for measure mean just in case
+        outputs = outputs.copy()
+        outputs["Raw_Filepath"] = \
+            [grab_raw_score_filepath(filepath, resource_id) for
+             filepath, resource_id in zip(outputs["Filepath"],
+                                          outputs["resource_id"])]
+
+    columns = [col for col in outputs.columns if col not in
+               ("series_dir", "resource_id", "strat_info",
+                "power_params_file")]
+
+    # unique_resource_id is tuple (resource_id,strat_info)
+    output_dict_list = {}
+    for unique_resource_id, resource_df in \
+            outputs.groupby(["resource_id", "strat_info"], sort=False):
+        output_dict_list[unique_resource_id] = \
+            resource_df[columns].to_dict("records")
 
     return output_dict_list
 
@@ -351,8 +456,8 @@ def gather_outputs(pipeline_folder, resource_list, inclusion_list, \
 
     # probably won't have a session list due to subject ID format!
 
-    nifti_globs = gather_nifti_globs(pipeline_folder, resource_list)
-    output_dict_list = create_output_dict_list(nifti_globs, pipeline_folder, \
+    output_catalog = build_output_catalog(pipeline_folder)
+    output_dict_list = create_output_dict_list(output_catalog, resource_list, \
                            get_motion, get_raw_score)
     output_df_dict = create_output_df_dict(output_dict_list, inclusion_list)
 
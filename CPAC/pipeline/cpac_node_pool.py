@@ -0,0 +1,151 @@
+# CPAC/pipeline/cpac_node_pool.py
+#
+
+'''
+This module contains the node pool, which lets the participants running on
+one machine share its cores and memory node by node
+'''
+
+# Import packages
+from nipype.pipeline.plugins.multiproc import MultiProcPlugin
+
+
+# Node pool of this process, inherited by the participant processes and
+# their MultiProc workers
+node_pool = None
+
+
+class NodePool(object):
+    '''
+    Budget of cores and memory shared by the processes forked after it is
+    created
+
+    Parameters
+    ----------
+    num_cpus : integer
+        number of cores of the budget
+    memory_gb : float
+        memory of the budget, in GB
+    '''
+
+    def __init__(self, num_cpus, memory_gb):
+
+        from multiprocessing import Condition, Value
+
+        self.num_cpus = int(num_cpus)
+        self.memory_gb = float(memory_gb)
+
+        self.free_cpus = Value('i', self.num_cpus, lock=False)
+        self.free_memory_gb = Value('d', self.memory_gb, lock=False)
+        self.condition = Condition()
+
+    def fit(self, mem_gb, n_procs):
+        '''
+        Returns the resources of a node, capped to the budget so that any
+        node can run once the others are done
+        '''
+        return min(float(mem_gb), self.memory_gb), \
+            max(1, min(int(n_procs), self.num_cpus))
+
+    def acquire(self, mem_gb, n_procs):
+        '''
+        Waits until the resources of a node are free, and reserves them
+        '''
+        with self.condition:
+            while self.free_cpus.value < n_procs or \
+                    self.free_memory_gb.value < mem_gb - 1e-6:
+                self.condition.wait(5)
+            self.free_cpus.value -= n_procs
+            self.free_memory_gb.value -= mem_gb
+
+    def release(self, mem_gb, n_procs):
+        '''
+        Frees the resources of a node
+        '''
+        with self.condition:
+            self.free_cpus.value += n_procs
+            self.free_memory_gb.value += mem_gb
+            self.condition.notify_all()
+
+
+def init_node_pool(num_cpus, memory_gb):
+    '''
+    Function to create the node pool of this process, before the
+    participant processes are started
+
+    Parameters
+    ----------
+    num_cpus : integer
+        number of cores shared by the participants
+    memory_gb : float
+        memory shared by the participants, in GB
+
+    Returns
+    -------
+    node_pool : NodePool
+        the node pool
+    '''
+
+    global node_pool
+    node_pool = NodePool(num_cpus, memory_gb)
+    return node_pool
+
+
+def get_node_pool():
+    '''
+    Function to get the node pool of this process, None if the
+    participants do not share one
+    '''
+    return node_pool
+
+
+class PooledNode(object):
+    '''
+    Wrapper of a node submitted to a MultiProc worker, which runs the node
+    once its resources are free in the node pool
+    '''
+
+    def __init__(self, node, mem_gb, n_procs):
+        self._node = node
+        self._mem_gb = mem_gb
+        self._n_procs = n_procs
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('_node', '_mem_gb', '_n_procs'):
+            raise AttributeError(name)
+        return getattr(self._node, name)
+
+    def run(self, *args, **kwargs):
+        pool = get_node_pool()
+        if pool is None:
+            return self._node.run(*args, **kwargs)
+
+        pool.acquire(self._mem_gb, self._n_procs)
+        try:
+            return self._node.run(*args, **kwargs)
+        finally:
+            pool.release(self._mem_gb, self._n_procs)
+
+
+class NodePoolPlugin(MultiProcPlugin):
+    '''
+    MultiProc plugin which, on top of the participant's own cores and
+    memory, runs each node within the node pool shared by the participants,
+    and profiles each node run when profiling is enabled
+    '''
+
+    def _submit_job(self, node, updatehash=False):
+        from CPAC.utils import get_node_resources
+        from CPAC.utils.instrumentation import get_profile_dir, ProfiledNode
+
+        # profile the node run only, not its wait in the pool
+        if get_profile_dir() is not None:
+            node = ProfiledNode(node)
+
+        pool = get_node_pool()
+        if pool is not None:
+            mem_gb, n_procs = pool.fit(*get_node_resources(node))
+            node = PooledNode(node, mem_gb, n_procs)
+
+        return super(NodePoolPlugin, self)._submit_job(node,
+                                                       updatehash=updatehash)
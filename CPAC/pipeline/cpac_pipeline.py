@@ -47,9 +47,11 @@ from CPAC.registration import create_nonlinear_register, \
     create_wf_apply_ants_warp, \
     create_wf_c3d_fsl_to_itk, \
     create_wf_collect_transforms
-from CPAC.nuisance import create_nuisance, bandpass_voxels
+from CPAC.nuisance import create_nuisance, bandpass_voxels, \
+    estimate_residuals_memory
 
-from CPAC.median_angle import create_median_angle_correction
+from CPAC.median_angle import create_median_angle_correction, \
+                               calc_median_angle_params
 from CPAC.generate_motion_statistics import motion_power_statistics
 from CPAC.generate_motion_statistics import fristons_twenty_four
 from CPAC.scrubbing import create_scrubbing_preproc
@@ -57,7 +59,7 @@ from CPAC.timeseries import create_surface_registration, get_roi_timeseries, \
     get_voxel_timeseries, get_vertices_timeseries, \
     get_spatial_map_timeseries
 from CPAC.network_centrality import create_resting_state_graphs, \
-    get_cent_zscore
+    get_cent_zscore, estimate_centrality_memory
 from CPAC.utils.datasource import *
 from CPAC.utils import Configuration, create_all_qc
 from CPAC.qc.qc import create_montage, create_montage_gm_wm_csf
@@ -71,7 +73,12 @@ from CPAC.utils.utils import extract_one_d, set_gauss, \
     get_tr, extract_txt, create_log, \
     create_log_template, extract_output_mean, \
     create_output_mean_csv, get_zscore, \
-    get_fisher_zscore, dbg_file_lineno, add_afni_prefix
+    get_fisher_zscore, dbg_file_lineno, add_afni_prefix, \
+    compress_nifti_outputs, set_node_resources, get_node_resources, \
+    get_image_dims
+from CPAC.pipeline.cpac_node_pool import get_node_pool, NodePoolPlugin
+from CPAC.utils.instrumentation import get_profile_run_dir, \
+    write_profile_strategies
 from CPAC.vmhc.vmhc import create_vmhc
 from CPAC.reho.reho import create_reho
 from CPAC.alff.alff import create_alff
@@ -134,6 +141,72 @@ def create_new_fork(strat):
     return strat
 
 
+class fork_registry:
+    """Registry of the nodes and sub-workflows already wired for one of the
+    strategy forks, keyed by the resource pool entries they consume, so that
+    the forks whose inputs are identical share them instead of each wiring
+    (and hashing, and running) a clone of its own."""
+
+    def __init__(self):
+        self.entries = {}
+        self.num_shared = 0
+        self.shared_names = []
+
+    def get_key(self, label, strat, resource_keys, params=None):
+        """Key of a node for a strategy: its label, the (node, output) of
+        each resource pool entry it consumes, and its parameters. A resource
+        key of None stands for the leaf of the strategy. Returns None if the
+        strategy lacks one of the resources."""
+
+        inputs = []
+        for resource_key in resource_keys:
+            if resource_key is None:
+                node, out_file = strat.get_leaf_properties()
+            elif resource_key in strat.resource_pool:
+                node, out_file = strat.resource_pool[resource_key]
+            else:
+                return None
+            inputs.append((id(node), str(out_file)))
+
+        return (label, tuple(inputs), repr(params))
+
+    def register(self, key, nodes, resources, names, leaf=None):
+        """Record the nodes wired for a strategy, with the resource pool
+        entries, strategy names and leaf they gave it."""
+
+        if key is None:
+            return
+
+        num_nodes = 0
+        for node in nodes:
+            if hasattr(node, '_get_all_nodes'):
+                num_nodes += len(node._get_all_nodes())
+            else:
+                num_nodes += 1
+
+        self.entries[key] = (dict(resources), list(names), leaf, num_nodes)
+
+    def share(self, key, strat):
+        """Give a strategy the outputs of the nodes registered under its key,
+        if any. Returns True if they were shared."""
+
+        if key is None or key not in self.entries:
+            return False
+
+        resources, names, leaf, num_nodes = self.entries[key]
+
+        strat.update_resource_pool(resources)
+        for name in names:
+            strat.append_name(name)
+        if leaf:
+            strat.set_leaf_properties(*leaf)
+
+        self.num_shared += num_nodes
+        self.shared_names += names
+
+        return True
+
+
 # Create and prepare C-PAC pipeline workflow
 def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                   p_name=None, plugin='MultiProc', plugin_args=None):
@@ -238,6 +311,10 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
     else:
         plugin_args = {'memory_gb': sub_mem_gb, 'n_procs': num_cores_per_sub}
 
+    # size of the functional scans, to estimate the memory of the nodes
+    # which hold a whole scan at once
+    func_dims = get_image_dims(sub_dict.get('func', sub_dict.get('rest', {})))
+
     # perhaps in future allow user to set threads maximum
     # this is for centrality mostly    
     # import mkl
@@ -342,6 +419,13 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
     workflow preliminary setup
     '''
 
+    nifti_format = getattr(c, 'intermediateNiftiFormat', None) or 'nii.gz'
+    if nifti_format not in ('nii.gz', 'nii', 'pigz'):
+        err = "\n\n[!] CPAC says: The intermediate NIfTI format must be " \
+              "one of nii.gz, nii or pigz. Value provided: {0}\n\n" \
+              .format(nifti_format)
+        raise Exception(err)
+
     wfname = 'resting_preproc_' + str(subject_id)
     workflow = pe.Workflow(name=wfname)
     workflow.base_dir = c.workingDirectory
@@ -426,6 +510,9 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
 
     strat_list = []
 
+    # nodes wired once and shared by the forks with identical inputs
+    shared_nodes = fork_registry()
+
     workflow_bit_id = {}
     workflow_counter = 0
 
@@ -1998,7 +2085,9 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                                     'power_params': (gen_motion_stats,
                                                      'outputspec.power_params'),
                                     'motion_params': (gen_motion_stats,
-                                                      'outputspec.motion_params')})
+                                                      'outputspec.motion_params'),
+                                    'motion_stats': (gen_motion_stats,
+                                                     'outputspec.motion_stats')})
 
         if "De-Spiking" in c.runMotionSpike and 1 in c.runNuisance:
             strat.update_resource_pool({'despiking_frames_excluded': (
@@ -2080,6 +2169,12 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                     [('selector', c.Regressors),
                      ('compcor_ncomponents', c.nComponents)])
 
+                if func_dims:
+                    set_node_resources(nuisance.get_node('residuals'),
+                                       mem_gb=estimate_residuals_memory(
+                                           func_dims[0], func_dims[1],
+                                           c.Regressors))
+
                 nuisance.inputs.inputspec.lat_ventricles_mask = c.lateral_ventricles_mask
 
                 try:
@@ -2224,6 +2319,12 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                     [('selector', c.Regressors),
                      ('compcor_ncomponents', c.nComponents)])
 
+                if func_dims:
+                    set_node_resources(nuisance.get_node('residuals'),
+                                       mem_gb=estimate_residuals_memory(
+                                           func_dims[0], func_dims[1],
+                                           c.Regressors))
+
                 nuisance.inputs.inputspec.lat_ventricles_mask = c.lateral_ventricles_mask
 
                 try:
@@ -2330,6 +2431,21 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                 node, out_file = strat.get_leaf_properties()
                 workflow.connect(node, out_file,
                                  median_angle_corr, 'inputspec.subject')
+
+                # compute the principal components once, and reuse them
+                # for every target angle
+                if len(c.targetAngleDeg) > 1:
+                    median_angle_params = pe.Node(
+                        util.Function(input_names=['subject'],
+                                      output_names=['mean_bold',
+                                                    'median_angle',
+                                                    'pc_file'],
+                                      function=calc_median_angle_params),
+                        name='median_angle_params_%d' % num_strat)
+                    workflow.connect(node, out_file,
+                                     median_angle_params, 'subject')
+                    workflow.connect(median_angle_params, 'pc_file',
+                                     median_angle_corr, 'inputspec.pc_file')
             except:
                 logConnectionError('Median Angle Correction', num_strat,
                                    strat.get_resource_pool(), '0011')
@@ -2367,6 +2483,16 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
 
     if 1 in c.runALFF:
         for strat in strat_list:
+
+            # share the ALFF of a fork with the same inputs
+            key = shared_nodes.get_key('alff', strat,
+                                       [None, 'functional_brain_mask'],
+                                       (c.highPassFreqALFF,
+                                        c.lowPassFreqALFF))
+            if shared_nodes.share(key, strat):
+                num_strat += 1
+                continue
+
             alff = create_alff('alff_falff_%d' % num_strat)
             alff.inputs.hp_input.hp = c.highPassFreqALFF
             alff.inputs.lp_input.lp = c.lowPassFreqALFF
@@ -2394,6 +2520,11 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
             strat.update_resource_pool({'alff': (alff, 'outputspec.alff_img')})
             strat.update_resource_pool({'falff': (alff, 'outputspec.falff_img')})
 
+            shared_nodes.register(key, [alff],
+                                  {'alff': (alff, 'outputspec.alff_img'),
+                                   'falff': (alff, 'outputspec.falff_img')},
+                                  [alff.name])
+
             create_log_node(alff, 'outputspec.falff_img', num_strat)
 
             num_strat += 1
@@ -2412,8 +2543,22 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
         workflow_bit_id['frequency_filter'] = workflow_counter
         filter_imports = ['import os', 'import nibabel as nb',
                           'import numpy as np',
-                          'from scipy.fftpack import fft, ifft']
+                          'from scipy.fftpack import fft, ifft',
+                          'from CPAC.utils import save_nifti',
+                          'from CPAC.utils.result_cache import ResultCache']
         for strat in strat_list:
+
+            # share the filter of a fork with the same leaf
+            key = shared_nodes.get_key('frequency_filter', strat, [None],
+                                       c.nuisanceBandpassFreq)
+            if key in shared_nodes.entries:
+                if 0 in c.runFrequencyFiltering:
+                    strat = create_new_fork(strat)
+                    new_strat_list.append(strat)
+                shared_nodes.share(key, strat)
+                num_strat += 1
+                continue
+
             frequency_filter = pe.Node(
                 util.Function(input_names=['realigned_file',
                                            'bandpass_freqs',
@@ -2449,6 +2594,12 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
 
             strat.update_resource_pool({'functional_freq_filtered': (frequency_filter, 'bandpassed_file')})
 
+            shared_nodes.register(key, [frequency_filter],
+                                  {'functional_freq_filtered':
+                                       (frequency_filter, 'bandpassed_file')},
+                                  [frequency_filter.name],
+                                  leaf=(frequency_filter, 'bandpassed_file'))
+
             create_log_node(frequency_filter, 'bandpassed_file', num_strat)
 
             num_strat += 1
@@ -3015,6 +3166,14 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
     if 1 in c.runReHo:
         for strat in strat_list:
 
+            # share the ReHo of a fork with the same inputs
+            key = shared_nodes.get_key('reho', strat,
+                                       [None, 'functional_brain_mask'],
+                                       c.clusterSize)
+            if shared_nodes.share(key, strat):
+                num_strat += 1
+                continue
+
             preproc = create_reho()
             cluster_size = c.clusterSize
             # Check the cluster size is supported
@@ -3046,6 +3205,10 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                 {'reho': (reho, 'outputspec.raw_reho_map')})
             strat.append_name(reho.name)
 
+            shared_nodes.register(key, [reho],
+                                  {'reho': (reho, 'outputspec.raw_reho_map')},
+                                  [reho.name])
+
             create_log_node(reho, 'outputspec.raw_reho_map', num_strat)
 
             num_strat += 1
@@ -3638,6 +3801,17 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
         # For each desired strategy
         for strat in strat_list:
 
+            # Share the centrality of a fork with the same functional_mni
+            key = shared_nodes.get_key('network_centrality', strat,
+                                       ['functional_to_standard'])
+            if shared_nodes.share(key, strat):
+                if 0 in c.runNetworkCentrality:
+                    new_strat_list.append(create_new_fork(strat))
+                num_strat += 1
+                continue
+
+            num_names = len(strat.get_name())
+
             # Resample the functional mni to the centrality mask resolution
             resample_functional_to_template = pe.Node(interface=fsl.FLIRT(),
                                                       name='resample_functional_to_template_%d' % num_strat)
@@ -3664,6 +3838,8 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                                                function=merge_lists),
                                  name='merge_node_%d' % num_strat)
 
+            centrality_nodes = [resample_functional_to_template, merge_node]
+
             # Function to connect the CPAC centrality python workflow
             # into pipeline
             def connectCentralityWorkflow(methodOption,
@@ -3678,6 +3854,17 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                         wf_name='network_centrality_%d-%s' \
                                 % (num_strat, methodOption),
                         allocated_memory=c.memoryAllocatedForDegreeCentrality)
+                centrality_nodes.append(network_centrality)
+
+                # Reserve the memory of the block size calc_centrality will
+                # pick for this method
+                if func_dims and os.path.isfile(c.templateSpecificationFile):
+                    set_node_resources(
+                        network_centrality.get_node('calculate_centrality'),
+                        mem_gb=estimate_centrality_memory(
+                            c.templateSpecificationFile, func_dims[1],
+                            methodOption, thresholdOption, threshold,
+                            c.memoryAllocatedForDegreeCentrality))
 
                 # Connect resampled (to template/mask resolution)
                 # functional_mni to inputspec
@@ -3747,6 +3934,7 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                     create_afni_centrality_wf(wf_name, method_option,
                                               threshold_option,
                                               threshold, num_threads, memory)
+                centrality_nodes.append(afni_centrality_wf)
 
                 # Connect pipeline resources to workflow
                 # Dataset
@@ -3814,6 +4002,11 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                                    strat.get_resource_pool(), '0050')
                 raise
 
+            shared_nodes.register(key, centrality_nodes,
+                                  {'centrality_outputs':
+                                       (merge_node, 'merged_list')},
+                                  strat.get_name()[num_names:])
+
             if 0 in c.runNetworkCentrality:
                 tmp = strategy()
                 tmp.resource_pool = dict(strat.resource_pool)
@@ -3841,6 +4034,21 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
 
         nodes = getNodeList(strat)
 
+        # share the warp of a fork with the same output and transforms
+        if 'apply_ants_warp_functional_to_standard' in nodes:
+            resource_keys = [output_name, 'functional_to_anat_linear_xfm',
+                             'anatomical_brain',
+                             'anatomical_to_mni_nonlinear_xfm',
+                             'ants_initial_xfm', 'ants_affine_xfm',
+                             'ants_rigid_xfm']
+        else:
+            resource_keys = [output_name, 'functional_to_anat_linear_xfm',
+                             'anatomical_to_mni_nonlinear_xfm']
+        key = shared_nodes.get_key('output_to_standard', strat, resource_keys,
+                                   (output_name, map_node, input_image_type))
+        if shared_nodes.share(key, strat):
+            return strat
+
         if 'apply_ants_warp_functional_to_standard' in nodes:
 
             # ANTS WARP APPLICATION
@@ -3932,6 +4140,13 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
             strat.update_resource_pool({'{0}_to_standard'.format(output_name): (apply_ants_warp, 'outputspec.output_image')})
             strat.append_name(apply_ants_warp.name)
 
+            shared_nodes.register(key, [fsl_to_itk_convert,
+                                        collect_transforms, apply_ants_warp],
+                                  {'{0}_to_standard'.format(output_name):
+                                       (apply_ants_warp,
+                                        'outputspec.output_image')},
+                                  [apply_ants_warp.name])
+
             num_strat += 1
 
         else:
@@ -3970,6 +4185,11 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
             strat.update_resource_pool({'{0}_to_standard'.format(output_name): (apply_fsl_warp, 'out_file')})
             strat.append_name(apply_fsl_warp.name)
 
+            shared_nodes.register(key, [apply_fsl_warp],
+                                  {'{0}_to_standard'.format(output_name):
+                                       (apply_fsl_warp, 'out_file')},
+                                  [apply_fsl_warp.name])
+
         return strat
 
     ''''''
@@ -3978,6 +4198,15 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
     def z_score_standardize(output_name, mask_name, strat, num_strat,
                             map_node=False):
 
+        # share the z-scoring of a fork with the same output and mask
+        resource_keys = [output_name]
+        if "/" not in mask_name:
+            resource_keys.append(mask_name)
+        key = shared_nodes.get_key('z_score_std', strat, resource_keys,
+                                   (output_name, mask_name, map_node))
+        if shared_nodes.share(key, strat):
+            return strat
+
         # call the z-scoring sub-workflow builder
         z_score_std = get_zscore(output_name, map_node,
                                  'z_score_std_%s_%d' % (output_name, num_strat))
@@ -4006,11 +4235,23 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
         strat.append_name(z_score_std.name)
         strat.update_resource_pool({'{0}_zstd'.format(output_name): (z_score_std, 'outputspec.z_score_img')})
 
+        shared_nodes.register(key, [z_score_std],
+                              {'{0}_zstd'.format(output_name):
+                                   (z_score_std, 'outputspec.z_score_img')},
+                              [z_score_std.name])
+
         return strat
 
     def fisher_z_score_standardize(output_name, timeseries_oned_file, strat,
                                    num_strat, map_node=False):
 
+        # share the r-to-z of a fork with the same correlations
+        key = shared_nodes.get_key('fisher_z_score_std', strat,
+                                   [output_name, timeseries_oned_file],
+                                   (output_name, map_node))
+        if shared_nodes.share(key, strat):
+            return strat
+
         # call the fisher r-to-z sub-workflow builder
         fisher_z_score_std = get_fisher_zscore(output_name, map_node,
                                                'fisher_z_score_std_%s_%d' \
@@ -4036,6 +4277,12 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
         strat.append_name(fisher_z_score_std.name)
         strat.update_resource_pool({'{0}_fisher_zstd'.format(output_name): (fisher_z_score_std, 'outputspec.fisher_z_score_img')})
 
+        shared_nodes.register(key, [fisher_z_score_std],
+                              {'{0}_fisher_zstd'.format(output_name):
+                                   (fisher_z_score_std,
+                                    'outputspec.fisher_z_score_img')},
+                              [fisher_z_score_std.name])
+
         return strat
 
     ''''''
@@ -4044,6 +4291,15 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
     def output_smooth(output_name, mask_name, strat, num_strat,
                       map_node=False):
 
+        # share the smoothing of a fork with the same output and mask
+        resource_keys = [output_name]
+        if "/" not in mask_name:
+            resource_keys.append(mask_name)
+        key = shared_nodes.get_key('output_smooth', strat, resource_keys,
+                                   (output_name, mask_name, map_node))
+        if shared_nodes.share(key, strat):
+            return strat
+
         if map_node:
             output_smooth = pe.MapNode(interface=fsl.MultiImageMaths(),
                                        name='{0}_smooth_{1}'.format(output_name,
@@ -4082,6 +4338,11 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
         strat.append_name(output_smooth.name)
         strat.update_resource_pool({'{0}_smooth'.format(output_name): (output_smooth, 'out_file')})
 
+        shared_nodes.register(key, [output_smooth],
+                              {'{0}_smooth'.format(output_name):
+                                   (output_smooth, 'out_file')},
+                              [output_smooth.name])
+
         return strat
 
     ''''''
@@ -4090,6 +4351,12 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
     def calc_avg(output_name, strat, num_strat, map_node=False):
         """Calculate the average of an output using AFNI 3dmaskave."""
 
+        # share the average of a fork with the same output
+        key = shared_nodes.get_key('calc_avg', strat, [output_name],
+                                   (output_name, map_node))
+        if shared_nodes.share(key, strat):
+            return strat
+
         extract_imports = ['import os']
 
         if map_node:
@@ -4133,6 +4400,11 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
         strat.append_name(calc_average.name)
         strat.update_resource_pool({'output_means.@{0}_average'.format(output_name): (mean_to_csv, 'output_mean')})
 
+        shared_nodes.register(key, [calc_average, mean_to_csv],
+                              {'output_means.@{0}_average'.format(output_name):
+                                   (mean_to_csv, 'output_mean')},
+                              [calc_average.name])
+
         return strat
 
     '''
@@ -4664,7 +4936,8 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                     # measure
                     montage = create_montage(wf_name='montage_%s_%d' % (measure, num_strat),
                                              cbar_name='cyan_to_yellow',
-                                             png_name=measure)
+                                             png_name=measure,
+                                             num_procs=c.maxCoresPerParticipant)
                     montage.inputs.inputspec.underlay = c.template_brain_only_for_func
 
                     workflow.connect(drop_percent, 'modified_measure_file',
@@ -5112,7 +5385,12 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                                                   (r"/qc___", '/qc/')]
 
                 node, out_file = rp[key]
-                workflow.connect(node, out_file, ds, key)
+                if nifti_format == 'nii':
+                    # intermediates are uncompressed, the outputs are not
+                    workflow.connect(node, (out_file, compress_nifti_outputs),
+                                     ds, key)
+                else:
+                    workflow.connect(node, out_file, ds, key)
 
                 link_node = pe.Node(interface=util.Function(
                                         input_names=['in_file', 'strategies',
@@ -5166,6 +5444,10 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
         create_log_template(pip_ids, wf_names, scan_ids, subject_id, log_dir)
 
         logger.info("\n\nStrategy forks: {0}\n\n".format(str(set(pipes))))
+        logger.info("Nodes shared across the strategy forks instead of "
+                    "being wired per fork: {0} ({1})\n\n".format(
+                        shared_nodes.num_shared,
+                        ', '.join(sorted(set(shared_nodes.shared_names)))))
 
         pipeline_start_date = strftime("%Y-%m-%d")
         pipeline_start_datetime = strftime("%Y-%m-%d %H:%M:%S")
@@ -5184,8 +5466,13 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
 
         subject_info['status'] = 'Running'
 
-        # TODO:set memory and num_threads of critical nodes if running
-        # MultiProcPlugin
+        # Keep the resources of the nodes within the participant's own
+        # budget, MultiProc never starts a node that does not fit in it
+        for node in workflow._get_all_nodes():
+            mem_gb, n_procs = get_node_resources(node)
+            if mem_gb > sub_mem_gb or n_procs > num_cores_per_sub:
+                set_node_resources(node, mem_gb=min(mem_gb, sub_mem_gb),
+                                   n_procs=min(n_procs, num_cores_per_sub))
 
         # Create callback logger
         import logging as cb_logging
@@ -5220,11 +5507,53 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                 from nipype.utils.profiler import log_nodes_cb
                 plugin_args['status_callback'] = log_nodes_cb
 
-        # Actually run the pipeline now, for the current subject
+        # Share the masked functional data loaded by the derivatives
+        # (CPAC.utils.load_masked) within the subject's working directory
+        os.environ['CPAC_DATA_CACHE_DIR'] = os.path.join(
+            c.workingDirectory, wfname, 'data_cache')
+
+        # Format of the NIfTI files written by our nodes (CPAC.utils.save_nifti)
+        os.environ['CPAC_NIFTI_FORMAT'] = nifti_format
+        os.environ['CPAC_NIFTI_THREADS'] = str(c.maxCoresPerParticipant)
+
+        # Record the wall time, CPU time, memory and IO of each node, and
+        # the stages of our own nodes, for the report of the run
+        profile = getattr(c, 'generateProfilingReport', False)
+        if profile:
+            run_id = None
+            if pipeline_timing_info:
+                run_id = pipeline_timing_info[0]
+            profile_dir = get_profile_run_dir(c.logDirectory,
+                                              c.pipelineName, run_id)
+            os.environ['CPAC_PROFILE_DIR'] = profile_dir
+            os.environ['CPAC_PROFILE_SUBJECT'] = subject_id
+            write_profile_strategies(profile_dir, subject_id,
+                                     [strat.get_name()
+                                      for strat in strat_list])
+
+        # Reuse the outputs of our derivative functions computed on the
+        # same inputs by earlier runs (CPAC.utils.result_cache)
+        result_cache_dir = getattr(c, 'resultCacheDirectory', None)
+        if result_cache_dir and str(result_cache_dir).lower() != 'none':
+            os.environ['CPAC_RESULT_CACHE_DIR'] = \
+                os.path.abspath(result_cache_dir)
+            os.environ['CPAC_RESULT_CACHE_SIZE_GB'] = \
+                str(getattr(c, 'resultCacheSizeGB', 20))
+
+        # Share the cores and memory of the machine with the other
+        # participants node by node, if cpac_runner set up a node pool,
+        # and profile the nodes in the MultiProc workers
+        if (get_node_pool() is not None or profile) and \
+                plugin in (None, 'MultiProc'):
+            plugin = NodePoolPlugin(plugin_args=plugin_args)
+
+        # Actually run the pipeline now, for the current subject. A failed
+        # run is not reported as completed, the caller records the error
         try:
             workflow.run(plugin=plugin, plugin_args=plugin_args)
         except Exception as e:
             logger.error(e)
+            raise
 
         # Dump subject info pickle file to subject log dir
         subject_info['status'] = 'Completed'
@@ -5245,7 +5574,8 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                     qc_output_folder = os.path.join(pipeline_base, subject_id,
                                                     'qc_files_here')
                     generateQCPages(qc_output_folder, qc_montage_id_a,
-                                    qc_montage_id_s, qc_plot_id, qc_hist_id)
+                                    qc_montage_id_s, qc_plot_id, qc_hist_id,
+                                    num_procs=c.maxCoresPerParticipant)
                 except Exception as e:
                     logger.error("[!] Error: The QC interface page "
                                  "generator ran into a problem.\nDetails: "
@@ -6,7 +6,6 @@ This module contains functions used to run a C-PAC pipeline
 '''
 
 # Import packages
-from multiprocessing import Process
 import os
 from CPAC.utils.utils import create_seeds_, create_group_log_template
 from CPAC.utils import Configuration
@@ -369,6 +368,265 @@ def append_seeds_to_file(working_dir, seed_list, seed_file):
         return f_name
 
 
+def get_participant_label(sub_dict):
+    '''
+    Function to get the label of a participant in the subject list, as used
+    in the log directory names
+
+    Parameters
+    ----------
+    sub_dict : dictionary
+        participant entry of the subject list
+
+    Returns
+    -------
+    label : string
+        subject ID, and unique ID if there is one
+    '''
+
+    if sub_dict.get('unique_id'):
+        return '%s_%s' % (sub_dict['subject_id'], sub_dict['unique_id'])
+    return str(sub_dict['subject_id'])
+
+
+def get_system_resources():
+    '''
+    Function to get the number of CPUs and the physical memory of the
+    machine
+
+    Returns
+    -------
+    num_cpus : integer
+        number of CPUs
+    memory_gb : float or None
+        physical memory in GB, None if it cannot be determined
+    '''
+
+    import multiprocessing
+
+    try:
+        num_cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        num_cpus = 1
+
+    try:
+        memory_gb = os.sysconf('SC_PAGE_SIZE') * \
+            os.sysconf('SC_PHYS_PAGES') / float(1024 ** 3)
+    except (AttributeError, ValueError, OSError):
+        memory_gb = None
+
+    return num_cpus, memory_gb
+
+
+def write_status_file(status_file, status_list):
+    '''
+    Function to write the status of the participant runs to a JSON file
+
+    Parameters
+    ----------
+    status_file : string
+        path to the status file
+    status_list : list
+        list of participant status dictionaries
+    '''
+
+    import json
+    from CPAC.utils.utils import atomic_write
+
+    # write to a temporary file first, so that readers never see a
+    # partial file
+    try:
+        with atomic_write(status_file) as tmp_file:
+            with open(tmp_file, 'w') as f:
+                json.dump({'updated': strftime("%Y-%m-%d_%H:%M:%S"),
+                           'participants': status_list}, f, indent=2)
+    except (IOError, OSError) as e:
+        print "Could not write the participant status file %s: %s" \
+              % (status_file, e)
+
+
+def run_participant(index, result_queue, sub_dict, c, strategies,
+                    pipeline_timing_info, p_name, plugin, plugin_args):
+    '''
+    Function run in each participant's process - builds and runs the
+    participant's workflow, and reports the outcome to the scheduler
+
+    Parameters
+    ----------
+    index : integer
+        index of the participant in the subject list
+    result_queue : multiprocessing.Queue
+        queue the outcome is reported to, as (index, error) with error set
+        to None on success
+    '''
+
+    import traceback
+    from CPAC.pipeline.cpac_pipeline import prep_workflow
+
+    error = None
+    try:
+        prep_workflow(sub_dict, c, strategies, 1, pipeline_timing_info,
+                      p_name, plugin, plugin_args)
+    except BaseException:
+        error = traceback.format_exc()
+    finally:
+        result_queue.put((index, error))
+
+
+def run_participants(sublist, c, strategies, pipeline_timing_info,
+                     p_name=None, plugin=None, plugin_args=None):
+    '''
+    Function to run the participants of a subject list on this machine
+
+    Participants are started from a queue as soon as one finishes, as long
+    as at most numParticipantsAtOnce participants run at the same time and
+    their maxCoresPerParticipant cores and maximumMemoryPerParticipant GB
+    fit in the machine. Each participant runs in its own process, since
+    its workflow may start a pool of its own. The status of each
+    participant is written to participant_status.json in the working
+    directory.
+
+    With shareResourcesAcrossParticipants, the cores and memory of the
+    machine are shared node by node instead: participants are only limited
+    by numParticipantsAtOnce, and their nodes wait in a node pool until
+    the cores and memory they need are free.
+
+    Parameters
+    ----------
+    sublist : list
+        subject list
+    c : Configuration
+        pipeline configuration
+    strategies : list
+        preprocessing strategies
+
+    Returns
+    -------
+    status_list : list
+        list of participant status dictionaries
+    '''
+
+    from collections import deque
+    from multiprocessing import Process, Queue
+    from Queue import Empty
+
+    num_cpus, memory_gb = get_system_resources()
+
+    max_participants = max(1, int(c.numParticipantsAtOnce))
+    cores_per_participant = max(1, int(c.maxCoresPerParticipant))
+    memory_per_participant = float(c.maximumMemoryPerParticipant)
+
+    share_resources = getattr(c, 'shareResourcesAcrossParticipants', False)
+    if share_resources:
+        from CPAC.pipeline.cpac_node_pool import init_node_pool
+
+        # leave some memory to the system, as MultiProc does
+        if memory_gb:
+            pool_memory_gb = 0.9 * memory_gb
+        else:
+            pool_memory_gb = max_participants * memory_per_participant
+        init_node_pool(num_cpus, pool_memory_gb)
+
+        print "Sharing %d cores and %.1fGB of memory across the " \
+              "participants\n" % (num_cpus, pool_memory_gb)
+
+    status_file = os.path.join(c.workingDirectory, 'participant_status.json')
+    status_list = [{'participant': get_participant_label(sub),
+                    'status': 'pending',
+                    'pid': None,
+                    'start': None,
+                    'end': None,
+                    'error': None} for sub in sublist]
+    write_status_file(status_file, status_list)
+
+    def fits(running):
+        # at least one participant always runs, even if it asks for more
+        # than the machine has
+        if not running:
+            return True
+        if len(running) >= max_participants:
+            return False
+        if share_resources:
+            return True
+        if (len(running) + 1) * cores_per_participant > num_cpus:
+            return False
+        if memory_gb and \
+                (len(running) + 1) * memory_per_participant > memory_gb:
+            return False
+        return True
+
+    pending = deque(range(len(sublist)))
+    running = {}
+    result_queue = Queue()
+
+    pid_file = open(os.path.join(c.workingDirectory, 'pid.txt'), 'w')
+
+    try:
+        while pending or running:
+
+            # admit as many participants as the resources allow
+            while pending and fits(running):
+                idx = pending.popleft()
+                proc = Process(target=run_participant,
+                               args=(idx, result_queue, sublist[idx], c,
+                                     strategies, pipeline_timing_info,
+                                     p_name, plugin, plugin_args))
+                proc.start()
+                print >>pid_file, proc.pid
+                pid_file.flush()
+
+                running[idx] = proc
+                status_list[idx].update({'status': 'running',
+                                         'pid': proc.pid,
+                                         'start': strftime(
+                                             "%Y-%m-%d_%H:%M:%S")})
+                write_status_file(status_file, status_list)
+
+            # wait for a participant to finish
+            finished = []
+            try:
+                finished.append(result_queue.get(timeout=10))
+            except Empty:
+                # catch the processes that died without reporting back
+                dead = [idx for idx, proc in running.items()
+                        if not proc.is_alive()]
+                reported = []
+                if dead:
+                    # a process may have reported just before exiting
+                    while True:
+                        try:
+                            finished.append(result_queue.get(timeout=1))
+                        except Empty:
+                            break
+                    reported = [idx for idx, error in finished]
+                for idx in dead:
+                    if idx not in reported:
+                        proc = running[idx]
+                        finished.append((idx, 'The participant process '
+                                              'exited with code %s.'
+                                              % proc.exitcode))
+
+            for idx, error in finished:
+                if idx not in running:
+                    continue
+                running.pop(idx).join()
+
+                status_list[idx].update({'status': 'failed' if error
+                                                   else 'completed',
+                                         'end': strftime("%Y-%m-%d_%H:%M:%S"),
+                                         'error': error})
+                write_status_file(status_file, status_list)
+
+                if error:
+                    print "\n\n[!] Participant %s failed:\n%s\n\n" \
+                          % (status_list[idx]['participant'], error)
+    finally:
+        # Close PID txt file to indicate finish
+        pid_file.close()
+
+    return status_list
+
+
 # Run C-PAC subjects via job queue
 def run(config_file, subject_list_file, p_name=None, plugin=None,
         plugin_args=None):
@@ -474,12 +732,6 @@ def run(config_file, subject_list_file, p_name=None, plugin=None,
 
     # Run on one computer
     else:
-        # Init variables
-        procss = [Process(target=prep_workflow,
-                          args=(sub, c, strategies, 1, pipeline_timing_info,
-                                p_name, plugin, plugin_args))
-                  for sub in sublist]
-
         if not os.path.exists(c.workingDirectory):
             try:
                 os.makedirs(c.workingDirectory)
@@ -488,47 +740,17 @@ def run(config_file, subject_list_file, p_name=None, plugin=None,
                       "directory: %s\n\nMake sure you have permissions " \
                       "to write to this directory.\n\n" % c.workingDirectory
                 raise Exception(err)
-                
-        pid = open(os.path.join(c.workingDirectory, 'pid.txt'), 'w')
-        # Init job queue
-        jobQueue = []
-
-        # If we're allocating more processes than are subjects, run them all
-        if len(sublist) <= c.numParticipantsAtOnce:
-            for p in procss:
-                p.start()
-                print >>pid, p.pid
-        # Otherwise manage resources to run processes incrementally
-        else:
-            idx = 0
-            while idx < len(sublist):
-                # If the job queue is empty and we haven't started indexing
-                if len(jobQueue) == 0 and idx == 0:
-                    # Init subject process index
-                    idc = idx
-                    # Launch processes (one for each subject)
-                    for p in procss[idc: idc+c.numParticipantsAtOnce]:
-                        p.start()
-                        print >>pid, p.pid
-                        jobQueue.append(p)
-                        idx += 1
-                # Otherwise, jobs are running - check them
-                else:
-                    # Check every job in the queue's status
-                    for job in jobQueue:
-                        # If the job is not alive
-                        if not job.is_alive():
-                            # Find job and delete it from queue
-                            print 'found dead job ', job
-                            loc = jobQueue.index(job)
-                            del jobQueue[loc]
-                            # ...and start the next available process
-                            # (subject)
-                            procss[idx].start()
-                            # Append this to job queue and increment index
-                            jobQueue.append(procss[idx])
-                            idx += 1
-                    # Add sleep so while loop isn't consuming 100% of CPU
-                    time.sleep(2)
-        # Close PID txt file to indicate finish
-        pid.close()
+
+        run_participants(sublist, c, strategies, pipeline_timing_info,
+                         p_name, plugin, plugin_args)
+
+        # Aggregate the node profiles of all the participants of this run
+        if getattr(c, 'generateProfilingReport', False):
+            from CPAC.utils.instrumentation import get_profile_run_dir, \
+                create_profile_report
+
+            profile_dir = get_profile_run_dir(c.logDirectory, c.pipelineName,
+                                              unique_pipeline_id)
+            report_files = create_profile_report(profile_dir)
+            if report_files:
+                print "Profiling report written to %s\n" % profile_dir
@@ -31,19 +31,18 @@ def write_new_sub_file(current_mod_path, subject_list, new_participant_list):
 
 
 
-def create_merged_copefile(list_of_output_files, merged_outfile):
+def create_merged_copefile(list_of_output_files, merged_outfile,
+                           mask_outfile=None):
 
-    import subprocess
-
-    merge_string = ["fslmerge", "-t", merged_outfile]
-
-    merge_string = merge_string + list_of_output_files
+    from CPAC.utils import merge_nifti_files
 
+    # the volumes are written in the order of the list, so the merged file
+    # matches the design matrix by construction
     try:
-        retcode = subprocess.check_output(merge_string)
+        merge_nifti_files(list_of_output_files, merged_outfile, mask_outfile)
     except Exception as e:
-        err = "\n\n[!] Something went wrong with FSL's fslmerge during the " \
-              "creation of the 4D merged file for group analysis.\n\n" \
+        err = "\n\n[!] Something went wrong during the creation of the 4D " \
+              "merged file for group analysis.\n\n" \
               "Attempted to create file: %s\n\nLength of list of files to " \
               "merge: %d\n\nError details: %s\n\n" \
               % (merged_outfile, len(list_of_output_files), e)
@@ -55,16 +54,14 @@ def create_merged_copefile(list_of_output_files, merged_outfile):
 
 def create_merge_mask(merged_file, mask_outfile):
 
-    import subprocess
-
-    mask_string = ["fslmaths", merged_file, "-abs", "-Tmin", "-bin", \
-                   mask_outfile]
+    from CPAC.utils import merge_nifti_files
 
+    # voxels which are non-zero in every volume (fslmaths -abs -Tmin -bin)
     try:
-        retcode = subprocess.check_output(mask_string)
+        merge_nifti_files([merged_file], mask_file=mask_outfile)
     except Exception as e:
-        err = "\n\n[!] Something went wrong with FSL's fslmaths during the " \
-              "creation of the merged copefile group mask.\n\nAttempted to " \
+        err = "\n\n[!] Something went wrong during the creation of the " \
+              "merged copefile group mask.\n\nAttempted to " \
               "create file: %s\n\nMerged file: %s\n\nError details: %s\n\n" \
               % (mask_outfile, merged_file, e)
         raise Exception(err)
@@ -73,49 +70,14 @@ def create_merge_mask(merged_file, mask_outfile):
 
 
 
-def calculate_measure_mean_in_df(model_df, merge_mask):
 
-    import subprocess
-    import pandas as pd
+def calculate_measure_mean_in_df(model_df, merge_mask, num_threads=1):
 
-    mm_dict_list = []
-    
-    for raw_file in list(model_df["Raw_Filepath"]):
-    
-        mask_string = ["3dmaskave", "-mask", merge_mask, raw_file]
-        
-        # calculate
-        try:
-            retcode = subprocess.check_output(mask_string)
-        except Exception as e:
-            err = "\n\n[!] AFNI's 3dMaskAve failed for raw output: %s\n" \
-                  "Error details: %s\n\n" % (raw_file, e)
-            raise Exception(err)
-        
-        # if this breaks, 3dmaskave output to STDOUT has changed
-        try:
-            mean = retcode.split(" ")[0]
-        except Exception as e:
-            err = "\n\n[!] Something went wrong with parsing the output of " \
-                  "AFNI's 3dMaskAve - this is used in calculating the " \
-                  "Measure Mean in group analysis.\n\nError details: %s\n\n" \
-                  % e
-            raise Exception(err)
-        
-        mm_dict = {}
-        mm_dict["Raw_Filepath"] = raw_file
-        mm_dict["Measure_Mean"] = mean
-        mm_dict_list.append(mm_dict)
-        
-    mm_df = pd.DataFrame(mm_dict_list)
-    
-    # demean!
-    mm_df["Measure_Mean"] = mm_df["Measure_Mean"].astype(float)
-    mm_df["Measure_Mean"] = mm_df["Measure_Mean"].sub(mm_df["Measure_Mean"].mean())
-    
-    model_df = pd.merge(model_df, mm_df, how="inner", on=["Raw_Filepath"])
-    
-    return model_df
+    from CPAC.pipeline.cpac_ga_model_generator import \
+        calculate_mask_means_in_df
+
+    return calculate_mask_means_in_df(model_df, mask=merge_mask,
+                                      num_threads=num_threads)
 
 
 
@@ -185,75 +147,13 @@ def trim_mask(input_mask, ref_mask, output_mask_path):
 
 
 
-def calculate_custom_roi_mean_in_df(model_df, roi_mask):   
+def calculate_custom_roi_mean_in_df(model_df, roi_mask, num_threads=1):
 
-    import os
-    import subprocess
-    import pandas as pd
-
-    # calculate the ROI means
-    roi_dict_list = []
-    
-    for raw_file in list(model_df["Raw_Filepath"]):
-        
-        roi_string = ["3dROIstats", "-mask", roi_mask, raw_file]
-
-        try:
-            retcode = subprocess.check_output(roi_string)
-        except Exception as e:
-            err = "\n\n[!] Something went wrong with running AFNI's " \
-                  "3dROIstats while calculating the custom ROI means.\n\n" \
-                  "Custom ROI mask file: %s\n\nRaw output filepath: %s\n\n" \
-                  "Error details: %s\n\n" % (roi_mask, raw_file, e)
-            raise Exception(err)
-
-        # process the output string
-        roi_means_string = retcode.split(raw_file)[1].rstrip("\n")
-
-        if "\t[0]?\t" in roi_means_string:
-            roi_means_string = roi_means_string.replace("\t[0]?\t","")
-
-        roi_means_string_list = roi_means_string.split("\t")
+    from CPAC.pipeline.cpac_ga_model_generator import \
+        calculate_mask_means_in_df
 
-        # check
-        roi_means_list = []
-        for roi_mean in roi_means_string_list:
-            try:
-                roi_means_list.append(float(roi_mean))
-            except:
-                err = "\n\n[!] Something went wrong with parsing the output "\
-                      "of AFNI's 3dROIstats during the calculation of the " \
-                      "custom ROI means.\n\nOutput file: %s\n\nCustom ROI " \
-                      "mask file: %s\n\n3dROIstats output: %s\n\n" \
-                      % (raw_file, roi_mask, retcode)
-                raise Exception(err)
-
-        # add in the custom ROI means!
-        roi_dict = {}
-        roi_dict["Raw_Filepath"] = raw_file
-
-        i = 1
-        for roi_mean in roi_means_list:
-            roi_label = "Custom_ROI_Mean_%d" % i
-            roi_dict[roi_label] = roi_mean
-            i += 1
-
-        roi_dict_list.append(roi_dict)
-
-
-    roi_df = pd.DataFrame(roi_dict_list)
-    
-    # demean!
-    i = 1
-    for roi_mean in roi_means_list:
-        roi_label = "Custom_ROI_Mean_%d" % i
-        i += 1  
-        roi_df[roi_label] = roi_df[roi_label].astype(float)
-        roi_df[roi_label] = roi_df[roi_label].sub(roi_df[roi_label].mean())
-    
-    model_df = pd.merge(model_df, roi_df, how="inner", on=["Raw_Filepath"])
-    
-    return model_df
+    return calculate_mask_means_in_df(model_df, roi_mask=roi_mask,
+                                      num_threads=num_threads)
 
 
 
@@ -395,13 +295,14 @@ def prep_group_analysis_workflow(model_df, pipeline_config_obj, \
     merge_outfile = model_name + "_" + resource_id + "_merged.nii.gz"
     merge_outfile = os.path.join(model_path, merge_outfile)
 
-    merge_file = create_merged_copefile(list(model_df["Filepath"]), \
-                                        merge_outfile)
-
-    # create merged group mask
+    # create merged group mask, in the same pass
+    merge_mask_outfile = None
     if group_config_obj.mean_mask[0] == "Group Mask":
-        merge_mask_outfile = os.path.basename(merge_file) + "_mask.nii.gz"
-        merge_mask = create_merged_mask(merge_file, merge_mask_outfile)
+        merge_mask_outfile = os.path.basename(merge_outfile) + "_mask.nii.gz"
+
+    merge_file = create_merged_copefile(list(model_df["Filepath"]), \
+                                        merge_outfile, merge_mask_outfile)
+    merge_mask = merge_mask_outfile
 
     # calculate measure means, and demean
     if "Measure_Mean" in design_formula:
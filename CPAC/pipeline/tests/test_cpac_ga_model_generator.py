@@ -0,0 +1,142 @@
+
+def make_raw_files(out_dir, n_files=4, seed=0):
+    # raw outputs, a mask with non-binary values and an ROI image with
+    # non-contiguous labels
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(seed)
+
+    shape = (6, 5, 4)
+
+    mask_data = np.zeros(shape, dtype=np.float32)
+    mask_data[1:5, 1:4, 1:3] = 1
+    mask_data[2, 2, 2] = 0.5
+    mask_file = os.path.join(out_dir, 'mask.nii.gz')
+    nb.Nifti1Image(mask_data, np.eye(4)).to_filename(mask_file)
+
+    roi_data = np.zeros(shape, dtype=np.float32)
+    roi_data[:3, :, :2] = 12
+    roi_data[3:, :2, :] = 3
+    roi_data[4:, 3:, 2:] = 7
+    roi_file = os.path.join(out_dir, 'roi.nii.gz')
+    nb.Nifti1Image(roi_data, np.eye(4)).to_filename(roi_file)
+
+    raw_files = []
+    raw_datas = []
+    for i in range(n_files):
+        raw_data = np.random.randn(*shape).astype(np.float32) + i
+        raw_file = os.path.join(out_dir, 'raw_%d.nii.gz' % i)
+        nb.Nifti1Image(raw_data, np.eye(4)).to_filename(raw_file)
+        raw_files.append(raw_file)
+        raw_datas.append(raw_data.astype(np.float64))
+
+    return raw_files, raw_datas, mask_file, mask_data, roi_file, roi_data
+
+
+def test_calculate_mask_means():
+    from CPAC.pipeline.cpac_ga_model_generator import calculate_mask_means
+    import tempfile
+    import numpy as np
+
+    raw_files, raw_datas, mask_file, mask_data, roi_file, roi_data = \
+        make_raw_files(tempfile.mkdtemp())
+
+    for num_threads in [1, 3]:
+        means_df = calculate_mask_means(raw_files, mask_file, roi_file,
+                                        num_threads=num_threads)
+
+        # the ROI means are numbered in increasing label order
+        assert list(means_df.columns) == ['Raw_Filepath', 'Measure_Mean',
+                                          'Custom_ROI_Mean_1',
+                                          'Custom_ROI_Mean_2',
+                                          'Custom_ROI_Mean_3']
+        assert list(means_df['Raw_Filepath']) == raw_files
+
+        for i, raw_data in enumerate(raw_datas):
+            row = means_df.iloc[i]
+            np.testing.assert_allclose(row['Measure_Mean'],
+                                       raw_data[mask_data != 0].mean())
+            for n, label in enumerate([3, 7, 12]):
+                np.testing.assert_allclose(
+                    row['Custom_ROI_Mean_%d' % (n + 1)],
+                    raw_data[roi_data == label].mean())
+
+    means_df = calculate_mask_means(raw_files, mask=mask_file)
+    assert list(means_df.columns) == ['Raw_Filepath', 'Measure_Mean']
+
+    means_df = calculate_mask_means(raw_files, roi_mask=roi_file)
+    assert list(means_df.columns) == ['Raw_Filepath', 'Custom_ROI_Mean_1',
+                                      'Custom_ROI_Mean_2',
+                                      'Custom_ROI_Mean_3']
+
+
+def test_calculate_mask_means_shape():
+    from CPAC.pipeline.cpac_ga_model_generator import calculate_mask_means
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    out_dir = tempfile.mkdtemp()
+    raw_files, _, mask_file, _, roi_file, _ = make_raw_files(out_dir)
+
+    small_file = os.path.join(out_dir, 'small.nii.gz')
+    nb.Nifti1Image(np.ones((3, 3, 3), dtype=np.float32),
+                   np.eye(4)).to_filename(small_file)
+
+    for kwargs in [{'mask': mask_file, 'roi_mask': small_file},
+                   {'mask': small_file}]:
+        try:
+            calculate_mask_means(raw_files, **kwargs)
+            raise AssertionError('no error raised for mismatched dimensions')
+        except Exception as e:
+            assert 'dimensions' in str(e)
+
+
+def test_calculate_mask_means_in_df():
+    from CPAC.pipeline.cpac_ga_model_generator import \
+        calculate_mask_means_in_df, calculate_measure_mean_in_df
+    import tempfile
+    import numpy as np
+    import pandas as pd
+
+    raw_files, raw_datas, mask_file, mask_data, roi_file, roi_data = \
+        make_raw_files(tempfile.mkdtemp())
+
+    model_df = pd.DataFrame({'Participant': ['sub-%d' % i
+                                             for i in range(len(raw_files))],
+                             'Raw_Filepath': raw_files,
+                             'Age': [20, 31, 42, 53]})
+
+    merged_df = calculate_mask_means_in_df(model_df, mask_file, roi_file,
+                                           num_threads=2)
+
+    assert list(merged_df.columns) == list(model_df.columns) + \
+        ['Measure_Mean', 'Custom_ROI_Mean_1', 'Custom_ROI_Mean_2',
+         'Custom_ROI_Mean_3']
+    assert list(merged_df['Participant']) == list(model_df['Participant'])
+    assert list(merged_df['Age']) == [20, 31, 42, 53]
+
+    # demeaned across the files
+    measure_means = np.array([raw_data[mask_data != 0].mean()
+                              for raw_data in raw_datas])
+    np.testing.assert_allclose(merged_df['Measure_Mean'],
+                               measure_means - measure_means.mean())
+
+    for n, label in enumerate([3, 7, 12]):
+        roi_means = np.array([raw_data[roi_data == label].mean()
+                              for raw_data in raw_datas])
+        np.testing.assert_allclose(merged_df['Custom_ROI_Mean_%d' % (n + 1)],
+                                   roi_means - roi_means.mean())
+
+    for col in merged_df.columns[3:]:
+        np.testing.assert_allclose(merged_df[col].mean(), 0, atol=1e-12)
+
+    # only the rows of the model are kept
+    merged_df = calculate_measure_mean_in_df(model_df.iloc[1:], mask_file)
+    assert list(merged_df['Raw_Filepath']) == raw_files[1:]
+    np.testing.assert_allclose(
+        merged_df['Measure_Mean'],
+        measure_means[1:] - measure_means[1:].mean())
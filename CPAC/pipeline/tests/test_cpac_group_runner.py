@@ -0,0 +1,95 @@
+
+
+def create_output_tree(pipeline_output_folder, files):
+
+    import os
+
+    for rel_path in files:
+        path = os.path.join(pipeline_output_folder, rel_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write("0.1 0.2 0.3\n")
+
+
+def test_list_output_dir():
+    import os
+    import tempfile
+    from CPAC.pipeline.cpac_group_runner import list_output_dir
+
+    dir_path = tempfile.mkdtemp()
+    create_output_tree(dir_path, ["_fwhm_6/alff.nii.gz",
+                                  "_fwhm_4/alff.nii.gz",
+                                  "sub-1_pow_params.txt",
+                                  "b.nii",
+                                  "log.txt",
+                                  "qc.png"])
+
+    assert list_output_dir(dir_path) == \
+        (["_fwhm_4", "_fwhm_6"], ["b.nii", "sub-1_pow_params.txt"])
+
+
+def test_build_output_catalog():
+    import os
+    import tempfile
+    import CPAC.pipeline.cpac_group_runner as group_runner
+
+    output_folder = tempfile.mkdtemp()
+    create_output_tree(output_folder, [
+        "sub-1/alff/_scan_rest_1_rest/_fwhm_6/alff.nii.gz",
+        "sub-1/alff/_scan_rest_2_rest/_fwhm_6/alff.nii.gz",
+        "sub-1/power_params/_scan_rest_1_rest/pow_params.txt",
+        "sub-2/alff/_scan_rest_1_rest/_fwhm_6/alff.nii.gz",
+        "sub-2/alff/_scan_rest_1_rest/_fwhm_6/alff.png"])
+
+    catalog = group_runner.build_output_catalog(output_folder)
+    catalog = catalog.sort_values(["participant_id", "Series"])
+
+    assert list(catalog["participant_id"]) == ["sub-1", "sub-1", "sub-2"]
+    assert list(catalog["Series"]) == ["rest_1", "rest_2", "rest_1"]
+    assert set(catalog["resource_id"]) == set(["alff"])
+    assert set(catalog["strat_info"]) == set(["/_fwhm_6/alff.nii.gz"])
+    assert catalog["Filepath"].iloc[0] == os.path.join(
+        output_folder, "sub-1/alff/_scan_rest_1_rest/_fwhm_6/alff.nii.gz")
+    assert list(catalog["power_params_file"].isnull()) == \
+        [False, True, True]
+    assert catalog["power_params_file"].iloc[0] == os.path.join(
+        output_folder, "sub-1/power_params/_scan_rest_1_rest/pow_params.txt")
+
+    catalog_file = os.path.join(output_folder, ".cpac_output_catalog.json")
+    assert os.path.isfile(catalog_file)
+
+    # add an output and bump the modification time of its directory, then
+    # check that only the changed directories are listed again
+    new_dir = os.path.join(output_folder,
+                           "sub-2/alff/_scan_rest_1_rest/_fwhm_6")
+    create_output_tree(new_dir, ["falff.nii.gz"])
+    mtime = os.stat(new_dir).st_mtime + 10
+    os.utime(new_dir, (mtime, mtime))
+
+    listed = []
+    list_output_dir = group_runner.list_output_dir
+
+    def counting_list_output_dir(dir_path):
+        listed.append(dir_path)
+        return list_output_dir(dir_path)
+
+    group_runner.list_output_dir = counting_list_output_dir
+    try:
+        catalog = group_runner.build_output_catalog(output_folder)
+    finally:
+        group_runner.list_output_dir = list_output_dir
+
+    # the root holds the catalog file, so it is always listed again
+    assert listed == [os.path.join(output_folder, ""), new_dir]
+    assert len(catalog) == 4
+    assert sorted(catalog[catalog["participant_id"] == "sub-2"]
+                  ["strat_info"]) == ["/_fwhm_6/alff.nii.gz",
+                                      "/_fwhm_6/falff.nii.gz"]
+
+    # a catalog of another output folder is not reused
+    other_folder = tempfile.mkdtemp()
+    create_output_tree(other_folder, [
+        "sub-3/alff/_scan_rest_1_rest/_fwhm_6/alff.nii.gz"])
+    catalog = group_runner.build_output_catalog(other_folder, catalog_file)
+    assert list(catalog["participant_id"]) == ["sub-3"]
@@ -0,0 +1,83 @@
+
+
+def fake_prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info,
+                       p_name, plugin, plugin_args):
+
+    import os
+
+    if sub_dict['subject_id'] == 'sub-2':
+        raise Exception('\n\n[!] CPAC says: sub-2 has no anatomical '
+                        'scan.\n\n')
+    if sub_dict['subject_id'] == 'sub-3':
+        # a worker killed without reporting back, e.g. by the OOM killer
+        os._exit(3)
+
+
+def test_run_participants_failures():
+    import os
+    import json
+    import tempfile
+    import CPAC.pipeline.cpac_pipeline as cpac_pipeline
+    from CPAC.utils import Configuration
+    from CPAC.pipeline.cpac_runner import run_participants
+
+    working_dir = tempfile.mkdtemp()
+    c = Configuration({'workingDirectory': working_dir,
+                       'numParticipantsAtOnce': 2,
+                       'maxCoresPerParticipant': 1,
+                       'maximumMemoryPerParticipant': 0.1})
+
+    sublist = [{'subject_id': 'sub-1', 'unique_id': 'ses-1'},
+               {'subject_id': 'sub-2', 'unique_id': 'ses-1'},
+               {'subject_id': 'sub-3'}]
+
+    # the participant processes are forked, so they run the fake workflow
+    prep_workflow = cpac_pipeline.prep_workflow
+    cpac_pipeline.prep_workflow = fake_prep_workflow
+    try:
+        status_list = run_participants(sublist, c, [], None)
+    finally:
+        cpac_pipeline.prep_workflow = prep_workflow
+
+    assert [status['participant'] for status in status_list] == \
+        ['sub-1_ses-1', 'sub-2_ses-1', 'sub-3']
+    assert [status['status'] for status in status_list] == \
+        ['completed', 'failed', 'failed']
+
+    assert status_list[0]['error'] is None
+    assert 'sub-2 has no anatomical scan' in status_list[1]['error']
+    assert status_list[2]['error'] == \
+        'The participant process exited with code 3.'
+
+    for status in status_list:
+        assert status['pid']
+        assert status['start'] and status['end']
+
+    with open(os.path.join(working_dir, 'participant_status.json')) as f:
+        assert json.load(f)['participants'] == status_list
+
+    with open(os.path.join(working_dir, 'pid.txt')) as f:
+        assert [int(pid) for pid in f.read().split()] == \
+            [status['pid'] for status in status_list]
+
+
+def test_write_status_file():
+    import os
+    import json
+    import tempfile
+    from CPAC.pipeline.cpac_runner import write_status_file
+
+    status_file = os.path.join(tempfile.mkdtemp(), 'participant_status.json')
+    status_list = [{'participant': 'sub-1', 'status': 'pending'}]
+
+    write_status_file(status_file, status_list)
+
+    with open(status_file) as f:
+        status = json.load(f)
+    assert status['participants'] == status_list
+    assert 'updated' in status
+    assert os.listdir(os.path.dirname(status_file)) == \
+        ['participant_status.json']
+
+    # an unwritable location is reported, not raised
+    write_status_file(os.path.join(status_file, 'status.json'), status_list)
@@ -1,8 +1,9 @@
 
 from CPAC.qc.utils import *
+from CPAC.utils.utils import set_node_resources
 
 
-def create_montage(wf_name, cbar_name, png_name):
+def create_montage(wf_name, cbar_name, png_name, num_procs=1):
 
     wf = pe.Workflow(name=wf_name)
 
@@ -31,34 +32,42 @@ def create_montage(wf_name, cbar_name, png_name):
 
     # node for axial montages
     montage_a_imports = ['import os',
-                         'from CPAC.qc.utils import make_montage_axial']
+                         'from CPAC.qc.utils import make_montage_axial, '
+                         'render_montages']
     montage_a = pe.Node(util.Function(input_names=['overlay',
                                                    'underlay',
                                                    'png_name',
-                                                   'cbar_name'],
+                                                   'cbar_name',
+                                                   'num_procs'],
                                       output_names=['png_name'],
                                       function=montage_axial,
                                       imports=montage_a_imports),
                         name='montage_a')
     montage_a.inputs.cbar_name = cbar_name
     montage_a.inputs.png_name = png_name + '_a.png'
+    montage_a.inputs.num_procs = num_procs
+    set_node_resources(montage_a, n_procs=num_procs)
 
     wf.connect(resample_u, 'new_fname', montage_a, 'underlay')
     wf.connect(resample_o, 'new_fname', montage_a, 'overlay')
 
     # node for sagittal montages
     montage_s_imports = ['import os',
-                         'from CPAC.qc.utils import make_montage_sagittal']
+                         'from CPAC.qc.utils import make_montage_sagittal, '
+                         'render_montages']
     montage_s = pe.Node(util.Function(input_names=['overlay',
                                                    'underlay',
                                                    'png_name',
-                                                   'cbar_name'],
+                                                   'cbar_name',
+                                                   'num_procs'],
                                       output_names=['png_name'],
                                       function=montage_sagittal,
                                       imports=montage_s_imports),
                         name='montage_s')
     montage_s.inputs.cbar_name = cbar_name
     montage_s.inputs.png_name = png_name + '_s.png'
+    montage_s.inputs.num_procs = num_procs
+    set_node_resources(montage_s, n_procs=num_procs)
 
     wf.connect(resample_u, 'new_fname', montage_s, 'underlay')
     wf.connect(resample_o, 'new_fname', montage_s, 'overlay')
@@ -0,0 +1,78 @@
+
+def make_montage_inputs(out_dir, n_overlays=3, seed=0):
+    # an anatomical brain and non-negative measure maps on it
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(seed)
+
+    shape = (20, 24, 18)
+    x, y, z = np.meshgrid(*[np.linspace(-1, 1, n) for n in shape],
+                          indexing='ij')
+    brain = (x ** 2 + y ** 2 + z ** 2) < 0.8
+
+    underlay = os.path.join(out_dir, 'anatomical_brain.nii.gz')
+    nb.Nifti1Image((brain * (500 + 100 * x)).astype(np.float32),
+                   np.eye(4)).to_filename(underlay)
+
+    overlays = []
+    for i in range(n_overlays):
+        overlay = os.path.join(out_dir, 'alff_%d.nii.gz' % i)
+        data = brain * np.random.rand(*shape) * (i + 1)
+        nb.Nifti1Image(data.astype(np.float32), np.eye(4)).to_filename(
+            overlay)
+        overlays.append(overlay)
+
+    return underlay, overlays
+
+
+def test_render_montages():
+    from CPAC.qc.utils import render_montages, make_montage, \
+        register_pallete
+    import os
+    import tempfile
+    import CPAC
+    import matplotlib.image as mpimg
+    import numpy as np
+
+    register_pallete(os.path.join(CPAC.__path__[0], 'qc', 'red_to_blue.py'),
+                     'red_to_blue')
+
+    underlay, overlays = make_montage_inputs(tempfile.mkdtemp())
+
+    cwd = os.getcwd()
+    try:
+        for direction in ['axial', 'sagittal']:
+            png_names = ['alff_%d_%s.png' % (i, direction[0])
+                         for i in range(len(overlays))]
+
+            serial_dir = tempfile.mkdtemp()
+            os.chdir(serial_dir)
+            serial_pngs = [make_montage(overlay, underlay, png_name,
+                                        'red_to_blue', direction)
+                           for overlay, png_name in zip(overlays, png_names)]
+
+            parallel_dir = tempfile.mkdtemp()
+            os.chdir(parallel_dir)
+            parallel_pngs = render_montages(overlays, underlay, png_names,
+                                            'red_to_blue', direction,
+                                            num_procs=2)
+
+            # in the order of the overlays, in the working directory
+            assert parallel_pngs == [os.path.join(parallel_dir, png_name)
+                                     for png_name in png_names]
+
+            for serial_png, parallel_png in zip(serial_pngs, parallel_pngs):
+                assert os.path.basename(serial_png) == \
+                    os.path.basename(parallel_png)
+                serial_img = mpimg.imread(serial_png)
+                parallel_img = mpimg.imread(parallel_png)
+                assert serial_img.shape == parallel_img.shape
+                np.testing.assert_array_equal(serial_img, parallel_img)
+
+            # the montages of different overlays differ
+            assert not np.array_equal(mpimg.imread(parallel_pngs[0]),
+                                      mpimg.imread(parallel_pngs[1]))
+    finally:
+        os.chdir(cwd)
@@ -892,6 +892,7 @@ def make_page(file_, qc_montage_id_a, qc_montage_id_s, qc_plot_id,
     """
 
     import os
+    from StringIO import StringIO
     from CPAC.qc.utils import grp_pngs_by_id, add_head, add_tail, \
         feed_lines_html
 
@@ -912,9 +913,13 @@ def make_page(file_, qc_montage_id_a, qc_montage_id_s, qc_plot_id,
                                                         "QC-interface_scan"))
     html_f_name = html_f_name.replace("/qc_files_here", "")
 
-    f_html_ = open(html_f_name, 'wb')
-    f_html_0 = open(html_f_name_0, 'wb')
-    f_html_1 = open(html_f_name_1, 'wb')
+    # assemble the pages in memory, and write each of them at once
+    f_html_ = StringIO()
+    f_html_0 = StringIO()
+    f_html_1 = StringIO()
+    f_html_.name = html_f_name
+    f_html_0.name = html_f_name_0
+    f_html_1.name = html_f_name_1
 
     dict_a, dict_s, dict_hist, dict_plot, all_ids = \
         grp_pngs_by_id(pngs_, qc_montage_id_a, qc_montage_id_s, qc_plot_id,
@@ -931,14 +936,21 @@ def make_page(file_, qc_montage_id_a, qc_montage_id_s, qc_plot_id,
 
     add_tail(f_html_, f_html_0, f_html_1)
 
-    f_html_.close()
-    f_html_0.close()
-    f_html_1.close()
+    for f_html in (f_html_, f_html_0, f_html_1):
+        with open(f_html.name, 'wb') as f:
+            f.write(f_html.getvalue())
+        f_html.close()
+
+
+def make_page_job(args):
+    """Calls make_page with a tuple of arguments, in a worker process."""
+    return make_page(*args)
 
     
-def make_qc_pages(qc_path, qc_montage_id_a, qc_montage_id_s, qc_plot_id, qc_hist_id):
+def make_qc_pages(qc_path, qc_montage_id_a, qc_montage_id_s, qc_plot_id,
+                  qc_hist_id, num_procs=1):
     """Generates a QC HTML file for each text file in the 'qc_files_here'
-    folder in the CPAC output directory.
+    folder in the CPAC output directory, in a pool of processes.
 
     Parameters
     ----------
@@ -961,6 +973,8 @@ def make_qc_pages(qc_path, qc_montage_id_a, qc_montage_id_s, qc_plot_id, qc_hist
           dictionary of histogram pngs key : id no
           value is list of png types
 
+    num_procs : integer
+          number of processes generating the pages
 
     Returns
     -------
@@ -968,19 +982,30 @@ def make_qc_pages(qc_path, qc_montage_id_a, qc_montage_id_s, qc_plot_id, qc_hist
 
     """
     import os
-    from CPAC.qc.utils import make_page
+    from multiprocessing import Pool
+    from CPAC.qc.utils import make_page_job
 
     qc_files = os.listdir(qc_path)
 
-    for file_ in qc_files:
-        if not (file_.endswith('.txt')):
-            continue
-        make_page(os.path.join(qc_path, file_), qc_montage_id_a,
-                  qc_montage_id_s, qc_plot_id, qc_hist_id)
+    jobs = [(os.path.join(qc_path, file_), qc_montage_id_a, qc_montage_id_s,
+             qc_plot_id, qc_hist_id)
+            for file_ in qc_files if file_.endswith('.txt')]
+
+    num_procs = min(int(num_procs or 1), len(jobs))
+    if num_procs > 1:
+        pool = Pool(num_procs)
+        try:
+            pool.map(make_page_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            make_page_job(job)
 
 
 def generateQCPages(qc_path, qc_montage_id_a, qc_montage_id_s, qc_plot_id,
-                    qc_hist_id):
+                    qc_hist_id, num_procs=1):
     """Generates the QC HTML files populated with the QC images that were
     created during the CPAC pipeline run.
 
@@ -1007,6 +1032,9 @@ def generateQCPages(qc_path, qc_montage_id_a, qc_montage_id_s, qc_plot_id,
           dictionary of histogram pngs key : id no
           value is list of png types
 
+    num_procs : integer
+          number of processes generating the pages
+
     Returns
     -------
     None
@@ -1025,7 +1053,7 @@ def generateQCPages(qc_path, qc_montage_id_a, qc_montage_id_s, qc_plot_id,
     second_pass_organizing_files(qc_path)
 
     make_qc_pages(qc_path, qc_montage_id_a, qc_montage_id_s, qc_plot_id,
-                  qc_hist_id)
+                  qc_hist_id, num_procs)
 
 
 def afni_edge(in_file):
@@ -1673,15 +1701,15 @@ def determine_start_and_end(data, direction, percent):
     return start, end
 
 
-def montage_axial(overlay, underlay, png_name, cbar_name):
+def montage_axial(overlay, underlay, png_name, cbar_name, num_procs=1):
     """Draws Montage using overlay on Anatomical brain in Axial Direction,
     calls make_montage_axial.
 
     Parameters
     ----------
 
-    overlay : string
-            Nifi file
+    overlay : string or list of strings
+            Nifi file, or list of them
 
     underlay : string
             Nifti for Anatomical Brain
@@ -1692,6 +1720,9 @@ def montage_axial(overlay, underlay, png_name, cbar_name):
     png_name : string
             Proposed name of the montage plot
 
+    num_procs : integer
+            number of processes rendering a list of overlays
+
     Returns
     -------
 
@@ -1701,11 +1732,12 @@ def montage_axial(overlay, underlay, png_name, cbar_name):
 
     pngs = None
     if isinstance(overlay, list):
-        pngs = []
+        png_names = []
         for ov in overlay:
             fname = os.path.basename(os.path.splitext(os.path.splitext(ov)[0])[0])
-            pngs.append(make_montage_axial(ov, underlay,
-                                           fname + '_' + png_name, cbar_name))
+            png_names.append(fname + '_' + png_name)
+        pngs = render_montages(overlay, underlay, png_names, cbar_name,
+                               'axial', num_procs)
     else:
         pngs = make_montage_axial(overlay, underlay, png_name, cbar_name)
 
@@ -1739,121 +1771,60 @@ def make_montage_axial(overlay, underlay, png_name, cbar_name):
     png_name : Path to generated PNG
 
     """
-    import os
-    import matplotlib
-    matplotlib.rcParams.update({'font.size': 5})
-    import matplotlib.cm as cm
-    try:
-        from mpl_toolkits.axes_grid1 import ImageGrid   
-    except:
-        from mpl_toolkits.axes_grid import ImageGrid
-    import matplotlib.pyplot as plt
-    import nibabel as nb
-    import numpy as np
-    from CPAC.qc.utils import determine_start_and_end, get_spacing
+    from CPAC.qc.utils import make_montage
 
-    Y = nb.load(underlay).get_data()
-    X = nb.load(overlay).get_data()
-    X = X.astype(np.float32)
-    Y = Y.astype(np.float32)
+    return make_montage(overlay, underlay, png_name, cbar_name, 'axial')
 
-    if 'skull_vis' in png_name:
-        X[X < 20.0] = 0.0
-    if 'skull_vis' in png_name or \
-            't1_edge_on_mean_func_in_t1' in png_name or \
-                'MNI_edge_on_mean_func_mni' in png_name:
-        max_ = np.nanmax(np.abs(X.flatten()))
-        X[X != 0.0] = max_
 
-    z1, z2 = determine_start_and_end(Y, 'axial', 0.0001)
-    spacing = get_spacing(6, 3, z2 - z1)
-    x, y, z = Y.shape
-    fig = plt.figure(1)
-    max_ = np.max(np.abs(Y))
+def montage_sagittal(overlay, underlay, png_name, cbar_name, num_procs=1):
+    """
+    Draws Montage using overlay on Anatomical brain in Sagittal Direction
+    calls make_montage_sagittal
 
-    if ('snr' in png_name) or ('reho' in png_name) or \
-            ('vmhc' in png_name) or ('sca_' in png_name) or \
-            ('alff' in png_name) or ('centrality' in png_name) or \
-            ('dr_tempreg' in png_name):
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                         aspect=True, cbar_mode="single", cbar_pad=0.2,
-                         direction="row")
-    else:
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                         aspect=True, direction="row")
+    Parameters
+    ----------
 
-    zz = z1
-    for i in range(6*3):
-        if zz >= z2:
-            break
-        try:
-            im = grid[i].imshow(np.rot90(Y[:, :, zz]), cmap=cm.Greys_r)
-        except IndexError as e:
-            # TODO: send this to the logger instead
-            print("\n[!] QC Interface: Had a problem with creating the "
-                  "axial montage for {0}\n\nDetails:{1}"
-                  "\n".format(png_name, e))
-            pass
-        zz += spacing
+    overlay : string or list of strings
+            Nifi file, or list of them
 
-    x, y, z = X.shape
-    X[X == 0.0] = np.nan
-    max_ = np.nanmax(np.abs(X.flatten()))
+    underlay : string
+            Nifti for Anatomical Brain
 
-    zz = z1
-    im = None
-    for i in range(6*3):
-        if zz >= z2:
-            break
+    cbar_name : string
+            name of the cbar 
 
-        try:
-            if cbar_name is 'red_to_blue':
-                im = grid[i].imshow(np.rot90(X[:, :, zz]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=0, vmax=max_)
-            elif cbar_name is 'green':
-                im = grid[i].imshow(np.rot90(X[:, :, zz]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=0, vmax=max_)
-            else:
-                im = grid[i].imshow(np.rot90(X[:, :, zz]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=- max_, vmax=max_)
-        except IndexError as e:
-            # TODO: send this to the logger instead
-            print("\n[!] QC Interface: Had a problem with creating the "
-                  "axial montage for {0}\n\nDetails:{1}"
-                  "\n".format(png_name, e))
-            pass
+    png_name : string
+            Proposed name of the montage plot
 
-        grid[i].axes.get_xaxis().set_visible(False)
-        grid[i].axes.get_yaxis().set_visible(False)
-        zz += spacing
+    num_procs : integer
+            number of processes rendering a list of overlays
 
-    cbar = grid.cbar_axes[0].colorbar(im)
+    Returns
+    -------
 
-    if 'snr' in png_name:
-        cbar.ax.set_yticks(drange(0, max_))
+    png_name : Path to generated PNG
 
-    elif ('reho' in png_name) or ('vmhc' in png_name) or \
-            ('sca_' in png_name) or ('alff' in png_name) or \
-            ('centrality' in png_name) or ('dr_tempreg' in png_name):
-        cbar.ax.set_yticks(drange(-max_, max_))
+    """
 
-    plt.axis("off")
-    png_name = os.path.join(os.getcwd(), png_name)
-    plt.savefig(png_name, dpi=200, bbox_inches='tight')
-    plt.close()
+    pngs = None
 
-    matplotlib.rcdefaults()
+    if isinstance(overlay, list):
+        png_names = []
+        for ov in overlay:
+            fname = os.path.basename(os.path.splitext(os.path.splitext(ov)[0])[0])
+            png_names.append(fname + '_' + png_name)
+        pngs = render_montages(overlay, underlay, png_names, cbar_name,
+                               'sagittal', num_procs)
+    else:
+        pngs = make_montage_sagittal(overlay, underlay, png_name, cbar_name)
+    png_name = pngs
 
     return png_name
 
 
-def montage_sagittal(overlay, underlay, png_name, cbar_name):
+def make_montage_sagittal(overlay, underlay, png_name, cbar_name):
     """
     Draws Montage using overlay on Anatomical brain in Sagittal Direction
-    calls make_montage_sagittal
 
     Parameters
     ----------
@@ -1876,24 +1847,66 @@ def montage_sagittal(overlay, underlay, png_name, cbar_name):
     png_name : Path to generated PNG
 
     """
+    from CPAC.qc.utils import make_montage
 
-    pngs = None
+    return make_montage(overlay, underlay, png_name, cbar_name, 'sagittal')
 
-    if isinstance(overlay, list):
-        pngs = []
-        for ov in overlay:
-            fname = os.path.basename(os.path.splitext(os.path.splitext(ov)[0])[0])
-            pngs.append(make_montage_sagittal(ov, underlay, fname + '_' + png_name, cbar_name))
-    else:
-        pngs = make_montage_sagittal(overlay, underlay, png_name, cbar_name)
-    png_name = pngs
 
-    return png_name
+# Underlays loaded by this process, keyed by path, modification time and size
+underlay_cache = {}
 
 
-def make_montage_sagittal(overlay, underlay, png_name, cbar_name):
+def load_underlay(underlay):
     """
-    Draws Montage using overlay on Anatomical brain in Sagittal Direction
+    Loads the underlay of the montages, once per process, with its first
+    and last slices in both directions
+
+    Parameters
+    ----------
+
+    underlay : string
+            Nifti for Anatomical Brain
+
+    Returns
+    -------
+
+    data : ndarray
+            read-only float32 data of the underlay
+
+    axial : tuple
+            first and last axial slices
+
+    sagittal : tuple
+            first and last sagittal slices
+
+    """
+    import nibabel as nb
+
+    key = (os.path.realpath(underlay), os.path.getmtime(underlay),
+           os.path.getsize(underlay))
+
+    if key not in underlay_cache:
+        # the montages of a participant share one or two underlays
+        if len(underlay_cache) >= 4:
+            underlay_cache.clear()
+
+        data = nb.load(underlay).get_data().astype(np.float32)
+        data.flags.writeable = False
+        underlay_cache[key] = (data,
+                               determine_start_and_end(data, 'axial',
+                                                       0.0001),
+                               determine_start_and_end(data, 'sagittal',
+                                                       0.0001))
+
+    return underlay_cache[key]
+
+
+def make_montage(overlay, underlay, png_name, cbar_name, direction):
+    """
+    Draws Montage using overlay on Anatomical brain
+
+    The figure is drawn with the object-oriented interface of matplotlib,
+    on its own Agg canvas, so that montages can be drawn concurrently.
 
     Parameters
     ----------
@@ -1904,11 +1917,14 @@ def make_montage_sagittal(overlay, underlay, png_name, cbar_name):
     underlay : string
             Nifti for Anatomical Brain
 
+    png_name : string
+            Proposed name of the montage plot
+
     cbar_name : string
             name of the cbar 
 
-    png_name : string
-            Proposed name of the montage plot
+    direction : string
+            'axial' or 'sagittal'
 
     Returns
     -------
@@ -1916,23 +1932,22 @@ def make_montage_sagittal(overlay, underlay, png_name, cbar_name):
     png_name : Path to generated PNG
 
     """
-    from CPAC.qc.utils import determine_start_and_end, get_spacing
-    import matplotlib
     import os
-    import numpy as np
-    matplotlib.rcParams.update({'font.size': 5})
+    import matplotlib
+    import matplotlib.cm as cm
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
     try:
-        from mpl_toolkits.axes_grid1 import ImageGrid   
+        from mpl_toolkits.axes_grid1 import ImageGrid
     except:
         from mpl_toolkits.axes_grid import ImageGrid
-    import matplotlib.cm as cm
-    import matplotlib.pyplot as plt
     import nibabel as nb
+    import numpy as np
+    from CPAC.qc.utils import load_underlay, get_spacing, drange
 
-    Y = nb.load(underlay).get_data()
+    Y, axial, sagittal = load_underlay(underlay)
     X = nb.load(overlay).get_data()
     X = X.astype(np.float32)
-    Y = Y.astype(np.float32)
 
     if 'skull_vis' in png_name:
         X[X < 20.0] = 0.0
@@ -1942,90 +1957,147 @@ def make_montage_sagittal(overlay, underlay, png_name, cbar_name):
         max_ = np.nanmax(np.abs(X.flatten()))
         X[X != 0.0] = max_
 
-    x1, x2 = determine_start_and_end(Y, 'sagittal', 0.0001)
-    spacing = get_spacing(6, 3, x2 - x1)
-    x, y, z = Y.shape
-    fig = plt.figure(1)
-    max_ = np.max(np.abs(Y))
-
-    if ('snr' in png_name) or ('reho' in png_name) or \
-            ('vmhc' in png_name) or ('sca_' in png_name) or \
-            ('alff' in png_name) or ('centrality' in png_name) or \
-            ('dr_tempreg' in png_name):
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                         aspect=True, cbar_mode="single", cbar_pad=0.5,
-                         direction="row")
+    if direction == 'axial':
+        start, end = axial
+        get_slice = lambda data, idx: data[:, :, idx]
+        cbar_pad = 0.2
     else:
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                         aspect=True, cbar_mode="None", direction="row")
+        start, end = sagittal
+        get_slice = lambda data, idx: data[idx, :, :]
+        cbar_pad = 0.5
 
-    xx = x1
-    for i in range(6*3):
-        if xx >= x2:
-            break
+    spacing = get_spacing(6, 3, end - start)
 
-        try:
-            im = grid[i].imshow(np.rot90(Y[xx, :, :]), cmap=cm.Greys_r)
-        except IndexError as e:
-            # TODO: send this to the logger instead
-            print("\n[!] QC Interface: Had a problem with creating the "
-                  "sagittal montage for {0}\n\nDetails:{1}"
-                  "\n".format(png_name, e))
-            pass
-
-        grid[i].get_xaxis().set_visible(False)
-        grid[i].get_yaxis().set_visible(False)
-        xx += spacing
-
-    x, y, z = X.shape
     X[X == 0.0] = np.nan
     max_ = np.nanmax(np.abs(X.flatten()))
-    xx = x1
-    for i in range(6*3):
-        if xx >= x2:
-            break
+
+    # the red_to_blue and green overlays are non-negative measures, their
+    # colour range starts at zero
+    if cbar_name in ('red_to_blue', 'green'):
+        vmin = 0
+    else:
+        vmin = - max_
+
+    measure_map = ('snr' in png_name) or ('reho' in png_name) or \
+        ('vmhc' in png_name) or ('sca_' in png_name) or \
+        ('alff' in png_name) or ('centrality' in png_name) or \
+        ('dr_tempreg' in png_name)
+
+    with matplotlib.rc_context({'font.size': 5}):
+
+        fig = Figure()
+        FigureCanvasAgg(fig)
+
+        if measure_map:
+            grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
+                             aspect=True, cbar_mode="single",
+                             cbar_pad=cbar_pad, direction="row")
+        else:
+            grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
+                             aspect=True, direction="row")
+
+        idx = start
         im = None
+        for i in range(6*3):
+            if idx >= end:
+                break
 
-        try:
-            if cbar_name is 'red_to_blue':
-                im = grid[i].imshow(np.rot90(X[xx, :, :]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=0, vmax=max_)
-            elif cbar_name is 'green':
-                im = grid[i].imshow(np.rot90(X[xx, :, :]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=0, vmax=max_)
-            else:
-                im = grid[i].imshow(np.rot90(X[xx, :, :]),
+            try:
+                grid[i].imshow(np.rot90(get_slice(Y, idx)), cmap=cm.Greys_r)
+                im = grid[i].imshow(np.rot90(get_slice(X, idx)),
                                     cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=- max_, vmax=max_)
-        except IndexError as e:
-            # TODO: send this to the logger instead
-            print("\n[!] QC Interface: Had a problem with creating the "
-                  "sagittal montage for {0}\n\nDetails:{1}"
-                  "\n".format(png_name, e))
-            pass
+                                    vmin=vmin, vmax=max_)
+            except IndexError as e:
+                # TODO: send this to the logger instead
+                print("\n[!] QC Interface: Had a problem with creating the "
+                      "{0} montage for {1}\n\nDetails:{2}"
+                      "\n".format(direction, png_name, e))
+                pass
 
-        xx += spacing
+            grid[i].axes.get_xaxis().set_visible(False)
+            grid[i].axes.get_yaxis().set_visible(False)
+            idx += spacing
 
-    cbar = grid.cbar_axes[0].colorbar(im)
+        cbar = grid.cbar_axes[0].colorbar(im)
 
-    if 'snr' in png_name:
-        cbar.ax.set_yticks(drange(0, max_))
-    elif ('reho' in png_name) or ('vmhc' in png_name) or \
-            ('sca_' in png_name) or ('alff' in png_name) or \
-            ('centrality' in png_name) or ('dr_tempreg' in png_name):
-        cbar.ax.set_yticks(drange(-max_, max_))
+        if 'snr' in png_name:
+            cbar.ax.set_yticks(drange(0, max_))
+        elif measure_map:
+            cbar.ax.set_yticks(drange(-max_, max_))
 
-    plt.axis("off")
-    png_name = os.path.join(os.getcwd(), png_name)
-    plt.savefig(png_name, dpi=200, bbox_inches='tight')
-    plt.close()
-    matplotlib.rcdefaults()
+        fig.gca().axis("off")
+        png_name = os.path.join(os.getcwd(), png_name)
+        fig.savefig(png_name, dpi=200, bbox_inches='tight')
 
     return png_name
 
 
+def make_montage_job(args):
+    """Calls make_montage with a tuple of arguments, in a worker process."""
+    return make_montage(*args)
+
+
+def render_montages(overlays, underlay, png_names, cbar_name, direction,
+                    num_procs=1):
+    """
+    Draws the montages of several overlays on the same Anatomical brain,
+    in a pool of processes
+
+    The underlay is loaded once, before the pool is started, and shared by
+    its processes.
+
+    Parameters
+    ----------
+
+    overlays : list of strings
+            Nifti files
+
+    underlay : string
+            Nifti for Anatomical Brain
+
+    png_names : list of strings
+            Proposed names of the montage plots
+
+    cbar_name : string
+            name of the cbar 
+
+    direction : string
+            'axial' or 'sagittal'
+
+    num_procs : integer
+            number of processes drawing the montages
+
+    Returns
+    -------
+
+    png_names : list of paths to generated PNGs
+
+    """
+    from multiprocessing import Pool
+
+    jobs = [(overlay, underlay, png_name, cbar_name, direction)
+            for overlay, png_name in zip(overlays, png_names)]
+
+    load_underlay(underlay)
+
+    num_procs = min(int(num_procs or 1), len(jobs))
+    if num_procs > 1:
+        try:
+            pool = Pool(num_procs)
+        except (AssertionError, OSError):
+            # within a daemonic worker, which can not have children
+            pool = None
+
+        if pool is not None:
+            try:
+                return pool.map(make_montage_job, jobs)
+            finally:
+                pool.close()
+                pool.join()
+
+    return [make_montage_job(job) for job in jobs]
+
+
 def montage_gm_wm_csf_axial(overlay_csf, overlay_wm, overlay_gm, underlay, png_name):
 
     """
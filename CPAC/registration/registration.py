@@ -3,6 +3,8 @@ import nipype.interfaces.utility as util
 import nipype.interfaces.fsl as fsl
 import nipype.interfaces.c3 as c3
 
+from CPAC.utils.utils import set_node_resources
+
 
 def create_nonlinear_register(name='nonlinear_register'):
     """
@@ -636,7 +638,10 @@ def create_wf_calculate_ants_warp(name='create_wf_calculate_ants_warp', mult_inp
                                         function=hardcoded_reg,
                                         imports=reg_imports),
                 name='calc_ants_warp')
-    calculate_ants_warp.interface.num_threads = num_threads
+
+    # antsRegistration runs its SyN stage on the full-resolution template
+    # with num_threads ITK threads
+    set_node_resources(calculate_ants_warp, mem_gb=3.0, n_procs=num_threads)
 
     select_forward_initial = pe.Node(util.Function(input_names=['warp_list',
             'selection'], output_names=['selected_warp'],
@@ -911,8 +916,7 @@ def create_wf_apply_ants_warp(map_node=False,
                                   name='apply_ants_warp')
 
     apply_ants_warp.inputs.out_postfix = '_antswarp'
-    apply_ants_warp.interface.num_threads = ants_threads
-    apply_ants_warp.interface.estimated_memory_gb = 1.5
+    set_node_resources(apply_ants_warp, mem_gb=1.5, n_procs=ants_threads)
 
     outputspec = pe.Node(util.IdentityInterface(fields=['output_image']),
                          name='outputspec')
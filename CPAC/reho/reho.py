@@ -92,7 +92,10 @@ def create_reho():
 
     reho_imports = ['import os', 'import sys', 'import nibabel as nb',
                     'import numpy as np',
-                    'from CPAC.reho.utils import f_kendall']
+                    'from CPAC.reho.utils import f_kendall',
+                    'from CPAC.utils import save_nifti',
+                    'from CPAC.utils.instrumentation import StageTimer',
+                    'from CPAC.utils.result_cache import ResultCache']
     raw_reho_map = pe.Node(util.Function(input_names=['in_file', 'mask_file',
                                                       'cluster_size'],
                                          output_names=['out_file'],
@@ -96,6 +96,16 @@ def compute_reho(in_file, mask_file, cluster_size):
 
     """
 
+    # reuse the ReHo map of identical inputs, if the result cache is enabled
+    cache = ResultCache('CPAC.reho.utils.compute_reho', in_file=in_file,
+                        mask_file=mask_file, cluster_size=cluster_size)
+    out_file = cache.fetch()
+    if out_file is not None:
+        return out_file
+
+    stages = StageTimer()
+    stages.start('load')
+
     out_file = None
 
     res_fname = (in_file)
@@ -120,6 +130,8 @@ def compute_reho(in_file, mask_file, cluster_size):
     # x,y,z - produces (timepoints, N voxels) shaped data array
     res_data = np.reshape(res_data, (n_x*n_y*n_z, n_t), order='F').T
 
+    stages.start('rank')
+
     # create a blank array of zeroes of size n_voxels, one for each time point
     Ranks_res_data = np.tile((np.zeros((1, (res_data.shape)[1]))),
                              [(res_data.shape)[0], 1])
@@ -218,6 +230,8 @@ def compute_reho(in_file, mask_file, cluster_size):
 
     Ranks_res_data = np.reshape(Ranks_res_data, (n_t, n_x, n_y, n_z), order='F')
 
+    stages.start('kendall')
+
     K = np.zeros((n_x, n_y, n_z))
 
     mask_cluster = np.ones((3, 3, 3))
@@ -273,11 +287,14 @@ def compute_reho(in_file, mask_file, cluster_size):
 
                     K[i, j, k] = f_kendall(mask_R_block)
 
+    stages.start('write')
+
     img = nb.Nifti1Image(K, header=res_img.get_header(),
                          affine=res_img.get_affine())
-    reho_file = os.path.join(os.getcwd(), 'ReHo.nii.gz')
-    img.to_filename(reho_file)
+    reho_file = save_nifti(img, 'ReHo')
     out_file = reho_file
 
-    return out_file
+    stages.stop()
+
+    return cache.store(out_file)
 
@@ -2,11 +2,14 @@ from sca import create_sca
 from sca import create_temporal_reg
 
 from utils import compute_fisher_z_score
-from utils import check_ts, map_to_roi
+from utils import check_ts, map_to_roi, calc_temporal_regression
+from utils import calc_sca
 
 # List all functions
 __all__ = ['create_sca', \
            'compute_fisher_z_score', \
            'create_temporal_reg', \
            'check_ts', \
-           'map_to_roi']
+           'map_to_roi', \
+           'calc_temporal_regression', \
+           'calc_sca']
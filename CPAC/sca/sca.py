@@ -61,8 +61,8 @@ def create_sca(name_sca='sca'):
     SCA Workflow Procedure:
 
     1. Compute pearson correlation between input timeseries 1D file and input functional file
-       Use 3dTcorr1D to compute that. Input timeseries can be a 1D file containing parcellation ROI's
-       or a 3D mask
+       with a single matrix product for all the timeseries (see calc_sca). Input timeseries can be
+       a 1D file containing parcellation ROI's or a 3D mask
 
     2. Compute Fisher Z score of the correlation computed in step above. If a mask is provided then a 
        a single Z score file is returned, otherwise z-scores for all ROIs are returned as a list of 
@@ -91,8 +91,6 @@ def create_sca(name_sca='sca'):
 
     """
 
-    from CPAC.utils.utils import get_roi_num_list
-
     sca = pe.Workflow(name=name_sca)
     inputNode = pe.Node(util.IdentityInterface(fields=['timeseries_one_d',
                                                 'functional_file',
@@ -107,56 +105,24 @@ def create_sca(name_sca='sca'):
                         name='outputspec')
 
     # 2. Compute voxel-wise correlation with Seed Timeseries
-    corr = pe.Node(interface=preprocess.TCorr1D(),
-                      name='3dTCorr1D')
-    corr.inputs.pearson = True
-    corr.inputs.outputtype = 'NIFTI_GZ'
+    corr = pe.Node(util.Function(input_names=['functional_file',
+                                              'timeseries_one_d',
+                                              'fisher_z'],
+                                 output_names=['correlation_stack',
+                                               'correlation_files'],
+                                 function=calc_sca),
+                   name='sca_correlation')
+    corr.inputs.fisher_z = False
 
     sca.connect(inputNode, 'timeseries_one_d',
-                corr, 'y_1d')
+                corr, 'timeseries_one_d')
     sca.connect(inputNode, 'functional_file',
-                corr, 'xset')
-
-    # Transform the sub-bricks into volumes
-    try:
-        concat = pe.Node(interface=preprocess.TCat(), name='3dTCat')
-    except AttributeError:
-        from nipype.interfaces.afni import utils as afni_utils
-        concat = pe.Node(interface=afni_utils.TCat(), name='3dTCat')
-
-    concat.inputs.outputtype = 'NIFTI_GZ'
-
-    # also write out volumes as individual files
-    split = pe.Node(interface=fsl.Split(), name='split_raw_volumes_sca')
-    split.inputs.dimension = 't'
-    split.inputs.out_base_name = 'sca_'
-
-    get_roi_num_list = pe.Node(util.Function(input_names=['timeseries_file',
-                                                          'prefix'],
-                                             output_names=['roi_list'],
-                                             function=get_roi_num_list),
-                               name='get_roi_num_list')
-    get_roi_num_list.inputs.prefix = "sca"
-
-    rename_rois = pe.MapNode(interface=util.Rename(), name='output_rois',
-                             iterfield=['in_file', 'format_string'])
-    rename_rois.inputs.keep_ext = True
+                corr, 'functional_file')
 
-    sca.connect(corr, 'out_file', concat, 'in_files')
-
-    sca.connect(concat, 'out_file', split, 'in_file')
-
-    sca.connect(concat, 'out_file',
+    sca.connect(corr, 'correlation_stack',
                 outputNode, 'correlation_stack')
 
-    sca.connect(inputNode, 'timeseries_one_d', get_roi_num_list,
-                'timeseries_file')
-
-    sca.connect(split, 'out_files', rename_rois, 'in_file')
-
-    sca.connect(get_roi_num_list, 'roi_list', rename_rois, 'format_string')
-
-    sca.connect(rename_rois, 'out_file', outputNode,
+    sca.connect(corr, 'correlation_files', outputNode,
                 'correlation_files')
 
     return sca
@@ -288,91 +254,32 @@ def create_temporal_reg(wflow_name='temporal_reg', which='SR'):
     wflow.connect(inputNode, 'subject_timeseries',
                   check_timeseries, 'in_file')
 
-    temporalReg = pe.Node(interface=fsl.GLM(), name='temporal_regression')
-    temporalReg.inputs.out_file = 'temp_reg_map.nii.gz'
-    temporalReg.inputs.out_z_name = 'temp_reg_map_z.nii.gz'
-
-    wflow.connect(inputNode, 'subject_rest', temporalReg, 'in_file')
-    wflow.connect(check_timeseries, 'out_file', temporalReg, 'design')
+    temporalReg = pe.Node(util.Function(input_names=['subject_rest',
+                                                     'subject_timeseries',
+                                                     'subject_mask',
+                                                     'demean',
+                                                     'normalize',
+                                                     'roi_labels'],
+                                        output_names=['temp_reg_map',
+                                                      'temp_reg_map_files',
+                                                      'temp_reg_map_z',
+                                                      'temp_reg_map_z_files'],
+                                        function=calc_temporal_regression),
+                          name='temporal_regression')
+    temporalReg.inputs.roi_labels = (which == 'RT')
+
+    wflow.connect(inputNode, 'subject_rest', temporalReg, 'subject_rest')
+    wflow.connect(check_timeseries, 'out_file',
+                  temporalReg, 'subject_timeseries')
     wflow.connect(inputNode, 'demean', temporalReg, 'demean')
-    wflow.connect(inputNode, 'normalize', temporalReg, 'des_norm')
-    wflow.connect(inputNode, 'subject_mask', temporalReg, 'mask')
-
-    wflow.connect(temporalReg, 'out_file', outputNode, 'temp_reg_map')
-    wflow.connect(temporalReg, 'out_z', outputNode, 'temp_reg_map_z')
-
-    split = pe.Node(interface=fsl.Split(), name='split_raw_volumes')
-    split.inputs.dimension = 't'
-    split.inputs.out_base_name = 'temp_reg_map_'
-
-    wflow.connect(temporalReg, 'out_file', split, 'in_file')
-
-    split_zstat = pe.Node(interface=fsl.Split(), name='split_zstat_volumes')
-    split_zstat.inputs.dimension = 't'
-    split_zstat.inputs.out_base_name = 'temp_reg_map_z_'
-
-    wflow.connect(temporalReg, 'out_z',
-                  split_zstat, 'in_file')
-
-    if which == 'SR':
-        wflow.connect(split, 'out_files',
-                      outputNode, 'temp_reg_map_files')
-        wflow.connect(split_zstat, 'out_files',
-                      outputNode, 'temp_reg_map_z_files')
-
-    elif which == 'RT':
-        map_roi_imports = ['import os', 'import numpy as np']
-
-        # get roi order and send to output node for raw outputs
-        get_roi_order = pe.Node(util.Function(input_names=['maps',
-                                                           'timeseries'],
-                                              output_names=['labels',
-                                                            'maps'],
-                                              function=map_to_roi,
-                                              imports=map_roi_imports),
-                                name='get_roi_order')
-
-        wflow.connect(split, 'out_files', get_roi_order, 'maps')
-
-        wflow.connect(inputNode, 'subject_timeseries',
-                      get_roi_order, 'timeseries')
-
-        rename_maps = pe.MapNode(interface=util.Rename(),
-                                 name='rename_maps',
-                                 iterfield=['in_file',
-                                            'format_string'])
-        rename_maps.inputs.keep_ext = True
-
-        wflow.connect(get_roi_order, 'labels', rename_maps, 'format_string')
-        wflow.connect(get_roi_order, 'maps', rename_maps, 'in_file')
-        wflow.connect(rename_maps, 'out_file',
-                      outputNode, 'temp_reg_map_files')
-
-        # get roi order and send to output node for z-stat outputs
-        get_roi_order_zstat = pe.Node(util.Function(input_names=['maps',
-                                                           'timeseries'],
-                                                    output_names=['labels',
-                                                                  'maps'],
-                                                    function=map_to_roi,
-                                                    imports=map_roi_imports),
-                                      name='get_roi_order_zstat')
-
-        wflow.connect(split_zstat, 'out_files', get_roi_order_zstat, 'maps')
-        wflow.connect(inputNode, 'subject_timeseries',
-                      get_roi_order_zstat, 'timeseries')
-
-        rename_maps_zstat = pe.MapNode(interface=util.Rename(),
-                                       name='rename_maps_zstat',
-                                       iterfield=['in_file',
-                                                  'format_string'])
-        rename_maps_zstat.inputs.keep_ext = True
-
-        wflow.connect(get_roi_order_zstat, 'labels',
-                      rename_maps_zstat, 'format_string')
-        wflow.connect(get_roi_order_zstat, 'maps',
-                      rename_maps_zstat, 'in_file')
-
-        wflow.connect(rename_maps_zstat, 'out_file',
-                      outputNode, 'temp_reg_map_z_files')
+    wflow.connect(inputNode, 'normalize', temporalReg, 'normalize')
+    wflow.connect(inputNode, 'subject_mask', temporalReg, 'subject_mask')
+
+    wflow.connect(temporalReg, 'temp_reg_map', outputNode, 'temp_reg_map')
+    wflow.connect(temporalReg, 'temp_reg_map_files',
+                  outputNode, 'temp_reg_map_files')
+    wflow.connect(temporalReg, 'temp_reg_map_z', outputNode, 'temp_reg_map_z')
+    wflow.connect(temporalReg, 'temp_reg_map_z_files',
+                  outputNode, 'temp_reg_map_z_files')
 
     return wflow
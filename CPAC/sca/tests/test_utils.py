@@ -0,0 +1,235 @@
+
+def make_functional(out_dir, n_vols=30, seed=0):
+    # a functional image, its mask and seed timeseries with the 3dROIstats
+    # labels in the header
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(seed)
+
+    shape = (5, 4, 3)
+    seeds = np.random.randn(n_vols, 2)
+    weights = np.random.randn(*shape + (2,))
+    data = 100 + np.einsum('xyzk,tk->xyzt', weights, seeds) + \
+        np.random.randn(*shape + (n_vols,))
+
+    mask_data = np.ones(shape, dtype=np.uint8)
+    mask_data[0, 0, :] = 0
+
+    func_file = os.path.join(out_dir, 'rest.nii.gz')
+    nb.Nifti1Image(data.astype(np.float32), np.eye(4)).to_filename(func_file)
+
+    mask_file = os.path.join(out_dir, 'mask.nii.gz')
+    nb.Nifti1Image(mask_data, np.eye(4)).to_filename(mask_file)
+
+    ts_file = os.path.join(out_dir, 'roi_timeseries.1D')
+    np.savetxt(ts_file, seeds, fmt='%.8f', delimiter='\t',
+               header='File\tSub-brick\tMean_3\tMean_11')
+
+    return func_file, mask_file, ts_file, data.astype(np.float32), \
+        mask_data.astype(bool), seeds
+
+
+def test_calc_temporal_regression():
+    from CPAC.sca import calc_temporal_regression
+    from CPAC.utils.tests.test_utils import glm_reference
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    out_dir = tempfile.mkdtemp()
+    func_file, mask_file, ts_file, data, mask, seeds = \
+        make_functional(out_dir)
+    seeds = np.loadtxt(ts_file)
+
+    cwd = os.getcwd()
+    try:
+        for demean, normalize in [(True, True), (True, False),
+                                  (False, True)]:
+            os.chdir(tempfile.mkdtemp())
+
+            temp_reg_map, temp_reg_map_files, temp_reg_map_z, \
+                temp_reg_map_z_files = \
+                calc_temporal_regression(func_file, ts_file, mask_file,
+                                         demean, normalize)
+
+            expected_beta, expected_z = \
+                glm_reference(data[mask].T.astype(np.float64), seeds,
+                              demean, normalize)
+
+            for stat_file, stat_files, expected in \
+                    [(temp_reg_map, temp_reg_map_files, expected_beta),
+                     (temp_reg_map_z, temp_reg_map_z_files, expected_z)]:
+                stat = nb.load(stat_file).get_data()
+                assert stat.shape == mask.shape + (2,)
+                assert not stat[~mask].any()
+                np.testing.assert_allclose(stat[mask], expected.T,
+                                           rtol=1e-4, atol=1e-5)
+
+                assert len(stat_files) == 2
+                for i, map_file in enumerate(stat_files):
+                    np.testing.assert_array_equal(
+                        nb.load(map_file).get_data(), stat[..., i])
+
+            assert os.path.basename(temp_reg_map_files[0]) == \
+                'temp_reg_map_0000.nii.gz'
+            assert os.path.basename(temp_reg_map_z_files[1]) == \
+                'temp_reg_map_z_0001.nii.gz'
+    finally:
+        os.chdir(cwd)
+
+
+def test_calc_temporal_regression_roi_labels():
+    from CPAC.sca import calc_temporal_regression
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    out_dir = tempfile.mkdtemp()
+    func_file, mask_file, ts_file, _, _, _ = make_functional(out_dir)
+
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        temp_reg_map, temp_reg_map_files, temp_reg_map_z, \
+            temp_reg_map_z_files = \
+            calc_temporal_regression(func_file, ts_file, mask_file,
+                                     True, True, roi_labels=True)
+
+        # the single maps are named after the ROIs of the timeseries
+        assert temp_reg_map_files == \
+            [os.path.abspath('sca_tempreg_maps_roi_{0}.nii.gz'.format(n))
+             for n in [3, 11]]
+        assert temp_reg_map_z_files == \
+            [os.path.abspath('sca_tempreg_z_maps_roi_{0}.nii.gz'.format(n))
+             for n in [3, 11]]
+
+        for stat_file, stat_files in [(temp_reg_map, temp_reg_map_files),
+                                      (temp_reg_map_z,
+                                       temp_reg_map_z_files)]:
+            stat = nb.load(stat_file).get_data()
+            for i, map_file in enumerate(stat_files):
+                np.testing.assert_array_equal(nb.load(map_file).get_data(),
+                                              stat[..., i])
+
+        assert not [f for f in os.listdir(os.getcwd()) if '_000' in f]
+    finally:
+        os.chdir(cwd)
+
+
+def test_calc_temporal_regression_timepoints():
+    from CPAC.sca import calc_temporal_regression
+    import os
+    import tempfile
+    import numpy as np
+
+    out_dir = tempfile.mkdtemp()
+    func_file, mask_file, ts_file, _, _, seeds = make_functional(out_dir)
+
+    short_ts_file = os.path.join(out_dir, 'short_timeseries.1D')
+    np.savetxt(short_ts_file, seeds[:-1])
+
+    try:
+        calc_temporal_regression(func_file, short_ts_file, mask_file,
+                                 True, True)
+        raise AssertionError('no error raised for mismatched timepoints')
+    except Exception as e:
+        assert 'timepoints' in str(e)
+
+
+def test_calc_sca():
+    from CPAC.sca import calc_sca
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(2)
+    n_vols = 25
+
+    seeds = np.column_stack((np.random.randn(n_vols),
+                             np.sin(np.arange(n_vols) / 2.0),
+                             np.zeros(n_vols)))
+
+    data = np.random.randn(4, 3, 3, n_vols) * 5 + 100
+    data[1, 1, 1] += seeds[:, 1] * 50
+    # a constant voxel, a voxel outside the brain, a copy of a seed and a
+    # voxel anticorrelated with it
+    data[0, 0, 0] = 50
+    data[0, 0, 1] = 0
+    data[2, 2, 2] = seeds[:, 0]
+    data[3, 2, 2] = -seeds[:, 0]
+    data = data.astype(np.float32)
+
+    out_dir = tempfile.mkdtemp()
+    func_file = os.path.join(out_dir, 'rest.nii.gz')
+    nb.Nifti1Image(data, np.eye(4)).to_filename(func_file)
+
+    ts_file = os.path.join(out_dir, 'roi_timeseries.1D')
+    np.savetxt(ts_file, seeds, fmt='%.10f', delimiter='\t',
+               header='File\tSub-brick\tMean_2\tMean_5\tMean_9')
+    seeds = np.loadtxt(ts_file)
+
+    expected = np.zeros(data.shape[:3] + (3,))
+    for idx in np.ndindex(*data.shape[:3]):
+        voxel = data[idx].astype(np.float64)
+        if voxel.std() == 0:
+            continue
+        for i in range(2):
+            expected[idx + (i,)] = np.corrcoef(voxel, seeds[:, i])[0, 1]
+
+    cwd = os.getcwd()
+    try:
+        for fisher_z in [False, True]:
+            # chunks smaller than, not dividing, and larger than the brain
+            for chunk_size in [1, 7, 10000]:
+                os.chdir(tempfile.mkdtemp())
+
+                correlation_stack, correlation_files = \
+                    calc_sca(func_file, ts_file, fisher_z=fisher_z,
+                             chunk_size=chunk_size)
+
+                corr = nb.load(correlation_stack).get_data()
+                assert corr.shape == data.shape[:3] + (3,)
+                assert corr.dtype == np.float32
+                assert np.isfinite(corr).all()
+
+                # the zero seed and the constant voxels have no correlation
+                assert not corr[..., 2].any()
+                assert not corr[0, 0, 0].any()
+                assert not corr[0, 0, 1].any()
+
+                if fisher_z:
+                    # undefined for the copy of the seed, which may not be
+                    # exactly 1 after rounding
+                    assert corr[2, 2, 2, 0] == 0 or corr[2, 2, 2, 0] > 5
+                    assert corr[3, 2, 2, 0] == 0 or corr[3, 2, 2, 0] < -5
+                    valid = np.abs(expected) < 0.999
+                    np.testing.assert_allclose(corr[valid],
+                                               np.arctanh(expected[valid]),
+                                               rtol=1e-5, atol=1e-6)
+                else:
+                    np.testing.assert_allclose(corr, expected, rtol=1e-5,
+                                               atol=1e-6)
+
+                # the single maps are named after the ROIs of the seeds
+                assert correlation_files == \
+                    [os.path.abspath('sca_ROI_{0}.nii.gz'.format(n))
+                     for n in [2, 5, 9]]
+                for i, roi_file in enumerate(correlation_files):
+                    np.testing.assert_array_equal(
+                        nb.load(roi_file).get_data(), corr[..., i])
+
+        # without the 3dROIstats labels, the maps are numbered
+        plain_ts_file = os.path.join(out_dir, 'timeseries.1D')
+        np.savetxt(plain_ts_file, seeds)
+        os.chdir(tempfile.mkdtemp())
+        correlation_stack, correlation_files = calc_sca(func_file,
+                                                        plain_ts_file)
+        assert correlation_files == \
+            [os.path.abspath('sca_{0}.nii.gz'.format(i)) for i in range(3)]
+    finally:
+        os.chdir(cwd)
@@ -30,6 +30,7 @@ def compute_fisher_z_score(correlation_file, timeseries_one_d):
     import nibabel as nb
     import numpy as np
     import os
+    from CPAC.utils import save_nifti
 
     roi_numbers = []
     if '#' in open(timeseries_one_d, 'r').readline().rstrip('\r\n'):
@@ -59,14 +60,12 @@ def compute_fisher_z_score(correlation_file, timeseries_one_d):
                 sub_data = np.reshape(corr_data[:, i], (x, y, z), order='F')
 
             sub_img = nb.Nifti1Image(sub_data, header=corr_img.get_header(), affine=corr_img.get_affine())
-            sub_z_score_file = os.path.join(os.getcwd(), 'z_score_ROI_number_%s.nii.gz' % (roi_numbers[i]))
-            sub_img.to_filename(sub_z_score_file)
+            sub_z_score_file = save_nifti(sub_img, 'z_score_ROI_number_%s' % (roi_numbers[i]))
             out_file.append(sub_z_score_file)
 
     else:
         z_score_img = nb.Nifti1Image(corr_data, header=hdr, affine=corr_img.get_affine())
-        z_score_file = os.path.join(os.getcwd(), 'z_score.nii.gz')
-        z_score_img.to_filename(z_score_file)
+        z_score_file = save_nifti(z_score_img, 'z_score')
         out_file.append(z_score_file)
 
     return out_file
@@ -125,6 +124,9 @@ def map_to_roi(timeseries, maps):
         (which == 'RT')
     """
 
+    import os
+    import numpy as np
+
     testMat = np.loadtxt(timeseries)
     timepoints, rois = testMat.shape
 
@@ -174,3 +176,232 @@ def map_to_roi(timeseries, maps):
     maps = maps[:rois]
 
     return roi_list, maps
+
+
+def calc_temporal_regression(subject_rest, subject_timeseries, subject_mask,
+                             demean, normalize, roi_labels=False):
+    """
+    Regresses the timeseries on the functional data of each voxel in the
+    mask, producing a spatial map of parameter estimates and a z-stat map
+    for each timeseries
+
+    All the voxels are regressed in one least squares solve, with the
+    demeaning and normalization of fsl_glm --demean and --des_norm.
+
+    Parameters
+    ----------
+
+    subject_rest : string (nifti file)
+        Input functional file
+
+    subject_timeseries : string (txt file)
+        Timeseries to regress, organized by columns, timepoints by rows
+
+    subject_mask : string (nifti file)
+        Functional mask, the maps are zero outside of it
+
+    demean : Boolean
+        Demean the timeseries and the data
+
+    normalize : Boolean
+        Normalize the timeseries to unit standard deviation
+
+    roi_labels : Boolean
+        Name the single map files after the ROI labels in the header of the
+        timeseries file, as `map_to_roi` does
+
+    Returns
+    -------
+
+    temp_reg_map : string (nifti file)
+        4D file of the parameter estimates, one volume per timeseries
+
+    temp_reg_map_files : list (nifti files)
+        Parameter estimate map of each timeseries
+
+    temp_reg_map_z : string (nifti file)
+        4D file of the z-stats, one volume per timeseries
+
+    temp_reg_map_z_files : list (nifti files)
+        Z-stat map of each timeseries
+    """
+
+    import os
+    import numpy as np
+    import nibabel as nb
+    from CPAC.utils import calc_glm, save_nifti
+    from CPAC.sca.utils import map_to_roi
+
+    timeseries = np.loadtxt(subject_timeseries, ndmin=2)
+
+    rest_img = nb.load(subject_rest)
+    mask = nb.load(subject_mask).get_data().astype(bool)
+
+    if rest_img.shape[:3] != mask.shape:
+        raise Exception('\n\n[!] CPAC says: Invalid Shape Error. The '
+                        'functional data and the mask should have the same '
+                        'voxel dimensions.\n\n')
+
+    if rest_img.shape[3] != timeseries.shape[0]:
+        raise Exception('\n\n[!] CPAC says: The functional data has {0} '
+                        'timepoints, but the timeseries file {1} has {2}.\n\n'
+                        .format(rest_img.shape[3], subject_timeseries,
+                                timeseries.shape[0]))
+
+    data = rest_img.get_data()[mask].T
+
+    beta, z = calc_glm(data, timeseries, demean=demean, des_norm=normalize,
+                       calc_z=True)
+    del data
+
+    hdr = rest_img.get_header().copy()
+    hdr.set_data_dtype(np.float32)
+
+    outputs = []
+    for name, stat in [('temp_reg_map', beta), ('temp_reg_map_z', z)]:
+        stat_data = np.zeros(mask.shape + (stat.shape[0],), dtype=np.float32)
+        stat_data[mask] = stat.T
+
+        stat_file = save_nifti(nb.Nifti1Image(stat_data,
+                                              rest_img.get_affine(), hdr),
+                               name)
+
+        stat_files = []
+        for i in range(stat_data.shape[3]):
+            map_file = save_nifti(nb.Nifti1Image(stat_data[..., i],
+                                                 rest_img.get_affine(), hdr),
+                                  '{0}_{1:04d}'.format(name, i))
+            stat_files.append(map_file)
+
+        if roi_labels:
+            labels, stat_files = map_to_roi(subject_timeseries, stat_files)
+            if name == 'temp_reg_map':
+                labels = [label.replace('_z_maps', '_maps')
+                          for label in labels]
+
+            renamed_files = []
+            for label, map_file in zip(labels, stat_files):
+                label_file = os.path.join(os.getcwd(), label +
+                                          map_file[map_file.rindex('.nii'):])
+                os.rename(map_file, label_file)
+                renamed_files.append(label_file)
+            stat_files = renamed_files
+
+        outputs += [stat_file, stat_files]
+
+    return tuple(outputs)
+
+
+def calc_sca(functional_file, timeseries_one_d, fisher_z=False,
+             out_dtype='float32', chunk_size=10000):
+    """
+    Computes the Pearson correlation of every voxel with each of the seed
+    timeseries, as 3dTcorr1D -pearson does, with a single read of the
+    functional file
+
+    The voxel timeseries are normalized, a block of voxels at a time, and
+    correlated with all the normalized seeds with one matrix product.
+
+    Parameters
+    ----------
+
+    functional_file : string (nifti file)
+        Input functional file
+
+    timeseries_one_d : string (1D file)
+        1D file of the seed timeseries, one column per seed, lines starting
+        with '#' are ignored. If the header has the 3dROIstats labels, the
+        single map files are named after them.
+
+    fisher_z : Boolean
+        Fisher z transform the correlations, zero where it is undefined
+
+    out_dtype : string
+        Data type of the output maps
+
+    chunk_size : integer
+        Number of voxels correlated at a time
+
+    Returns
+    -------
+
+    correlation_stack : string (nifti file)
+        4D file of the correlation maps, one volume per seed
+
+    correlation_files : list (nifti files)
+        Correlation map of each seed
+    """
+
+    import os
+    import numpy as np
+    import nibabel as nb
+    from CPAC.utils.utils import get_roi_num_list, load_masked, save_nifti
+
+    seeds = np.loadtxt(timeseries_one_d, comments='#', ndmin=2)
+
+    func_img = nb.load(functional_file)
+    func_data, func_mask = load_masked(functional_file)
+
+    if func_data.shape[0] != seeds.shape[0]:
+        raise Exception('\n\n[!] CPAC says: The functional file has {0} '
+                        'timepoints, but the seed timeseries file {1} has '
+                        '{2}.\n\n'.format(func_img.shape[3],
+                                          timeseries_one_d,
+                                          seeds.shape[0]))
+
+    seeds = seeds - seeds.mean(0)
+    seed_norms = np.sqrt(np.square(seeds).sum(0))
+    seed_norms[seed_norms == 0] = 1
+    seeds /= seed_norms
+
+    # voxels which are zero at every timepoint are left out, their
+    # correlation is zero
+    corr = np.zeros((func_data.shape[1], seeds.shape[1]), dtype=out_dtype)
+
+    for start in range(0, func_data.shape[1], chunk_size):
+        chunk = func_data[:, start:start + chunk_size].T.astype(np.float64)
+        chunk -= chunk.mean(1)[:, np.newaxis]
+        norms = np.sqrt(np.square(chunk).sum(1))
+
+        # constant voxels are left at zero
+        valid = norms > 0
+        chunk_corr = np.dot(chunk[valid], seeds) / norms[valid, np.newaxis]
+
+        if fisher_z:
+            # undefined where the correlation is +/-1, left at zero as in
+            # calc_vmhc
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.arctanh(chunk_corr, out=chunk_corr)
+            chunk_corr[~np.isfinite(chunk_corr)] = 0
+
+        corr[start:start + chunk.shape[0]][valid] = chunk_corr
+
+    del func_data
+
+    corr_data = np.zeros(func_mask.shape + (seeds.shape[1],),
+                         dtype=out_dtype)
+    corr_data[func_mask] = corr
+    corr = corr_data
+
+    hdr = func_img.get_header().copy()
+    hdr.set_data_dtype(out_dtype)
+
+    correlation_stack = save_nifti(nb.Nifti1Image(corr, func_img.get_affine(),
+                                                  hdr),
+                                   'sca_correlation_stack')
+
+    try:
+        roi_list = get_roi_num_list(timeseries_one_d, prefix='sca')
+    except Exception:
+        roi_list = []
+
+    if len(roi_list) != seeds.shape[1]:
+        roi_list = ['sca_{0}'.format(i) for i in range(seeds.shape[1])]
+
+    correlation_files = []
+    for i, roi in enumerate(roi_list):
+        roi_file = save_nifti(nb.Nifti1Image(corr[..., i],
+                                             func_img.get_affine(), hdr), roi)
+        correlation_files.append(roi_file)
+
+    return correlation_stack, correlation_files
@@ -1,7 +1,9 @@
 from scrubbing import create_scrubbing_preproc, \
                       get_mov_parameters, \
-                      get_indx
+                      load_frame_indices, \
+                      scrub_frames
 
 __all__ = ['create_scrubbing_preproc', \
            'get_mov_parameters', \
-           'get_indx']
+           'load_frame_indices', \
+           'scrub_frames']
@@ -47,10 +47,8 @@ def create_scrubbing_preproc(wf_name = 'scrubbing'):
     - Remove all movement parameters for all the time frames other than those that are present
       in the frames_in_1D file
       
-    - Remove the discarded timepoints from the input image. For details see `3dcalc <http://afni.nimh.nih.gov/pub/dist/doc/program_help/3dcalc.html>`_::
-        
-        3dcalc -a bandpassed_demeaned_filtered.nii.gz[0,1,5,6,7,8,9,10,15,16,17,18,19,20,24,25,287,288,289,290,291,292,293,294,295] 
-               -expr 'a' -prefix bandpassed_demeaned_filtered_3dc.nii.gz
+    - Remove the discarded timepoints from the input image, in-process, by
+      selecting the included volumes by their indices (see `scrub_frames`)
                
     High Level Workflow Graph:
     
@@ -85,33 +83,19 @@ def create_scrubbing_preproc(wf_name = 'scrubbing'):
                                                         'scrubbed_movement_parameters']),
                          name='outputspec')
 
-    craft_scrub_input = pe.Node(util.Function(input_names=['scrub_input', 'frames_in_1D_file'],
-                                              output_names=['scrub_input_string'],
-                                              function=get_indx),
-                                name = 'scrubbing_craft_input_string')
-
     scrubbed_movement_parameters = pe.Node(util.Function(input_names=['infile_a', 'infile_b'], 
                                                  output_names=['out_file'],
                                                  function=get_mov_parameters), 
                                    name='scrubbed_movement_parameters')
 
-    # THIS commented out until Nipype has an input for this interface that
-    # allows for the selection of specific volumes to include
-    
-    #scrubbed_preprocessed = pe.Node(interface=e_afni.Calc(), 
-    #                           name='scrubbed_preprocessed')
-    #scrubbed_preprocessed.inputs.expr = 'a'
-    #scrubbed_preprocessed.inputs.outputtype = 'NIFTI_GZ'   
-    
-    scrubbed_preprocessed = pe.Node(util.Function(input_names=['scrub_input'],
+    scrubbed_preprocessed = pe.Node(util.Function(input_names=['in_file',
+                                                               'frames_in'],
                                                   output_names=['scrubbed_image'],
-                                                  function=scrub_image),
+                                                  function=scrub_frames),
                                     name='scrubbed_preprocessed')
 
-    scrub.connect(inputNode, 'preprocessed', craft_scrub_input, 'scrub_input')
-    scrub.connect(inputNode, 'frames_in_1D', craft_scrub_input, 'frames_in_1D_file')
-    
-    scrub.connect(craft_scrub_input, 'scrub_input_string', scrubbed_preprocessed, 'scrub_input')    
+    scrub.connect(inputNode, 'preprocessed', scrubbed_preprocessed, 'in_file')
+    scrub.connect(inputNode, 'frames_in_1D', scrubbed_preprocessed, 'frames_in')
 
     scrub.connect(inputNode, 'movement_parameters', scrubbed_movement_parameters, 'infile_b')
     scrub.connect(inputNode, 'frames_in_1D', scrubbed_movement_parameters, 'infile_a' )
@@ -170,64 +154,95 @@ def get_mov_parameters(infile_a, infile_b):
     return out_file
 
 
-def get_indx(scrub_input, frames_in_1D_file):
-
+def load_frame_indices(frames_in):
     """
-    Method to get the list of time 
-    frames that are to be included
-    
+    Method to get the time frames to be included as an integer array
+
     Parameters
     ----------
-    in_file : string
-        path to file containing the valid time frames
-    
+    frames_in : string or sequence of integers
+        path to the 1D file of comma-separated time frames, or the time
+        frames themselves
+
     Returns
     -------
-    scrub_input_string : string
-        input string for 3dCalc in scrubbing workflow,
-        looks something like " 4dfile.nii.gz[0,1,2,..100] "
-    
+    indices : numpy.ndarray
+        integer indices of the time frames, in the order given, as the
+        volume selector of 3dcalc and `get_mov_parameters` take them
+
     """
 
-    with open(frames_in_1D_file, 'r') as f:
-        line = f.readline()
+    import numpy as np
 
-    line = line.strip(',')
-    if line:
-        indx = map(int, line.split(","))
-    else:
+    if isinstance(frames_in, basestring):
+        with open(frames_in, 'r') as f:
+            line = f.readline()
+
+        line = line.strip().strip(',')
+        frames_in = [int(x) for x in line.split(',') if x != ''] \
+            if line else []
+
+    indices = np.asarray(frames_in, dtype=int).ravel()
+
+    if indices.size == 0:
         raise Exception("No time points remaining after scrubbing.")
-    
-    scrub_input_string = scrub_input + str(indx).replace(" ", "")
-    
-    return scrub_input_string
-    
-    
-def scrub_image(scrub_input):
+
+    return indices
+
+
+def scrub_frames(in_file, frames_in):
 
     """
-    Method to run 3dcalc in order to scrub the image. This is used instead of
-    the Nipype interface for 3dcalc because functionality is needed for
-    specifying an input file with specifically-selected volumes. For example:
-        input.nii.gz[2,3,4,..98], etc.
-        
+    Method to scrub a 4D image in-process by keeping only the included
+    time frames, in the order given. Uncompressed images are read one
+    volume at a time, and the scrubbed image is written once.
+
     Parameters
     ----------
-    scrub_input : string
-        path to 4D file to be scrubbed, plus with selected volumes to be
-        included
-        
+    in_file : string
+        path to 4D file to be scrubbed
+    frames_in : string or sequence of integers
+        path to the 1D file of time frames to be included, or the time frames
+        themselves
+
     Returns
     -------
     scrubbed_image : string
         path to the scrubbed 4D file
-        
+
     """
 
     import os
+    import numpy as np
+    import nibabel as nb
+    from CPAC.scrubbing.scrubbing import load_frame_indices
+    from CPAC.utils import save_nifti
+
+    img = nb.load(in_file)
+    n_vols = img.shape[3]
+
+    indices = load_frame_indices(frames_in)
+
+    if indices.min() < 0 or indices.max() >= n_vols:
+        raise ValueError("Time frames to include are out of range for "
+                         "{0}, which has {1} volumes: "
+                         "{2}".format(in_file, n_vols, indices.tolist()))
+
+    if in_file.endswith('.gz'):
+        # seeking in a gzip stream restarts decompression, so read the
+        # compressed image in a single pass
+        scrubbed = img.get_data()[..., indices]
+    else:
+        first = np.asarray(img.dataobj[..., int(indices[0])])
+        scrubbed = np.empty(img.shape[:3] + (indices.size,),
+                            dtype=first.dtype)
+        scrubbed[..., 0] = first
+        for out_idx, vol_idx in enumerate(indices[1:], 1):
+            scrubbed[..., out_idx] = img.dataobj[..., int(vol_idx)]
 
-    os.system("3dcalc -a %s -expr 'a' -prefix scrubbed_preprocessed.nii.gz" % scrub_input)
+    scrubbed_img = nb.Nifti1Image(scrubbed, header=img.get_header(),
+                                  affine=img.get_affine())
 
-    scrubbed_image = os.path.join(os.getcwd(), "scrubbed_preprocessed.nii.gz")
+    scrubbed_image = save_nifti(scrubbed_img, "scrubbed_preprocessed")
 
     return scrubbed_image
@@ -0,0 +1,78 @@
+
+
+def test_load_frame_indices():
+    from CPAC.scrubbing import load_frame_indices
+    import os
+    import tempfile
+    import numpy as np
+
+    frames_file = os.path.join(tempfile.mkdtemp(), 'frames_in.1D')
+
+    # as written by the scrubbing input node, with a trailing comma
+    with open(frames_file, 'w') as f:
+        f.write('0,1,2,5,6,')
+    np.testing.assert_array_equal(load_frame_indices(frames_file),
+                                  [0, 1, 2, 5, 6])
+
+    # unsorted and duplicate frames are kept in the order given, as the
+    # 3dcalc volume selector and get_mov_parameters take them
+    with open(frames_file, 'w') as f:
+        f.write('4,2,2,0\n')
+    np.testing.assert_array_equal(load_frame_indices(frames_file),
+                                  [4, 2, 2, 0])
+
+    np.testing.assert_array_equal(load_frame_indices([3, 1]), [3, 1])
+    assert load_frame_indices(np.array([3, 1])).dtype.kind == 'i'
+
+    for frames_in in [[], frames_file]:
+        with open(frames_file, 'w') as f:
+            f.write(',\n')
+        try:
+            load_frame_indices(frames_in)
+            raise AssertionError('no error raised for an empty frame list')
+        except Exception as e:
+            assert 'No time points remaining' in str(e)
+
+
+def test_scrub_frames():
+    from CPAC.scrubbing import scrub_frames
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(0)
+    data = np.random.randn(4, 5, 6, 10).astype(np.float32)
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        for ext in ['nii', 'nii.gz']:
+            in_file = os.path.abspath('rest.' + ext)
+            img = nb.Nifti1Image(data, affine)
+            img.get_header().set_zooms((3.0, 3.0, 3.0, 2.0))
+            img.to_filename(in_file)
+
+            for frames in [[0, 1, 2, 5, 9], [9, 3, 3, 0]]:
+                frames_file = os.path.abspath('frames_in.1D')
+                with open(frames_file, 'w') as f:
+                    f.write(','.join(str(x) for x in frames) + ',')
+
+                for frames_in in [frames_file, frames]:
+                    scrubbed = nb.load(scrub_frames(in_file, frames_in))
+                    np.testing.assert_array_equal(scrubbed.get_data(),
+                                                  data[..., frames])
+                    np.testing.assert_allclose(scrubbed.get_affine(),
+                                               affine)
+                    assert scrubbed.get_header().get_zooms()[3] == 2.0
+
+            for frames_in in [[0, 10], [-1, 2]]:
+                try:
+                    scrub_frames(in_file, frames_in)
+                    raise AssertionError('no error raised for the out of '
+                                         'range frames %s' % frames_in)
+                except ValueError as e:
+                    assert 'out of range' in str(e)
+    finally:
+        os.chdir(cwd)
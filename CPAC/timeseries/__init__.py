@@ -4,7 +4,9 @@ from timeseries_analysis import create_surface_registration, \
                                 get_vertices_timeseries, \
                                 gen_vertices_timeseries, \
                                 gen_voxel_timeseries, \
+                                gen_spatial_map_timeseries, \
                                 gen_roi_timeseries, \
+                                compute_roi_means, \
                                 get_spatial_map_timeseries
 
 __all__ = ['create_surface_registration', \
@@ -13,5 +15,7 @@ __all__ = ['create_surface_registration', \
            'get_vertices_timeseries', \
            'gen_vertices_timeseries', \
            'gen_voxel_timeseries', \
+           'gen_spatial_map_timeseries', \
            'gen_roi_timeseries', \
+           'compute_roi_means', \
            'get_spatial_map_timeseries']
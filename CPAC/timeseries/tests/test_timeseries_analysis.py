@@ -0,0 +1,236 @@
+
+def make_data(out_dir, seed=0):
+    # a functional image with a zero voxel in the brain, and two atlases
+    # with non-contiguous labels, overlapping each other
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(seed)
+
+    data = (np.random.randn(6, 5, 4, 12) * 10 + 100).astype(np.float32)
+    data[0, 0, 0] = 0
+
+    labels_a = np.zeros((6, 5, 4))
+    labels_a[:3, :, :2] = 1
+    labels_a[3:, :2, :] = 7
+    labels_a[4:, 3:, 1:] = 3
+    # fractional labels are rounded up, as 2.2 -> 3
+    labels_a[5, 4, 3] = 2.2
+
+    labels_b = np.zeros((6, 5, 4))
+    labels_b[1:5, 1:4, 1:3] = 12
+    labels_b[0, :, :] = 4
+
+    data_file = os.path.join(out_dir, 'rest.nii.gz')
+    nb.Nifti1Image(data, np.eye(4)).to_filename(data_file)
+
+    templates = []
+    for name, labels in [('atlas_a', labels_a), ('atlas_b', labels_b)]:
+        template = os.path.join(out_dir, name + '.nii.gz')
+        nb.Nifti1Image(labels.astype(np.float32),
+                       np.eye(4)).to_filename(template)
+        templates.append(template)
+
+    return data_file, templates, data, [np.ceil(labels_a),
+                                        np.ceil(labels_b)]
+
+
+def test_compute_roi_means():
+    from CPAC.timeseries import compute_roi_means
+    import os
+    import tempfile
+    import numpy as np
+
+    data_file, templates, data, labels = make_data(tempfile.mkdtemp())
+
+    # the data is cached in the working directory of the node
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        roi_means = compute_roi_means(data_file, templates)
+    finally:
+        os.chdir(cwd)
+
+    assert len(roi_means) == 2
+
+    for (nodes, means), unit_data in zip(roi_means, labels):
+        expected_nodes = sorted(set(unit_data[unit_data > 0].astype(int)))
+        assert nodes == expected_nodes
+        assert means.dtype == np.float32
+        assert means.shape == (data.shape[3], len(nodes))
+
+        for i, n in enumerate(nodes):
+            np.testing.assert_allclose(means[:, i],
+                                       data[unit_data == n].mean(0),
+                                       rtol=1e-6)
+
+    assert roi_means[0][0] == [1, 3, 7]
+    assert roi_means[1][0] == [4, 12]
+
+
+def test_compute_roi_means_shape():
+    from CPAC.timeseries import compute_roi_means
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    out_dir = tempfile.mkdtemp()
+    data_file, templates, _, _ = make_data(out_dir)
+
+    template = os.path.join(out_dir, 'atlas_small.nii.gz')
+    nb.Nifti1Image(np.ones((3, 3, 3), dtype=np.float32),
+                   np.eye(4)).to_filename(template)
+
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        compute_roi_means(data_file, [templates[0], template])
+        raise AssertionError('no error raised for a mismatched roi mask')
+    except Exception as e:
+        assert 'Invalid Shape Error' in str(e)
+    finally:
+        os.chdir(cwd)
+
+
+def test_gen_roi_timeseries():
+    from CPAC.timeseries import gen_roi_timeseries
+    from CPAC.utils.result_cache import RESULT_CACHE_DIR_ENV
+    import os
+    import tempfile
+    import numpy as np
+
+    out_dir = tempfile.mkdtemp()
+    data_file, templates, data, labels = make_data(out_dir)
+    vol = data.shape[3]
+
+    cwd = os.getcwd()
+    cache_dir = os.environ.pop(RESULT_CACHE_DIR_ENV, None)
+    os.chdir(tempfile.mkdtemp())
+    try:
+        out_list = gen_roi_timeseries(data_file, templates, [True, True])
+
+        exts = ['.npy', '.1D', '.txt', '.csv', '.npz']
+        expected_files = [os.path.abspath('roi_' + name + ext)
+                          for name in ['atlas_a', 'atlas_b']
+                          for ext in exts]
+        assert out_list == expected_files
+
+        for name, unit_data in zip(['atlas_a', 'atlas_b'], labels):
+            nodes = sorted(set(unit_data[unit_data > 0].astype(int)))
+            expected = np.column_stack([data[unit_data == n].mean(0)
+                                        for n in nodes])
+
+            means = np.load('roi_{0}.npy'.format(name))
+            assert means.dtype == np.float32
+            np.testing.assert_allclose(means, expected, rtol=1e-6)
+
+            with open('roi_{0}.1D'.format(name), 'r') as f:
+                lines = f.read().splitlines()
+            assert lines[0] == '\t'.join('#{0}'.format(n) for n in nodes)
+            assert len(lines) == vol + 1
+            np.testing.assert_allclose(
+                [[float(x) for x in line.split('\t')] for line in lines[1:]],
+                means, atol=1e-6)
+
+            with open('roi_{0}.txt'.format(name), 'r') as f:
+                assert f.read().splitlines() == lines
+
+            with open('roi_{0}.csv'.format(name), 'r') as f:
+                lines = f.read().splitlines()
+            assert lines[0] == ','.join(['node/volume'] +
+                                        [str(t) for t in range(vol)])
+            assert [int(line.split(',')[0]) for line in lines[1:]] == nodes
+            np.testing.assert_allclose(
+                [[float(x) for x in line.split(',')[1:]]
+                 for line in lines[1:]],
+                means.T, atol=1e-6)
+
+            npz = np.load('roi_{0}.npz'.format(name))
+            np.testing.assert_allclose(npz['roi_data'], expected.T,
+                                       rtol=1e-6)
+            assert npz['roi_numbers'].tolist() == [str(n) for n in nodes]
+
+        # a single template, without the text and optional files
+        os.chdir(tempfile.mkdtemp())
+        out_list = gen_roi_timeseries(data_file, templates[1],
+                                      [False, False], write_text=False)
+        assert out_list == [os.path.abspath('roi_atlas_b.npy')]
+    finally:
+        os.chdir(cwd)
+        if cache_dir is not None:
+            os.environ[RESULT_CACHE_DIR_ENV] = cache_dir
+
+
+def test_gen_spatial_map_timeseries():
+    from CPAC.timeseries import gen_spatial_map_timeseries
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(1)
+
+    shape = (6, 5, 4)
+    mask_data = np.zeros(shape, dtype=np.uint8)
+    mask_data[1:5, 1:4, :] = 1
+    in_mask = mask_data.astype(bool)
+
+    maps = np.random.rand(*shape + (3,))
+    true_ts = np.random.randn(3, 15) * 10
+    data = np.einsum('xyzk,kt->xyzt', maps, true_ts) + 50 + \
+        np.random.randn(*shape + (15,))
+
+    out_dir = tempfile.mkdtemp()
+    subject_rest = os.path.join(out_dir, 'rest.nii.gz')
+    nb.Nifti1Image(data.astype(np.float32), np.eye(4)).to_filename(
+        subject_rest)
+    subject_mask = os.path.join(out_dir, 'mask.nii.gz')
+    nb.Nifti1Image(mask_data, np.eye(4)).to_filename(subject_mask)
+    spatial_map = os.path.join(out_dir, 'maps.nii.gz')
+    nb.Nifti1Image(maps.astype(np.float32), np.eye(4)).to_filename(
+        spatial_map)
+
+    Y = data.astype(np.float32)[in_mask].astype(np.float64)
+    X = maps.astype(np.float32)[in_mask].astype(np.float64)
+
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        for demean in [True, False]:
+            out_file = gen_spatial_map_timeseries(subject_rest, subject_mask,
+                                                  spatial_map, demean)
+            assert out_file == os.path.abspath('spatial_map_timeseries.txt')
+
+            if demean:
+                expected = np.linalg.lstsq(X - X.mean(0), Y - Y.mean(0),
+                                           rcond=-1)[0]
+            else:
+                expected = np.linalg.lstsq(X, Y, rcond=-1)[0]
+
+            # a column per spatial map, a row per timepoint
+            timeseries = np.loadtxt(out_file)
+            assert timeseries.shape == (15, 3)
+            np.testing.assert_allclose(timeseries, expected.T, rtol=1e-6,
+                                       atol=1e-6)
+
+        # a single 3D map
+        single_map = os.path.join(out_dir, 'map.nii.gz')
+        nb.Nifti1Image(maps[..., 0].astype(np.float32),
+                       np.eye(4)).to_filename(single_map)
+        out_file = gen_spatial_map_timeseries(subject_rest, subject_mask,
+                                              single_map, True)
+        assert np.loadtxt(out_file, ndmin=2).shape == (15, 1)
+
+        small_mask = os.path.join(out_dir, 'small_mask.nii.gz')
+        nb.Nifti1Image(np.ones((3, 3, 3), dtype=np.uint8),
+                       np.eye(4)).to_filename(small_mask)
+        try:
+            gen_spatial_map_timeseries(subject_rest, small_mask,
+                                       spatial_map, True)
+            raise AssertionError('no error raised for a mismatched mask')
+        except Exception as e:
+            assert 'Invalid Shape Error' in str(e)
+    finally:
+        os.chdir(cwd)
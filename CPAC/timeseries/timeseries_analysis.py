@@ -400,20 +400,82 @@ def get_spatial_map_timeseries(wf_name='spatial_map_timeseries'):
         fields=['subject_timeseries']),
                          name='outputspec')
 
-    spatialReg = pe.Node(interface=fsl.GLM(),
+    spatialReg = pe.Node(util.Function(input_names=['subject_rest',
+                                                    'subject_mask',
+                                                    'spatial_map',
+                                                    'demean'],
+                                       output_names=['out_file'],
+                                       function=gen_spatial_map_timeseries),
                          name='spatial_regression')
 
-    spatialReg.inputs.out_file = 'spatial_map_timeseries.txt'
-
-    wflow.connect(inputNode, 'subject_rest', spatialReg, 'in_file')
-    wflow.connect(inputNode, 'subject_mask', spatialReg, 'mask')
-    wflow.connect(inputNode, 'spatial_map', spatialReg, 'design')
+    wflow.connect(inputNode, 'subject_rest', spatialReg, 'subject_rest')
+    wflow.connect(inputNode, 'subject_mask', spatialReg, 'subject_mask')
+    wflow.connect(inputNode, 'spatial_map', spatialReg, 'spatial_map')
     wflow.connect(inputNode, 'demean', spatialReg, 'demean')
     wflow.connect(spatialReg, 'out_file', outputNode, 'subject_timeseries')
 
     return wflow
 
 
+def gen_spatial_map_timeseries(subject_rest, subject_mask, spatial_map,
+                               demean):
+    """
+    Method to regress the spatial maps on each volume of the functional
+    data, inside the mask, returning a timeseries for each of the maps
+
+    All the volumes are regressed in one least squares solve over the
+    (voxels x maps) design, as fsl_glm does with a 4D design image.
+
+    Parameters
+    ----------
+    subject_rest : string (nifti file)
+        path to input functional data
+    subject_mask : string (nifti file)
+        path to subject functional mask
+    spatial_map : string (nifti file)
+        path to 4D file of spatial maps, one map per volume
+    demean : boolean
+        demean the maps and the data across the voxels in the mask
+
+    Returns
+    -------
+    out_file : string (txt file)
+        path to the space separated txt file of the timeseries, the
+        columns are spatial maps, rows are timepoints
+
+    Raises
+    ------
+    Exception
+
+    """
+    import os
+    import nibabel as nib
+    import numpy as np
+    from CPAC.utils import calc_glm
+
+    mask = nib.load(subject_mask).get_data().astype(bool)
+    maps = nib.load(spatial_map).get_data()
+    if maps.ndim == 3:
+        maps = maps[..., np.newaxis]
+    maps = maps.reshape(maps.shape[:3] + (-1,))
+
+    rest_img = nib.load(subject_rest)
+
+    if not (rest_img.shape[:3] == mask.shape == maps.shape[:3]):
+        raise Exception('\n\n[!] CPAC says: Invalid Shape Error. The '
+                        'functional data, the mask and the spatial maps '
+                        'should have the same voxel dimensions.\n\n')
+
+    data = rest_img.get_data()[mask]
+
+    timeseries = calc_glm(data, maps[mask], demean=demean)
+
+    out_file = os.path.join(os.getcwd(), 'spatial_map_timeseries.txt')
+    np.savetxt(out_file, timeseries.T, fmt='%.8g')
+
+    return out_file
+
+
 def get_vertices_timeseries(wf_name='vertices_timeseries'):
 
     """
@@ -537,28 +599,28 @@ def get_normalized_moments(wf_name='normalized_moments'):
     return wflow
 
 
-def gen_roi_timeseries(data_file, template, output_type):
+def compute_roi_means(data_file, templates):
     """
-    Method to extract mean of voxel across
-    all timepoints for each node in roi mask
+    Method to compute the mean timeseries of every node of one or more roi
+    masks with a single read of the functional data
+
+    The voxels inside any of the roi masks are extracted once, and the
+    means of all the nodes of each mask are computed together as the
+    product of a sparse averaging matrix with the (voxels x timepoints)
+    matrix.
 
     Parameters
     ----------
     data_file : string
         path to input functional data
-    template : string
-        path to input roi mask in functional native space
-    output_type : list
-        list of two boolean values suggesting
-        the output types - numpy npz file and csv
-        format
+    templates : list of strings
+        paths to input roi masks in functional native space
 
     Returns
     -------
-    out_list : list
-        list of 1D file, txt file, csv file and/or npz file containing
-        mean timeseries for each scan corresponding
-        to each node in roi mask
+    roi_means : list of tuples
+        for each roi mask, a tuple of the sorted node numbers and the
+        (timepoints x nodes) float32 array of their mean timeseries
 
     Raises
     ------
@@ -566,100 +628,156 @@ def gen_roi_timeseries(data_file, template, output_type):
 
     """
     import nibabel as nib
-    import csv
     import numpy as np
-    import os
-    import shutil
+    import scipy.sparse
+    from CPAC.utils import load_masked, masked_voxels
 
-    unit_data = nib.load(template).get_data()
-    # Cast as rounded-up integer
-    unit_data = np.int64(np.ceil(unit_data))
-    datafile = nib.load(data_file)
-    img_data = datafile.get_data()
-    vol = img_data.shape[3]
+    data, data_mask = load_masked(data_file)
 
-    if unit_data.shape != img_data.shape[:3]:
-        raise Exception('\n\n[!] CPAC says: Invalid Shape Error.'
-                        'Please check the voxel dimensions. '
-                        'Data and roi should have the same shape.\n\n')
+    unit_datas = []
+    for template in templates:
+        # Cast as rounded-up integer
+        unit_data = np.int64(np.ceil(nib.load(template).get_data()))
 
-    nodes = np.unique(unit_data).tolist()
-    sorted_list = []
-    node_dict = {}
-    out_list = []
+        if unit_data.shape != data_mask.shape:
+            raise Exception('\n\n[!] CPAC says: Invalid Shape Error.'
+                            'Please check the voxel dimensions. '
+                            'Data and roi should have the same shape.\n\n')
 
-    # extracting filename from input template
-    tmp_file = os.path.splitext(
-                    os.path.basename(template))[0]
-    tmp_file = os.path.splitext(tmp_file)[0]
-    oneD_file = os.path.abspath('roi_' + tmp_file + '.1D')
-    txt_file = os.path.abspath('roi_' + tmp_file + '.txt')
-    csv_file = os.path.abspath('roi_' + tmp_file + '.csv')
-    numpy_file = os.path.abspath('roi_' + tmp_file + '.npz')
-    
-    nodes.sort()
-    for n in nodes:
-        if n > 0:
-            node_array = img_data[unit_data == n]
-            node_str = 'node_{0}'.format(n)
-            avg = np.mean(node_array, axis=0)
-            avg = np.round(avg, 6)
-            list1 = [n] + avg.tolist()
-            sorted_list.append(list1)
-            node_dict[node_str] = avg.tolist()
+        unit_datas.append(unit_data)
 
-    # writing to 1Dfile
-    print("writing 1D file..")
-    f = open(oneD_file, 'w')
-    writer = csv.writer(f, delimiter='\t')
+    in_roi = np.zeros(data_mask.shape, dtype=bool)
+    for unit_data in unit_datas:
+        in_roi |= unit_data > 0
 
-    value_list = []
+    roi_voxels = masked_voxels(data, data_mask, in_roi).T.astype(np.float64)
+    del data
 
-    new_keys = sorted([int(float(key.split('node_')[1])) for key in node_dict.keys()])
+    roi_means = []
+    for unit_data in unit_datas:
+        labels = unit_data[in_roi]
+        in_node = labels > 0
 
-    roi_number_list = [str(n) for n in new_keys]
+        nodes, node_idx, counts = np.unique(labels[in_node],
+                                            return_inverse=True,
+                                            return_counts=True)
 
-    roi_number_str = []
-    for number in roi_number_list:
-        roi_number_str.append("#" + number)
+        averaging = scipy.sparse.csr_matrix(
+            (1.0 / counts[node_idx], (node_idx, np.flatnonzero(in_node))),
+            shape=(nodes.size, labels.size))
 
-    for key in new_keys:
-        value_list.append(node_dict['node_{0}'.format(key)])
+        means = averaging.dot(roi_voxels).T.astype(np.float32)
+        roi_means.append((nodes.tolist(), means))
 
-    column_list = zip(*value_list)
+    return roi_means
 
-    writer.writerow(roi_number_str)
 
-    for column in column_list:
-        writer.writerow(list(column))
-    f.close()
-    out_list.append(oneD_file)
+def gen_roi_timeseries(data_file, template, output_type, write_text=True):
+    """
+    Method to extract mean of voxel across
+    all timepoints for each node in roi mask
 
-    # copy the 1D contents to txt file
-    shutil.copy(oneD_file, txt_file)
-    out_list.append(txt_file)
+    Parameters
+    ----------
+    data_file : string
+        path to input functional data
+    template : string or list of strings
+        path to input roi mask in functional native space, or a list of
+        them, which are all extracted from a single read of the data
+    output_type : list
+        list of two boolean values suggesting
+        the output types - numpy npz file and csv
+        format
+    write_text : boolean
+        write the AFNI compatible 1D file and its txt copy
 
-    # if csv is required
-    if output_type[0]:
-        print "writing csv file.."
-        f = open(csv_file, 'wt')
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL)
-        headers = ['node/volume'] + np.arange(vol).tolist()
-        writer.writerow(headers)
-        writer.writerows(sorted_list)
-        f.close()
-        out_list.append(csv_file)
+    Returns
+    -------
+    out_list : list
+        list of npy file, and 1D file, txt file, csv file and/or npz file
+        containing mean timeseries for each scan corresponding
+        to each node in roi mask. The npy file holds a float32
+        (timepoints x nodes) array, with the nodes in increasing order.
 
-    # if npz file is required
-    if output_type[1]:
-        print "writing npz file.."
-        np.savez(numpy_file, roi_data=value_list, roi_numbers=roi_number_list)
-        out_list.append(numpy_file)
+    Raises
+    ------
+    Exception
 
-    return out_list
+    """
+    import numpy as np
+    import os
+    import shutil
+    from CPAC.timeseries.timeseries_analysis import compute_roi_means
+    from CPAC.utils.result_cache import ResultCache
+
+    if isinstance(template, basestring):
+        template = [template]
+
+    # reuse the timeseries of identical inputs, if the result cache is
+    # enabled
+    cache = ResultCache('CPAC.timeseries.timeseries_analysis.'
+                        'gen_roi_timeseries', data_file=data_file,
+                        template=template, output_type=output_type,
+                        write_text=write_text)
+    out_list = cache.fetch()
+    if out_list is not None:
+        return out_list
 
+    out_list = []
 
-def gen_voxel_timeseries(data_file, template, output_type):
+    roi_means = compute_roi_means(data_file, template)
+
+    for roi_file, (nodes, means) in zip(template, roi_means):
+
+        # extracting filename from input template
+        tmp_file = os.path.splitext(
+                        os.path.basename(roi_file))[0]
+        tmp_file = os.path.splitext(tmp_file)[0]
+        npy_file = os.path.abspath('roi_' + tmp_file + '.npy')
+        oneD_file = os.path.abspath('roi_' + tmp_file + '.1D')
+        txt_file = os.path.abspath('roi_' + tmp_file + '.txt')
+        csv_file = os.path.abspath('roi_' + tmp_file + '.csv')
+        numpy_file = os.path.abspath('roi_' + tmp_file + '.npz')
+
+        np.save(npy_file, means)
+        out_list.append(npy_file)
+
+        roi_number_list = [str(n) for n in nodes]
+
+        if write_text:
+            # writing to 1Dfile
+            print("writing 1D file..")
+            np.savetxt(oneD_file, means, fmt='%.6f', delimiter='\t',
+                       header='\t'.join(['#' + n for n in roi_number_list]),
+                       comments='')
+            out_list.append(oneD_file)
+
+            # copy the 1D contents to txt file
+            shutil.copy(oneD_file, txt_file)
+            out_list.append(txt_file)
+
+        # if csv is required
+        if output_type[0]:
+            print "writing csv file.."
+            vol = means.shape[0]
+            headers = ['node/volume'] + [str(t) for t in range(vol)]
+            np.savetxt(csv_file,
+                       np.column_stack((nodes, means.T)),
+                       fmt=['%d'] + ['%.6f'] * vol, delimiter=',',
+                       header=','.join(headers), comments='')
+            out_list.append(csv_file)
+
+        # if npz file is required
+        if output_type[1]:
+            print "writing npz file.."
+            np.savez(numpy_file, roi_data=means.T,
+                     roi_numbers=roi_number_list)
+            out_list.append(numpy_file)
+
+    return cache.store(out_list)
+
+
+def gen_voxel_timeseries(data_file, template, output_type, chunk_size=100):
     """
     Method to extract timeseries for each voxel
     in the data that is present in the input mask
@@ -674,6 +792,8 @@ def gen_voxel_timeseries(data_file, template, output_type):
         list of two boolean values suggesting
         the output types - numpy npz file and csv 
         format
+    chunk_size : integer
+        number of volumes written to the csv file at a time
         
     Returns
     -------
@@ -683,7 +803,10 @@ def gen_voxel_timeseries(data_file, template, output_type):
         the data that is present in the input mask.The row header 
         corresponds to voxel's xyz cordinates and column headers corresponds 
         to the volume index in the csv. By default it outputs afni compatible 
-        1D file with mean of timeseries of voxels across timepoints.
+        1D file with mean of timeseries of voxels across timepoints, and
+        a (timepoints x voxels) npy file which can be memory-mapped. The
+        npz file holds the same array as 'voxel_data' and the xyz
+        cordinates of the voxels as 'coordinates'.
         
     Raises
     ------
@@ -692,7 +815,6 @@ def gen_voxel_timeseries(data_file, template, output_type):
     """
     import nibabel as nib
     import numpy as np
-    import csv
     import os
 
     unit = nib.load(template)
@@ -701,54 +823,48 @@ def gen_voxel_timeseries(data_file, template, output_type):
     img_data = datafile.get_data()
     header_data = datafile.get_header()
     qform = header_data.get_qform()
-    sorted_list = []
-    vol_dict = {}
     out_list = []
 
     tmp_file = os.path.splitext(
                   os.path.basename(template))[0]
     tmp_file = os.path.splitext(tmp_file)[0]
     oneD_file = os.path.abspath('mask_' + tmp_file + '.1D')
-    f = open(oneD_file, 'wt')
-
-    x, y, z = unit_data.shape
-
-    node_array = img_data[unit_data != 0]
-    node_array = node_array.T
-    time_points = node_array.shape[0]
-    for t in range(0, time_points):
-        string = 'vol {0}'.format(t)
-        vol_dict[string] = node_array[t]
-        f.write(str(np.round(np.mean(node_array[t]), 6)))
-        val = node_array[t].tolist()
-        val.insert(0, t)
-        sorted_list.append(val)
-
-    f.close()
+    npy_file = os.path.abspath('mask_' + tmp_file + '.npy')
+
+    in_mask = unit_data != 0
+
+    # (timepoints x voxels), voxels in the same order as np.argwhere
+    node_array = np.ascontiguousarray(img_data[in_mask].T)
+    del img_data
+
+    np.savetxt(oneD_file, np.round(node_array.mean(1), 6), fmt='%s')
     out_list.append(oneD_file)
 
+    np.save(npy_file, node_array)
+    out_list.append(npy_file)
+
+    # world cordinates of all the voxels in one product
+    cordinates = np.argwhere(in_mask)
+    cordinates = nib.affines.apply_affine(qform, cordinates)
+
     if output_type[0]:
         csv_file = os.path.abspath('mask_' + tmp_file + '.csv')
-        f = open(csv_file, 'wt')
-        writer = csv.writer(f, delimiter=str(','),
-                            quoting=csv.QUOTE_MINIMAL)
-        one = np.array([1])
-        headers = ['volume/xyz']
-        cordinates = np.argwhere(unit_data != 0)
-        for val in range(np.alen(cordinates)):
-            ijk_mat = np.concatenate([cordinates[val], one])
-            ijk_mat = ijk_mat.T
-            product = np.dot(qform, ijk_mat)
-            val = tuple(product.tolist()[0:3])
-            headers.append(val)
-        writer.writerow(headers)
-        writer.writerows(sorted_list)
-        f.close()
+        headers = ['volume/xyz'] + ['"{0}"'.format(tuple(xyz))
+                                    for xyz in cordinates.tolist()]
+        vol_fmt = ['%d'] + ['%.6f'] * node_array.shape[1]
+        with open(csv_file, 'wt') as f:
+            f.write(','.join(headers) + '\n')
+            for start in range(0, node_array.shape[0], chunk_size):
+                chunk = node_array[start:start + chunk_size]
+                vols = np.arange(start, start + chunk.shape[0])
+                np.savetxt(f, np.column_stack((vols, chunk)),
+                           fmt=vol_fmt, delimiter=',')
         out_list.append(csv_file)
 
     if output_type[1]:
         numpy_file = os.path.abspath('mask_' + tmp_file + '.npz')
-        np.savez(numpy_file, **dict(vol_dict))
+        np.savez(numpy_file, voxel_data=node_array,
+                 coordinates=cordinates)
         out_list.append(numpy_file)
 
     return out_list
@@ -0,0 +1,600 @@
+# CPAC/utils/instrumentation.py
+#
+
+'''
+This module contains the profiling of the individual-level pipeline: the
+node wrapper run in the MultiProc workers, the stage timer used by our own
+Function nodes, and the per-run profiling report
+'''
+
+# Import packages
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import threading
+
+
+# Environment variables set by prep_workflow when profiling is enabled,
+# inherited by the MultiProc workers
+PROFILE_DIR_ENV = 'CPAC_PROFILE_DIR'
+PROFILE_SUBJECT_ENV = 'CPAC_PROFILE_SUBJECT'
+
+# ru_maxrss is in kilobytes on Linux, in bytes on macOS
+MAXRSS_BYTES = 1 if sys.platform == 'darwin' else 1024
+
+
+def get_profile_dir():
+    '''
+    Function to get the directory of the profiling records of this run,
+    None if profiling is disabled
+    '''
+    return os.environ.get(PROFILE_DIR_ENV) or None
+
+
+def get_profile_run_dir(log_directory, pipeline_name, run_id=None):
+    '''
+    Function to get, and create, the directory of the profiling records of
+    a pipeline run
+
+    Parameters
+    ----------
+    log_directory : string
+        log directory of the pipeline configuration
+    pipeline_name : string
+        name of the pipeline
+    run_id : string (optional); default=None
+        unique ID of the run, the records of all the runs of the pipeline
+        share one directory without it
+
+    Returns
+    -------
+    profile_dir : string
+        path to the profiling directory
+    '''
+
+    run_name = pipeline_name
+    if run_id:
+        run_name = '%s_%s' % (pipeline_name, run_id)
+
+    profile_dir = os.path.join(log_directory, 'profiling', run_name)
+    if not os.path.isdir(profile_dir):
+        try:
+            os.makedirs(profile_dir)
+        except OSError:
+            # created by another participant in the meantime
+            if not os.path.isdir(profile_dir):
+                raise
+
+    return profile_dir
+
+
+def write_profile_record(record, profile_dir=None):
+    '''
+    Function to append a record to the profiling records of this process
+
+    Each process writes to its own file, so that the workers never
+    interleave their records.
+
+    Parameters
+    ----------
+    record : dictionary
+        JSON-serializable record
+    profile_dir : string (optional); default=None
+        profiling directory, the one of this run by default
+    '''
+
+    profile_dir = profile_dir or get_profile_dir()
+    if not profile_dir:
+        return
+
+    record_file = os.path.join(profile_dir, 'records_%s_%d.json'
+                               % (socket.gethostname(), os.getpid()))
+    try:
+        with open(record_file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    except (IOError, OSError):
+        # profiling never fails the pipeline
+        pass
+
+
+def write_profile_strategies(profile_dir, subject_id, strat_names):
+    '''
+    Function to record the node names of the strategies of a participant,
+    to label the nodes of the report with their strategies
+
+    Parameters
+    ----------
+    profile_dir : string
+        profiling directory
+    subject_id : string
+        participant label
+    strat_names : list
+        list of the lists of node names of each strategy
+    '''
+
+    strat_file = os.path.join(profile_dir, 'strategies_%s.json' % subject_id)
+    try:
+        with open(strat_file, 'w') as f:
+            json.dump({'subject': subject_id,
+                       'strategies': dict(('strat_%d' % idx, list(names))
+                                          for idx, names in
+                                          enumerate(strat_names))}, f)
+    except (IOError, OSError):
+        pass
+
+
+def get_usage():
+    '''
+    Function to get the CPU time and block IO of this process and of the
+    child processes it waited for
+
+    Returns
+    -------
+    usage : dictionary
+        cpu_time (seconds), read_bytes, written_bytes, and the largest RSS
+        of a child process (children_maxrss, bytes)
+    '''
+
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return {'cpu_time': self_usage.ru_utime + self_usage.ru_stime +
+                        child_usage.ru_utime + child_usage.ru_stime,
+            'read_bytes': (self_usage.ru_inblock +
+                           child_usage.ru_inblock) * 512,
+            'written_bytes': (self_usage.ru_oublock +
+                              child_usage.ru_oublock) * 512,
+            'children_maxrss': child_usage.ru_maxrss * MAXRSS_BYTES}
+
+
+class MemorySampler(threading.Thread):
+    '''
+    Thread sampling the RSS of this process and of its child processes,
+    to get the peak memory usage of a node
+
+    Parameters
+    ----------
+    interval : float (optional); default=0.5
+        sampling interval, in seconds
+    '''
+
+    def __init__(self, interval=0.5):
+        super(MemorySampler, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.peak_rss = 0
+        self.stop_event = threading.Event()
+
+        try:
+            import psutil
+            self.process = psutil.Process(os.getpid())
+        except Exception:
+            self.process = None
+
+    def sample(self):
+        if self.process is None:
+            # without psutil, only this process is sampled, on Linux
+            try:
+                with open('/proc/self/statm', 'r') as f:
+                    rss = int(f.read().split()[1]) * \
+                        resource.getpagesize()
+            except (IOError, OSError, ValueError, IndexError):
+                return
+            self.peak_rss = max(self.peak_rss, rss)
+            return
+
+        import psutil
+
+        try:
+            rss = self.process.memory_info().rss
+            for child in self.process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.Error:
+                    pass
+        except psutil.Error:
+            return
+
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def run(self):
+        self.sample()
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.sample()
+        return self.peak_rss
+
+
+class ProfiledNode(object):
+    '''
+    Wrapper of a node submitted to a MultiProc worker, which records the
+    wall time, CPU time, peak RSS and block IO of the node run
+    '''
+
+    def __init__(self, node):
+        self._node = node
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == '_node':
+            raise AttributeError(name)
+        return getattr(self._node, name)
+
+    def run(self, *args, **kwargs):
+        if not get_profile_dir():
+            return self._node.run(*args, **kwargs)
+
+        sampler = MemorySampler()
+        sampler.start()
+        before = get_usage()
+        start = time.time()
+        status = 'completed'
+
+        try:
+            return self._node.run(*args, **kwargs)
+        except BaseException:
+            status = 'failed'
+            raise
+        finally:
+            end = time.time()
+            peak_rss = sampler.stop()
+            after = get_usage()
+
+            # the children reaped during the node also count, their RSS is
+            # only known once they are done
+            if after['children_maxrss'] > before['children_maxrss']:
+                peak_rss = max(peak_rss, after['children_maxrss'])
+
+            try:
+                node_dir = self._node.output_dir()
+            except Exception:
+                node_dir = None
+
+            write_profile_record({
+                'type': 'node',
+                'subject': os.environ.get(PROFILE_SUBJECT_ENV),
+                'node': self._node.fullname,
+                'dir': node_dir,
+                'status': status,
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'start': start,
+                'end': end,
+                'wall_time': end - start,
+                'cpu_time': after['cpu_time'] - before['cpu_time'],
+                'peak_rss_mb': peak_rss / 1024.0 ** 2,
+                'read_bytes': after['read_bytes'] - before['read_bytes'],
+                'written_bytes': after['written_bytes'] -
+                                 before['written_bytes']})
+
+
+class StageTimer(object):
+    '''
+    Timer of the stages of a Function node. Starting a stage ends the
+    previous one, and each stage is recorded with the node's working
+    directory, which links it to the node in the report. It does nothing
+    when profiling is disabled.
+
+    Examples
+    --------
+
+    >>> stages = StageTimer()
+    >>> stages.start('load')
+    >>> stages.start('regression')
+    >>> stages.stop()
+    '''
+
+    def __init__(self):
+        self.enabled = get_profile_dir() is not None
+        self.stage = None
+
+    def start(self, stage):
+        if not self.enabled:
+            return
+
+        self.stop()
+        self.stage = stage
+        self.stage_start = time.time()
+        self.stage_cpu = get_usage()['cpu_time']
+
+    def stop(self):
+        if not self.enabled or self.stage is None:
+            return
+
+        end = time.time()
+        write_profile_record({
+            'type': 'stage',
+            'subject': os.environ.get(PROFILE_SUBJECT_ENV),
+            'dir': os.getcwd(),
+            'stage': self.stage,
+            'pid': os.getpid(),
+            'start': self.stage_start,
+            'end': end,
+            'wall_time': end - self.stage_start,
+            'cpu_time': get_usage()['cpu_time'] - self.stage_cpu})
+        self.stage = None
+
+
+def load_profile_records(profile_dir):
+    '''
+    Function to load the profiling records of a run
+
+    Parameters
+    ----------
+    profile_dir : string
+        profiling directory
+
+    Returns
+    -------
+    nodes : list
+        node records, labeled with their workflow and strategies
+    stages : list
+        stage records, labeled with their node
+    '''
+
+    import glob
+    import re
+
+    nodes = []
+    stages = []
+    for record_file in sorted(glob.glob(os.path.join(profile_dir,
+                                                     'records_*.json'))):
+        with open(record_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # partially written line of a killed process
+                    continue
+                if record.get('type') == 'node':
+                    nodes.append(record)
+                elif record.get('type') == 'stage':
+                    stages.append(record)
+
+    strategies = {}
+    for strat_file in glob.glob(os.path.join(profile_dir,
+                                             'strategies_*.json')):
+        with open(strat_file, 'r') as f:
+            strat_info = json.load(f)
+        strategies[strat_info['subject']] = strat_info['strategies']
+
+    # the top-level sub-workflow (or node) of a node is what the strategies
+    # list, and without its strategy number, what the node is across
+    # participants and strategies
+    node_dirs = {}
+    for record in nodes:
+        hierarchy = record['node'].split('.')
+        record['workflow'] = hierarchy[1] if len(hierarchy) > 1 \
+            else hierarchy[0]
+        record['strategy'] = ';'.join(sorted(
+            strat for strat, names in
+            strategies.get(record['subject'], {}).items()
+            if record['workflow'] in names))
+        record['node_type'] = '.'.join(
+            [re.sub(r'_\d+(-.*)?$', '', record['workflow'])] + hierarchy[2:])
+        if record.get('dir'):
+            node_dirs[os.path.realpath(record['dir'])] = record
+
+    for record in stages:
+        node = node_dirs.get(os.path.realpath(record['dir']))
+        record['node'] = node['node'] if node else None
+        record['node_type'] = node['node_type'] if node else None
+
+    nodes.sort(key=lambda r: r['start'])
+    stages.sort(key=lambda r: r['start'])
+
+    return nodes, stages
+
+
+def summarize_profile(nodes, stages):
+    '''
+    Function to aggregate the node and stage records across participants
+
+    Returns
+    -------
+    summary : list
+        one dictionary per node type and per stage of a node type
+    '''
+
+    groups = {}
+    for record in nodes:
+        groups.setdefault((record['node_type'], ''), []).append(record)
+    for record in stages:
+        groups.setdefault((record['node_type'] or '', record['stage']),
+                          []).append(record)
+
+    summary = []
+    for (node_type, stage), records in sorted(groups.items()):
+        wall_times = [r['wall_time'] for r in records]
+        summary.append({
+            'node_type': node_type,
+            'stage': stage,
+            'count': len(records),
+            'subjects': len(set(r['subject'] for r in records)),
+            'total_wall_time': sum(wall_times),
+            'mean_wall_time': sum(wall_times) / len(wall_times),
+            'max_wall_time': max(wall_times),
+            'total_cpu_time': sum(r['cpu_time'] for r in records),
+            'max_peak_rss_mb': max(r.get('peak_rss_mb', 0) for r in records),
+            'total_read_bytes': sum(r.get('read_bytes', 0) for r in records),
+            'total_written_bytes': sum(r.get('written_bytes', 0)
+                                       for r in records)})
+
+    # node types by decreasing time, each followed by its stages
+    node_times = dict((s['node_type'], s['total_wall_time'])
+                      for s in summary if not s['stage'])
+    summary.sort(key=lambda s: (-node_times.get(s['node_type'], 0),
+                                s['node_type'], s['stage'] != '',
+                                -s['total_wall_time']))
+    return summary
+
+
+def write_profile_gantt(nodes, stages, out_file):
+    '''
+    Function to write an HTML Gantt view of the nodes and their stages,
+    one row per participant worker process
+    '''
+
+    from cgi import escape
+
+    if not nodes:
+        return
+
+    run_start = min(r['start'] for r in nodes)
+    run_end = max(r['end'] for r in nodes)
+    span = max(run_end - run_start, 1e-3)
+
+    subjects = sorted(set(r['subject'] for r in nodes))
+    colors = ['#4e79a7', '#f28e2b', '#e15759', '#76b7b2', '#59a14f',
+              '#edc948', '#b07aa1', '#ff9da7', '#9c755f', '#bab0ac']
+    subject_colors = dict((subject, colors[idx % len(colors)])
+                          for idx, subject in enumerate(subjects))
+
+    lanes = {}
+    for record in nodes:
+        lanes.setdefault((record['subject'], record.get('host'),
+                          record['pid']), []).append(record)
+    lane_stages = {}
+    for record in stages:
+        lane_stages.setdefault((record['subject'], record['pid']),
+                               []).append(record)
+
+    def position(record):
+        left = 100.0 * (record['start'] - run_start) / span
+        width = max(100.0 * (record['end'] - record['start']) / span, 0.05)
+        return 'left:%.4f%%;width:%.4f%%;' % (left, width)
+
+    rows = []
+    for (subject, host, pid), records in sorted(
+            lanes.items(), key=lambda l: (l[0][0], l[1][0]['start'])):
+        bars = []
+        for record in records:
+            title = '%s\n%s\nstrategy: %s\nwall: %.1fs, cpu: %.1fs\n' \
+                    'peak RSS: %.0fMB\nread: %.1fMB, written: %.1fMB' \
+                    % (record['node'], record['status'],
+                       record['strategy'] or '-', record['wall_time'],
+                       record['cpu_time'], record['peak_rss_mb'],
+                       record['read_bytes'] / 1024.0 ** 2,
+                       record['written_bytes'] / 1024.0 ** 2)
+            bars.append('<div class="node%s" style="%sbackground:%s" '
+                        'title="%s"></div>'
+                        % (' failed' if record['status'] == 'failed' else '',
+                           position(record), subject_colors[subject],
+                           escape(title, True)))
+        for record in lane_stages.get((subject, pid), []):
+            title = '%s: %s\nwall: %.1fs, cpu: %.1fs' \
+                    % (record['node'] or record['dir'], record['stage'],
+                       record['wall_time'], record['cpu_time'])
+            bars.append('<div class="stage" style="%s" title="%s"></div>'
+                        % (position(record), escape(title, True)))
+        rows.append('<div class="row"><div class="label">%s<br>'
+                    '<small>%s:%s</small></div><div class="lane">%s</div>'
+                    '</div>' % (escape(str(subject)), escape(str(host)), pid,
+                                ''.join(bars)))
+
+    legend = ''.join('<span><i style="background:%s"></i>%s</span>'
+                     % (color, escape(str(subject)))
+                     for subject, color in sorted(subject_colors.items()))
+
+    html = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>C-PAC node profile</title>
+<style>
+body { font-family: sans-serif; font-size: 12px; }
+.row { display: flex; border-bottom: 1px solid #eee; }
+.label { width: 160px; flex: none; padding: 2px; overflow: hidden; }
+.lane { position: relative; flex: auto; height: 30px; }
+.node { position: absolute; top: 2px; height: 16px; opacity: 0.85; }
+.node.failed { outline: 2px solid red; }
+.stage { position: absolute; top: 20px; height: 8px; background: #333; }
+.legend span { margin-right: 12px; }
+.legend i { display: inline-block; width: 10px; height: 10px;
+            margin-right: 4px; }
+</style>
+</head>
+<body>
+<h2>C-PAC node profile</h2>
+<p>%d nodes, %d stages, %.1f minutes. Hover a bar for its details; the dark
+bars under the nodes are their stages.</p>
+<p class="legend">%s</p>
+%s
+</body>
+</html>
+''' % (len(nodes), len(stages), span / 60.0, legend, '\n'.join(rows))
+
+    with open(out_file, 'w') as f:
+        f.write(html)
+
+
+def create_profile_report(profile_dir, out_dir=None):
+    '''
+    Function to write the profiling report of a run: node_profile.csv,
+    stage_profile.csv and profile_summary.csv, all the records and the
+    summary in profile.json, and the profile_gantt.html Gantt view
+
+    Parameters
+    ----------
+    profile_dir : string
+        profiling directory of the run
+    out_dir : string (optional); default=None
+        directory of the report, the profiling directory by default
+
+    Returns
+    -------
+    report_files : list
+        paths to the report files, empty if there are no records
+    '''
+
+    import csv
+
+    out_dir = out_dir or profile_dir
+    nodes, stages = load_profile_records(profile_dir)
+    if not nodes and not stages:
+        return []
+
+    summary = summarize_profile(nodes, stages)
+
+    node_fields = ['subject', 'strategy', 'workflow', 'node', 'node_type',
+                   'status', 'host', 'pid', 'start', 'end', 'wall_time',
+                   'cpu_time', 'peak_rss_mb', 'read_bytes', 'written_bytes',
+                   'dir']
+    stage_fields = ['subject', 'node', 'node_type', 'stage', 'pid', 'start',
+                    'end', 'wall_time', 'cpu_time', 'dir']
+    summary_fields = ['node_type', 'stage', 'count', 'subjects',
+                      'total_wall_time', 'mean_wall_time', 'max_wall_time',
+                      'total_cpu_time', 'max_peak_rss_mb', 'total_read_bytes',
+                      'total_written_bytes']
+
+    report_files = []
+    for name, fields, records in [('node_profile.csv', node_fields, nodes),
+                                  ('stage_profile.csv', stage_fields, stages),
+                                  ('profile_summary.csv', summary_fields,
+                                   summary)]:
+        out_file = os.path.join(out_dir, name)
+        with open(out_file, 'wb') as f:
+            writer = csv.DictWriter(f, fieldnames=fields,
+                                    extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(records)
+        report_files.append(out_file)
+
+    out_file = os.path.join(out_dir, 'profile.json')
+    with open(out_file, 'w') as f:
+        json.dump({'nodes': nodes, 'stages': stages, 'summary': summary}, f,
+                  indent=1)
+    report_files.append(out_file)
+
+    if nodes:
+        out_file = os.path.join(out_dir, 'profile_gantt.html')
+        write_profile_gantt(nodes, stages, out_file)
+        report_files.append(out_file)
+
+    return report_files
@@ -0,0 +1,390 @@
+# CPAC/utils/result_cache.py
+#
+
+'''
+This module contains the result cache of our own derivative functions,
+which stores their output files under a key made of the checksums of their
+input files, their parameters and the version of their code, so that they
+are reused across runs, strategies and working directories
+'''
+
+# Import packages
+import os
+import json
+import time
+import shutil
+import hashlib
+
+from CPAC.utils.utils import atomic_write
+
+
+# Environment variables set by prep_workflow when the cache is enabled,
+# inherited by the MultiProc workers
+RESULT_CACHE_DIR_ENV = 'CPAC_RESULT_CACHE_DIR'
+RESULT_CACHE_SIZE_ENV = 'CPAC_RESULT_CACHE_SIZE_GB'
+
+# Size of the cache when none is configured, in GB
+DEFAULT_CACHE_SIZE_GB = 20.0
+
+
+def get_result_cache_dir():
+    '''
+    Function to get the root directory of the result cache, None if the
+    cache is disabled
+    '''
+    return os.environ.get(RESULT_CACHE_DIR_ENV) or None
+
+
+def get_result_cache_size():
+    '''
+    Function to get the maximum size of the result cache, in GB
+    '''
+    try:
+        return float(os.environ.get(RESULT_CACHE_SIZE_ENV,
+                                    DEFAULT_CACHE_SIZE_GB))
+    except ValueError:
+        return DEFAULT_CACHE_SIZE_GB
+
+
+def file_checksum(path, cache_dir=None):
+    '''
+    Function to compute the SHA-1 checksum of the contents of a file
+
+    The checksum is remembered in the cache directory under the path,
+    modification time and size of the file, so that the file is only read
+    once as long as it is unchanged.
+
+    Parameters
+    ----------
+    path : string
+        path to the file
+    cache_dir : string (optional); default=None
+        root directory of the result cache
+
+    Returns
+    -------
+    checksum : string
+        hexadecimal SHA-1 checksum of the file
+    '''
+
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+
+    memo_file = None
+    if cache_dir:
+        memo_key = '{0}:{1}:{2}'.format(path, stat.st_mtime, stat.st_size)
+        memo_file = os.path.join(cache_dir, 'checksums',
+                                 hashlib.sha1(memo_key).hexdigest())
+        if os.path.isfile(memo_file):
+            with open(memo_file, 'r') as f:
+                return f.read().strip()
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    checksum = sha1.hexdigest()
+
+    if memo_file:
+        try:
+            if not os.path.isdir(os.path.dirname(memo_file)):
+                os.makedirs(os.path.dirname(memo_file))
+            with atomic_write(memo_file) as tmp_file:
+                with open(tmp_file, 'w') as f:
+                    f.write(checksum)
+        except (IOError, OSError):
+            pass
+
+    return checksum
+
+
+# code versions computed by this process, by package directory
+code_versions = {}
+
+
+def get_code_version(package_dir=None):
+    '''
+    Function to get the version of the code of the derivative functions:
+    the C-PAC version and the checksum of the sources of the whole C-PAC
+    package, since a function also depends on the modules it calls
+
+    The checksum is only computed again when a source file is added,
+    removed or modified.
+
+    Parameters
+    ----------
+    package_dir : string (optional); default=None
+        directory of the package, the one of C-PAC by default
+
+    Returns
+    -------
+    code_version : string
+        version of the code
+    '''
+
+    import CPAC
+
+    if not package_dir:
+        package_dir = os.path.dirname(os.path.abspath(CPAC.__file__))
+
+    source_files = []
+    for root, dirs, files in os.walk(package_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                source_files.append((os.path.relpath(path, package_dir),
+                                     stat.st_mtime, stat.st_size))
+
+    cached = code_versions.get(package_dir)
+    if cached and cached[0] == source_files:
+        return cached[1]
+
+    sha1 = hashlib.sha1()
+    for rel_path, mtime, size in source_files:
+        sha1.update(rel_path + '\0')
+        with open(os.path.join(package_dir, rel_path), 'rb') as f:
+            sha1.update(f.read())
+        sha1.update('\0')
+
+    code_version = '%s:%s' % (CPAC.__version__, sha1.hexdigest())
+    code_versions[package_dir] = (source_files, code_version)
+
+    return code_version
+
+
+class ResultCache(object):
+    '''
+    Result cache of one call of a derivative function
+
+    The function looks its outputs up with fetch() before computing them,
+    and hands them to store() once computed. Both do nothing when the cache
+    is disabled, and never fail the function: a cache error only costs the
+    computation.
+
+    Parameters
+    ----------
+    function_path : string
+        dotted path of the function, e.g. 'CPAC.reho.utils.compute_reho'
+    **inputs
+        inputs of the call; the existing files among them (and among their
+        lists and dictionaries) are keyed by their contents, the others by
+        their values
+
+    Examples
+    --------
+    >>> cache = ResultCache('CPAC.reho.utils.compute_reho',
+    ...                     in_file=in_file, mask_file=mask_file,
+    ...                     cluster_size=cluster_size)
+    >>> out_file = cache.fetch()
+    >>> if out_file is None:
+    ...     out_file = cache.store(compute(in_file, mask_file, cluster_size))
+    '''
+
+    def __init__(self, function_path, **inputs):
+
+        self.function_path = function_path
+        self.inputs = inputs
+        self.cache_dir = get_result_cache_dir()
+        self.key = None
+
+        if not self.cache_dir:
+            return
+
+        try:
+            key = {'function': function_path,
+                   'version': get_code_version(),
+                   'inputs': self._key_value(inputs)}
+            key = json.dumps(key, sort_keys=True)
+            self.key = hashlib.sha1(key).hexdigest()
+        except Exception as e:
+            print('Result cache disabled for %s: %s' % (function_path, e))
+            self.key = None
+
+    def _key_value(self, value):
+        if isinstance(value, basestring) and os.path.isfile(value):
+            return 'file:' + file_checksum(value, self.cache_dir)
+        if isinstance(value, (list, tuple)):
+            return [self._key_value(v) for v in value]
+        if isinstance(value, dict):
+            return dict((str(k), self._key_value(v))
+                        for k, v in value.items())
+        return repr(value)
+
+    def get_entry_dir(self):
+        '''
+        Returns the directory of the cached outputs of the call, None if the
+        cache is disabled
+        '''
+        if not self.key:
+            return None
+        return os.path.join(self.cache_dir, 'results', self.key)
+
+    def fetch(self, out_dir=None):
+        '''
+        Copies the cached output files of the call into a directory, the
+        current one by default
+
+        Returns
+        -------
+        outputs : object
+            outputs of the call, as returned by the function, with the
+            paths of the copies; None if they are not cached
+        '''
+
+        entry_dir = self.get_entry_dir()
+        if not entry_dir:
+            return None
+
+        manifest_file = os.path.join(entry_dir, 'manifest.json')
+        if not os.path.isfile(manifest_file):
+            return None
+
+        out_dir = os.path.abspath(out_dir or os.getcwd())
+
+        try:
+            with open(manifest_file, 'r') as f:
+                manifest = json.load(f)
+
+            out_files = []
+            for stored_name, name in manifest['files']:
+                out_file = os.path.join(out_dir, str(name))
+                shutil.copyfile(os.path.join(entry_dir, stored_name),
+                                out_file)
+                out_files.append(out_file)
+
+            # mark the entry as recently used
+            os.utime(manifest_file, None)
+
+        except (IOError, OSError, ValueError, KeyError):
+            # evicted or written in the meantime
+            return None
+
+        print('Reusing the cached outputs of %s from %s'
+              % (self.function_path, entry_dir))
+
+        return self._decode(manifest['outputs'], out_files)
+
+    def store(self, outputs):
+        '''
+        Copies the output files of the call into the cache, and evicts the
+        least recently used entries beyond the size of the cache
+
+        Returns
+        -------
+        outputs : object
+            the outputs, unchanged
+        '''
+
+        entry_dir = self.get_entry_dir()
+        if not entry_dir or os.path.isdir(entry_dir):
+            return outputs
+
+        try:
+            # publish the entry at once, unless another process did first
+            with atomic_write(entry_dir) as tmp_dir:
+                if not os.path.isdir(tmp_dir):
+                    os.makedirs(tmp_dir)
+
+                files = []
+                encoded = self._encode(outputs, files)
+
+                size = 0
+                stored_files = []
+                for idx, path in enumerate(files):
+                    name = os.path.basename(path)
+                    stored_name = '%d_%s' % (idx, name)
+                    # copy, the node may later rewrite its own file in place
+                    shutil.copyfile(path, os.path.join(tmp_dir, stored_name))
+                    size += os.path.getsize(path)
+                    stored_files.append([stored_name, name])
+
+                manifest = {'function': self.function_path,
+                            'outputs': encoded,
+                            'files': stored_files,
+                            'size': size,
+                            'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+                with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+                    json.dump(manifest, f)
+
+        except (IOError, OSError, TypeError, ValueError):
+            return outputs
+
+        evict_result_cache(self.cache_dir, get_result_cache_size())
+
+        return outputs
+
+    def _encode(self, value, files):
+        if isinstance(value, basestring) and os.path.isfile(value):
+            files.append(value)
+            return {'file': len(files) - 1}
+        if isinstance(value, tuple):
+            return {'tuple': [self._encode(v, files) for v in value]}
+        if isinstance(value, list):
+            return [self._encode(v, files) for v in value]
+        if value is None or isinstance(value, (basestring, int, float, bool)):
+            return value
+        raise TypeError('Cannot cache an output of type %s' % type(value))
+
+    def _decode(self, value, out_files):
+        if isinstance(value, dict):
+            if 'file' in value:
+                return out_files[value['file']]
+            return tuple(self._decode(v, out_files) for v in value['tuple'])
+        if isinstance(value, list):
+            return [self._decode(v, out_files) for v in value]
+        if isinstance(value, unicode):
+            # json loads the strings as unicode
+            return value.encode('utf-8')
+        return value
+
+
+def evict_result_cache(cache_dir, max_size_gb):
+    '''
+    Function to delete the least recently used entries of the result cache
+    until it fits in its size
+
+    Parameters
+    ----------
+    cache_dir : string
+        root directory of the result cache
+    max_size_gb : float
+        maximum size of the cache, in GB
+
+    Returns
+    -------
+    evicted : list
+        keys of the deleted entries
+    '''
+
+    results_dir = os.path.join(cache_dir, 'results')
+    if not os.path.isdir(results_dir):
+        return []
+
+    entries = []
+    total_size = 0
+    for key in os.listdir(results_dir):
+        manifest_file = os.path.join(results_dir, key, 'manifest.json')
+        if key.endswith('.tmp') or not os.path.isfile(manifest_file):
+            continue
+        try:
+            with open(manifest_file, 'r') as f:
+                size = json.load(f)['size']
+            last_used = os.path.getmtime(manifest_file)
+        except (IOError, OSError, ValueError, KeyError):
+            continue
+        entries.append((last_used, key, size))
+        total_size += size
+
+    max_size = max_size_gb * 1024 ** 3
+
+    evicted = []
+    for last_used, key, size in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(os.path.join(results_dir, key), ignore_errors=True)
+        total_size -= size
+        evicted.append(key)
+
+    return evicted
@@ -0,0 +1,202 @@
+
+
+def read_records(profile_dir):
+
+    import os
+    import glob
+    import json
+
+    records = []
+    for record_file in glob.glob(os.path.join(profile_dir,
+                                              'records_*.json')):
+        with open(record_file, 'r') as f:
+            records += [json.loads(line) for line in f]
+    return records
+
+
+def test_stage_timer():
+    import os
+    import time
+    import tempfile
+    from CPAC.utils.instrumentation import StageTimer, PROFILE_DIR_ENV
+
+    profile_dir = tempfile.mkdtemp()
+    node_dir = tempfile.mkdtemp()
+
+    cwd = os.getcwd()
+    os.chdir(node_dir)
+    try:
+        # disabled without a profiling directory
+        os.environ.pop(PROFILE_DIR_ENV, None)
+        stages = StageTimer()
+        stages.start('load')
+        stages.stop()
+        assert not os.listdir(profile_dir)
+
+        os.environ[PROFILE_DIR_ENV] = profile_dir
+        stages = StageTimer()
+        stages.start('load')
+        time.sleep(0.2)
+        stages.start('compute')
+        sum(i * i for i in range(10 ** 6))
+        stages.stop()
+        # stopping twice records nothing more
+        stages.stop()
+    finally:
+        os.environ.pop(PROFILE_DIR_ENV, None)
+        os.chdir(cwd)
+
+    records = sorted(read_records(profile_dir), key=lambda r: r['start'])
+
+    assert [r['stage'] for r in records] == ['load', 'compute']
+    for record in records:
+        assert record['type'] == 'stage'
+        assert os.path.realpath(record['dir']) == os.path.realpath(node_dir)
+        assert record['pid'] == os.getpid()
+        assert record['end'] - record['start'] == record['wall_time']
+
+    assert records[0]['wall_time'] >= 0.2
+    assert records[0]['end'] <= records[1]['start']
+    assert records[1]['cpu_time'] > 0
+
+
+def test_profiled_node():
+    import os
+    import tempfile
+    from CPAC.utils.instrumentation import ProfiledNode, PROFILE_DIR_ENV, \
+        PROFILE_SUBJECT_ENV
+
+    class FakeNode(object):
+        fullname = 'resting_preproc_sub-1.alff_falff_0.calc_alff'
+
+        def __init__(self, fail=False):
+            self.fail = fail
+
+        def output_dir(self):
+            return '/work/alff_falff_0/calc_alff'
+
+        def run(self, updatehash=False):
+            if self.fail:
+                raise RuntimeError('calc_alff failed')
+            return 'result'
+
+    profile_dir = tempfile.mkdtemp()
+    os.environ[PROFILE_DIR_ENV] = profile_dir
+    os.environ[PROFILE_SUBJECT_ENV] = 'sub-1'
+    try:
+        node = ProfiledNode(FakeNode())
+        assert node.fullname == FakeNode.fullname
+        assert node.run(updatehash=False) == 'result'
+
+        try:
+            ProfiledNode(FakeNode(fail=True)).run()
+            raise AssertionError('the node error was not raised')
+        except RuntimeError:
+            pass
+    finally:
+        os.environ.pop(PROFILE_DIR_ENV, None)
+        os.environ.pop(PROFILE_SUBJECT_ENV, None)
+
+    records = sorted(read_records(profile_dir), key=lambda r: r['start'])
+
+    assert [r['status'] for r in records] == ['completed', 'failed']
+    for record in records:
+        assert record['type'] == 'node'
+        assert record['subject'] == 'sub-1'
+        assert record['node'] == FakeNode.fullname
+        assert record['dir'] == '/work/alff_falff_0/calc_alff'
+        assert record['wall_time'] >= 0
+        assert record['peak_rss_mb'] > 0
+
+
+def test_create_profile_report():
+    import os
+    import csv
+    import json
+    import tempfile
+    from CPAC.utils.instrumentation import write_profile_record, \
+        write_profile_strategies, create_profile_report
+
+    profile_dir = tempfile.mkdtemp()
+    out_dir = tempfile.mkdtemp()
+
+    assert create_profile_report(profile_dir, out_dir) == []
+
+    def node(subject, name, start, end, node_dir, status='completed'):
+        return {'type': 'node', 'subject': subject,
+                'node': 'resting_preproc_%s.%s' % (subject, name),
+                'dir': node_dir, 'status': status, 'host': 'node01',
+                'pid': 100, 'start': start, 'end': end,
+                'wall_time': end - start, 'cpu_time': end - start,
+                'peak_rss_mb': 100.0, 'read_bytes': 1024,
+                'written_bytes': 2048}
+
+    for subject in ['sub-1', 'sub-2']:
+        write_profile_strategies(profile_dir, subject,
+                                 [['anat_preproc_0', 'alff_falff_0'],
+                                  ['anat_preproc_0', 'alff_falff_1']])
+        write_profile_record(node(subject, 'anat_preproc_0.anat_skullstrip',
+                                  0.0, 60.0, '/work/%s/skullstrip'
+                                  % subject), profile_dir)
+        write_profile_record(node(subject, 'alff_falff_0.calc_alff',
+                                  60.0, 70.0, '/work/%s/calc_alff_0'
+                                  % subject), profile_dir)
+        write_profile_record(node(subject, 'alff_falff_1.calc_alff',
+                                  60.0, 75.0, '/work/%s/calc_alff_1'
+                                  % subject, status='failed'), profile_dir)
+        write_profile_record({'type': 'stage', 'subject': subject,
+                              'dir': '/work/%s/calc_alff_0' % subject,
+                              'stage': 'fft', 'pid': 100, 'start': 61.0,
+                              'end': 65.0, 'wall_time': 4.0,
+                              'cpu_time': 4.0}, profile_dir)
+
+    # partial line of a killed process
+    with open(os.path.join(profile_dir, 'records_node01_1.json'), 'w') as f:
+        f.write('{"type": "node", "subj')
+
+    report_files = create_profile_report(profile_dir, out_dir)
+
+    assert sorted(os.path.basename(f) for f in report_files) == \
+        ['node_profile.csv', 'profile.json', 'profile_gantt.html',
+         'profile_summary.csv', 'stage_profile.csv']
+
+    with open(os.path.join(out_dir, 'profile.json'), 'r') as f:
+        profile = json.load(f)
+
+    nodes = dict(((r['subject'], r['node'].split('.', 1)[1]), r)
+                 for r in profile['nodes'])
+    assert len(nodes) == 6
+    skullstrip = nodes[('sub-1', 'anat_preproc_0.anat_skullstrip')]
+    assert skullstrip['workflow'] == 'anat_preproc_0'
+    assert skullstrip['node_type'] == 'anat_preproc.anat_skullstrip'
+    assert skullstrip['strategy'] == 'strat_0;strat_1'
+    assert nodes[('sub-2', 'alff_falff_1.calc_alff')]['strategy'] == \
+        'strat_1'
+
+    # stages are linked to their node through its directory
+    assert sorted((r['subject'], r['node']) for r in profile['stages']) == \
+        [('sub-1', 'resting_preproc_sub-1.alff_falff_0.calc_alff'),
+         ('sub-2', 'resting_preproc_sub-2.alff_falff_0.calc_alff')]
+
+    # node types by decreasing time, each followed by its stages
+    with open(os.path.join(out_dir, 'profile_summary.csv'), 'r') as f:
+        summary = list(csv.DictReader(f))
+    assert [(r['node_type'], r['stage'], r['count'], r['subjects'])
+            for r in summary] == \
+        [('anat_preproc.anat_skullstrip', '', '2', '2'),
+         ('alff_falff.calc_alff', '', '4', '2'),
+         ('alff_falff.calc_alff', 'fft', '2', '2')]
+    assert float(summary[0]['total_wall_time']) == 120.0
+    assert float(summary[1]['total_wall_time']) == 50.0
+    assert float(summary[1]['max_wall_time']) == 15.0
+    assert int(summary[1]['total_written_bytes']) == 4 * 2048
+
+    with open(os.path.join(out_dir, 'node_profile.csv'), 'r') as f:
+        node_rows = list(csv.DictReader(f))
+    assert len(node_rows) == 6
+    assert [r['status'] for r in node_rows].count('failed') == 2
+
+    with open(os.path.join(out_dir, 'profile_gantt.html'), 'r') as f:
+        html = f.read()
+    assert '6 nodes, 2 stages' in html
+    assert html.count('class="node failed"') == 2
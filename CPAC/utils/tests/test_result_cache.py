@@ -0,0 +1,133 @@
+
+
+def write_file(path, content):
+
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_get_code_version():
+    import os
+    import time
+    import tempfile
+    from CPAC.utils.result_cache import get_code_version
+
+    package_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(package_dir, 'reho'))
+    write_file(os.path.join(package_dir, '__init__.py'), '')
+    utils_file = write_file(os.path.join(package_dir, 'reho', 'utils.py'),
+                            'def compute_reho():\n    pass\n')
+    write_file(os.path.join(package_dir, 'reho', 'README.txt'), 'ReHo')
+
+    version = get_code_version(package_dir)
+    assert get_code_version(package_dir) == version
+
+    # other files than the sources do not change the version
+    write_file(os.path.join(package_dir, 'reho', 'README.txt'), 'ReHo 2')
+    assert get_code_version(package_dir) == version
+
+    # a change in any module of the package does
+    time.sleep(1)
+    write_file(utils_file, 'def compute_reho():\n    return 1\n')
+    modified_version = get_code_version(package_dir)
+    assert modified_version != version
+
+    write_file(os.path.join(package_dir, 'nuisance.py'), '')
+    assert get_code_version(package_dir) not in (version, modified_version)
+
+
+def test_result_cache():
+    import os
+    import tempfile
+    import CPAC.utils.result_cache as result_cache
+    from CPAC.utils.result_cache import ResultCache, RESULT_CACHE_DIR_ENV
+
+    in_dir = tempfile.mkdtemp()
+    in_file = write_file(os.path.join(in_dir, 'func.nii.gz'), 'func data')
+    mask_file = write_file(os.path.join(in_dir, 'mask.nii.gz'), 'mask')
+
+    def compute(in_file, mask_file, cluster_size):
+        out_file = write_file(os.path.join(os.getcwd(), 'ReHo.nii.gz'),
+                              open(in_file).read() + ' reho')
+        return (out_file, [out_file], 7, 'label')
+
+    def run_node(in_file, cluster_size=27):
+        cache = ResultCache('CPAC.reho.utils.compute_reho', in_file=in_file,
+                            mask_file=mask_file, cluster_size=cluster_size)
+        outputs = cache.fetch()
+        if outputs is not None:
+            return True, outputs
+        return False, cache.store(compute(in_file, mask_file,
+                                          cluster_size))
+
+    cwd = os.getcwd()
+    os.environ[RESULT_CACHE_DIR_ENV] = tempfile.mkdtemp()
+    try:
+        # computed in a first node, then copied into a second one
+        node_dir = tempfile.mkdtemp()
+        os.chdir(node_dir)
+        assert run_node(in_file) == \
+            (False, (os.path.join(node_dir, 'ReHo.nii.gz'),
+                     [os.path.join(node_dir, 'ReHo.nii.gz')], 7, 'label'))
+
+        node_dir = tempfile.mkdtemp()
+        os.chdir(node_dir)
+        hit, outputs = run_node(in_file)
+        out_file = os.path.join(node_dir, 'ReHo.nii.gz')
+        assert hit
+        assert outputs == (out_file, [out_file], 7, 'label')
+        assert open(out_file).read() == 'func data reho'
+
+        # other parameters or input contents are computed again
+        assert not run_node(in_file, cluster_size=19)[0]
+
+        write_file(in_file, 'new func data')
+        hit, outputs = run_node(in_file)
+        assert not hit
+        assert open(outputs[0]).read() == 'new func data reho'
+
+        # and so are the results of another version of the code
+        get_code_version = result_cache.get_code_version
+        result_cache.get_code_version = lambda: 'another version'
+        try:
+            assert not run_node(in_file)[0]
+            assert run_node(in_file)[0]
+        finally:
+            result_cache.get_code_version = get_code_version
+        assert run_node(in_file)[0]
+
+    finally:
+        os.environ.pop(RESULT_CACHE_DIR_ENV, None)
+        os.chdir(cwd)
+
+    # disabled without a cache directory
+    os.chdir(tempfile.mkdtemp())
+    try:
+        cache = ResultCache('CPAC.reho.utils.compute_reho', in_file=in_file)
+        assert cache.fetch() is None
+        assert cache.store(in_file) == in_file
+        assert cache.get_entry_dir() is None
+    finally:
+        os.chdir(cwd)
+
+
+def test_evict_result_cache():
+    import os
+    import json
+    import tempfile
+    from CPAC.utils.result_cache import evict_result_cache
+
+    cache_dir = tempfile.mkdtemp()
+    for idx, key in enumerate(['old', 'recent', 'newest']):
+        entry_dir = os.path.join(cache_dir, 'results', key)
+        os.makedirs(entry_dir)
+        manifest_file = write_file(os.path.join(entry_dir, 'manifest.json'),
+                                   json.dumps({'size': 400 * 1024 ** 2}))
+        os.utime(manifest_file, (1000 + idx, 1000 + idx))
+
+    # the least recently used entries go first, until the cache fits
+    assert evict_result_cache(cache_dir, 1.0) == ['old']
+    assert sorted(os.listdir(os.path.join(cache_dir, 'results'))) == \
+        ['newest', 'recent']
+    assert evict_result_cache(cache_dir, 1.0) == []
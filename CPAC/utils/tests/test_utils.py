@@ -0,0 +1,325 @@
+
+
+def test_load_masked_cache():
+    from CPAC.utils import load_masked
+    import os
+    import time
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    cache_dir = tempfile.mkdtemp()
+    in_file = os.path.join(tempfile.mkdtemp(), 'func.nii.gz')
+
+    np.random.seed(0)
+    data = np.random.randn(4, 5, 6, 10).astype(np.float32)
+    data[0] = 0
+    nb.Nifti1Image(data, np.eye(4)).to_filename(in_file)
+
+    Y, mask = load_masked(in_file, cache_dir=cache_dir)
+    np.testing.assert_array_equal(mask, (data != 0).any(-1))
+    np.testing.assert_array_equal(Y, data[mask].T)
+    assert len(os.listdir(cache_dir)) == 2
+
+    # a second call maps the cached matrix
+    Y, mask = load_masked(in_file, cache_dir=cache_dir)
+    assert isinstance(Y, np.memmap)
+    np.testing.assert_array_equal(Y, data[mask].T)
+
+    # a new version of the file replaces the cached one
+    time.sleep(1)
+    nb.Nifti1Image(data * 2, np.eye(4)).to_filename(in_file)
+    Y, mask = load_masked(in_file, cache_dir=cache_dir)
+    np.testing.assert_array_equal(Y, 2 * data[mask].T)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_load_masked_default_cache_dir():
+    from CPAC.utils import load_masked
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    in_dir = tempfile.mkdtemp()
+    in_file = os.path.join(in_dir, 'func.nii.gz')
+    nb.Nifti1Image(np.ones((3, 3, 3, 4), dtype=np.float32),
+                   np.eye(4)).to_filename(in_file)
+
+    cwd = os.getcwd()
+    cache_env = os.environ.pop('CPAC_DATA_CACHE_DIR', None)
+    node_dir = tempfile.mkdtemp()
+    os.chdir(node_dir)
+    try:
+        load_masked(in_file)
+    finally:
+        os.chdir(cwd)
+        if cache_env is not None:
+            os.environ['CPAC_DATA_CACHE_DIR'] = cache_env
+
+    # cached in the working directory of the node, not next to the input
+    assert os.listdir(in_dir) == ['func.nii.gz']
+    assert len(os.listdir(node_dir)) == 2
+
+
+def test_merge_nifti_files():
+    from CPAC.utils import merge_nifti_files
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    out_dir = tempfile.mkdtemp()
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+
+    np.random.seed(0)
+    volumes = [np.random.rand(4, 5, 6) + 1 for i in range(5)]
+    # voxels which are zero in only one volume are out of the group mask
+    volumes[1][0, 0, 0] = 0
+    volumes[4][3, 4, 5] = 0
+
+    # 3D and 4D inputs, of different data types
+    in_data = [volumes[0].astype(np.float32),
+               np.stack(volumes[1:3], axis=-1),
+               (volumes[3] * 1000).astype(np.int16),
+               volumes[4][..., np.newaxis]]
+    in_files = []
+    for idx, data in enumerate(in_data):
+        in_file = os.path.join(out_dir, 'in_%d.nii.gz' % idx)
+        nb.Nifti1Image(data, affine).to_filename(in_file)
+        in_files.append(in_file)
+
+    merged_file, mask_file = merge_nifti_files(
+        in_files, os.path.join(out_dir, 'merged.nii.gz'),
+        os.path.join(out_dir, 'mask.nii.gz'))
+
+    merged = nb.load(merged_file)
+    assert merged.shape == (4, 5, 6, 5)
+    np.testing.assert_allclose(merged.get_affine(), affine)
+
+    # volumes in the order of the input files
+    expected = [volumes[0], volumes[1], volumes[2],
+                (volumes[3] * 1000).astype(np.int16), volumes[4]]
+    merged_data = merged.get_data()
+    for idx, volume in enumerate(expected):
+        np.testing.assert_allclose(merged_data[..., idx], volume, rtol=1e-6)
+
+    mask = nb.load(mask_file).get_data()
+    expected_mask = np.ones((4, 5, 6))
+    expected_mask[0, 0, 0] = 0
+    expected_mask[3, 4, 5] = 0
+    np.testing.assert_array_equal(mask, expected_mask)
+
+    # a big-endian first image, whose header byte order is kept
+    big_endian = nb.Nifti1Image(volumes[0].astype(np.float32), affine,
+                                nb.Nifti1Header(endianness='>'))
+    big_endian_file = os.path.join(out_dir, 'in_big_endian.nii.gz')
+    big_endian.to_filename(big_endian_file)
+    assert nb.load(big_endian_file).get_header().endianness == '>'
+
+    merged_file, mask_file = merge_nifti_files(
+        [big_endian_file] + in_files[1:],
+        os.path.join(out_dir, 'merged_big_endian.nii.gz'),
+        os.path.join(out_dir, 'mask_big_endian.nii.gz'))
+
+    merged_data = nb.load(merged_file).get_data()
+    for idx, volume in enumerate(expected):
+        np.testing.assert_allclose(merged_data[..., idx], volume, rtol=1e-6)
+    np.testing.assert_array_equal(nb.load(mask_file).get_data(),
+                                  expected_mask)
+
+
+def test_get_image_dims():
+    from CPAC.utils import get_image_dims
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    out_dir = tempfile.mkdtemp()
+    rest_1 = os.path.join(out_dir, 'rest_1.nii.gz')
+    rest_2 = os.path.join(out_dir, 'rest_2.nii.gz')
+    nb.Nifti1Image(np.zeros((4, 5, 6, 10), dtype=np.float32),
+                   np.eye(4)).to_filename(rest_1)
+    nb.Nifti1Image(np.zeros((3, 3, 3, 20), dtype=np.float32),
+                   np.eye(4)).to_filename(rest_2)
+
+    # functional scans of a data configuration entry, with their scan
+    # parameters
+    sub_dict = {'subject_id': 'sub-1',
+                'unique_id': 'ses-1',
+                'anat': os.path.join(out_dir, 'anat.nii.gz'),
+                'func': {'rest_1': {'scan': rest_1,
+                                    'scan_parameters': {'tr': 2.0}},
+                         'rest_2': {'scan': rest_2,
+                                    'scan_parameters': {'tr': 2.0}},
+                         'rest_3': {'scan': 's3://bucket/rest_3.nii.gz'}}}
+
+    assert get_image_dims(sub_dict['func']) == (120, 20)
+
+    # older subject lists, with the paths of the scans only
+    assert get_image_dims({'rest_1': rest_1, 'rest_2': rest_2}) == (120, 20)
+    assert get_image_dims(rest_2) == (27, 20)
+    assert get_image_dims([os.path.join(out_dir, 'missing.nii.gz')]) is None
+
+
+def glm_reference(data, design, demean, des_norm):
+    # explicit normal equations, and the z-stats from the t tail
+    import numpy as np
+    from scipy import stats
+
+    if demean:
+        data = data - data.mean(0)
+        design = design - design.mean(0)
+    if des_norm:
+        design = design / design.std(0, ddof=1)
+
+    beta = np.linalg.lstsq(design, data, rcond=-1)[0]
+
+    dof = design.shape[0] - design.shape[1]
+    sigma_sq = np.square(data - design.dot(beta)).sum(0) / dof
+    se = np.sqrt(np.outer(np.diag(np.linalg.inv(design.T.dot(design))),
+                          sigma_sq))
+    t = beta / se
+    z = np.sign(t) * stats.norm.isf(stats.t.sf(np.abs(t), dof))
+
+    return beta, z
+
+
+def test_calc_glm():
+    from CPAC.utils import calc_glm
+    import numpy as np
+
+    np.random.seed(0)
+    n_obs = 40
+    design = np.column_stack((np.random.randn(n_obs),
+                              np.sin(np.arange(n_obs) / 3.0) * 5,
+                              np.arange(n_obs) / 10.0))
+    true_beta = np.random.randn(3, 6)
+    data = 20 + design.dot(true_beta) + np.random.randn(n_obs, 6)
+    # a column with little noise, and a constant column
+    data[:, 4] = 20 + design.dot(true_beta[:, 4]) + \
+        np.random.randn(n_obs) * 1e-2
+    data[:, 5] = 7
+
+    for demean in [True, False]:
+        for des_norm in [True, False]:
+            beta = calc_glm(data, design, demean=demean, des_norm=des_norm)
+            beta_z, z = calc_glm(data, design, demean=demean,
+                                 des_norm=des_norm, calc_z=True)
+
+            expected_beta, expected_z = \
+                glm_reference(data[:, :5], design, demean, des_norm)
+
+            assert beta.shape == z.shape == (3, 6)
+            np.testing.assert_allclose(beta, beta_z)
+            np.testing.assert_allclose(beta[:, :5], expected_beta,
+                                       rtol=1e-8, atol=1e-10)
+            np.testing.assert_allclose(z[:, :5], expected_z, rtol=1e-6)
+
+            # the constant column has no variance to explain
+            if demean:
+                np.testing.assert_allclose(beta[:, 5], 0, atol=1e-10)
+                np.testing.assert_array_equal(z[:, 5], 0)
+
+    # large statistics keep their precision, where converting through the
+    # cdf would give infinite z-stats
+    beta, z = calc_glm(data, design, demean=True, calc_z=True)
+    assert np.isfinite(z).all()
+    assert (np.abs(z[:, 4]) > 10).all()
+
+    # a single regressor, as a 1D design
+    beta, z = calc_glm(data, design[:, 0], demean=True, calc_z=True)
+    expected_beta, expected_z = \
+        glm_reference(data[:, :4], design[:, :1], True, False)
+    np.testing.assert_allclose(beta[:, :4], expected_beta, rtol=1e-8)
+    np.testing.assert_allclose(z[:, :4], expected_z, rtol=1e-6)
+
+
+def test_calc_glm_underspecified():
+    from CPAC.utils import calc_glm
+    import numpy as np
+
+    np.random.seed(0)
+    design = np.random.randn(3, 3)
+    data = np.random.randn(3, 2)
+
+    # the parameter estimates alone can still be computed
+    assert calc_glm(data, design).shape == (3, 2)
+
+    try:
+        calc_glm(data, design, calc_z=True)
+        raise AssertionError('no error raised for an underspecified GLM')
+    except Exception as e:
+        assert 'underspecified' in str(e)
+
+
+def test_atomic_write():
+    from CPAC.utils import atomic_write
+    import os
+    import tempfile
+    import numpy as np
+
+    out_dir = tempfile.mkdtemp()
+
+    out_file = os.path.join(out_dir, 'status.json')
+    with atomic_write(out_file) as tmp_file:
+        assert tmp_file != out_file
+        assert os.path.dirname(tmp_file) == out_dir
+        with open(tmp_file, 'w') as f:
+            f.write('{}')
+        assert not os.path.exists(out_file)
+    with open(out_file, 'r') as f:
+        assert f.read() == '{}'
+
+    # replaces an existing file
+    with atomic_write(out_file) as tmp_file:
+        with open(tmp_file, 'w') as f:
+            f.write('[]')
+    with open(out_file, 'r') as f:
+        assert f.read() == '[]'
+
+    # writers which add an extension
+    npy_file = os.path.join(out_dir, 'data.npy')
+    with atomic_write(npy_file, '.npy') as tmp_file:
+        np.save(tmp_file, np.arange(3))
+    np.testing.assert_array_equal(np.load(npy_file), np.arange(3))
+
+    # directories
+    entry_dir = os.path.join(out_dir, 'entry')
+    with atomic_write(entry_dir) as tmp_dir:
+        os.makedirs(tmp_dir)
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+            f.write('{}')
+    assert os.listdir(entry_dir) == ['manifest.json']
+
+    # a failed write leaves neither the output nor the temporary path,
+    # and raises the error
+    for fail_path, is_dir in [(os.path.join(out_dir, 'failed.json'), False),
+                              (os.path.join(out_dir, 'failed'), True)]:
+        try:
+            with atomic_write(fail_path) as tmp_path:
+                if is_dir:
+                    os.makedirs(tmp_path)
+                else:
+                    open(tmp_path, 'w').close()
+                raise IOError('disk full')
+            raise AssertionError('the error of the write was not raised')
+        except IOError as e:
+            assert 'disk full' in str(e)
+        assert not os.path.exists(fail_path)
+        assert not os.path.exists(tmp_path)
+
+    # so does a failed rename, onto an existing non-empty directory
+    try:
+        with atomic_write(entry_dir) as tmp_dir:
+            os.makedirs(tmp_dir)
+            open(os.path.join(tmp_dir, 'other.json'), 'w').close()
+        raise AssertionError('no error raised for an existing directory')
+    except OSError:
+        pass
+    assert not os.path.exists(tmp_dir)
+    assert os.listdir(entry_dir) == ['manifest.json']
+
+    assert sorted(os.listdir(out_dir)) == ['data.npy', 'entry',
+                                           'status.json']
@@ -1,4 +1,5 @@
 from inspect import currentframe, getframeinfo
+from contextlib import contextmanager
 
 import threading
 
@@ -63,6 +64,7 @@ files_folders_wf = {
     'scrubbing_frames_included': 'parameters',
     'scrubbing_frames_excluded': 'parameters',
     'motion_params': 'parameters',
+    'motion_stats': 'parameters',
     'power_params': 'parameters',
     'scrubbed_preprocessed': 'func',
     'functional_to_standard': 'func',
@@ -343,6 +345,7 @@ def compute_fisher_z_score(correlation_file, timeseries_one_d, input_name):
     import nibabel as nb
     import numpy as np
     import os
+    from CPAC.utils import save_nifti
 
     if isinstance(timeseries_one_d, basestring):
         if '.1D' in timeseries_one_d or '.csv' in timeseries_one_d:
@@ -370,9 +373,7 @@ def compute_fisher_z_score(correlation_file, timeseries_one_d, input_name):
     z_score_img = nb.Nifti1Image(corr_data, header=hdr,
                                  affine=corr_img.get_affine())
 
-    out_file = os.path.join(os.getcwd(), filename + '_fisher_zstd.nii.gz')
-
-    z_score_img.to_filename(out_file)
+    out_file = save_nifti(z_score_img, filename + '_fisher_zstd')
 
     return out_file
 
@@ -459,6 +460,575 @@ def safe_shape(*vol_data):
     return same_volume
 
 
+def iter_volume_chunks(in_file, chunk_size=32, dtype='float32'):
+    """
+    Reads a 4D NIfTI file a few volumes at a time, with a single sequential
+    pass over the (possibly gzipped) file.
+
+    Parameters
+    ----------
+    in_file : string
+        Path of the 4D nifti file.
+    chunk_size : integer, optional
+        Number of volumes per chunk.
+    dtype : string, optional
+        Data type of the returned chunks, after scaling.
+
+    Returns
+    -------
+    chunks : generator
+        Yields (start, data) tuples, where `start` is the index of the first
+        volume in the chunk and `data` is an (X, Y, Z, n) array.
+    """
+    import numpy as np
+    import nibabel as nb
+    from nibabel.openers import ImageOpener
+    from nibabel.volumeutils import array_from_file
+
+    img = nb.load(in_file)
+    proxy = img.dataobj
+
+    vol_shape = img.shape[:3]
+    n_vols = img.shape[3] if len(img.shape) > 3 else 1
+
+    in_dtype = np.dtype(proxy.dtype)
+    slope, inter = proxy.slope, proxy.inter
+    offset = proxy.offset
+    vol_bytes = int(np.prod(vol_shape)) * in_dtype.itemsize
+
+    # volumes are read in order, so the file is only decompressed once
+    with ImageOpener(in_file) as fobj:
+        for start in range(0, n_vols, chunk_size):
+            n = min(chunk_size, n_vols - start)
+            raw = array_from_file(vol_shape + (n,), in_dtype, fobj,
+                                  offset=offset + start * vol_bytes,
+                                  order='F', mmap=False)
+            data = raw.astype(dtype)
+            if slope != 1.0 or inter != 0.0:
+                data *= slope
+                data += inter
+            yield start, data
+
+
+def calc_glm(data, design, demean=False, des_norm=False, calc_z=False):
+    """
+    Fits the general linear model data = design * beta for all the columns
+    of the data at once, as FSL's fsl_glm does.
+
+    Parameters
+    ----------
+    data : ndarray
+        (N, M) array, with the regression done along the first dimension
+        for each of the M columns.
+    design : ndarray
+        (N, K) design matrix.
+    demean : bool, optional
+        Demean the data and the design along the first dimension (fsl_glm
+        --demean).
+    des_norm : bool, optional
+        Normalise the design columns to unit standard deviation (fsl_glm
+        --des_norm).
+    calc_z : bool, optional
+        Also return the z-statistics of the parameter estimates.
+
+    Returns
+    -------
+    beta : ndarray
+        (K, M) array of the parameter estimates.
+    z : ndarray
+        (K, M) array of the z-statistics, only if `calc_z` is set. They are
+        converted from the t-statistics with N - K degrees of freedom, and
+        are zero where the residual variance is zero.
+    """
+    import numpy as np
+    from scipy import stats
+
+    design = np.array(design, dtype=np.float64, ndmin=2)
+    if design.shape[0] == 1:
+        design = design.T
+
+    if demean:
+        data = data - data.mean(0)
+        design = design - design.mean(0)
+
+    if des_norm:
+        design_std = design.std(0, ddof=1)
+        design_std[design_std == 0] = 1
+        design = design / design_std
+
+    beta = np.linalg.lstsq(design, data, rcond=-1)[0]
+
+    if not calc_z:
+        return beta
+
+    dof = design.shape[0] - np.linalg.matrix_rank(design)
+    if dof <= 0:
+        raise Exception('\n\n[!] CPAC says: The GLM is underspecified, '
+                        'the number of observations ({0}) must be larger '
+                        'than the number of regressors ({1}).\n\n'
+                        .format(design.shape[0], design.shape[1]))
+
+    residuals = data - np.dot(design, beta)
+    sigma_sq = np.square(residuals).sum(0) / dof
+    del residuals
+
+    beta_var = np.outer(np.diag(np.linalg.pinv(np.dot(design.T, design))),
+                        sigma_sq)
+
+    z = np.zeros(beta.shape)
+    valid = beta_var > 0
+    t = beta[valid] / np.sqrt(beta_var[valid])
+    # convert through the tail probability of |t| to keep the precision
+    # of large statistics, then restore the sign
+    z[valid] = np.sign(t) * stats.norm.isf(stats.t.sf(np.abs(t), dof))
+
+    return beta, z
+
+
+@contextmanager
+def atomic_write(out_path, suffix=''):
+    """
+    Context manager to write a file, or fill a directory, under a temporary
+    name next to it, renamed to `out_path` once the block completes, so
+    that concurrent readers never see a partial output.
+
+    Parameters
+    ----------
+    out_path : string
+        Path of the file or directory.
+    suffix : string, optional
+        Suffix of the temporary path, for writers which add an extension
+        (np.save adds .npy).
+
+    Returns
+    -------
+    tmp_path : string
+        Temporary path to write, as the target of the with statement. It is
+        removed if the block or the rename fails, and the error is raised.
+    """
+    import os
+    import shutil
+
+    tmp_path = '{0}.{1}.tmp{2}'.format(out_path, os.getpid(), suffix)
+
+    try:
+        yield tmp_path
+        os.rename(tmp_path, out_path)
+    except BaseException:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_masked(in_file, mask=None, cache_dir=None):
+    """
+    Loads the timeseries of the voxels in a mask as a (T, V) float32
+    matrix, through a cache shared by all the nodes of a subject.
+
+    The first call for a given file and mask decompresses the data once and
+    saves the matrix and the mask as .npy files in the cache directory,
+    under a key made of the paths, modification times and sizes of the
+    file and the mask. Later calls, from any node, memory-map them instead
+    of reading the NIfTI file again. The entries of previous versions of
+    the same file and mask are deleted when a new one is saved.
+
+    Parameters
+    ----------
+    in_file : string
+        Path of the 4D nifti file.
+    mask : string, optional
+        Path of the 3D mask. If None, the voxels with a nonzero value at
+        any timepoint are used.
+    cache_dir : string, optional
+        Directory of the cache. Defaults to the CPAC_DATA_CACHE_DIR
+        environment variable, set by the pipeline to the subject's working
+        directory, or to the current directory (the working directory of
+        the node). If the directory can't be written, the data is loaded
+        without caching.
+
+    Returns
+    -------
+    data : ndarray
+        (T, V) read-only float32 matrix, voxels in the order of
+        `mask_data.nonzero()`.
+    mask_data : ndarray
+        3D boolean mask of the voxels in `data`.
+    """
+    import os
+    import hashlib
+    import numpy as np
+    import nibabel as nb
+    from CPAC.utils.utils import atomic_write
+
+    def file_key(path):
+        stat = os.stat(path)
+        return '{0}:{1}'.format(stat.st_mtime, stat.st_size)
+
+    def sha1(value):
+        return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+    # the entries are named <paths key>_<versions key>, so that the entries
+    # of the previous versions of the same file and mask can be found
+    paths_key = sha1(os.path.realpath(in_file) + '|' +
+                     (os.path.realpath(mask) if mask else 'nonzero'))
+    versions_key = sha1(file_key(in_file) + '|' +
+                        (file_key(mask) if mask else 'nonzero'))
+    key = '{0}_{1}'.format(paths_key, versions_key)
+
+    if not cache_dir:
+        cache_dir = os.environ.get('CPAC_DATA_CACHE_DIR', os.getcwd())
+
+    data_file = os.path.join(cache_dir, key + '_data.npy')
+    mask_file = os.path.join(cache_dir, key + '_mask.npy')
+
+    if os.path.exists(data_file) and os.path.exists(mask_file):
+        return np.load(data_file, mmap_mode='r'), np.load(mask_file)
+
+    img_data = nb.load(in_file).get_data()
+
+    if mask:
+        mask_data = nb.load(mask).get_data().astype(bool)
+        if mask_data.shape != img_data.shape[:3]:
+            raise Exception('\n\n[!] CPAC says: The mask {0} and the '
+                            'functional file {1} have different '
+                            'dimensions.\n\n'.format(mask, in_file))
+    else:
+        mask_data = (img_data != 0).any(-1)
+
+    data = np.ascontiguousarray(img_data[mask_data].T, dtype=np.float32)
+    del img_data
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        # write under a temporary name, so that concurrent nodes never read
+        # a partial file
+        for out_file, out_data in [(mask_file, mask_data),
+                                   (data_file, data)]:
+            with atomic_write(out_file, '.npy') as tmp_file:
+                np.save(tmp_file, out_data)
+
+    except (IOError, OSError):
+        data.flags.writeable = False
+        return data, mask_data
+
+    # delete the superseded entries, the nodes that still map them keep
+    # their data until they are done
+    for cache_file in os.listdir(cache_dir):
+        if cache_file.startswith(paths_key + '_') and \
+                not cache_file.startswith(key + '_') and \
+                '.tmp.' not in cache_file:
+            try:
+                os.remove(os.path.join(cache_dir, cache_file))
+            except OSError:
+                pass
+
+    return np.load(data_file, mmap_mode='r'), mask_data
+
+
+def masked_voxels(data, mask_data, voxel_mask):
+    """
+    Selects the timeseries of the voxels of another mask from a matrix
+    returned by `load_masked`.
+
+    Parameters
+    ----------
+    data : ndarray
+        (T, V) matrix of the voxels in `mask_data`.
+    mask_data : ndarray
+        3D boolean mask of the voxels in `data`.
+    voxel_mask : ndarray
+        3D boolean mask of the voxels to select.
+
+    Returns
+    -------
+    voxels : ndarray
+        (T, N) matrix of the N voxels of `voxel_mask`, in the order of
+        `voxel_mask.nonzero()`. Voxels outside of `mask_data` are zero.
+    """
+    import numpy as np
+
+    columns = np.zeros(mask_data.shape, dtype=np.int64) - 1
+    columns[mask_data] = np.arange(data.shape[1])
+    columns = columns[voxel_mask]
+
+    inside = columns >= 0
+    if inside.all():
+        return data[:, columns]
+
+    voxels = np.zeros((data.shape[0], columns.shape[0]), dtype=data.dtype)
+    voxels[:, inside] = data[:, columns[inside]]
+
+    return voxels
+
+
+def get_nifti_format():
+    """
+    Returns the format of the NIfTI files written in the working directory,
+    from the CPAC_NIFTI_FORMAT environment variable set by the pipeline
+    (intermediateNiftiFormat in the pipeline configuration).
+
+    Returns
+    -------
+    nifti_format : string
+        'nii.gz' (default), 'nii' or 'pigz'.
+    """
+    import os
+
+    nifti_format = os.environ.get('CPAC_NIFTI_FORMAT', 'nii.gz')
+
+    if nifti_format not in ('nii.gz', 'nii', 'pigz'):
+        raise Exception('\n\n[!] CPAC says: Invalid intermediate NIfTI '
+                        'format: {0}. It must be one of nii.gz, nii or '
+                        'pigz.\n\n'.format(nifti_format))
+
+    return nifti_format
+
+
+def nifti_output_path(name, out_dir=None):
+    """
+    Builds the path of a NIfTI file written by a node, with the extension
+    of the intermediate NIfTI format.
+
+    Parameters
+    ----------
+    name : string
+        File name, with or without a .nii/.nii.gz extension.
+    out_dir : string, optional
+        Directory of the file, the current directory by default.
+
+    Returns
+    -------
+    out_file : string
+        Absolute path of the file.
+    """
+    import os
+    from CPAC.utils.utils import get_nifti_format
+
+    for ext in ('.nii.gz', '.nii'):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+            break
+
+    ext = '.nii.gz' if get_nifti_format() == 'nii.gz' else '.nii'
+
+    return os.path.abspath(os.path.join(out_dir or os.getcwd(), name + ext))
+
+
+def save_nifti(img, name, out_dir=None):
+    """
+    Writes a NIfTI image in the intermediate NIfTI format.
+
+    Parameters
+    ----------
+    img : nibabel image
+        Image to write.
+    name : string
+        File name, with or without a .nii/.nii.gz extension.
+    out_dir : string, optional
+        Directory of the file, the current directory by default.
+
+    Returns
+    -------
+    out_file : string
+        Path of the written file.
+    """
+    from CPAC.utils.utils import get_nifti_format, nifti_output_path, \
+        compress_nifti
+
+    out_file = nifti_output_path(name, out_dir)
+    img.to_filename(out_file)
+
+    if get_nifti_format() == 'pigz':
+        out_file = compress_nifti(out_file)
+
+    return out_file
+
+
+def compress_nifti(in_file, keep=False):
+    """
+    Compresses an uncompressed NIfTI file, with pigz when it is available,
+    using CPAC_NIFTI_THREADS threads, or gzip otherwise.
+
+    Parameters
+    ----------
+    in_file : string
+        Path of the file. Files not ending in .nii are left untouched.
+    keep : boolean, optional
+        Keep the uncompressed file, for files which may still be read by
+        other nodes. An existing compressed file newer than it is reused.
+
+    Returns
+    -------
+    out_file : string
+        Path of the compressed file.
+    """
+    import os
+    import gzip
+    import shutil
+    import subprocess
+    from CPAC.utils.utils import atomic_write
+
+    if not in_file.endswith('.nii'):
+        return in_file
+
+    out_file = in_file + '.gz'
+
+    if keep and os.path.exists(out_file) and \
+            os.path.getmtime(out_file) >= os.path.getmtime(in_file):
+        return out_file
+
+    threads = os.environ.get('CPAC_NIFTI_THREADS', '1')
+
+    # compress to a temporary file, so that a partial file is never seen
+    with atomic_write(out_file) as tmp_file:
+        try:
+            with open(tmp_file, 'wb') as f_out:
+                subprocess.check_call(['pigz', '-c', '-p', str(threads),
+                                       in_file], stdout=f_out)
+        except (OSError, subprocess.CalledProcessError):
+            with open(in_file, 'rb') as f_in:
+                f_out = gzip.open(tmp_file, 'wb', 6)
+                try:
+                    shutil.copyfileobj(f_in, f_out, 1 << 20)
+                finally:
+                    f_out.close()
+
+    if not keep:
+        os.remove(in_file)
+
+    return out_file
+
+
+def compress_nifti_outputs(outputs):
+    """
+    Compresses the uncompressed NIfTI files in a node output, so that the
+    files copied to the output directory are always compressed. Used as a
+    connection modifier of the DataSink inputs.
+
+    Parameters
+    ----------
+    outputs : string or list
+        File path or (nested) list of file paths.
+
+    Returns
+    -------
+    outputs : string or list
+        The same outputs, with the paths of the compressed files.
+    """
+    from CPAC.utils.utils import compress_nifti, compress_nifti_outputs
+
+    if isinstance(outputs, (list, tuple)):
+        return [compress_nifti_outputs(output) for output in outputs]
+
+    if isinstance(outputs, basestring) and outputs.endswith('.nii'):
+        return compress_nifti(outputs, keep=True)
+
+    return outputs
+
+
+def merge_nifti_files(in_files, merged_file=None, mask_file=None):
+    """
+    Concatenates NIfTI images along the fourth dimension, in the order
+    given, and computes the group mask (voxels which are non-zero in every
+    volume) on the fly. The volumes are streamed to the merged file one at
+    a time, so the 4D image is never held in memory.
+
+    Parameters
+    ----------
+    in_files : list of strings
+        Paths of the 3D (or 4D) images to merge.
+    merged_file : string, optional
+        Path of the merged 4D image. Not written if None.
+    mask_file : string, optional
+        Path of the group mask. Not written if None.
+
+    Returns
+    -------
+    merged_file : string
+        Path of the merged 4D image.
+    mask_file : string
+        Path of the group mask.
+    """
+    import gzip
+    import numpy as np
+    import nibabel as nb
+
+    if isinstance(in_files, basestring):
+        in_files = [in_files]
+
+    first_img = nb.load(in_files[0])
+    shape = first_img.shape[:3]
+    affine = first_img.get_affine()
+
+    n_vols = 0
+    for in_file in in_files:
+        in_shape = nb.load(in_file).shape
+        if in_shape[:3] != shape:
+            raise Exception('\n\n[!] CPAC says: The image %s has '
+                            'dimensions %s, while %s has dimensions %s. All '
+                            'the images must have the same dimensions.\n\n'
+                            % (in_file, str(in_shape[:3]), in_files[0],
+                               str(shape)))
+        n_vols += int(np.prod(in_shape[3:]))
+
+    f_out = None
+    if merged_file:
+        hdr = nb.Nifti1Header.from_header(first_img.get_header())
+        hdr.set_data_shape(shape + (n_vols,))
+        hdr.set_data_dtype(np.float32)
+        hdr.set_zooms(first_img.get_header().get_zooms()[:3] + (1.0,))
+        hdr.set_slope_inter(1.0, 0.0)
+        hdr.set_qform(affine)
+        hdr.set_sform(affine)
+        hdr['vox_offset'] = 0
+
+        # the header keeps the byte order of the first image, the volumes
+        # are written in it
+        out_dtype = hdr.get_data_dtype()
+
+        if merged_file.endswith('.gz'):
+            f_out = gzip.open(merged_file, 'wb', 6)
+        else:
+            f_out = open(merged_file, 'wb')
+        hdr.write_to(f_out)
+        f_out.write(b'\x00' * (hdr.get_data_offset() - f_out.tell()))
+
+    abs_min = None
+    try:
+        for in_file in in_files:
+            data = nb.load(in_file).get_data()
+            data = np.asarray(data, dtype=np.float32).reshape(shape + (-1,),
+                                                              order='F')
+
+            for i in range(data.shape[3]):
+                vol = data[..., i]
+
+                # the volumes are written in file order, so the order of
+                # the merged file matches the order of in_files
+                if f_out is not None:
+                    f_out.write(vol.astype(out_dtype).tostring(order='F'))
+
+                if abs_min is None:
+                    abs_min = np.abs(vol)
+                else:
+                    np.minimum(abs_min, np.abs(vol), out=abs_min)
+    finally:
+        if f_out is not None:
+            f_out.close()
+
+    if mask_file:
+        mask_hdr = nb.Nifti1Header.from_header(first_img.get_header())
+        mask_hdr.set_data_dtype(np.float32)
+        nb.Nifti1Image((abs_min > 0).astype(np.float32), affine,
+                       mask_hdr).to_filename(mask_file)
+
+    return merged_file, mask_file
+
+
 def extract_one_d(list_timeseries):
     if isinstance(list_timeseries, basestring):
         if '.1D' in list_timeseries or '.csv' in list_timeseries:
@@ -2197,7 +2767,10 @@ def check_config_resources(c):
     # Check if user specified cores
     if c.maxCoresPerParticipant:
         total_user_cores = c.numParticipantsAtOnce * c.maxCoresPerParticipant
-        if total_user_cores > num_cores:
+        # with a shared node pool, the participants are kept within the
+        # cores of the machine together
+        if total_user_cores > num_cores and \
+                not getattr(c, 'shareResourcesAcrossParticipants', False):
             err_msg = 'Config file specifies more subjects running in ' \
                       'parallel than number of threads available. Change ' \
                       'this and try again'
@@ -2224,3 +2797,100 @@ def check_config_resources(c):
 
     # Return memory and cores
     return sub_mem_gb, num_cores_per_sub, num_ants_cores
+
+
+def set_node_resources(node, mem_gb=None, n_procs=None):
+    """
+    Sets the memory and the number of threads the MultiProc plugin reserves
+    for a node.
+
+    Parameters
+    ----------
+    node : nipype Node
+        Node to annotate.
+    mem_gb : float, optional
+        Estimated memory usage of the node, in GB.
+    n_procs : integer, optional
+        Number of threads used by the node.
+    """
+
+    # nipype 0.13 reads the resources from the interface, later versions
+    # from the node (and still pick up estimated_memory_gb)
+    if mem_gb is not None:
+        node.interface.estimated_memory_gb = float(mem_gb)
+        if hasattr(node, '_mem_gb'):
+            node._mem_gb = float(mem_gb)
+
+    if n_procs is not None:
+        node.interface.num_threads = int(n_procs)
+        if hasattr(node, '_n_procs'):
+            node._n_procs = int(n_procs)
+
+
+def get_node_resources(node):
+    """
+    Returns the memory and the number of threads the MultiProc plugin
+    reserves for a node.
+
+    Parameters
+    ----------
+    node : nipype Node
+        Node to read the resources of.
+
+    Returns
+    -------
+    mem_gb : float
+        Estimated memory usage of the node, in GB.
+    n_procs : integer
+        Number of threads used by the node.
+    """
+
+    if hasattr(node, '_n_procs'):
+        return float(node.mem_gb), int(node.n_procs)
+
+    return float(getattr(node.interface, 'estimated_memory_gb', None) or 1.0), \
+        int(getattr(node.interface, 'num_threads', None) or 1)
+
+
+def get_image_dims(image_files):
+    """
+    Returns the largest number of voxels per volume and number of volumes
+    among NIfTI images, from their headers.
+
+    Parameters
+    ----------
+    image_files : string, list or dictionary
+        Paths of the images, as in the functional scans of a subject list
+        entry, where a scan may also be a dictionary with its path under
+        'scan' (and its scan parameters).
+
+    Returns
+    -------
+    nvoxs, ntpts : tuple of integers, or None
+        None if none of the images can be read locally, e.g. on S3.
+    """
+    import numpy as np
+    import nibabel as nb
+
+    if isinstance(image_files, dict):
+        image_files = image_files.values()
+    elif isinstance(image_files, basestring):
+        image_files = [image_files]
+
+    dims = None
+    for image_file in image_files:
+        if isinstance(image_file, dict):
+            image_file = image_file.get('scan')
+        try:
+            shape = nb.load(image_file).shape
+        except Exception:
+            continue
+
+        nvoxs = int(np.prod(shape[:3]))
+        ntpts = int(shape[3]) if len(shape) > 3 else 1
+        if dims is None:
+            dims = (nvoxs, ntpts)
+        else:
+            dims = (max(dims[0], nvoxs), max(dims[1], ntpts))
+
+    return dims
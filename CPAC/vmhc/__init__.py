@@ -2,9 +2,11 @@ from vmhc import create_vmhc
 
 from utils import set_gauss, \
                   get_img_nvols, \
-                  get_operand_expression
+                  get_operand_expression, \
+                  calc_vmhc
 
 
 __all__ = ['create_vmhc', \
            'get_img_nvols', \
-           'get_operand_expression']
+           'get_operand_expression', \
+           'calc_vmhc']
@@ -0,0 +1,79 @@
+
+def test_calc_vmhc():
+    from CPAC.vmhc import calc_vmhc
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+
+    np.random.seed(0)
+    nvols = 20
+
+    # an odd number of x slices, so the midline voxels are their own
+    # mirror
+    shape = (7, 5, 3)
+    data = np.random.randn(*shape + (nvols,)) * 10 + 100
+    # mirrored voxels sharing a signal, and constant and empty voxels
+    signal = np.random.randn(nvols) * 20
+    data[1, 2, 1] += signal
+    data[5, 2, 1] += signal
+    data[0, 0, 0] = 0
+    data[6, 4, 2] = 30
+    data = data.astype(np.float32)
+
+    out_dir = tempfile.mkdtemp()
+    in_file = os.path.join(out_dir, 'rest_res_2symmstandard.nii.gz')
+    nb.Nifti1Image(data, np.eye(4)).to_filename(in_file)
+
+    # brute force correlation of each voxel with its mirror
+    expected = np.zeros(shape)
+    for x, y, z in np.ndindex(*shape):
+        voxel = data[x, y, z].astype(np.float64)
+        mirror = data[shape[0] - 1 - x, y, z].astype(np.float64)
+        if voxel.std() == 0 or mirror.std() == 0:
+            continue
+        expected[x, y, z] = np.corrcoef(voxel, mirror)[0, 1]
+
+    cwd = os.getcwd()
+    try:
+        # slabs smaller than, not dividing, and larger than the y axis
+        for chunk_size in [1, 2, 8]:
+            os.chdir(tempfile.mkdtemp())
+
+            vmhc_img, vmhc_z_img, vmhc_z_stat_img = \
+                calc_vmhc(in_file, chunk_size=chunk_size)
+
+            vmhc = nb.load(vmhc_img).get_data()
+            vmhc_z = nb.load(vmhc_z_img).get_data()
+            vmhc_z_stat = nb.load(vmhc_z_stat_img).get_data()
+
+            assert vmhc.shape == vmhc_z.shape == vmhc_z_stat.shape == shape
+            assert vmhc.dtype == np.float32
+
+            # up to the float32 rounding of the output
+            np.testing.assert_allclose(vmhc, expected.astype(np.float32),
+                                       rtol=0, atol=1.6e-8)
+            np.testing.assert_array_equal(vmhc, vmhc[::-1])
+            assert vmhc[1, 2, 1] > 0.8
+
+            # constant and empty voxels, and their mirrors, are zero
+            assert vmhc[0, 0, 0] == vmhc[6, 0, 0] == 0
+            assert vmhc[6, 4, 2] == vmhc[0, 4, 2] == 0
+
+            # the midline voxels correlate perfectly with themselves, their
+            # Fisher z is undefined and left at zero
+            np.testing.assert_allclose(vmhc[3][vmhc[3] != 0], 1)
+            assert not vmhc_z[3].any()
+
+            off_midline = np.ones(shape, dtype=bool)
+            off_midline[3] = False
+            np.testing.assert_allclose(vmhc_z[off_midline],
+                                       np.arctanh(vmhc[off_midline]),
+                                       rtol=1e-6)
+            assert np.isfinite(vmhc_z).all()
+
+            np.testing.assert_allclose(vmhc_z_stat,
+                                       vmhc_z * np.sqrt(nvols - 3),
+                                       rtol=1e-6)
+    finally:
+        os.chdir(cwd)
@@ -91,3 +91,85 @@ def get_operand_expression(nvols):
 
     return expr
 
+
+
+def calc_vmhc(rest_res_2symmstandard, chunk_size=8):
+
+    """
+    Computes the voxel-mirrored homotopic connectivity, its Fisher z
+    transform and z-stat in one pass over the functional data
+
+    Each voxel is correlated with its mirror across the midsagittal plane,
+    the same voxel in the L/R flipped image. Since the flip only reverses
+    the x axis, the data is processed in slabs along y, each normalized
+    once and correlated with its reversed (not copied) view.
+
+    Parameters
+    ----------
+
+    rest_res_2symmstandard : string (nifti file)
+        functional data in symmetric standard space
+
+    chunk_size : int
+        number of y slices processed at a time
+
+    Returns
+    -------
+
+    vmhc_img : string (nifti file)
+        pearson correlation of each voxel with its mirror
+
+    vmhc_z_img : string (nifti file)
+        Fisher z transform of the correlation, zero where it is undefined
+
+    vmhc_z_stat_img : string (nifti file)
+        z-stat of the correlation, z * sqrt(nvols - 3)
+
+    """
+
+    import os
+    import numpy as np
+    import nibabel as nb
+    from CPAC.utils import save_nifti
+
+    img = nb.load(rest_res_2symmstandard)
+    data = img.get_data()
+
+    if data.ndim < 4:
+        data = data[..., np.newaxis]
+
+    nvols = data.shape[3]
+
+    vmhc = np.zeros(data.shape[:3], dtype=np.float32)
+
+    for start in range(0, data.shape[1], chunk_size):
+        slab = data[:, start:start + chunk_size].astype(np.float64)
+        slab -= slab.mean(3)[..., np.newaxis]
+        norms = np.sqrt(np.square(slab).sum(3))
+
+        # constant voxels are left at zero, as 3dTcorrelate does
+        norms[norms == 0] = np.inf
+        slab /= norms[..., np.newaxis]
+
+        vmhc[:, start:start + chunk_size] = (slab * slab[::-1]).sum(3)
+
+    del data
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vmhc_z = np.arctanh(vmhc)
+    vmhc_z[~np.isfinite(vmhc_z)] = 0
+
+    vmhc_z_stat = vmhc_z * np.sqrt(nvols - 3)
+
+    hdr = img.get_header().copy()
+    hdr.set_data_dtype(np.float32)
+
+    out_files = []
+    for name, out_data in [('VMHC', vmhc),
+                           ('VMHC_z', vmhc_z),
+                           ('VMHC_z_stat', vmhc_z_stat)]:
+        out_file = save_nifti(nb.Nifti1Image(out_data, img.get_affine(),
+                                             hdr), name)
+        out_files.append(out_file)
+
+    return tuple(out_files)
@@ -14,7 +14,8 @@ from CPAC.registration import create_wf_calculate_ants_warp, \
                               create_wf_collect_transforms, \
                               create_wf_apply_ants_warp
 
-def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
+def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1,
+                use_afni=False):
 
     """
     Compute the map of brain functional homotopy, the high degree of synchrony in spontaneous activity between geometrically corresponding interhemispheric (i.e., homotopic) regions.
@@ -24,7 +25,19 @@ def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
     Parameters
     ----------
 
-    None
+    use_ants : boolean
+        Use ANTS instead of FSL to warp the functional data to the symmetric
+        template
+
+    name : string
+        Name of the workflow
+
+    ants_threads : int
+        Number of threads for ANTS
+
+    use_afni : boolean
+        Run the fslswapdim, 3dTcorrelate and 3dcalc chain instead of the
+        in-process `calc_vmhc` node
 
     Returns
     -------
@@ -154,6 +167,11 @@ def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
         --premat=example_func2highres.mat
         
         
+    - Correlate each voxel of rest_res_2symmstandard.nii.gz with its mirror across the midsagittal plane,
+      and compute the Fisher Z transform and Z statistic maps of the correlation. This is done in a single
+      node reading the data once (see calc_vmhc), by default. With `use_afni`, the following commands are run
+      instead.
+
     - Copy and L/R swap the output of applywarp command (rest_res_2symmstandard.nii.gz). For details see  `fslswapdim <http://fsl.fmrib.ox.ac.uk/fsl/fsl4.0/avwutils/index.html>`_::
 
         fslswapdim
@@ -271,40 +289,6 @@ def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
         # this has to be 3 instead of default 0 because it is a 4D file
         apply_ants_xfm_vmhc.inputs.inputspec.input_image_type = 3
 
-    # copy and L/R swap file
-    copy_and_L_R_swap = pe.Node(interface=fsl.SwapDimensions(),
-                      name='copy_and_L_R_swap')
-    copy_and_L_R_swap.inputs.new_dims = ('-x', 'y', 'z')
-
-    # calculate vmhc
-    pearson_correlation = pe.Node(interface=preprocess.TCorrelate(),
-                      name='pearson_correlation')
-    pearson_correlation.inputs.pearson = True
-    pearson_correlation.inputs.polort = -1
-    pearson_correlation.inputs.outputtype = 'NIFTI_GZ'
-
-    try:
-        z_trans = pe.Node(interface=preprocess.Calc(), name='z_trans')
-        z_stat = pe.Node(interface=preprocess.Calc(), name='z_stat')
-    except AttributeError:
-        from nipype.interfaces.afni import utils as afni_utils
-        z_trans = pe.Node(interface=afni_utils.Calc(), name='z_trans')
-        z_stat = pe.Node(interface=afni_utils.Calc(), name='z_stat')
-
-    z_trans.inputs.expr = 'log((1+a)/(1-a))/2'
-    z_trans.inputs.outputtype = 'NIFTI_GZ'
-    z_stat.inputs.outputtype = 'NIFTI_GZ'
-
-    NVOLS = pe.Node(util.Function(input_names=['in_files'],
-                                  output_names=['nvols'],
-                    function=get_img_nvols),
-                    name='NVOLS')
-
-    generateEXP = pe.Node(util.Function(input_names=['nvols'],
-                                        output_names=['expr'],
-                          function=get_operand_expression),
-                          name='generateEXP')
-
     smooth = pe.Node(interface=fsl.MultiImageMaths(),
                         name='smooth')
 
@@ -324,10 +308,6 @@ def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
         ## func->anat matrix (bbreg)
         vmhc.connect(inputNode, 'example_func2highres_mat',
                      nonlinear_func_to_standard, 'premat')
-        vmhc.connect(nonlinear_func_to_standard, 'out_file',
-                     copy_and_L_R_swap, 'in_file')
-        vmhc.connect(nonlinear_func_to_standard, 'out_file',
-                     pearson_correlation, 'xset')
 
     elif use_ants == True:
         # connections for ANTS stuff
@@ -375,39 +355,92 @@ def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
                      'outputspec.transformation_series',
                      apply_ants_xfm_vmhc, 'inputspec.transforms')
 
-        vmhc.connect(apply_ants_xfm_vmhc, 'outputspec.output_image',
-                     copy_and_L_R_swap, 'in_file')
-
-        vmhc.connect(apply_ants_xfm_vmhc, 'outputspec.output_image',
-                     pearson_correlation, 'xset')
-
-    vmhc.connect(copy_and_L_R_swap, 'out_file',
-                 pearson_correlation, 'yset')
-    vmhc.connect(pearson_correlation, 'out_file',
-                 z_trans, 'in_file_a')
-    vmhc.connect(copy_and_L_R_swap, 'out_file',
-                 NVOLS, 'in_files')
-    vmhc.connect(NVOLS, 'nvols',
-                 generateEXP, 'nvols')
-    vmhc.connect(z_trans, 'out_file',
-                 z_stat, 'in_file_a')
-    vmhc.connect(generateEXP, 'expr',
-                 z_stat, 'expr')
-
     if use_ants == False:
-        vmhc.connect(nonlinear_func_to_standard, 'out_file',
-                     outputNode, 'rest_res_2symmstandard')
-
+        warped_func, warped_func_out = nonlinear_func_to_standard, 'out_file'
     elif use_ants == True:
-        # ANTS warp outputs to outputnode
-        vmhc.connect(apply_ants_xfm_vmhc, 'outputspec.output_image',
-                     outputNode, 'rest_res_2symmstandard')
-
-    vmhc.connect(pearson_correlation, 'out_file',
-                 outputNode, 'VMHC_FWHM_img')
-    vmhc.connect(z_trans, 'out_file',
-                 outputNode, 'VMHC_Z_FWHM_img')
-    vmhc.connect(z_stat, 'out_file',
-                 outputNode, 'VMHC_Z_stat_FWHM_img')
+        warped_func, warped_func_out = apply_ants_xfm_vmhc, \
+                                       'outputspec.output_image'
+
+    if not use_afni:
+        # calculate vmhc, its Fisher Z transform and Z statistic
+        calc_vmhc_maps = pe.Node(util.Function(
+                                 input_names=['rest_res_2symmstandard'],
+                                 output_names=['vmhc_img',
+                                               'vmhc_z_img',
+                                               'vmhc_z_stat_img'],
+                                 function=calc_vmhc),
+                                 name='calc_vmhc')
+
+        vmhc.connect(warped_func, warped_func_out,
+                     calc_vmhc_maps, 'rest_res_2symmstandard')
+
+        vmhc.connect(calc_vmhc_maps, 'vmhc_img',
+                     outputNode, 'VMHC_FWHM_img')
+        vmhc.connect(calc_vmhc_maps, 'vmhc_z_img',
+                     outputNode, 'VMHC_Z_FWHM_img')
+        vmhc.connect(calc_vmhc_maps, 'vmhc_z_stat_img',
+                     outputNode, 'VMHC_Z_stat_FWHM_img')
+
+    else:
+        # copy and L/R swap file
+        copy_and_L_R_swap = pe.Node(interface=fsl.SwapDimensions(),
+                          name='copy_and_L_R_swap')
+        copy_and_L_R_swap.inputs.new_dims = ('-x', 'y', 'z')
+
+        # calculate vmhc
+        pearson_correlation = pe.Node(interface=preprocess.TCorrelate(),
+                          name='pearson_correlation')
+        pearson_correlation.inputs.pearson = True
+        pearson_correlation.inputs.polort = -1
+        pearson_correlation.inputs.outputtype = 'NIFTI_GZ'
+
+        try:
+            z_trans = pe.Node(interface=preprocess.Calc(), name='z_trans')
+            z_stat = pe.Node(interface=preprocess.Calc(), name='z_stat')
+        except AttributeError:
+            from nipype.interfaces.afni import utils as afni_utils
+            z_trans = pe.Node(interface=afni_utils.Calc(), name='z_trans')
+            z_stat = pe.Node(interface=afni_utils.Calc(), name='z_stat')
+
+        z_trans.inputs.expr = 'log((1+a)/(1-a))/2'
+        z_trans.inputs.outputtype = 'NIFTI_GZ'
+        z_stat.inputs.outputtype = 'NIFTI_GZ'
+
+        NVOLS = pe.Node(util.Function(input_names=['in_files'],
+                                      output_names=['nvols'],
+                        function=get_img_nvols),
+                        name='NVOLS')
+
+        generateEXP = pe.Node(util.Function(input_names=['nvols'],
+                                            output_names=['expr'],
+                              function=get_operand_expression),
+                              name='generateEXP')
+
+        vmhc.connect(warped_func, warped_func_out,
+                     copy_and_L_R_swap, 'in_file')
+        vmhc.connect(warped_func, warped_func_out,
+                     pearson_correlation, 'xset')
+        vmhc.connect(copy_and_L_R_swap, 'out_file',
+                     pearson_correlation, 'yset')
+        vmhc.connect(pearson_correlation, 'out_file',
+                     z_trans, 'in_file_a')
+        vmhc.connect(copy_and_L_R_swap, 'out_file',
+                     NVOLS, 'in_files')
+        vmhc.connect(NVOLS, 'nvols',
+                     generateEXP, 'nvols')
+        vmhc.connect(z_trans, 'out_file',
+                     z_stat, 'in_file_a')
+        vmhc.connect(generateEXP, 'expr',
+                     z_stat, 'expr')
+
+        vmhc.connect(pearson_correlation, 'out_file',
+                     outputNode, 'VMHC_FWHM_img')
+        vmhc.connect(z_trans, 'out_file',
+                     outputNode, 'VMHC_Z_FWHM_img')
+        vmhc.connect(z_stat, 'out_file',
+                     outputNode, 'VMHC_Z_stat_FWHM_img')
+
+    vmhc.connect(warped_func, warped_func_out,
+                 outputNode, 'rest_res_2symmstandard')
 
     return vmhc